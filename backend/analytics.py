@@ -0,0 +1,92 @@
+"""Sales analytics API endpoints.
+
+Served from the ``sales_daily_rollup`` / ``sales_beat_totals`` tables, which
+the database keeps current as orders are fulfilled (see the sales rollups
+migration), so each query reads a few rollup rows instead of scanning the
+order history. Results are cached per worker for ``ANALYTICS_CACHE_TTL_SECONDS``.
+"""
+from datetime import date
+from typing import Any, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+
+from backend.config import setting
+from backend.database import db
+from backend.services.cache import TTLCache
+
+router = APIRouter(prefix="/api/analytics", tags=["analytics"])
+
+GRANULARITIES = ("day", "week", "month")
+
+analytics_cache = TTLCache("analytics", maxsize=256, ttl=setting("analytics_cache_ttl_seconds"))
+
+
+def _window(date_from: Optional[date], date_to: Optional[date]) -> dict:
+    if date_from and date_to and date_from >= date_to:
+        raise HTTPException(status_code=400, detail="from must be before to")
+    return {
+        "p_from": date_from.isoformat() if date_from else None,
+        "p_to": date_to.isoformat() if date_to else None,
+    }
+
+
+async def _rollup(function: str, params: dict) -> List[Any]:
+    async def load() -> List[Any]:
+        result = await db.rpc(function, params).execute()
+        return result.data or []
+
+    return await analytics_cache.get_or_load((function, tuple(sorted(params.items()))), load)
+
+
+@router.get("/top-beats")
+async def get_top_beats(
+    date_from: Optional[date] = Query(None, alias="from", description="inclusive"),
+    date_to: Optional[date] = Query(None, alias="to", description="exclusive"),
+    limit: int = Query(10, ge=1, le=100),
+):
+    """Get the best-selling beats by revenue, all time or within a date range - Admin only."""
+    params = {**_window(date_from, date_to), "p_limit": limit}
+    try:
+        return {"success": True, "data": await _rollup("sales_top_beats", params)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching top beats: {str(e)}")
+
+
+@router.get("/revenue-by-license-type")
+async def get_revenue_by_license_type(
+    date_from: Optional[date] = Query(None, alias="from", description="inclusive"),
+    date_to: Optional[date] = Query(None, alias="to", description="exclusive"),
+):
+    """Get items sold and revenue per license type - Admin only."""
+    params = _window(date_from, date_to)
+    try:
+        return {"success": True, "data": await _rollup("sales_by_license_type", params)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching revenue by license type: {str(e)}")
+
+
+@router.get("/timeseries")
+async def get_revenue_timeseries(
+    granularity: str = Query("day", description="day, week or month"),
+    date_from: Optional[date] = Query(None, alias="from", description="inclusive"),
+    date_to: Optional[date] = Query(None, alias="to", description="exclusive"),
+):
+    """Get items sold and revenue per day, week or month - Admin only."""
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(GRANULARITIES)}")
+    params = {**_window(date_from, date_to), "p_granularity": granularity}
+    try:
+        return {"success": True, "data": await _rollup("sales_timeseries", params)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching revenue time series: {str(e)}")
+
+
+@router.post("/refresh")
+async def refresh_rollups(date_from: Optional[date] = Query(None, alias="from", description="rebuild from this day on")):
+    """Rebuild the rollups from order_items, e.g. after a manual data fix - Admin only."""
+    try:
+        result = await db.rpc("refresh_sales_rollups", {"p_from": date_from.isoformat() if date_from else None}).execute()
+        analytics_cache.clear()
+        return {"success": True, "data": result.data}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error refreshing sales rollups: {str(e)}")
@@ -1,8 +1,27 @@
 """Beat management API endpoints."""
-from fastapi import APIRouter, HTTPException, Header
-from pydantic import BaseModel
-from typing import Optional
-from backend.database import supabase
+import logging
+from collections import Counter
+from uuid import UUID
+
+from fastapi import APIRouter, HTTPException, Header, Query, Request
+from pydantic import BaseModel, Field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from backend.config import get_settings
+from backend.database import db
+from backend.pagination import BEAT_FIELDS, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, apply_keyset, build_select, paginate
+from backend.services.beat_cache import (
+    cache_stats,
+    get_beat as get_cached_beat,
+    get_catalog_page,
+    invalidate_beat,
+    invalidate_beats,
+    invalidate_catalog,
+)
+from backend.services.beat_import import detect_format, read_rows, write_rows
+from backend.services.beat_search import SearchQuery, search_beats as run_search
+from backend.services.media_pipeline import enqueue_beat_media
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/beats", tags=["beats"])
 
@@ -35,42 +54,252 @@ class BeatUpdate(BaseModel):
     licensor_legal_name: Optional[str] = None
 
 
+class BeatImport(BeatCreate):
+    # Rows with an id update that beat (only the fields they give); rows without one create a new beat
+    id: Optional[UUID] = None
+
+
+class BeatIdsRequest(BaseModel):
+    ids: List[UUID] = Field(..., min_length=1, max_length=1000)
+
+
+class BeatBulkToggleRequest(BeatIdsRequest):
+    is_active: bool = True
+
+
+# Ids per `id=in.(...)` filter, keeping request URLs well under proxy limits
+ID_FILTER_CHUNK = 200
+# Beats read (and jobs queued) per page by the analysis backfill
+BACKFILL_PAGE_SIZE = 1000
+
+
 @router.get("/", name="list_beats")
-async def list_beats():
-    """Get all beats (including inactive) - Admin only."""
+async def list_beats(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """Get a page of beats (including inactive), newest first - Admin only."""
+    select = build_select(fields, BEAT_FIELDS)
     try:
-        result = supabase.table("beats").select("*").order("created_at", desc=True).execute()
+        query = apply_keyset(db.table("beats").select(select), cursor, limit)
+        rows = await get_catalog_page(("list_beats", select, cursor, limit), query)
         
-        return {"success": True, "data": result.data or []}
+        data, next_cursor = paginate(rows, limit)
+        return {"success": True, "data": data, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching beats: {str(e)}")
 
 
 @router.post("/", name="create_beat")
 async def create_beat(beat: BeatCreate):
-    """Create a new beat."""
+    """Create a new beat; its preview clip and waveform are generated in the background."""
     try:
         beat_data = beat.dict()
-        result = supabase.table("beats").insert(beat_data).execute()
+        result = await db.table("beats").insert(beat_data).execute()
         
         if not result.data:
             raise HTTPException(status_code=500, detail="Failed to create beat")
         
+        invalidate_catalog()
+        await _queue_media([result.data[0]["id"]])
         return {"success": True, "data": result.data[0]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating beat: {str(e)}")
 
 
+@router.post("/bulk")
+async def bulk_upsert_beats(
+    request: Request,
+    format: Optional[str] = Query(None, description="json, ndjson or csv (default: from Content-Type)"),
+    atomic: bool = Query(False, description="all-or-nothing: write nothing if any row is invalid or fails"),
+):
+    """Create or update many beats from a JSON array, NDJSON or CSV upload - Admin only.
+
+    Every row is validated before anything is written. Rows with an ``id``
+    update that beat, the rest are created. An update only changes the
+    fields the row gives (for CSV, its non-empty cells); a new beat gets
+    the defaults. Returns a result per input row.
+    """
+    fmt = detect_format(request, format)
+    valid, results = await read_rows(request, fmt, BeatImport, get_settings().beat_bulk_max_rows)
+    if not results:
+        raise HTTPException(status_code=400, detail="No beats in upload")
+    
+    invalid = sum(1 for result in results if result.status == "invalid")
+    if atomic and invalid:
+        for result in results:
+            if result.status == "pending":
+                result.status = "not_written"
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "message": f"{invalid} invalid row(s); nothing was written",
+                "results": [result.to_dict() for result in results],
+            },
+        )
+    
+    try:
+        await write_rows(valid, results, get_settings().beat_bulk_chunk_size, atomic)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error importing beats: {str(e)}")
+    finally:
+        written = [result.id for result in results if result.status in ("created", "updated")]
+        if written:
+            invalidate_beats(written)
+            # Jobs for rows whose audio did not change finish without doing anything
+            await _queue_media(written)
+    
+    counts = Counter(result.status for result in results)
+    return {
+        "success": True,
+        "data": {
+            "created": counts["created"],
+            "updated": counts["updated"],
+            "invalid": counts["invalid"],
+            "failed": counts["failed"],
+            "results": [result.to_dict() for result in results],
+        },
+    }
+
+
+async def _queue_media(beat_ids: List[str]) -> None:
+    """Queue preview/waveform generation; the beats are saved either way, so failures are only logged."""
+    try:
+        await enqueue_beat_media(beat_ids)
+    except Exception as e:
+        logger.error(f"Failed to queue media processing for {len(beat_ids)} beat(s): {str(e)}")
+
+
+async def _apply_by_ids(ids: List[UUID], apply: Callable[[List[str]], Awaitable[Any]]) -> Dict[str, Any]:
+    """Run ``apply`` over the ids in chunks; a failing chunk is retried id by id."""
+    ids = list(dict.fromkeys(str(beat_id) for beat_id in ids))
+    done: List[str] = []
+    failed: List[Dict[str, str]] = []
+    for start in range(0, len(ids), ID_FILTER_CHUNK):
+        chunk = ids[start:start + ID_FILTER_CHUNK]
+        try:
+            done.extend(row["id"] for row in (await apply(chunk)).data or [])
+            continue
+        except Exception as e:
+            logger.warning(f"Bulk beat update of {len(chunk)} ids failed, retrying one by one: {str(e)}")
+        for beat_id in chunk:
+            try:
+                done.extend(row["id"] for row in (await apply([beat_id])).data or [])
+            except Exception as e:
+                failed.append({"id": beat_id, "error": str(e)})
+    if done:
+        invalidate_beats(done)
+    handled = set(done) | {failure["id"] for failure in failed}
+    not_found = [beat_id for beat_id in ids if beat_id not in handled]
+    return {"done": done, "not_found": not_found, "failed": failed}
+
+
+@router.patch("/bulk/toggle-active")
+async def bulk_toggle_beats_active(request: BeatBulkToggleRequest):
+    """Set is_active on many beats at once - Admin only."""
+    outcome = await _apply_by_ids(
+        request.ids,
+        lambda chunk: db.table("beats").update({"is_active": request.is_active}).in_("id", chunk).execute(),
+    )
+    return {
+        "success": True,
+        "data": {"updated": outcome["done"], "not_found": outcome["not_found"], "failed": outcome["failed"]},
+    }
+
+
+@router.post("/bulk/delete")
+async def bulk_delete_beats(request: BeatIdsRequest):
+    """Delete many beats at once; beats that have been sold fail individually - Admin only."""
+    outcome = await _apply_by_ids(
+        request.ids,
+        lambda chunk: db.table("beats").delete().in_("id", chunk).execute(),
+    )
+    return {
+        "success": True,
+        "data": {"deleted": outcome["done"], "not_found": outcome["not_found"], "failed": outcome["failed"]},
+    }
+
+
+@router.post("/analysis/backfill")
+async def backfill_beat_analysis(
+    only_missing: bool = Query(True, description="only beats without a bpm or key"),
+):
+    """Queue tempo and key detection for existing beats - Admin only.
+
+    Values entered by hand are never overwritten; see
+    ``backend.services.media_pipeline``.
+    """
+    try:
+        queued = 0
+        last_id: Optional[str] = None
+        while True:
+            query = db.table("beats").select("id").order("id").limit(BACKFILL_PAGE_SIZE)
+            if last_id:
+                query = query.gt("id", last_id)
+            if only_missing:
+                query = query.or_("bpm.is.null,key.is.null")
+            rows = (await query.execute()).data or []
+            if rows:
+                await enqueue_beat_media([row["id"] for row in rows], force=not only_missing, analysis_only=True)
+                queued += len(rows)
+                last_id = rows[-1]["id"]
+            if len(rows) < BACKFILL_PAGE_SIZE:
+                break
+        return {"success": True, "data": {"queued": queued}}
+    except Exception as e:
+        logger.error(f"Error queueing beat analysis backfill: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error queueing beat analysis: {str(e)}")
+
+
+@router.get("/search")
+async def search_beats(
+    q: Optional[str] = Query(None, max_length=200, description="words in the title, producer or genre"),
+    genre: Optional[str] = None,
+    key: Optional[str] = None,
+    license_type: Optional[str] = None,
+    bpm_min: Optional[int] = Query(None, ge=0),
+    bpm_max: Optional[int] = Query(None, ge=0),
+    price_min: Optional[int] = Query(None, ge=0),
+    price_max: Optional[int] = Query(None, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+):
+    """Search active beats by text with range / exact filters and facet counts.
+
+    Title matches rank first, then newest first. ``facets`` counts the
+    matching beats per genre, key and license type.
+    """
+    if bpm_min is not None and bpm_max is not None and bpm_min > bpm_max:
+        raise HTTPException(status_code=400, detail="bpm_min must not exceed bpm_max")
+    if price_min is not None and price_max is not None and price_min > price_max:
+        raise HTTPException(status_code=400, detail="price_min must not exceed price_max")
+    query = SearchQuery(q, genre, key, license_type, bpm_min, bpm_max, price_min, price_max, limit, offset)
+    try:
+        found = await run_search(query)
+        return {"success": True, "data": found["results"], "total": found["total"], "facets": found["facets"]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching beats: {str(e)}")
+
+
+@router.get("/cache/stats")
+async def get_beat_cache_stats():
+    """Hit, miss and eviction counters for the beat caches - Admin only."""
+    return {"success": True, "data": cache_stats()}
+
+
 @router.get("/{beat_id}")
 async def get_beat(beat_id: str):
     """Get a beat by ID."""
     try:
-        result = supabase.table("beats").select("*").eq("id", beat_id).execute()
+        beat = await get_cached_beat(beat_id)
         
-        if not result.data:
+        if not beat:
             raise HTTPException(status_code=404, detail="Beat not found")
         
-        return {"success": True, "data": result.data[0]}
+        return {"success": True, "data": beat}
     except HTTPException:
         raise
     except Exception as e:
@@ -81,17 +310,34 @@ async def get_beat(beat_id: str):
 async def delete_beat(beat_id: str):
     """Delete a beat."""
     try:
-        result = supabase.table("beats").delete().eq("id", beat_id).execute()
+        result = await db.table("beats").delete().eq("id", beat_id).execute()
+        invalidate_beat(beat_id)
         return {"success": True, "message": "Beat deleted"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting beat: {str(e)}")
 
 
+@router.post("/{beat_id}/media")
+async def reprocess_beat_media(beat_id: UUID):
+    """Regenerate a beat's preview clip and waveform and re-detect its tempo and key in the background - Admin only."""
+    try:
+        beat = await get_cached_beat(str(beat_id))
+        if not beat:
+            raise HTTPException(status_code=404, detail="Beat not found")
+        await enqueue_beat_media([str(beat_id)], force=True)
+        return {"success": True, "message": "Media processing queued"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error queueing media processing: {str(e)}")
+
+
 @router.patch("/{beat_id}/toggle-active")
 async def toggle_beat_active(beat_id: str, is_active: bool = True):
     """Toggle beat active status."""
     try:
-        result = supabase.table("beats").update({"is_active": is_active}).eq("id", beat_id).execute()
+        result = await db.table("beats").update({"is_active": is_active}).eq("id", beat_id).execute()
+        invalidate_beat(beat_id)
         
         if not result.data:
             raise HTTPException(status_code=404, detail="Beat not found")
@@ -0,0 +1,107 @@
+"""Public storefront catalog endpoint."""
+from typing import Optional
+from uuid import UUID
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+
+from backend.config import get_settings
+from backend.services.catalog_snapshot import EncodedCatalog, catalog_store
+from backend.services.reservations import get_availability
+
+# Beat ids per availability lookup, keeping the filter URL well under proxy limits
+MAX_AVAILABILITY_IDS = 200
+
+router = APIRouter(prefix="/api/catalog", tags=["catalog"])
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: a CDN may have turned our strong ETag into W/"..."
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates
+
+
+def _negotiate(accept_encoding: str, encoded: EncodedCatalog) -> Optional[str]:
+    accepted = {
+        part.split(";")[0].strip().lower()
+        for part in accept_encoding.split(",")
+        if part.strip() and not part.replace(" ", "").endswith(";q=0")
+    }
+    if encoded.br is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+@router.get("/")
+async def get_catalog(
+    request: Request,
+    genre: Optional[str] = None,
+    key: Optional[str] = None,
+    bpm_min: Optional[int] = Query(None, ge=0),
+    bpm_max: Optional[int] = Query(None, ge=0),
+):
+    """Get all active beats, newest first, optionally filtered by genre, key and BPM range.
+
+    Served from an in-memory snapshot with ETag revalidation and gzip/brotli
+    bodies precomputed at build time.
+    """
+    if bpm_min is not None and bpm_max is not None and bpm_min > bpm_max:
+        raise HTTPException(status_code=400, detail="bpm_min must not exceed bpm_max")
+    try:
+        snapshot = await catalog_store.get()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching catalog: {str(e)}")
+
+    filters = (
+        genre.strip().lower() if genre and genre.strip() else None,
+        key.strip().lower() if key and key.strip() else None,
+        bpm_min,
+        bpm_max,
+    )
+    encoded = snapshot.encoded(filters)
+    headers = {
+        "ETag": encoded.etag,
+        "Cache-Control": get_settings().catalog_cache_control,
+        "Vary": "Accept-Encoding",
+        "X-Catalog-Version": str(snapshot.version),
+    }
+    if _etag_matches(request.headers.get("if-none-match"), encoded.etag):
+        return Response(status_code=304, headers=headers)
+
+    encoding = _negotiate(request.headers.get("accept-encoding", ""), encoded)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    body = getattr(encoded, encoding) if encoding else encoded.identity
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/availability")
+async def get_beat_availability(ids: Optional[str] = Query(None, description="Comma-separated beat ids")):
+    """Whether each beat's exclusive license can still be bought: available, held, sold or unavailable.
+
+    Without ``ids``, lists only the beats currently held by a checkout.
+    Cached briefly in each worker and by the CDN; a new hold or release
+    clears the worker caches at once.
+    """
+    beat_ids = None
+    if ids is not None:
+        try:
+            beat_ids = [str(UUID(part.strip())) for part in ids.split(",") if part.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be comma-separated beat UUIDs")
+        if len(beat_ids) > MAX_AVAILABILITY_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_AVAILABILITY_IDS} ids per request")
+    try:
+        availability = await get_availability(beat_ids)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching availability: {str(e)}")
+    return JSONResponse(
+        {"success": True, "data": availability},
+        headers={"Cache-Control": get_settings().availability_cache_control},
+    )
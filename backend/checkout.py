@@ -0,0 +1,196 @@
+"""Stripe checkout session endpoints."""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+
+from backend.config import get_settings
+from backend.metrics import span
+from backend.services.beat_cache import get_beat as get_cached_beat
+from backend.services.checkout_items import (
+    EXCLUSIVE_LICENSE_TYPE,
+    LICENSE_PRICES_CENTS,
+    MAX_CHECKOUT_ITEMS,
+    list_price,
+)
+from backend.services.reservations import (
+    BeatsUnavailableError,
+    Hold,
+    attach_checkout,
+    expire_checkout_session,
+    release,
+    reserve_exclusive,
+)
+from backend.stripe_webhook import get_stripe
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/checkout", tags=["checkout"])
+
+# Stripe's limits on a session's expires_at, in seconds from creation
+MIN_SESSION_TTL_SECONDS = 30 * 60
+MAX_SESSION_TTL_SECONDS = 24 * 60 * 60
+# Stripe metadata values are limited to 500 characters; larger carts are read from the line items
+MAX_METADATA_VALUE = 500
+
+LICENSE_LABELS = {
+    "mp3_non_exclusive": "Basic Lease (MP3)",
+    "wav_non_exclusive": "Premium Lease (WAV)",
+    "premium_trackout_non_exclusive": "Unlimited Lease (WAV + Stems)",
+    EXCLUSIVE_LICENSE_TYPE: "Exclusive License",
+}
+
+
+class CheckoutLineItem(BaseModel):
+    beat_id: UUID
+    license_type: str
+
+
+class CheckoutSessionCreate(BaseModel):
+    items: List[CheckoutLineItem] = Field(..., min_length=1, max_length=MAX_CHECKOUT_ITEMS)
+    customer_email: Optional[str] = None
+    user_id: Optional[UUID] = None
+
+
+def _session_params(
+    items: List[Dict[str, Any]],
+    request: CheckoutSessionCreate,
+    expires_at: int,
+    hold: Optional[Hold],
+) -> Dict[str, Any]:
+    settings = get_settings()
+    success_url, cancel_url = settings.require("checkout_success_url", "checkout_cancel_url")
+    metadata = {}
+    encoded = json.dumps(
+        [{key: item[key] for key in ("beat_id", "license_type", "price_cents")} for item in items],
+        separators=(",", ":"),
+    )
+    if len(encoded) <= MAX_METADATA_VALUE:
+        metadata["items"] = encoded
+    if hold is not None:
+        metadata["hold_token"] = hold.token
+    if request.user_id:
+        metadata["user_id"] = str(request.user_id)
+    params = {
+        "mode": "payment",
+        "success_url": success_url,
+        "cancel_url": cancel_url,
+        "expires_at": expires_at,
+        "metadata": metadata,
+        "line_items": [
+            {
+                "quantity": 1,
+                "price_data": {
+                    "currency": settings.checkout_currency,
+                    "unit_amount": item["price_cents"],
+                    "product_data": {
+                        "name": f"{item['title']} - {LICENSE_LABELS[item['license_type']]}",
+                        # Read back by the webhook when the cart is too large for the session metadata
+                        "metadata": {"beat_id": item["beat_id"], "license_type": item["license_type"]},
+                    },
+                },
+            }
+            for item in items
+        ],
+    }
+    if request.customer_email:
+        params["customer_email"] = request.customer_email
+    return params
+
+
+@router.post("/sessions")
+async def create_checkout_session(request: CheckoutSessionCreate):
+    """
+    Start a Stripe checkout for one or more beat licenses.
+
+    Exclusive licenses are held for the buyer first, so two buyers can never
+    pay for the same one: the loser gets a 409 before reaching Stripe. The
+    hold lasts as long as the session and is released if the session expires
+    or is cancelled (DELETE /api/checkout/sessions/{checkout_id}).
+    """
+    unknown = sorted({item.license_type for item in request.items} - LICENSE_PRICES_CENTS.keys())
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown license type(s): {', '.join(unknown)}")
+    exclusive_ids = [str(item.beat_id) for item in request.items if item.license_type == EXCLUSIVE_LICENSE_TYPE]
+    if len(set(exclusive_ids)) != len(exclusive_ids):
+        raise HTTPException(status_code=400, detail="An exclusive license can only be bought once per beat")
+
+    hold = None
+    try:
+        beats = await asyncio.gather(*(get_cached_beat(str(item.beat_id)) for item in request.items))
+        items = []
+        for item, beat in zip(request.items, beats):
+            if not beat or not beat.get("is_active"):
+                raise HTTPException(status_code=404, detail=f"Beat {item.beat_id} not found")
+            items.append({
+                "beat_id": str(item.beat_id),
+                "license_type": item.license_type,
+                "price_cents": list_price(beat, item.license_type),
+                "title": beat.get("title") or "Beat",
+            })
+
+        settings = get_settings()
+        ttl = min(max(settings.checkout_session_ttl_seconds, MIN_SESSION_TTL_SECONDS), MAX_SESSION_TTL_SECONDS)
+        expires_at = int(time.time()) + ttl
+        if exclusive_ids:
+            with span("checkout.reserve"):
+                hold = await reserve_exclusive(exclusive_ids, ttl + settings.reservation_grace_seconds)
+
+        with span("checkout.create_session"):
+            stripe = get_stripe()
+            session = await asyncio.to_thread(
+                stripe.checkout.Session.create, **_session_params(items, request, expires_at, hold)
+            )
+        if hold is not None:
+            try:
+                await attach_checkout(hold.token, session["id"])
+            except Exception:
+                # Unattached, the hold could not be released with its session; close the session instead
+                await asyncio.to_thread(expire_checkout_session, session["id"])
+                raise
+
+        return {
+            "success": True,
+            "data": {
+                "checkout_id": session["id"],
+                "url": session["url"],
+                "expires_at": datetime.fromtimestamp(expires_at, timezone.utc).isoformat(),
+                "held_until": hold.expires_at if hold else None,
+            },
+        }
+    except BeatsUnavailableError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        if hold is not None:
+            try:
+                await release(token=hold.token)
+            except Exception as release_error:
+                logger.error("Failed to release hold %s: %s", hold.token, release_error)
+        raise HTTPException(status_code=500, detail=f"Error creating checkout session: {str(e)}")
+
+
+@router.delete("/sessions/{checkout_id}")
+async def cancel_checkout_session(checkout_id: str):
+    """Cancel an unpaid checkout session and release its exclusive-license holds."""
+    stripe = get_stripe()
+    try:
+        # Close the session first so it cannot be paid once the hold is gone
+        await asyncio.to_thread(expire_checkout_session, checkout_id)
+    except stripe.error.InvalidRequestError as e:
+        # Already completed (or unknown); a completed session keeps its licenses
+        raise HTTPException(status_code=409, detail=f"Checkout session cannot be cancelled: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error cancelling checkout session: {str(e)}")
+    try:
+        released = await release(checkout_id=checkout_id)
+        return {"success": True, "data": {"released": released}}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error releasing checkout holds: {str(e)}")
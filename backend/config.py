@@ -1,12 +1,22 @@
-"""Configuration module for environment variables."""
+"""Configuration module for environment variables.
+
+Settings are read from the environment (and ``.env``) on first use, not at
+import, so the app can be imported without credentials. Call
+``get_settings()`` where a value is needed; ``validate()`` runs at app
+startup so missing required variables still fail the deploy immediately.
+The UPPER_CASE module attributes (``from backend.config import
+STORAGE_BUCKET``) remain available and resolve through the same settings,
+but importing one loads the settings; objects built at import time (caches,
+the job queue) take ``setting("name")`` instead and read it on first use.
+"""
+import importlib.util
 import os
-from typing import Optional
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Any, Callable, Optional, Tuple, get_args
 
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
-
 
 def get_env_var(name: str, required: bool = True) -> Optional[str]:
     """Get environment variable, raise error if required and missing."""
@@ -16,15 +26,217 @@ def get_env_var(name: str, required: bool = True) -> Optional[str]:
     return value
 
 
-# Stripe configuration
-STRIPE_SECRET_KEY: str = get_env_var("STRIPE_SECRET_KEY")
-STRIPE_WEBHOOK_SECRET: str = get_env_var("STRIPE_WEBHOOK_SECRET")
+def _parse(raw: str, annotation: Any) -> Any:
+    # Optional[X] -> X
+    kind = next((arg for arg in get_args(annotation) if arg is not type(None)), annotation)
+    if kind is bool:
+        return raw.lower() == "true"
+    return kind(raw)
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Typed application settings; field names are the lower-cased env var names."""
+
+    # Stripe configuration (required)
+    stripe_secret_key: Optional[str] = None
+    stripe_webhook_secret: Optional[str] = None
+
+    # Supabase configuration (required)
+    supabase_url: Optional[str] = None
+    supabase_service_role_key: Optional[str] = None
+
+    # Async Supabase connection pool (shared by all API routers)
+    supabase_pool_max_connections: int = 20
+    supabase_pool_max_keepalive: int = 10
+    supabase_keepalive_expiry: float = 30.0
+    supabase_timeout_seconds: float = 10.0
+    supabase_http2: bool = True
+
+    # Object storage ("supabase", "local" or "memory")
+    storage_backend: str = "supabase"
+    storage_bucket: str = "beats"
+    # License PDFs; never public, handed out as signed download links
+    storage_private_bucket: str = "purchases"
+    storage_chunk_size: int = 1024 * 1024
+    storage_chunked_threshold: int = 5 * 1024 * 1024
+    local_storage_dir: str = "storage"
+    local_storage_base_url: Optional[str] = None
+    local_private_storage_dir: str = "storage_private"
+    # Connections in the storage HTTP pool, shared by every storage caller in the process
+    storage_pool_max_connections: int = 20
+    storage_pool_max_keepalive: int = 10
+    # Timeouts, dropped connections, 5xx and 429 are retried with exponential backoff
+    storage_max_attempts: int = 4
+    storage_retry_base_seconds: float = 0.2
+    storage_retry_max_seconds: float = 5.0
+    # After this many consecutive failures storage calls fail fast for the cooldown
+    storage_breaker_threshold: int = 5
+    storage_breaker_cooldown_seconds: float = 30.0
+
+    # Stripe webhook deduplication (recently processed event IDs kept in memory)
+    webhook_dedup_cache_size: int = 10000
+
+    # Beat catalog caches (per process; TTL bounds staleness across workers)
+    beat_cache_size: int = 1000
+    beat_cache_ttl_seconds: float = 60.0
+    catalog_cache_size: int = 100
+    catalog_cache_ttl_seconds: float = 30.0
+
+    # Public storefront catalog snapshot
+    catalog_snapshot_max_age_seconds: float = 60.0
+    catalog_cache_control: str = "public, max-age=60, s-maxage=300, stale-while-revalidate=600"
+
+    # Sampling profiler for slow requests (disabled unless PROFILE_SLOW_REQUEST_MS is set)
+    profile_slow_request_ms: Optional[float] = None
+    profile_sample_interval_ms: float = 5.0
+    profile_output_dir: str = "profiles"
+
+    # Storefront search ("memory": index over the catalog snapshot, "postgres": search_beats function)
+    beat_search_backend: str = "memory"
+
+    # Bulk beat import (POST /api/beats/bulk)
+    beat_bulk_max_rows: int = 5000
+    beat_bulk_chunk_size: int = 500
+
+    # Sales analytics (rollup query results cached per process)
+    analytics_cache_ttl_seconds: float = 30.0
+
+    # Accounting exports (rows fetched per keyset page while streaming)
+    export_page_size: int = 1000
+
+    # Signed download links (GET /api/downloads/{license_id}); a signature is reused until
+    # it has less than the refresh margin left
+    download_url_ttl_seconds: int = 900
+    download_url_refresh_margin_seconds: int = 120
+    download_url_cache_size: int = 10000
+    # Requests per minute (0 disables) and burst, counted per client and per license in each process
+    download_rate_limit_per_minute: int = 30
+    download_rate_limit_burst: int = 10
+    # Download log: rows are buffered and inserted in batches
+    download_log_batch_size: int = 200
+    download_log_flush_interval_seconds: float = 2.0
+    download_log_max_buffer: int = 10000
+
+    # Preview clips and waveform peaks generated when beats are created or imported
+    audio_pipeline_enabled: bool = True
+    # "auto" (ffmpeg when installed, else WAV), "ffmpeg" (MP3 previews) or "wav"
+    audio_transcoder: str = "auto"
+    ffmpeg_path: str = "ffmpeg"
+    audio_preview_seconds: float = 30.0
+    audio_preview_start_seconds: float = 0.0
+    audio_preview_bitrate_kbps: int = 64
+    # Min/max pairs per waveform
+    audio_waveform_points: int = 1000
+    # Processes decoding and transcoding audio (per API process)
+    audio_worker_processes: int = 2
+    audio_max_source_bytes: int = 500 * 1024 * 1024
+    # Tempo and key detection; detected values fill bpm/key unless they were entered by hand
+    audio_analysis_enabled: bool = True
+
+    # Checkout sessions (POST /api/checkout/sessions); Stripe keeps a session open for 30 minutes to 24 hours
+    checkout_success_url: Optional[str] = None
+    checkout_cancel_url: Optional[str] = None
+    checkout_session_ttl_seconds: int = 1800
+    checkout_currency: str = "usd"
+    # Exclusive-license holds outlive their session by this much, so a last-second payment still finds it
+    reservation_grace_seconds: int = 300
+    # Beat availability lookups (GET /api/catalog/availability), cached per process
+    availability_cache_size: int = 1000
+    availability_cache_ttl_seconds: float = 5.0
+    availability_cache_control: str = "public, max-age=5"
+
+    # Application logs, written to stderr by a background thread ("json" lines or "text")
+    log_format: str = "json"
+    log_level: str = "INFO"
+    # Records waiting for the writer; beyond this they are dropped, never waited for
+    log_queue_size: int = 10000
+    # Per-level sampling of noisy loggers: comma-separated [logger:]LEVEL=rate rules
+    log_sampling: Optional[str] = "httpx:INFO=0.01"
+
+    # License configuration (optional - can be set per-beat or via env vars)
+    producer_name: Optional[str] = None
+    licensor_legal_name: Optional[str] = None
+
+    # Background job queue configuration ("supabase" in production, "sqlite" for local runs)
+    job_queue_backend: str = "supabase"
+    job_queue_sqlite_path: str = ":memory:"
+    job_worker_concurrency: int = 4
+    job_max_attempts: int = 5
+
+    # Bulk license re-issue checkpoints (admin endpoint runs)
+    reissue_checkpoint_dir: str = "reissue_checkpoints"
+
+    # Multi-worker coordination ("memory" for one process, "sqlite" for one host, "postgres" for many)
+    shared_state_backend: str = "memory"
+    shared_state_sqlite_path: str = "shared_state.db"
+    database_url: Optional[str] = None
+    leader_lease_seconds: float = 15.0
+    # Leader-only maintenance: stale job recovery, replay of stuck webhook events, lost license renders
+    maintenance_interval_seconds: float = 60.0
+    webhook_replay_min_age_seconds: float = 300.0
+    # A failed Stripe event is retried with exponential backoff, then given up on (kept with its error)
+    webhook_retry_max_attempts: int = 10
+    webhook_retry_base_seconds: float = 60.0
+    webhook_retry_max_seconds: float = 3600.0
+    # Licenses still without a PDF and without a render job this long after the sale are re-queued
+    license_requeue_min_age_seconds: float = 900.0
+
+    REQUIRED = ("stripe_secret_key", "stripe_webhook_secret", "supabase_url", "supabase_service_role_key")
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """Read each field from the env var of the same name (upper-cased); unset keeps the default."""
+        values = {}
+        for field in fields(cls):
+            raw = get_env_var(field.name.upper(), required=False)
+            if raw:
+                values[field.name] = _parse(raw, field.type)
+        return cls(**values)
+
+    def require(self, *names: str) -> Tuple[str, ...]:
+        """Return the named settings, raising ValueError if any is unset."""
+        values = tuple(getattr(self, name) for name in names)
+        for name, value in zip(names, values):
+            if not value:
+                raise ValueError(f"Required environment variable {name.upper()} is not set")
+        return values
+
+    def validate(self) -> None:
+        """Fail fast (at startup) if a required variable or dependency is missing."""
+        self.require(*self.REQUIRED)
+        if self.shared_state_backend == "postgres":
+            self.require("database_url")
+            # Checked without importing it, so startup stays light
+            if importlib.util.find_spec("asyncpg") is None:
+                raise ValueError("SHARED_STATE_BACKEND=postgres needs the asyncpg package (pip install asyncpg)")
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """Load settings on first use; ``get_settings.cache_clear()`` forces a re-read."""
+    # Load environment variables from .env file
+    load_dotenv()
+    return Settings.from_env()
+
+
+def setting(name: str) -> Callable[[], Any]:
+    """Defer reading a setting: a callable returning ``get_settings().<name>``."""
+    if name not in _SETTING_NAMES:
+        raise AttributeError(f"Unknown setting: {name}")
+    return lambda: getattr(get_settings(), name)
+
+
+def resolve(value: Any) -> Any:
+    """The value of a deferred ``setting()``; anything else is returned unchanged."""
+    return value() if callable(value) else value
+
 
-# Supabase configuration
-SUPABASE_URL: str = get_env_var("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY: str = get_env_var("SUPABASE_SERVICE_ROLE_KEY")
+_SETTING_NAMES = {field.name for field in fields(Settings)}
 
-# License configuration (optional - can be set per-beat or via env vars)
-PRODUCER_NAME: Optional[str] = get_env_var("PRODUCER_NAME", required=False)
-LICENSOR_LEGAL_NAME: Optional[str] = get_env_var("LICENSOR_LEGAL_NAME", required=False)
 
+def __getattr__(name: str):
+    # Legacy module constants, e.g. ``from backend.config import STORAGE_BUCKET``
+    if name.isupper() and name.lower() in _SETTING_NAMES:
+        return getattr(get_settings(), name.lower())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
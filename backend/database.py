@@ -1,8 +1,130 @@
-"""Database connection module using Supabase client."""
-from supabase import create_client, Client
+"""Database connection module using the Supabase PostgREST API."""
+from typing import Any, Optional
 
-from backend.config import SUPABASE_SERVICE_ROLE_KEY, SUPABASE_URL
+from backend.config import get_settings
+from backend.metrics import ASYNC_SUPABASE_HOOKS
 
-# Initialize Supabase client with service role key (bypasses RLS)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 
+class AsyncDatabase:
+    """Non-blocking PostgREST access for request handlers.
+
+    Owns one pooled, keep-alive HTTP/2 connection to Supabase that is shared by
+    every router. The client is created on first use and closed by the app
+    lifespan, so it always belongs to the running event loop. Arguments left
+    as ``None`` are taken from the settings at that point.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        key: Optional[str] = None,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        timeout: Optional[float] = None,
+        http2: Optional[bool] = None,
+    ):
+        self._options = {
+            "url": url,
+            "key": key,
+            "max_connections": max_connections,
+            "max_keepalive_connections": max_keepalive_connections,
+            "keepalive_expiry": keepalive_expiry,
+            "timeout": timeout,
+            "http2": http2,
+        }
+        self._client: Optional[Any] = None
+
+    def _resolved_options(self) -> dict:
+        options = dict(self._options)
+        if None in options.values():
+            settings = get_settings()
+            defaults = {
+                "max_connections": settings.supabase_pool_max_connections,
+                "max_keepalive_connections": settings.supabase_pool_max_keepalive,
+                "keepalive_expiry": settings.supabase_keepalive_expiry,
+                "timeout": settings.supabase_timeout_seconds,
+                "http2": settings.supabase_http2,
+            }
+            if options["url"] is None or options["key"] is None:
+                defaults["url"], defaults["key"] = settings.require("supabase_url", "supabase_service_role_key")
+            options = {name: defaults[name] if value is None else value for name, value in options.items()}
+        return options
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            # Imported on first use to keep app startup fast
+            import httpx
+            from postgrest import AsyncPostgrestClient
+
+            options = self._resolved_options()
+            rest_url = f"{options['url'].rstrip('/')}/rest/v1"
+            headers = {
+                "apikey": options["key"],
+                "Authorization": f"Bearer {options['key']}",
+                "Accept": "application/json",
+                "Content-Type": "application/json",
+            }
+            http_client = httpx.AsyncClient(
+                base_url=rest_url,
+                headers=headers,
+                limits=httpx.Limits(
+                    max_connections=options["max_connections"],
+                    max_keepalive_connections=options["max_keepalive_connections"],
+                    keepalive_expiry=options["keepalive_expiry"],
+                ),
+                timeout=httpx.Timeout(options["timeout"]),
+                http2=options["http2"],
+                follow_redirects=True,
+                event_hooks=ASYNC_SUPABASE_HOOKS,
+            )
+            self._client = AsyncPostgrestClient(rest_url, headers=headers, http_client=http_client)
+        return self._client
+
+    def table(self, name: str) -> Any:
+        """Start a query on a table; finish it with ``await ....execute()``."""
+        return self.client.from_(name)
+
+    def rpc(self, function: str, params: Optional[dict] = None) -> Any:
+        """Call a Postgres function; finish it with ``await ....execute()``."""
+        return self.client.rpc(function, params or {})
+
+    async def aclose(self) -> None:
+        """Close pooled connections (called on app shutdown)."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# SQLSTATE classes and codes that mean the database was unreachable, overloaded or lost a race
+TRANSIENT_SQLSTATE_CLASSES = ("08", "53", "57", "58")
+TRANSIENT_SQLSTATES = frozenset({"40001", "40P01", "55P03"})
+# PostgREST could not connect to (or lost) the database
+TRANSIENT_POSTGREST_CODES = frozenset({"PGRST000", "PGRST001", "PGRST002", "PGRST003"})
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Whether repeating the request that raised ``error`` may succeed.
+
+    Errors PostgREST answers with a Postgres or PostgREST code (a missing
+    row, a constraint violation, a bad value) are permanent unless the code
+    says the database was unavailable or busy. Connection failures, timeouts,
+    5xx responses without an error body and anything else are transient.
+    """
+    from postgrest.exceptions import APIError
+
+    if not isinstance(error, APIError):
+        return True
+    code = error.code
+    if isinstance(code, int):
+        # No JSON error body: the HTTP status (e.g. a 502 from the gateway)
+        return code >= 500 or code in (408, 429)
+    code = str(code or "")
+    if code.startswith("PGRST"):
+        return code in TRANSIENT_POSTGREST_CODES
+    return code in TRANSIENT_SQLSTATES or code.startswith(TRANSIENT_SQLSTATE_CLASSES)
+
+
+# Shared async client for all routers (connects on first query)
+db = AsyncDatabase()
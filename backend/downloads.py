@@ -0,0 +1,113 @@
+"""Download API endpoints for purchased licenses and audio."""
+import logging
+import math
+from typing import Literal
+from uuid import UUID
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import RedirectResponse
+
+from backend.database import db
+from backend.services.beat_cache import get_beat
+from backend.services.downloads import DOWNLOADS, DOWNLOADS_RATE_LIMITED, download_limiter, download_recorder, url_signer
+from backend.services.storage import StorageUnavailableError, locate
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/downloads", tags=["downloads"])
+
+
+def _check_rate_limit(request: Request, license_id: UUID) -> None:
+    # The client address is the proxy's unless uvicorn trusts its forwarded headers (--forwarded-allow-ips)
+    client = request.client.host if request.client else "unknown"
+    for scope, key in (("client", f"client:{client}"), ("license", f"license:{license_id}")):
+        wait = download_limiter.acquire(key)
+        if wait:
+            DOWNLOADS_RATE_LIMITED.inc(scope=scope)
+            raise HTTPException(
+                status_code=429,
+                detail="Too many download requests, try again later",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+
+@router.get("/{license_id}")
+async def get_download(
+    request: Request,
+    license_id: UUID,
+    kind: Literal["license", "audio"] = "license",
+    redirect: bool = False,
+):
+    """Get a short-lived signed URL for a license PDF or the purchased audio.
+
+    With ``redirect=true`` the response is a 302 to the signed URL, so it can
+    be used directly as a link. This is the only way to the files: they are
+    kept in the private bucket and the license rows hold no usable URL.
+
+    There is no buyer check: anyone who has a license ID can download its
+    files, so the ID must be treated like a password: a random UUID to be
+    given only to the buyer. Requests are rate limited per client and per
+    license to slow down a leaked ID.
+    """
+    _check_rate_limit(request, license_id)
+    try:
+        result = await db.table("licenses").select(
+            "id, user_id, beat_id, license_url, order_item_id, order_items (order_id, orders (status))"
+        ).eq("id", str(license_id)).execute()
+        if not result.data:
+            raise HTTPException(status_code=404, detail="License not found")
+        license_row = result.data[0]
+        order_item = license_row.get("order_items") or {}
+        order = order_item.get("orders") or {}
+        # Only paid orders grant downloads (refunded or disputed ones lose access)
+        if order.get("status") != "completed":
+            raise HTTPException(status_code=403, detail="The order for this license is not completed")
+        order_id = order_item.get("order_id")
+
+        if kind == "license":
+            # license_url is filled in by the render_license job once the PDF exists
+            if not license_row.get("license_url") or not order_id:
+                raise HTTPException(status_code=409, detail="License PDF is not ready yet")
+            location = locate(license_row["license_url"])
+            if location is None:
+                raise HTTPException(status_code=404, detail="License PDF is not in storage")
+        else:
+            beat = await get_beat(license_row["beat_id"])
+            if not beat or not beat.get("audio_url"):
+                raise HTTPException(status_code=404, detail="Beat audio not found")
+            location = locate(beat["audio_url"])
+
+        if location is None:
+            # Audio hosted outside our storage cannot be signed; hand out its URL as is
+            signed = {"url": beat["audio_url"], "expires_at": None}
+            download_url = beat["audio_url"]
+        else:
+            backend, path = location
+            signed = await url_signer.sign(backend, path)
+            download_url = backend.public_url(path)
+
+        DOWNLOADS.inc(kind=kind)
+        download_recorder.record({
+            "license_id": str(license_id),
+            "user_id": license_row.get("user_id"),
+            "beat_id": license_row.get("beat_id"),
+            "order_id": order_id,
+            "kind": kind,
+            # The object, not the signed link: the token is a credential
+            "download_url": download_url,
+        })
+
+        if redirect:
+            return RedirectResponse(signed["url"], status_code=302)
+        return {"success": True, "data": {"kind": kind, **signed}}
+    except HTTPException:
+        raise
+    except StorageUnavailableError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Storage is temporarily unavailable: {str(e)}",
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+    except Exception as e:
+        logger.error(f"Error creating download link for license {license_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error creating download link: {str(e)}")
@@ -0,0 +1,223 @@
+"""Streaming NDJSON/CSV exports of orders and licenses for accounting.
+
+Rows are read one keyset page at a time (``EXPORT_PAGE_SIZE`` rows), flattened
+to one line per order item or license, encoded and optionally gzipped on the
+fly, so memory stays constant however long the history is.
+"""
+import csv
+import io
+import json
+import logging
+import zlib
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from backend.config import get_settings
+from backend.database import db
+from backend.pagination import apply_keyset, paginate
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+ORDER_EXPORT_SELECT = (
+    "id, created_at, status, total_cents, customer_name, customer_email, "
+    "stripe_checkout_id, stripe_payment_intent_id, "
+    "order_items (id, beat_id, license_type, price_cents, beats (title), licenses (id, license_url))"
+)
+ORDER_EXPORT_COLUMNS = [
+    "order_id", "order_created_at", "status", "total_cents", "customer_name", "customer_email",
+    "stripe_checkout_id", "stripe_payment_intent_id", "order_item_id", "beat_id", "beat_title",
+    "license_type", "price_cents", "license_id", "pdf_ready",
+]
+
+LICENSE_EXPORT_SELECT = (
+    "id, created_at, license_type, license_url, beat_id, order_item_id, "
+    "beats (title), "
+    "order_items (order_id, price_cents, orders (status, customer_name, customer_email, stripe_checkout_id))"
+)
+LICENSE_EXPORT_COLUMNS = [
+    "license_id", "license_created_at", "license_type", "pdf_ready", "beat_id", "beat_title",
+    "order_item_id", "price_cents", "order_id", "order_status", "customer_name", "customer_email",
+    "stripe_checkout_id",
+]
+
+
+def _pdf_ready(license_row: Dict[str, Any]) -> Optional[bool]:
+    # Exports carry whether the PDF exists, never where: it is downloaded through /api/downloads
+    if not license_row:
+        return None
+    return license_row.get("license_url") is not None
+
+
+def flatten_order(order: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    """One row per order item and license; orders without items still get a row."""
+    base = {
+        "order_id": order.get("id"),
+        "order_created_at": order.get("created_at"),
+        "status": order.get("status"),
+        "total_cents": order.get("total_cents"),
+        "customer_name": order.get("customer_name"),
+        "customer_email": order.get("customer_email"),
+        "stripe_checkout_id": order.get("stripe_checkout_id"),
+        "stripe_payment_intent_id": order.get("stripe_payment_intent_id"),
+    }
+    items = order.get("order_items") or []
+    if not items:
+        yield base
+        return
+    for item in items:
+        row = {
+            **base,
+            "order_item_id": item.get("id"),
+            "beat_id": item.get("beat_id"),
+            "beat_title": (item.get("beats") or {}).get("title"),
+            "license_type": item.get("license_type"),
+            "price_cents": item.get("price_cents"),
+        }
+        licenses = item.get("licenses") or [{}]
+        for license_row in licenses:
+            yield {**row, "license_id": license_row.get("id"), "pdf_ready": _pdf_ready(license_row)}
+
+
+def flatten_license(license_row: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    """One row per license with its beat title and order details."""
+    order_item = license_row.get("order_items") or {}
+    order = order_item.get("orders") or {}
+    yield {
+        "license_id": license_row.get("id"),
+        "license_created_at": license_row.get("created_at"),
+        "license_type": license_row.get("license_type"),
+        "pdf_ready": _pdf_ready(license_row),
+        "beat_id": license_row.get("beat_id"),
+        "beat_title": (license_row.get("beats") or {}).get("title"),
+        "order_item_id": license_row.get("order_item_id"),
+        "price_cents": order_item.get("price_cents"),
+        "order_id": order_item.get("order_id"),
+        "order_status": order.get("status"),
+        "customer_name": order.get("customer_name"),
+        "customer_email": order.get("customer_email"),
+        "stripe_checkout_id": order.get("stripe_checkout_id"),
+    }
+
+
+def _parse_date(name: str, value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    try:
+        datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date or date-time")
+    return value
+
+
+class _Encoder:
+    """Turns flat rows into NDJSON or CSV bytes, gzipping as it goes if asked."""
+
+    def __init__(self, fmt: str, columns: List[str], compress: bool):
+        self.fmt = fmt
+        self.columns = columns
+        self._buffer = io.StringIO()
+        self._writer = csv.DictWriter(self._buffer, fieldnames=columns, extrasaction="ignore")
+        # wbits=31: gzip container, so the stream is a valid .gz file
+        self._gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def _out(self, data: bytes) -> bytes:
+        return self._gzip.compress(data) if self._gzip else data
+
+    def header(self) -> bytes:
+        if self.fmt != "csv":
+            return b""
+        self._writer.writeheader()
+        return self._out(self._drain())
+
+    def encode(self, rows: Iterable[Dict[str, Any]]) -> bytes:
+        if self.fmt == "csv":
+            self._writer.writerows(rows)
+        else:
+            for row in rows:
+                self._buffer.write(json.dumps({column: row.get(column) for column in self.columns}, default=str))
+                self._buffer.write("\n")
+        return self._out(self._drain())
+
+    def finish(self) -> bytes:
+        return self._gzip.flush() if self._gzip else b""
+
+    def _drain(self) -> bytes:
+        data = self._buffer.getvalue().encode("utf-8")
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+def _query(table: str, select: str, created_from: Optional[str], created_to: Optional[str]) -> Any:
+    query = db.table(table).select(select)
+    if created_from:
+        query = query.gte("created_at", created_from)
+    if created_to:
+        query = query.lt("created_at", created_to)
+    return query
+
+
+async def export_response(
+    table: str,
+    select: str,
+    columns: List[str],
+    flatten: Callable[[Dict[str, Any]], Iterable[Dict[str, Any]]],
+    fmt: str,
+    created_from: Optional[str],
+    created_to: Optional[str],
+    compress: bool,
+) -> StreamingResponse:
+    """Stream every ``table`` row in ``[created_from, created_to)``, newest first.
+
+    The first page is fetched before the response starts so a failing query
+    still returns a 500. An error on a later page is logged and re-raised,
+    which aborts the connection mid-body so the client sees a truncated
+    download rather than a file that merely looks complete.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    created_from = _parse_date("created_from", created_from)
+    created_to = _parse_date("created_to", created_to)
+    page_size = get_settings().export_page_size
+
+    async def fetch(cursor: Optional[str]):
+        result = await apply_keyset(_query(table, select, created_from, created_to), cursor, page_size).execute()
+        return paginate(result.data or [], page_size)
+
+    try:
+        first_page = await fetch(None)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error exporting {table}: {str(e)}")
+
+    encoder = _Encoder(fmt, columns, compress)
+
+    async def body() -> AsyncIterator[bytes]:
+        yield encoder.header()
+        page, cursor = first_page
+        exported = 0
+        try:
+            while True:
+                chunk = encoder.encode(row for record in page for row in flatten(record))
+                exported += len(page)
+                if chunk:
+                    yield chunk
+                if not cursor:
+                    break
+                page, cursor = await fetch(cursor)
+        except Exception as e:
+            logger.error(f"Export of {table} aborted after {exported} rows: {str(e)}")
+            raise
+        yield encoder.finish()
+
+    filename = f"{table}.{fmt}" + (".gz" if compress else "")
+    media_type = "application/gzip" if compress else EXPORT_FORMATS[fmt]
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
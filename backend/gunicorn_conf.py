@@ -0,0 +1,44 @@
+"""Gunicorn settings for running the API with several worker processes.
+
+    gunicorn -c backend/gunicorn_conf.py backend.main:app
+
+Every worker is a full uvicorn event loop with its own caches, job workers
+and connection pools. Set ``SHARED_STATE_BACKEND`` so their caches stay
+consistent and one of them runs the maintenance duties: ``postgres`` (with
+``DATABASE_URL``) across hosts, ``sqlite`` on a single host.
+
+Environment:
+    PORT             listen port (default 8000)
+    WEB_CONCURRENCY  worker processes (default 2 x CPUs + 1)
+    GUNICORN_TIMEOUT seconds before a silent worker is restarted (default 60)
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY") or multiprocessing.cpu_count() * 2 + 1)
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Never preload: clients, pools and event loops must be created inside each worker
+preload_app = False
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically; jitter keeps them from restarting together
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    backend = os.getenv("SHARED_STATE_BACKEND", "memory")
+    if workers > 1 and backend == "memory":
+        server.log.warning(
+            f"Running {workers} workers with SHARED_STATE_BACKEND=memory: cache invalidations stay "
+            "in the worker that made the change (others catch up when their TTLs expire) and every "
+            "worker runs the maintenance duties. Use 'sqlite' (one host) or 'postgres'."
+        )
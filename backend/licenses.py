@@ -1,32 +1,136 @@
 """License management API endpoints."""
-from fastapi import APIRouter, HTTPException
-from backend.database import supabase
+import asyncio
+import json
+import os
+import uuid
+from typing import Dict, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel
+from backend.config import get_settings
+from backend.database import db
+from backend.exports import LICENSE_EXPORT_COLUMNS, LICENSE_EXPORT_SELECT, export_response, flatten_license
+from backend.pagination import (
+    DEFAULT_PAGE_SIZE,
+    LICENSE_EMBEDS,
+    LICENSE_FIELD_COLUMNS,
+    LICENSE_FIELDS,
+    MAX_PAGE_SIZE,
+    apply_keyset,
+    build_select,
+    embed_for_depth,
+    hide_license_path,
+    paginate,
+)
+from backend.services.license_reissue import ReissueFilter, ReissueProgress, reissue_licenses
 
 router = APIRouter(prefix="/api/licenses", tags=["licenses"])
 
 
 @router.get("/")
-async def list_licenses():
-    """Get all licenses with order_items, beats, and orders - Admin only."""
+async def list_licenses(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    embed: Optional[int] = Query(None, description="0 = licenses only, 1 = + order_items, 2 = + beats and orders (default)"),
+):
+    """Get a page of licenses with order_items, beats, and orders, newest first - Admin only.
+
+    ``pdf_ready`` tells whether the PDF exists; it is downloaded through
+    /api/downloads/{license_id}.
+    """
+    select = build_select(fields, LICENSE_FIELDS, embed_for_depth(LICENSE_EMBEDS, embed), LICENSE_FIELD_COLUMNS)
     try:
-        result = supabase.table("licenses").select(
-            """
-            *,
-            order_items (
-                *,
-                beats (*),
-                orders (*)
-            )
-            """
-        ).order("created_at", desc=True).execute()
+        query = apply_keyset(db.table("licenses").select(select), cursor, limit)
+        result = await query.execute()
         
-        return {"success": True, "data": result.data or []}
+        data, next_cursor = paginate([hide_license_path(row) for row in result.data or []], limit)
+        return {"success": True, "data": data, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching licenses: {str(e)}")
 
 
+@router.get("/export")
+async def export_licenses(
+    format: str = Query("ndjson", description="ndjson or csv"),
+    created_from: Optional[str] = Query(None, description="ISO date/time, inclusive"),
+    created_to: Optional[str] = Query(None, description="ISO date/time, exclusive"),
+    gzip: bool = False,
+):
+    """Stream all licenses with beat title and order details, newest first - Admin only."""
+    return await export_response(
+        "licenses", LICENSE_EXPORT_SELECT, LICENSE_EXPORT_COLUMNS, flatten_license, format, created_from, created_to, gzip
+    )
+
+
+class LicenseReissueRequest(BaseModel):
+    beat_id: Optional[str] = None
+    license_type: Optional[str] = None
+    created_from: Optional[str] = None
+    created_to: Optional[str] = None
+    workers: Optional[int] = None
+    resume_run_id: Optional[str] = None
+
 
+# Progress of re-issue runs started by this process
+_reissue_runs: Dict[str, ReissueProgress] = {}
+_reissue_tasks: Dict[str, asyncio.Task] = {}
 
 
+def _checkpoint_path(run_id: str) -> str:
+    return os.path.join(get_settings().reissue_checkpoint_dir, f"{run_id}.json")
 
 
+@router.post("/reissue")
+async def start_license_reissue(request: LicenseReissueRequest):
+    """Re-render and re-upload licenses matching the filters in the background - Admin only."""
+    run_id = request.resume_run_id or str(uuid.uuid4())
+    try:
+        uuid.UUID(run_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid resume_run_id")
+    if run_id in _reissue_tasks and not _reissue_tasks[run_id].done():
+        raise HTTPException(status_code=409, detail="Re-issue run is already in progress")
+    
+    filters = ReissueFilter(
+        beat_id=request.beat_id,
+        license_type=request.license_type,
+        created_from=request.created_from,
+        created_to=request.created_to,
+    )
+    os.makedirs(get_settings().reissue_checkpoint_dir, exist_ok=True)
+    
+    def on_progress(progress: ReissueProgress) -> None:
+        _reissue_runs[run_id] = progress
+    
+    _reissue_runs[run_id] = ReissueProgress()
+    _reissue_tasks[run_id] = asyncio.create_task(
+        reissue_licenses(
+            filters,
+            workers=request.workers or os.cpu_count() or 1,
+            checkpoint_path=_checkpoint_path(run_id),
+            on_progress=on_progress,
+        )
+    )
+    return {"success": True, "data": {"run_id": run_id}}
+
+
+@router.get("/reissue/{run_id}")
+async def get_license_reissue(run_id: str):
+    """Get progress and throughput of a re-issue run - Admin only."""
+    task = _reissue_tasks.get(run_id)
+    if task is not None and task.done() and task.exception() is not None:
+        raise HTTPException(status_code=500, detail=f"Re-issue run failed: {task.exception()}")
+    if run_id in _reissue_runs:
+        return {"success": True, "data": _reissue_runs[run_id].to_dict()}
+    
+    # Runs from a previous process are reported from their checkpoint
+    try:
+        uuid.UUID(run_id)
+        with open(_checkpoint_path(run_id), "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (ValueError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail="Re-issue run not found")
+    return {"success": True, "data": checkpoint.get("progress", {})}
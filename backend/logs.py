@@ -0,0 +1,233 @@
+"""Structured, non-blocking application logging.
+
+``configure_logging()`` (app startup) routes the root logger through a
+``QueueHandler`` into a bounded in-memory queue; a ``QueueListener`` thread
+formats each record and writes it to stderr. On the calling thread a log
+call only checks the level, applies sampling, captures the context and
+enqueues the record: message arguments, JSON encoding, tracebacks and the
+write all happen on the listener thread, so a slow or blocked stderr never
+stalls the event loop. When the queue is full, records are dropped (and
+counted) rather than waited for. Pass values as ``%s`` arguments or
+``extra=`` fields, not f-strings, to keep formatting off the hot path; the
+arguments are formatted later, so do not log objects that are mutated
+right after.
+
+``LOG_FORMAT=json`` (the default) writes one JSON object per line:
+``ts``, ``level``, ``logger`` and ``message``, the fields bound with
+``log_context`` (order_id, beat_id, stripe_event_id, ...), any ``extra=``
+fields, ``timings_ms`` (the ``span`` durations collected so far in the
+current ``collect_timings`` block) and ``exc`` for exceptions.
+
+``LOG_SAMPLING`` keeps only a fraction of the records of noisy loggers:
+comma-separated ``[logger:]LEVEL=rate`` rules, e.g.
+``httpx:INFO=0.01,backend.services.job_queue:DEBUG=0``; the longest
+matching logger prefix wins. Kept records carry their ``sample_rate``.
+
+The time log calls spend on the calling thread is exported as
+``beatstore_log_emit_seconds_total`` next to ``beatstore_log_records_total``
+(see ``benchmarks/bench_logging.py`` for the per-request budget).
+"""
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from backend.config import get_settings
+from backend.metrics import Counter, current_timings, registry
+
+LOG_RECORDS = registry.register(Counter(
+    "beatstore_log_records_total", "Log records by outcome (queued, sampled_out, dropped).",
+    labels=("outcome",),
+))
+LOG_EMIT_SECONDS = registry.register(Counter(
+    "beatstore_log_emit_seconds_total", "Time log calls spent on the calling thread (level check excluded).",
+))
+
+# Fields bound with log_context for the current task; copied on every change, never mutated
+_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+# Attributes every LogRecord has; anything else on a record came from extra=
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "context", "timings", "sample_rate", "taskName",
+}
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """Add ``fields`` to every record logged in this block (and tasks or threads started from it)."""
+    token = _context.set({**_context.get(), **{key: value for key, value in fields.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def bind_log_context(**fields: Any) -> None:
+    """Add ``fields`` to the enclosing ``log_context`` from here on (e.g. an order_id once it exists)."""
+    _context.set({**_context.get(), **{key: value for key, value in fields.items() if value is not None}})
+
+
+def parse_sampling(spec: Optional[str]) -> List[Tuple[str, int, float]]:
+    """``"httpx:INFO=0.01,DEBUG=0"`` -> ``[("httpx", 20, 0.01), ("", 10, 0.0)]``."""
+    rules = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        target, _, rate = part.partition("=")
+        name, _, level = target.rpartition(":")
+        levelno = logging.getLevelName(level.strip().upper())
+        if not isinstance(levelno, int) or not rate:
+            raise ValueError(f"Invalid LOG_SAMPLING rule: {part}")
+        rules.append((name.strip(), levelno, min(max(float(rate), 0.0), 1.0)))
+    return rules
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a random ``rate`` share of the records matching each sampling rule."""
+
+    def __init__(self, rules: List[Tuple[str, int, float]]):
+        super().__init__()
+        self.rules = sorted(rules, key=lambda rule: len(rule[0]), reverse=True)
+        self._rates: Dict[Tuple[str, int], float] = {}
+
+    def _rate(self, name: str, levelno: int) -> float:
+        key = (name, levelno)
+        rate = self._rates.get(key)
+        if rate is None:
+            rate = next(
+                (
+                    rule_rate for prefix, rule_level, rule_rate in self.rules
+                    if rule_level == levelno and (not prefix or name == prefix or name.startswith(prefix + "."))
+                ),
+                1.0,
+            )
+            self._rates[key] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self._rate(record.name, record.levelno)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0 or random.random() >= rate:
+            LOG_RECORDS.inc(outcome="sampled_out")
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class AsyncQueueHandler(QueueHandler):
+    """Enqueues records without formatting them or ever blocking; the listener does the rest."""
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        start = time.perf_counter()
+        try:
+            return super().handle(record)
+        finally:
+            LOG_EMIT_SECONDS.inc(time.perf_counter() - start)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Capture what only the calling task knows; everything else is formatted later
+        context = _context.get()
+        if context:
+            record.context = context
+        timings = current_timings()
+        if timings:
+            record.timings = dict(timings)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            LOG_RECORDS.inc(outcome="queued")
+        except queue.Full:
+            LOG_RECORDS.inc(outcome="dropped")
+
+
+def _fields(record: logging.LogRecord) -> Dict[str, Any]:
+    fields = dict(getattr(record, "context", {}))
+    fields.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+    timings = getattr(record, "timings", None)
+    if timings:
+        fields["timings_ms"] = {phase: round(seconds * 1000, 2) for phase, seconds in timings.items()}
+    if getattr(record, "sample_rate", None) is not None:
+        fields["sample_rate"] = record.sample_rate
+    return fields
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, separators=(",", ":"))
+
+
+class TextFormatter(logging.Formatter):
+    """The classic one-line format, with the structured fields appended as key=value."""
+
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        fields = _fields(record)
+        line = super().formatMessage(record)
+        return line + "".join(f" {key}={value}" for key, value in fields.items()) if fields else line
+
+
+_listener: Optional[QueueListener] = None
+_previous: Optional[Tuple[List[logging.Handler], int]] = None
+
+
+def configure_logging() -> None:
+    """Send root logging through the queue to stderr (idempotent); ``stop_logging`` flushes and undoes it."""
+    global _listener, _previous
+    if _listener is not None:
+        return
+    settings = get_settings()
+    if settings.log_format not in ("json", "text"):
+        raise ValueError(f"Unknown LOG_FORMAT: {settings.log_format}")
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if settings.log_format == "json" else TextFormatter())
+    handler = AsyncQueueHandler(queue.Queue(maxsize=settings.log_queue_size))
+    rules = parse_sampling(settings.log_sampling)
+    if rules:
+        handler.addFilter(SamplingFilter(rules))
+
+    root = logging.getLogger()
+    _previous = (root.handlers[:], root.level)
+    root.handlers = [handler]
+    root.setLevel(settings.log_level.upper())
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """Write out the queued records and restore the previous root handlers."""
+    global _listener, _previous
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    root = logging.getLogger()
+    if _previous is not None:
+        root.handlers, level = _previous
+        root.setLevel(level)
+        _previous = None
@@ -1,15 +1,65 @@
 """FastAPI application entry point."""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 
-from backend.stripe_webhook import router as stripe_router
+from backend.config import get_settings
+from backend.stripe_webhook import get_stripe, router as stripe_router
+from backend.analytics import router as analytics_router
 from backend.beats import router as beats_router
+from backend.catalog import router as catalog_router
+from backend.checkout import router as checkout_router
+from backend.downloads import router as downloads_router
 from backend.orders import router as orders_router
 from backend.licenses import router as licenses_router
 from backend.webhooks import router as webhooks_router
+from backend.database import db
+from backend.logs import configure_logging, stop_logging
+from backend.metrics import CONTENT_TYPE, MetricsMiddleware, render_metrics, start_profiler, stop_profiler
+from backend.services.downloads import download_recorder
+from backend.services.license_jobs import job_queue
+from backend.services.maintenance import create_maintenance_leader
+from backend.services.media_pipeline import shutdown_media_pool
+from backend.services.shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Validate settings and start background workers on startup; drain them and close pools on shutdown."""
+    configure_logging()
+    # Missing credentials fail the boot here rather than at import time
+    get_settings().validate()
+    start_profiler()
+    await shared_state.start()
+    await job_queue.start()
+    await download_recorder.start()
+    maintenance = create_maintenance_leader()
+    await maintenance.start()
+    # Load the Stripe SDK off the event loop so the first webhook does not pay for the import
+    stripe_warmup = asyncio.create_task(asyncio.to_thread(get_stripe))
+    yield
+    try:
+        await stripe_warmup
+    except Exception as e:
+        logger.error(f"Stripe SDK warm-up failed: {e}")
+    await maintenance.stop()
+    await download_recorder.stop()
+    await job_queue.stop()
+    await asyncio.to_thread(shutdown_media_pool)
+    await shared_state.stop()
+    await db.aclose()
+    stop_profiler()
+    stop_logging()
+
 
 # Initialize FastAPI app
-app = FastAPI(title="Beat Store API", version="1.0.0")
+app = FastAPI(title="Beat Store API", version="1.0.0", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -19,16 +69,27 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so latency includes every other middleware
+app.add_middleware(MetricsMiddleware)
 
 # Register routers
 app.include_router(stripe_router)
 app.include_router(beats_router)
+app.include_router(catalog_router)
+app.include_router(checkout_router)
 app.include_router(orders_router)
 app.include_router(licenses_router)
 app.include_router(webhooks_router)
+app.include_router(analytics_router)
+app.include_router(downloads_router)
 
 @app.get("/")
 async def root():
     """Health check endpoint."""
     return {"status": "ok", "message": "Beat Store API"}
 
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics for this worker process."""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
@@ -0,0 +1,385 @@
+"""In-process metrics exported in Prometheus text format at ``/metrics``.
+
+Records per-route request latency, in-flight requests, named phase spans
+(``with span("webhook.verify_signature"): ...``) and outbound Supabase calls
+per table. Metrics are per process; scrape every worker.
+
+Setting ``PROFILE_SLOW_REQUEST_MS`` turns on a sampling profiler: a thread
+samples the event loop's stack every ``PROFILE_SAMPLE_INTERVAL_MS`` and,
+when a request exceeds the threshold, writes the stacks captured during it
+to ``PROFILE_OUTPUT_DIR`` in collapsed ("folded") format, ready for
+flamegraph.pl or speedscope.
+"""
+import bisect
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as StackCounter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from backend.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labels, key)} {value:g}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args: Any, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        lines = self.header()
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _format_labels(self.labels, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    "beatstore_http_request_duration_seconds", "HTTP request latency by route template.",
+    labels=("method", "route", "status"),
+))
+REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    "beatstore_http_requests_in_flight", "HTTP requests currently being served.",
+))
+PHASE_LATENCY = registry.register(Histogram(
+    "beatstore_phase_duration_seconds", "Duration of named processing phases (spans).",
+    labels=("phase", "outcome"),
+))
+SUPABASE_CALLS = registry.register(Counter(
+    "beatstore_supabase_calls_total", "Outbound Supabase calls by API, table and method.",
+    labels=("api", "table", "method", "status"),
+))
+SUPABASE_LATENCY = registry.register(Histogram(
+    "beatstore_supabase_call_duration_seconds", "Outbound Supabase call latency by API and table.",
+    labels=("api", "table"),
+))
+
+
+# Span durations (seconds by phase) of the enclosing collect_timings block, if any
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("span_timings", default=None)
+
+
+@contextmanager
+def span(phase: str) -> Iterator[None]:
+    """Time a block of work (sync or async body) under ``phase``."""
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        PHASE_LATENCY.observe(elapsed, phase=phase, outcome=outcome)
+        timings = _timings.get()
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0.0) + elapsed
+
+
+@contextmanager
+def collect_timings() -> Iterator[Dict[str, float]]:
+    """Also sum the spans of this block per phase into the yielded dict (read by log records)."""
+    timings: Dict[str, float] = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def current_timings() -> Optional[Dict[str, float]]:
+    return _timings.get()
+
+
+# /rest/v1/<table>, /rest/v1/rpc/<function>, /storage/v1/object/[public/]<bucket>/...
+_SUPABASE_PATH = re.compile(r"/(rest|storage)/v1/(?:(rpc)/([^/?]+)|object/(?:public/|sign/)?([^/?]+)|([^/?]+))")
+
+
+def _supabase_target(request: Any) -> Tuple[str, str]:
+    match = _SUPABASE_PATH.search(request.url.path)
+    if not match:
+        return "other", "unknown"
+    api, rpc, function, bucket, table = match.groups()
+    if rpc:
+        return "rpc", function
+    return api, bucket or table or "unknown"
+
+
+def _record_supabase_call(response: Any) -> None:
+    request = response.request
+    api, table = _supabase_target(request)
+    SUPABASE_CALLS.inc(api=api, table=table, method=request.method, status=str(response.status_code))
+    started = request.extensions.get("metrics_start")
+    if started is not None:
+        SUPABASE_LATENCY.observe(time.perf_counter() - started, api=api, table=table)
+
+
+def _mark_request_start(request: Any) -> None:
+    request.extensions["metrics_start"] = time.perf_counter()
+
+
+async def _async_request_hook(request: Any) -> None:
+    _mark_request_start(request)
+
+
+async def _async_response_hook(response: Any) -> None:
+    _record_supabase_call(response)
+
+
+# Pass as ``event_hooks=`` to httpx clients that talk to Supabase
+ASYNC_SUPABASE_HOOKS = {"request": [_async_request_hook], "response": [_async_response_hook]}
+SYNC_SUPABASE_HOOKS = {"request": [_mark_request_start], "response": [_record_supabase_call]}
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval into a ring buffer."""
+
+    def __init__(self, interval: float, window: float = 60.0):
+        self.interval = interval
+        self._samples: Deque[Tuple[float, str]] = deque(maxlen=max(1, int(window / interval)))
+        self._thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, thread_id: int) -> None:
+        if self._thread is not None:
+            return
+        self._thread_id = thread_id
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self._samples.append((time.perf_counter(), ";".join(reversed(stack))))
+
+    def collapsed(self, start: float, end: float) -> StackCounter:
+        return StackCounter(stack for at, stack in list(self._samples) if start <= at <= end)
+
+
+class SlowRequestProfiler:
+    """Dumps the sampled stacks of requests slower than ``threshold`` seconds."""
+
+    def __init__(self, threshold: float, interval: float, output_dir: str):
+        self.threshold = threshold
+        self.output_dir = output_dir
+        self.sampler = StackSampler(interval)
+
+    def start(self) -> None:
+        # Sample the thread running the event loop (the caller)
+        self.sampler.start(threading.get_ident())
+        logger.info(f"Sampling profiler on: dumping requests slower than {self.threshold * 1000:.0f}ms to {self.output_dir}")
+
+    def stop(self) -> None:
+        self.sampler.stop()
+
+    def maybe_dump(self, method: str, route: str, start: float, end: float) -> Optional[str]:
+        if end - start < self.threshold:
+            return None
+        stacks = self.sampler.collapsed(start, end)
+        if not stacks:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{method}{route}").strip("_")
+        path = os.path.join(self.output_dir, f"{int(time.time() * 1000)}-{name}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.warning(f"Slow request {method} {route} took {(end - start) * 1000:.0f}ms; stacks in {path}")
+        return path
+
+
+profiler: Optional[SlowRequestProfiler] = None
+
+
+def start_profiler() -> None:
+    """Start the slow-request profiler if PROFILE_SLOW_REQUEST_MS is set (call from the event loop thread)."""
+    global profiler
+    settings = get_settings()
+    if profiler is None and settings.profile_slow_request_ms:
+        profiler = SlowRequestProfiler(
+            settings.profile_slow_request_ms / 1000,
+            settings.profile_sample_interval_ms / 1000,
+            settings.profile_output_dir,
+        )
+        profiler.start()
+
+
+def stop_profiler() -> None:
+    global profiler
+    if profiler is not None:
+        profiler.stop()
+        profiler = None
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency per route template and in-flight requests."""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = "500"
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end = time.perf_counter()
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            # Label by template (/api/beats/{beat_id}), never by raw path, to bound cardinality
+            route_path = getattr(route, "path", None) or "unmatched"
+            REQUEST_LATENCY.observe(end - start, method=scope["method"], route=route_path, status=status)
+            if profiler is not None:
+                profiler.maybe_dump(scope["method"], route_path, start, end)
+
+
+def render_metrics() -> str:
+    return registry.render()
@@ -1,34 +1,63 @@
 """Order management API endpoints."""
-from fastapi import APIRouter, HTTPException
-from backend.database import supabase
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from backend.database import db
+from backend.exports import ORDER_EXPORT_COLUMNS, ORDER_EXPORT_SELECT, export_response, flatten_order
+from backend.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    ORDER_EMBEDS,
+    ORDER_FIELDS,
+    apply_keyset,
+    build_select,
+    embed_for_depth,
+    hide_license_path,
+    paginate,
+)
 
 router = APIRouter(prefix="/api/orders", tags=["orders"])
 
 
 @router.get("/")
-async def list_orders():
-    """Get all orders with order_items and beats - Admin only."""
+async def list_orders(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    embed: Optional[int] = Query(None, description="0 = orders only, 1 = + order_items, 2 = + beats (default)"),
+):
+    """Get a page of orders with order_items and beats, newest first - Admin only."""
+    select = build_select(fields, ORDER_FIELDS, embed_for_depth(ORDER_EMBEDS, embed))
     try:
-        result = supabase.table("orders").select(
-            """
-            *,
-            order_items (
-                *,
-                beats (*)
-            )
-            """
-        ).order("created_at", desc=True).execute()
+        query = apply_keyset(db.table("orders").select(select), cursor, limit)
+        result = await query.execute()
         
-        return {"success": True, "data": result.data or []}
+        data, next_cursor = paginate(result.data or [], limit)
+        return {"success": True, "data": data, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching orders: {str(e)}")
 
 
+@router.get("/export")
+async def export_orders(
+    format: str = Query("ndjson", description="ndjson or csv"),
+    created_from: Optional[str] = Query(None, description="ISO date/time, inclusive"),
+    created_to: Optional[str] = Query(None, description="ISO date/time, exclusive"),
+    gzip: bool = False,
+):
+    """Stream all orders as one row per order item and license, newest first - Admin only."""
+    return await export_response(
+        "orders", ORDER_EXPORT_SELECT, ORDER_EXPORT_COLUMNS, flatten_order, format, created_from, created_to, gzip
+    )
+
+
 @router.get("/{order_id}")
 async def get_order(order_id: str):
     """Get an order by ID with order_items, beats, and licenses - Admin only."""
     try:
-        result = supabase.table("orders").select(
+        result = await db.table("orders").select(
             """
             *,
             order_items (
@@ -42,6 +71,9 @@ async def get_order(order_id: str):
         if not result.data:
             raise HTTPException(status_code=404, detail="Order not found")
         
+        for item in result.data.get("order_items") or []:
+            for license_row in item.get("licenses") or []:
+                hide_license_path(license_row)
         return {"success": True, "data": result.data}
     except HTTPException:
         raise
@@ -0,0 +1,122 @@
+"""Keyset pagination and field projection helpers for list endpoints.
+
+Pages are ordered by ``(created_at DESC, id DESC)`` and addressed with an
+opaque cursor encoding the last row's key, so each page is an index range
+scan regardless of how deep the client has paged.
+"""
+import base64
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Columns clients may request through ``fields=``
+BEAT_FIELDS = {
+    "id", "title", "bpm", "key", "genre", "price_cents", "license_type", "audio_url",
+    "preview_url", "is_active", "producer_name", "licensor_legal_name", "created_at", "updated_at",
+    "waveform_url", "duration_ms", "detected_bpm", "detected_key", "bpm_confidence", "key_confidence",
+}
+ORDER_FIELDS = {
+    "id", "user_id", "stripe_checkout_id", "stripe_payment_intent_id", "total_cents", "status", "created_at",
+    "customer_name", "customer_email",
+}
+LICENSE_FIELDS = {
+    "id", "order_item_id", "user_id", "beat_id", "license_type", "pdf_ready", "created_at",
+}
+# Fields computed from another column: pdf_ready is whether license_url (the PDF's storage path) is set
+LICENSE_FIELD_COLUMNS = {"pdf_ready": "license_url"}
+
+# Embedded resources per depth (0 = base row only)
+ORDER_EMBEDS = ["", "order_items (*)", "order_items (*, beats (*))"]
+LICENSE_EMBEDS = ["", "order_items (*)", "order_items (*, beats (*), orders (*))"]
+
+KEY_COLUMNS = ("created_at", "id")
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """Encode the keyset position of ``row`` as an opaque URL-safe cursor."""
+    raw = json.dumps([row["created_at"], row["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Decode a cursor produced by ``encode_cursor``."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return str(created_at), str(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def build_select(
+    fields: Optional[str],
+    allowed: Iterable[str],
+    embed: str = "",
+    sources: Optional[Dict[str, str]] = None,
+) -> str:
+    """Build a PostgREST select list from a ``fields=`` parameter.
+
+    The key columns are always included so the next cursor can be computed.
+    ``sources`` maps computed fields to the column they are read from.
+    """
+    if fields:
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = sorted(set(requested) - set(allowed))
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        requested = [(sources or {}).get(field, field) for field in requested]
+        columns = list(dict.fromkeys([*requested, *KEY_COLUMNS]))
+    else:
+        columns = ["*"]
+    if embed:
+        columns.append(embed)
+    return ", ".join(columns)
+
+
+def embed_for_depth(embeds: List[str], depth: Optional[int]) -> str:
+    """Pick the embed clause for ``depth``; ``None`` keeps the deepest (legacy) shape."""
+    if depth is None:
+        return embeds[-1]
+    if depth < 0 or depth >= len(embeds):
+        raise HTTPException(status_code=400, detail=f"embed must be between 0 and {len(embeds) - 1}")
+    return embeds[depth]
+
+
+def _quote(value: str) -> str:
+    # Timestamps contain PostgREST reserved characters (':' '.' '+')
+    return '"' + value.replace('"', '\\"') + '"'
+
+
+def apply_keyset(query: Any, cursor: Optional[str], limit: int) -> Any:
+    """Order by the key columns, seek past ``cursor`` and fetch one extra row."""
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.or_(
+            f"created_at.lt.{_quote(created_at)},"
+            f"and(created_at.eq.{_quote(created_at)},id.lt.{_quote(row_id)})"
+        )
+    return query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1)
+
+
+def hide_license_path(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace a license row's storage path with ``pdf_ready``.
+
+    The PDF is only handed out by ``/api/downloads/{license_id}``; its path
+    (or, for licenses stored before the private bucket, public URL) stays
+    in the database.
+    """
+    if "license_url" in row:
+        row["pdf_ready"] = row.pop("license_url") is not None
+    return row
+
+
+def paginate(rows: List[Dict[str, Any]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Trim the look-ahead row and return ``(page, next_cursor)``."""
+    if len(rows) > limit:
+        page = rows[:limit]
+        return page, encode_cursor(page[-1])
+    return rows, None
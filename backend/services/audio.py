@@ -0,0 +1,373 @@
+"""Audio decoding, preview clips and waveform peaks for uploaded beats.
+
+Everything here is CPU-bound and runs in the media worker processes (see
+``backend.services.media_pipeline``). Sources are read from a local file in
+fixed-size chunks, so memory use does not grow with the length of the track.
+
+PCM and float WAV files are decoded with NumPy. Any other format needs
+``ffmpeg``, which is also used to encode MP3 previews; without it previews
+are written as small 8-bit mono WAV files. Tempo and key detection
+(``backend.services.audio_analysis``) share the same decoding pass.
+
+Keep this module cheap to import: every worker process loads it on start.
+"""
+import struct
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+from backend.services.audio_analysis import AudioAnalyzer
+
+# Frames decoded per chunk
+CHUNK_FRAMES = 64 * 1024
+# Peak resolution while streaming; downsampled to the requested number of points at the end
+BLOCKS_PER_SECOND = 200
+# Rate ffmpeg decodes to (enough for peaks and WAV previews)
+FFMPEG_SAMPLE_RATE = 22050
+WAV_PREVIEW_SAMPLE_RATE = 11025
+MP3_PREVIEW_SAMPLE_RATE = 44100
+FADE_OUT_SECONDS = 1.0
+FFMPEG_TIMEOUT_SECONDS = 300
+
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_IEEE_FLOAT = 0x0003
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class AudioError(Exception):
+    """Raised when a source cannot be decoded or a preview cannot be encoded."""
+
+
+@dataclass(frozen=True)
+class WavFormat:
+    channels: int
+    sample_rate: int
+    # Bytes per sample
+    sample_width: int
+    is_float: bool
+    data_offset: int
+    data_size: int
+
+    @property
+    def frame_size(self) -> int:
+        return self.channels * self.sample_width
+
+    @property
+    def frames(self) -> int:
+        return self.data_size // self.frame_size
+
+
+@dataclass(frozen=True)
+class MediaOptions:
+    """What ``render_media`` produces; passed to the worker processes, so it must pickle."""
+    # "ffmpeg" (MP3 preview) or "wav" (8-bit mono WAV preview)
+    transcoder: str
+    # None when ffmpeg is not installed; then only WAV sources can be decoded
+    ffmpeg_path: Optional[str]
+    preview_seconds: float = 30.0
+    preview_start_seconds: float = 0.0
+    bitrate_kbps: int = 64
+    waveform_points: int = 1000
+
+
+def read_wav_format(f: BinaryIO) -> Optional[WavFormat]:
+    """Parse a RIFF/WAVE header; ``None`` if ``f`` is not a WAV file at all."""
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        return None
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise AudioError("WAV file has no data chunk")
+        chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+        if chunk_id == b"fmt ":
+            body = f.read(size + size % 2)
+            if len(body) < 16:
+                raise AudioError("Truncated WAV fmt chunk")
+            tag, channels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", body[:16])
+            if tag == _WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                # The real format is the first two bytes of the SubFormat GUID
+                tag = struct.unpack("<H", body[24:26])[0]
+            fmt = (tag, channels, sample_rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise AudioError("WAV data chunk comes before the fmt chunk")
+            tag, channels, sample_rate, bits = fmt
+            is_float = tag == _WAVE_FORMAT_IEEE_FLOAT
+            supported = (32, 64) if is_float else (8, 16, 24, 32)
+            if tag not in (_WAVE_FORMAT_PCM, _WAVE_FORMAT_IEEE_FLOAT) or bits not in supported:
+                raise AudioError(f"Unsupported WAV encoding (format {tag:#06x}, {bits}-bit)")
+            if channels < 1 or sample_rate < 1:
+                raise AudioError("Invalid WAV fmt chunk")
+            offset = f.tell()
+            end = f.seek(0, 2)
+            # Streaming writers leave the size at 0 or 0xFFFFFFFF; truncated uploads overstate it
+            if size in (0, 0xFFFFFFFF) or offset + size > end:
+                size = end - offset
+            return WavFormat(channels, sample_rate, bits // 8, is_float, offset, size)
+        else:
+            f.seek(size + size % 2, 1)
+
+
+def _decode_wav(raw: bytes, fmt: WavFormat) -> np.ndarray:
+    """Interleaved WAV sample bytes -> mono float32 in [-1, 1]."""
+    width = fmt.sample_width
+    if fmt.is_float:
+        samples = np.frombuffer(raw, dtype="<f4" if width == 4 else "<f8").astype(np.float32)
+    elif width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 3:
+        triples = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        # Assemble in the top three bytes, then an arithmetic shift sign-extends
+        ints = ((triples[:, 0] << 8) | (triples[:, 1] << 16) | (triples[:, 2] << 24)) >> 8
+        samples = ints.astype(np.float32) / float(1 << 23)
+    else:
+        samples = np.frombuffer(raw, dtype=f"<i{width}").astype(np.float32) / float(1 << (8 * width - 1))
+    if fmt.channels > 1:
+        samples = samples.reshape(-1, fmt.channels).mean(axis=1, dtype=np.float32)
+    return samples
+
+
+def _iter_wav(path: str, fmt: WavFormat, chunk_frames: int) -> Iterator[np.ndarray]:
+    with open(path, "rb") as f:
+        f.seek(fmt.data_offset)
+        remaining = fmt.frames * fmt.frame_size
+        while remaining > 0:
+            raw = f.read(min(chunk_frames * fmt.frame_size, remaining))
+            raw = raw[:len(raw) - len(raw) % fmt.frame_size]
+            if not raw:
+                return
+            remaining -= len(raw)
+            yield _decode_wav(raw, fmt)
+
+
+def _iter_ffmpeg(path: str, ffmpeg: str, chunk_frames: int) -> Iterator[np.ndarray]:
+    command = [
+        ffmpeg, "-v", "error", "-nostdin", "-i", path,
+        "-vn", "-ac", "1", "-ar", str(FFMPEG_SAMPLE_RATE), "-f", "s16le", "-",
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            raw = process.stdout.read(chunk_frames * 2)
+            if not raw:
+                break
+            yield np.frombuffer(raw[:len(raw) - len(raw) % 2], dtype="<i2").astype(np.float32) / 32768.0
+        errors = process.stderr.read().decode("utf-8", "replace").strip()
+        if process.wait() != 0:
+            raise AudioError(f"ffmpeg could not decode the source: {errors[-500:]}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def decode(path: str, ffmpeg: Optional[str] = None, chunk_frames: int = CHUNK_FRAMES) -> Tuple[int, Iterator[np.ndarray]]:
+    """Open ``path`` as (sample rate, iterator of mono float32 chunks)."""
+    try:
+        with open(path, "rb") as f:
+            fmt = read_wav_format(f)
+    except AudioError:
+        # e.g. ADPCM or A-law WAV; ffmpeg may still read it
+        if not ffmpeg:
+            raise
+        fmt = None
+    if fmt is not None:
+        return fmt.sample_rate, _iter_wav(path, fmt, chunk_frames)
+    if not ffmpeg:
+        raise AudioError("The source is not a WAV file, and decoding other formats needs ffmpeg")
+    return FFMPEG_SAMPLE_RATE, _iter_ffmpeg(path, ffmpeg, chunk_frames)
+
+
+class PeakAccumulator:
+    """Streaming per-block min/max, downsampled to ``points`` (min, max) pairs by ``finish``."""
+
+    def __init__(self, sample_rate: int, points: int):
+        self.block = max(1, sample_rate // BLOCKS_PER_SECOND)
+        self.points = points
+        self.frames = 0
+        self._carry = np.empty(0, dtype=np.float32)
+        self._mins = []
+        self._maxs = []
+
+    def add(self, samples: np.ndarray) -> None:
+        self.frames += len(samples)
+        if self._carry.size:
+            samples = np.concatenate((self._carry, samples))
+        whole = len(samples) - len(samples) % self.block
+        if whole:
+            blocks = samples[:whole].reshape(-1, self.block)
+            self._mins.append(blocks.min(axis=1))
+            self._maxs.append(blocks.max(axis=1))
+        self._carry = samples[whole:].copy()
+
+    def finish(self) -> np.ndarray:
+        """Interleaved little-endian int16 (min, max) pairs; full scale is 32767."""
+        mins, maxs = list(self._mins), list(self._maxs)
+        if self._carry.size:
+            mins.append(self._carry.min(keepdims=True))
+            maxs.append(self._carry.max(keepdims=True))
+        if not mins:
+            return np.zeros(0, dtype="<i2")
+        block_mins, block_maxs = np.concatenate(mins), np.concatenate(maxs)
+        points = min(self.points, len(block_mins))
+        # Strictly increasing start index of each point's run of blocks
+        starts = np.linspace(0, len(block_mins), points + 1).astype(np.int64)[:-1]
+        pairs = np.empty(points * 2, dtype=np.float32)
+        pairs[0::2] = np.minimum.reduceat(block_mins, starts)
+        pairs[1::2] = np.maximum.reduceat(block_maxs, starts)
+        return np.clip(np.round(pairs * 32767), -32768, 32767).astype("<i2")
+
+
+def _clip(path: str, ffmpeg: Optional[str], start: float, seconds: float) -> Tuple[int, np.ndarray]:
+    """Decode ``seconds`` of audio from ``start``, stopping as soon as the window is read."""
+    sample_rate, chunks = decode(path, ffmpeg)
+    first, last = int(start * sample_rate), int((start + seconds) * sample_rate)
+    position, parts = 0, []
+    for chunk in chunks:
+        low, high = max(first - position, 0), min(last - position, len(chunk))
+        if high > low:
+            parts.append(chunk[low:high])
+        position += len(chunk)
+        if position >= last:
+            chunks.close()
+            break
+    return sample_rate, np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
+
+
+def _resample(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    if source_rate == target_rate or not len(samples):
+        return samples
+    ratio = source_rate / target_rate
+    if ratio > 1:
+        # Box low-pass before decimating, against the worst of the aliasing
+        width = int(np.ceil(ratio))
+        samples = np.convolve(samples, np.full(width, 1.0 / width, dtype=np.float32), mode="same")
+    positions = np.arange(int(len(samples) / ratio)) * ratio
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def _fade_out(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    length = min(len(samples), int(FADE_OUT_SECONDS * sample_rate))
+    if length:
+        samples = samples.copy()
+        samples[-length:] *= np.linspace(1.0, 0.0, length, dtype=np.float32)
+    return samples
+
+
+def _info_chunk(tags: Dict[str, str]) -> bytes:
+    """RIFF LIST/INFO chunk (INAM title, IART artist, ICMT comment)."""
+    ids = {"title": b"INAM", "artist": b"IART", "comment": b"ICMT"}
+    body = b"INFO"
+    for name, value in tags.items():
+        if not value or name not in ids:
+            continue
+        text = value.encode("utf-8", "replace") + b"\0"
+        body += ids[name] + struct.pack("<I", len(text)) + text + b"\0" * (len(text) % 2)
+    return b"LIST" + struct.pack("<I", len(body)) + body
+
+
+def write_wav_preview(samples: np.ndarray, sample_rate: int, dest: Path, tags: Dict[str, str]) -> None:
+    """Write ``samples`` as an 8-bit mono WAV at ``WAV_PREVIEW_SAMPLE_RATE`` with INFO tags."""
+    samples = _resample(samples, sample_rate, WAV_PREVIEW_SAMPLE_RATE)
+    data = np.clip(np.round(samples * 127.0) + 128, 0, 255).astype(np.uint8).tobytes()
+    fmt = struct.pack("<HHIIHH", _WAVE_FORMAT_PCM, 1, WAV_PREVIEW_SAMPLE_RATE, WAV_PREVIEW_SAMPLE_RATE, 1, 8)
+    info = _info_chunk(tags)
+    chunks = (
+        b"fmt " + struct.pack("<I", len(fmt)) + fmt
+        + info
+        + b"data" + struct.pack("<I", len(data)) + data + b"\0" * (len(data) % 2)
+    )
+    with open(dest, "wb") as f:
+        f.write(b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WAVE")
+        f.write(chunks)
+
+
+def write_mp3_preview(
+    source: str, dest: Path, start: float, seconds: float, options: MediaOptions, tags: Dict[str, str]
+) -> None:
+    """Cut and encode an MP3 preview (mono, ``bitrate_kbps``, ID3v2 tags) with ffmpeg."""
+    fade_start = max(seconds - FADE_OUT_SECONDS, 0.0)
+    command = [
+        options.ffmpeg_path, "-v", "error", "-nostdin", "-y",
+        "-ss", f"{start:.3f}", "-t", f"{seconds:.3f}", "-i", source,
+        "-vn", "-map_metadata", "-1", "-ac", "1", "-ar", str(MP3_PREVIEW_SAMPLE_RATE),
+        "-af", f"afade=t=out:st={fade_start:.3f}:d={FADE_OUT_SECONDS}",
+        "-codec:a", "libmp3lame", "-b:a", f"{options.bitrate_kbps}k", "-id3v2_version", "3",
+    ]
+    for name, value in tags.items():
+        if value:
+            command += ["-metadata", f"{name}={value}"]
+    command.append(str(dest))
+    try:
+        result = subprocess.run(command, capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        raise AudioError(f"ffmpeg did not finish the preview within {FFMPEG_TIMEOUT_SECONDS} s")
+    if result.returncode != 0:
+        raise AudioError(f"ffmpeg could not encode the preview: {result.stderr.decode('utf-8', 'replace')[-500:]}")
+
+
+def analyze_file(source: str, ffmpeg: Optional[str] = None) -> Dict[str, Any]:
+    """Detect the tempo and key of ``source``; see ``AudioAnalyzer.result``."""
+    sample_rate, chunks = decode(source, ffmpeg)
+    analyzer = AudioAnalyzer(sample_rate)
+    for chunk in chunks:
+        analyzer.add(chunk)
+    return {**analyzer.result(), "seconds": round(analyzer.seconds, 3)}
+
+
+def render_media(
+    source: str,
+    output_dir: str,
+    title: str,
+    artist: Optional[str],
+    options: MediaOptions,
+    analyze: bool = False,
+) -> Dict[str, Any]:
+    """Write a waveform peaks file and a preview clip for ``source`` into ``output_dir``.
+
+    The source is decoded once, streaming, for the peaks, the duration and
+    (with ``analyze``) tempo and key; the preview then reads only its
+    window. Returns the paths, content types, duration and ``analysis``.
+    """
+    sample_rate, chunks = decode(source, options.ffmpeg_path)
+    peaks = PeakAccumulator(sample_rate, options.waveform_points)
+    analyzer = AudioAnalyzer(sample_rate) if analyze else None
+    for chunk in chunks:
+        peaks.add(chunk)
+        if analyzer is not None:
+            analyzer.add(chunk)
+    if not peaks.frames:
+        raise AudioError("The source contains no audio")
+    duration = peaks.frames / sample_rate
+
+    output = Path(output_dir)
+    peaks_path = output / "waveform.peaks"
+    peaks.finish().tofile(peaks_path)
+
+    seconds = min(options.preview_seconds, duration)
+    # A start past the end slides the window back rather than producing a short clip
+    start = min(max(options.preview_start_seconds, 0.0), duration - seconds)
+    tags = {"title": f"{title} (preview)", "artist": artist or "", "comment": "Preview clip"}
+    if options.transcoder == "ffmpeg":
+        preview_path, content_type = output / "preview.mp3", "audio/mpeg"
+        write_mp3_preview(source, preview_path, start, seconds, options, tags)
+    else:
+        preview_path, content_type = output / "preview.wav", "audio/wav"
+        clip_rate, clip = _clip(source, options.ffmpeg_path, start, seconds)
+        write_wav_preview(_fade_out(clip, clip_rate), clip_rate, preview_path, tags)
+
+    return {
+        "duration_ms": int(round(duration * 1000)),
+        "peaks_path": str(peaks_path),
+        "preview_path": str(preview_path),
+        "preview_content_type": content_type,
+        "preview_extension": preview_path.suffix.lstrip("."),
+        "analysis": analyzer.result() if analyzer is not None else None,
+    }
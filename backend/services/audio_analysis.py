@@ -0,0 +1,165 @@
+"""Tempo (BPM) and musical key detection.
+
+``AudioAnalyzer`` consumes mono float32 chunks as they are decoded (see
+``backend.services.audio.decode``) and keeps only small running state, so
+memory stays bounded however long the file is:
+
+- the audio is box-filtered and decimated to about ``ANALYSIS_RATE``
+- a short-time Fourier transform (``N_FFT`` window, ``HOP`` hop) gives
+  one spectral-flux onset strength value per frame (~43 per second) and a
+  running sum of per-frame chroma vectors
+
+Tempo is the lag that maximizes the autocorrelation of the onset envelope
+(with its first two multiples added in, under a log-normal prior centred
+on ``TEMPO_PRIOR_BPM``) within ``MIN_BPM``..``MAX_BPM``. One frame is
+several BPM at fast tempos, so the period is then refined from the
+autocorrelation peak ``REFINE_BEATS`` beats out. Confidence is the
+normalized autocorrelation at the beat lag.
+
+Key correlates the summed chroma (each frame scaled to its loudest pitch
+class, so sustained chords count as much as loud bass hits) with the 24
+rotated Krumhansl-Kessler major/minor profiles. Confidence is the winning
+key's share of a softmax over the 24 correlations, so near-ties (often the
+relative major/minor) score low.
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+ANALYSIS_RATE = 11025
+N_FFT = 2048
+HOP = 256
+MIN_BPM = 60.0
+MAX_BPM = 200.0
+TEMPO_PRIOR_BPM = 120.0
+# Width of the tempo prior, in octaves
+TEMPO_PRIOR_OCTAVES = 1.0
+REFINE_BEATS = 4
+# Frequency range folded into chroma
+CHROMA_MIN_HZ = 65.0
+CHROMA_MAX_HZ = 2100.0
+# Chroma peak below which a frame is scaled down instead of normalized (about -60 dBFS)
+CHROMA_FLOOR = 1.0
+KEY_SOFTMAX_TEMPERATURE = 0.05
+# Shorter inputs are not analyzed
+MIN_SECONDS = 5.0
+
+NOTES = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+
+def _key_templates() -> np.ndarray:
+    """24 z-scored profiles: C..B major, then C..B minor."""
+    rows = [np.roll(profile, tonic) for profile in (MAJOR_PROFILE, MINOR_PROFILE) for tonic in range(12)]
+    templates = np.array(rows)
+    templates -= templates.mean(axis=1, keepdims=True)
+    return templates / np.linalg.norm(templates, axis=1, keepdims=True)
+
+
+KEY_TEMPLATES = _key_templates()
+KEY_NAMES = [f"{note} {mode}" for mode in ("Major", "Minor") for note in NOTES]
+
+
+class AudioAnalyzer:
+    """Streaming tempo and key analysis for one track."""
+
+    def __init__(self, sample_rate: int):
+        self.decimation = max(1, int(round(sample_rate / ANALYSIS_RATE)))
+        self.rate = sample_rate / self.decimation
+        self.frames_per_second = self.rate / HOP
+        self.window = np.hanning(N_FFT).astype(np.float32)
+        frequencies = np.fft.rfftfreq(N_FFT, 1.0 / self.rate)
+        bins = np.nonzero((frequencies >= CHROMA_MIN_HZ) & (frequencies <= CHROMA_MAX_HZ))[0]
+        pitch_classes = np.round(69 + 12 * np.log2(frequencies[bins] / 440.0)).astype(np.int64) % 12
+        self._chroma_slice = slice(int(bins[0]), int(bins[-1]) + 1)
+        # Spectrum bins -> pitch classes
+        self._chroma_map = np.zeros((len(bins), 12), dtype=np.float32)
+        self._chroma_map[np.arange(len(bins)), pitch_classes] = 1.0
+        self.samples = 0
+        self._carry = np.empty(0, dtype=np.float32)
+        self._buffer = np.empty(0, dtype=np.float32)
+        self._previous: Optional[np.ndarray] = None
+        self._onsets: List[np.ndarray] = []
+        self._chroma = np.zeros(12)
+
+    def add(self, samples: np.ndarray) -> None:
+        self.samples += len(samples)
+        if self._carry.size:
+            samples = np.concatenate((self._carry, samples))
+        whole = len(samples) - len(samples) % self.decimation
+        self._carry = samples[whole:].copy()
+        decimated = samples[:whole].reshape(-1, self.decimation).mean(axis=1, dtype=np.float32)
+        buffer = np.concatenate((self._buffer, decimated)) if self._buffer.size else decimated
+        count = (len(buffer) - N_FFT) // HOP + 1 if len(buffer) >= N_FFT else 0
+        if count:
+            frames = np.lib.stride_tricks.sliding_window_view(buffer, N_FFT)[::HOP][:count]
+            magnitude = np.abs(np.fft.rfft(frames * self.window, axis=1))
+            chroma = magnitude[:, self._chroma_slice] @ self._chroma_map
+            self._chroma += (chroma / np.maximum(chroma.max(axis=1, keepdims=True), CHROMA_FLOOR)).sum(axis=0)
+            compressed = np.log1p(100.0 * magnitude)
+            previous = compressed[:1] if self._previous is None else self._previous[None, :]
+            flux = np.maximum(np.diff(compressed, axis=0, prepend=previous), 0.0).sum(axis=1)
+            self._onsets.append(flux.astype(np.float32))
+            self._previous = compressed[-1]
+            buffer = buffer[count * HOP:]
+        self._buffer = buffer.copy()
+
+    @property
+    def seconds(self) -> float:
+        return self.samples / (self.rate * self.decimation)
+
+    def tempo(self) -> Dict[str, Optional[float]]:
+        onsets = np.concatenate(self._onsets) if self._onsets else np.empty(0, dtype=np.float32)
+        fps = self.frames_per_second
+        min_lag, max_lag = int(np.floor(fps * 60 / MAX_BPM)), int(np.ceil(fps * 60 / MIN_BPM))
+        if len(onsets) < 4 * max_lag:
+            return {"bpm": None, "bpm_confidence": None}
+        # Remove the slowly varying loudness so only the pulses remain
+        width = max(1, int(fps / 2))
+        envelope = onsets - np.convolve(onsets, np.full(width, 1.0 / width), mode="same")
+        envelope = np.maximum(envelope, 0.0)
+        envelope -= envelope.mean()
+        size = 1 << int(np.ceil(np.log2(2 * len(envelope))))
+        spectrum = np.fft.rfft(envelope, size)
+        autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum), size)[:REFINE_BEATS * (max_lag + 1) + 2]
+        if autocorrelation[0] <= 0:
+            return {"bpm": None, "bpm_confidence": None}
+        autocorrelation /= autocorrelation[0]
+
+        lags = np.arange(min_lag, max_lag + 1)
+        # Periods fall between frames; score each lag by its best neighbour so rounding does not favour octaves
+        peaks = autocorrelation.copy()
+        peaks[1:-1] = np.maximum(np.maximum(autocorrelation[:-2], autocorrelation[1:-1]), autocorrelation[2:])
+        # A beat period also lines up at twice and four times its lag
+        score = peaks[lags] + 0.5 * peaks[2 * lags] + 0.25 * peaks[4 * lags]
+        bpms = 60.0 * fps / lags
+        prior = np.exp(-0.5 * (np.log2(bpms / TEMPO_PRIOR_BPM) / TEMPO_PRIOR_OCTAVES) ** 2)
+        lag = int(lags[np.argmax(np.maximum(score, 0.0) * prior)])
+
+        # Highest peak around REFINE_BEATS periods out, with parabolic interpolation
+        low = REFINE_BEATS * lag - REFINE_BEATS // 2 - 1
+        peak = low + int(np.argmax(autocorrelation[low:low + REFINE_BEATS + 3]))
+        period = float(peak)
+        left, centre, right = autocorrelation[peak - 1:peak + 2]
+        denominator = left - 2 * centre + right
+        if denominator < 0:
+            period += 0.5 * (left - right) / denominator
+        confidence = float(np.clip(autocorrelation[lag], 0.0, 1.0))
+        return {"bpm": int(round(60.0 * fps * REFINE_BEATS / period)), "bpm_confidence": round(confidence, 3)}
+
+    def key(self) -> Dict[str, Any]:
+        chroma = self._chroma - self._chroma.mean()
+        norm = np.linalg.norm(chroma)
+        if norm == 0:
+            return {"key": None, "key_confidence": None}
+        correlations = KEY_TEMPLATES @ (chroma / norm)
+        weights = np.exp((correlations - correlations.max()) / KEY_SOFTMAX_TEMPERATURE)
+        best = int(np.argmax(correlations))
+        return {"key": KEY_NAMES[best], "key_confidence": round(float(weights[best] / weights.sum()), 3)}
+
+    def result(self) -> Dict[str, Any]:
+        """``{"bpm", "bpm_confidence", "key", "key_confidence"}``; values are None when undetectable."""
+        if self.seconds < MIN_SECONDS:
+            return {"bpm": None, "bpm_confidence": None, "key": None, "key_confidence": None}
+        return {**self.tempo(), **self.key()}
@@ -0,0 +1,77 @@
+"""Read-through caches for beat records and catalog listings.
+
+Beats change rarely but are read on every product page, so single beats are
+cached by id and listing pages by query. Every write to ``beats`` must call
+``invalidate_beat`` or ``invalidate_beats`` (``invalidate_catalog`` for
+inserts), which also marks the public catalog snapshot stale and broadcasts
+the invalidation to the other workers through the shared-state backend.
+"""
+from typing import Any, Dict, Hashable, List, Optional
+
+from backend.config import setting
+from backend.database import db
+from backend.services.cache import TTLCache
+from backend.services.catalog_snapshot import catalog_store
+from backend.services.shared_state import shared_state
+
+INVALIDATION_CHANNEL = "beat_invalidation"
+
+beat_cache = TTLCache("beats", maxsize=setting("beat_cache_size"), ttl=setting("beat_cache_ttl_seconds"))
+catalog_cache = TTLCache("catalog", maxsize=setting("catalog_cache_size"), ttl=setting("catalog_cache_ttl_seconds"))
+
+
+async def get_beat(beat_id: str) -> Optional[Dict[str, Any]]:
+    """Return the full beat row for ``beat_id`` (``None`` if it does not exist)."""
+
+    async def load() -> Optional[Dict[str, Any]]:
+        result = await db.table("beats").select("*").eq("id", beat_id).execute()
+        return result.data[0] if result.data else None
+
+    return await beat_cache.get_or_load(beat_id, load)
+
+
+async def get_catalog_page(key: Hashable, query: Any) -> List[Dict[str, Any]]:
+    """Return the rows of a listing ``query``, cached under ``key``."""
+
+    async def load() -> List[Dict[str, Any]]:
+        result = await query.execute()
+        return result.data or []
+
+    return await catalog_cache.get_or_load(key, load)
+
+
+def _invalidate_local(beat_ids: List[str]) -> None:
+    for beat_id in beat_ids:
+        beat_cache.invalidate(beat_id)
+    catalog_cache.clear()
+    catalog_store.mark_stale()
+
+
+def _on_remote_invalidation(message: str) -> None:
+    # Comma-separated beat ids, "" for the listings only
+    _invalidate_local([beat_id for beat_id in message.split(",") if beat_id])
+
+
+def invalidate_catalog() -> None:
+    """Forget every listing, in this worker and (via shared state) all others."""
+    _invalidate_local([])
+    shared_state.publish_nowait(INVALIDATION_CHANNEL, "")
+
+
+def invalidate_beat(beat_id: str) -> None:
+    """Forget a changed beat and every listing that may contain it, in every worker."""
+    invalidate_beats([beat_id])
+
+
+def invalidate_beats(beat_ids: List[str]) -> None:
+    """Forget several changed beats (one broadcast for the batch) and every listing."""
+    beat_ids = [str(beat_id) for beat_id in beat_ids]
+    _invalidate_local(beat_ids)
+    shared_state.publish_nowait(INVALIDATION_CHANNEL, ",".join(beat_ids))
+
+
+shared_state.subscribe(INVALIDATION_CHANNEL, _on_remote_invalidation)
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {cache.name: cache.stats_dict() for cache in (beat_cache, catalog_cache)}
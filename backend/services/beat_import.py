@@ -0,0 +1,198 @@
+"""Bulk beat import for catalog uploads.
+
+Reads a JSON array, NDJSON or CSV upload, validating each row with the
+Pydantic model as it streams in, then writes the valid rows through the
+``bulk_upsert_beats`` function, one multi-row statement per chunk. In
+transactional mode the whole upload is a single call, so it lands or fails
+as a unit; otherwise a failing chunk is retried row by row so one bad row
+only fails itself.
+"""
+import csv
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Type
+
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, ValidationError
+
+from backend.database import db
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ("json", "ndjson", "csv")
+
+
+@dataclass
+class RowResult:
+    row: int
+    status: str  # pending (valid, unwritten) | created | updated | invalid | failed | not_written
+    id: Optional[str] = None
+    errors: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"row": self.row, "status": self.status, "id": self.id}
+        if self.errors:
+            result["errors"] = self.errors
+        return result
+
+
+def detect_format(request: Request, fmt: Optional[str]) -> str:
+    """Pick the upload format from ``?format=`` or the Content-Type header."""
+    if fmt:
+        if fmt not in IMPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(IMPORT_FORMATS)}")
+        return fmt
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in ("application/x-ndjson", "application/jsonl", "application/ndjson"):
+        return "ndjson"
+    if content_type in ("text/csv", "application/csv"):
+        return "csv"
+    return "json"
+
+
+async def _lines(request: Request) -> AsyncIterator[str]:
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *complete, buffer = buffer.split(b"\n")
+        for line in complete:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8-sig").rstrip("\r")
+
+
+async def _csv_records(request: Request) -> AsyncIterator[Any]:
+    header: Optional[List[str]] = None
+    record = ""
+    async for line in _lines(request):
+        # A quoted field may span lines: wait for the quotes to balance
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue
+        values, record = next(csv.reader([record]), []), ""
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield ValueError(f"expected {len(header)} columns, got {len(values)}")
+            continue
+        # Empty cells mean "not given" so model defaults apply
+        yield {name: value for name, value in zip(header, values) if value != ""}
+    if record:
+        yield ValueError("unterminated quoted field")
+
+
+async def _ndjson_records(request: Request) -> AsyncIterator[Any]:
+    async for line in _lines(request):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"invalid JSON: {e}")
+
+
+async def _json_records(request: Request) -> AsyncIterator[Any]:
+    try:
+        payload = json.loads(await request.body() or b"null")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+    if isinstance(payload, dict) and isinstance(payload.get("beats"), list):
+        payload = payload["beats"]
+    if not isinstance(payload, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of beats")
+    for item in payload:
+        yield item
+
+
+async def read_rows(
+    request: Request,
+    fmt: str,
+    model: Type[BaseModel],
+    max_rows: int,
+) -> Tuple[List[Tuple[int, Dict[str, Any]]], List[RowResult]]:
+    """Validate every uploaded row in one pass.
+
+    Returns the valid rows as ``(row_number, data)`` and a result per input
+    row (``invalid`` ones carry their errors, the rest are filled in by
+    ``write_rows``). ``data`` holds only the fields present in the row (for
+    CSV, the non-empty cells), not the model's defaults.
+    """
+    records = {"json": _json_records, "ndjson": _ndjson_records, "csv": _csv_records}[fmt](request)
+    valid: List[Tuple[int, Dict[str, Any]]] = []
+    results: List[RowResult] = []
+    seen_ids: Dict[str, int] = {}
+    async for record in records:
+        row = len(results) + 1
+        if row > max_rows:
+            raise HTTPException(status_code=413, detail=f"Too many rows (limit {max_rows})")
+        result = RowResult(row=row, status="invalid")
+        results.append(result)
+        if isinstance(record, Exception):
+            result.errors.append(str(record))
+            continue
+        if not isinstance(record, dict):
+            result.errors.append("expected an object")
+            continue
+        try:
+            # Only the fields the row gives: an update leaves the others as they are
+            data = model.model_validate(record).model_dump(mode="json", exclude_unset=True)
+        except ValidationError as e:
+            result.errors.extend(f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in e.errors())
+            continue
+        if data.get("id"):
+            if data["id"] in seen_ids:
+                result.errors.append(f"id: duplicate of row {seen_ids[data['id']]}")
+                continue
+            seen_ids[data["id"]] = row
+        else:
+            data.pop("id", None)
+        result.id = data.get("id")
+        result.status = "pending"
+        valid.append((row, data))
+    return valid, results
+
+
+async def _upsert(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    result = await db.rpc("bulk_upsert_beats", {"p_beats": rows}).execute()
+    return result.data or []
+
+
+async def write_rows(
+    valid: List[Tuple[int, Dict[str, Any]]],
+    results: List[RowResult],
+    chunk_size: int,
+    atomic: bool,
+) -> None:
+    """Upsert ``valid`` rows and record each row's outcome in ``results``.
+
+    Raises the database error in ``atomic`` mode (nothing was written).
+    """
+    by_row = {result.row: result for result in results}
+
+    def record(chunk: List[Tuple[int, Dict[str, Any]]], written: List[Dict[str, Any]]) -> None:
+        # bulk_upsert_beats returns one row per input element, in input order
+        for (row, _), outcome in zip(chunk, sorted(written, key=lambda item: item["ordinal"])):
+            by_row[row].status = "created" if outcome["created"] else "updated"
+            by_row[row].id = outcome["id"]
+
+    if atomic:
+        record(valid, await _upsert([data for _, data in valid]))
+        return
+
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        try:
+            record(chunk, await _upsert([data for _, data in chunk]))
+            continue
+        except Exception as e:
+            logger.warning(f"Bulk beat chunk of {len(chunk)} rows failed, retrying row by row: {str(e)}")
+        for row, data in chunk:
+            try:
+                record([(row, data)], await _upsert([data]))
+            except Exception as e:
+                by_row[row].status = "failed"
+                by_row[row].errors.append(str(e))
@@ -0,0 +1,239 @@
+"""Storefront beat search: full text, range and exact filters, facet counts.
+
+Two backends, picked with ``BEAT_SEARCH_BACKEND``:
+
+* ``memory`` (default) - an inverted index built from the catalog snapshot
+  (active beats only) in each worker. Query terms, filters and facet counts
+  are bitwise operations on Python ints used as bitsets (bit ``i`` =
+  ``snapshot.beats[i]``), so a query costs a handful of big-int ANDs however
+  many beats match.
+* ``postgres`` - the ``search_beats`` function over the generated
+  ``search_vector`` column and its GIN / btree indexes, for catalogs too big
+  to hold in every worker. Results are cached in the catalog cache.
+
+Both rank the same way: beats whose title matches every term first, then the
+rest, newest first within each group. The last query term matches as a
+prefix (search as you type) when it is at least two characters long.
+"""
+import asyncio
+import bisect
+import re
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from backend.config import get_settings
+from backend.database import db
+from backend.services.beat_cache import catalog_cache
+from backend.services.catalog_snapshot import catalog_store
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+FACET_FIELDS = ("genre", "key", "license_type")
+# Range filters keep one cumulative bitset per distinct value up to this many values
+MAX_RANGE_BITSETS = 2048
+# Bits per block when skipping to ``offset`` in a result bitset
+BLOCK_BITS = 4096
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+    q: Optional[str] = None
+    genre: Optional[str] = None
+    key: Optional[str] = None
+    license_type: Optional[str] = None
+    bpm_min: Optional[int] = None
+    bpm_max: Optional[int] = None
+    price_min: Optional[int] = None
+    price_max: Optional[int] = None
+    limit: int = 20
+    offset: int = 0
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return TOKEN.findall(text.lower()) if text else []
+
+
+def _normalize(value: Optional[str]) -> Optional[str]:
+    return value.strip().lower() if value and value.strip() else None
+
+
+def _bitset(positions: Iterable[int], size: int) -> int:
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, "little")
+
+
+class _RangeIndex:
+    """Bitset of beats whose value lies in ``[lo, hi]``."""
+
+    def __init__(self, values: List[Optional[int]], size: int):
+        pairs = sorted((value, position) for position, value in enumerate(values) if value is not None)
+        self._size = size
+        self._values = [value for value, _ in pairs]
+        self._positions = [position for _, position in pairs]
+        self._distinct = sorted(set(self._values))
+        # _below[i]: beats with a value below _distinct[i]; _below[-1]: every beat with a value
+        self._below: Optional[List[int]] = None
+        if len(self._distinct) <= MAX_RANGE_BITSETS:
+            self._below = []
+            bits = bytearray((size + 7) // 8)
+            index = 0
+            for threshold in self._distinct + [None]:
+                while index < len(pairs) and (threshold is None or pairs[index][0] < threshold):
+                    position = pairs[index][1]
+                    bits[position >> 3] |= 1 << (position & 7)
+                    index += 1
+                self._below.append(int.from_bytes(bits, "little"))
+
+    def select(self, lo: Optional[int], hi: Optional[int]) -> int:
+        if self._below is not None:
+            start = bisect.bisect_left(self._distinct, lo) if lo is not None else 0
+            stop = bisect.bisect_right(self._distinct, hi) if hi is not None else len(self._distinct)
+            return self._below[stop] & ~self._below[start] if stop > start else 0
+        start = bisect.bisect_left(self._values, lo) if lo is not None else 0
+        stop = bisect.bisect_right(self._values, hi) if hi is not None else len(self._values)
+        return _bitset(self._positions[start:stop], self._size)
+
+
+class SearchIndex:
+    """Inverted index and filter bitsets over one catalog snapshot."""
+
+    def __init__(self, beats: List[Dict[str, Any]]):
+        self.beats = beats
+        self.size = len(beats)
+        self.everything = (1 << self.size) - 1
+        postings: Dict[str, List[int]] = {}
+        title_postings: Dict[str, List[int]] = {}
+        facets: Dict[str, Dict[str, List[int]]] = {name: {} for name in FACET_FIELDS}
+        for position, beat in enumerate(beats):
+            title_tokens = set(tokenize(beat.get("title")))
+            for token in title_tokens:
+                title_postings.setdefault(token, []).append(position)
+            for token in title_tokens | set(tokenize(beat.get("producer_name"))) | set(tokenize(beat.get("genre"))):
+                postings.setdefault(token, []).append(position)
+            for name in FACET_FIELDS:
+                value = _normalize(beat.get(name))
+                if value:
+                    facets[name].setdefault(value, []).append(position)
+        # Frequent tokens keep a ready-made bitset; rare ones are converted per query
+        dense = max(64, self.size // 256)
+        self._fields = {
+            name: (table, {token: _bitset(positions, self.size) for token, positions in table.items() if len(positions) >= dense})
+            for name, table in (("all", postings), ("title", title_postings))
+        }
+        self._vocabulary = sorted(postings)
+        self._facets = {
+            name: {value: _bitset(positions, self.size) for value, positions in values.items()}
+            for name, values in facets.items()
+        }
+        self._bpm = _RangeIndex([beat.get("bpm") for beat in beats], self.size)
+        self._price = _RangeIndex([beat.get("price_cents") for beat in beats], self.size)
+
+    def _term_bits(self, field: str, term: str, prefix: bool) -> int:
+        postings, dense = self._fields[field]
+        if prefix and len(term) >= 2:
+            start = bisect.bisect_left(self._vocabulary, term)
+            stop = bisect.bisect_left(self._vocabulary, term + "\U0010ffff")
+            tokens = self._vocabulary[start:stop]
+        else:
+            tokens = [term]
+        bits = 0
+        sparse: List[int] = []
+        for token in tokens:
+            if token in dense:
+                bits |= dense[token]
+            else:
+                sparse.extend(postings.get(token, ()))
+        return bits | _bitset(sparse, self.size) if sparse else bits
+
+    def _matching(self, field: str, terms: List[str]) -> int:
+        """Beats whose ``field`` contains every term; the last term also matches as a prefix."""
+        bits = self.everything
+        for index, term in enumerate(terms):
+            bits &= self._term_bits(field, term, prefix=index == len(terms) - 1)
+            if not bits:
+                break
+        return bits
+
+    def _positions(self, bits: int, offset: int, limit: int) -> List[int]:
+        """The first ``limit`` set bits of ``bits`` after skipping ``offset``."""
+        positions: List[int] = []
+        block_mask = (1 << BLOCK_BITS) - 1
+        base = 0
+        while bits and len(positions) < limit:
+            block = bits & block_mask
+            count = block.bit_count()
+            if count <= offset:
+                offset -= count
+            else:
+                while block and len(positions) < limit:
+                    low = block & -block
+                    if offset:
+                        offset -= 1
+                    else:
+                        positions.append(base + low.bit_length() - 1)
+                    block ^= low
+            bits >>= BLOCK_BITS
+            base += BLOCK_BITS
+        return positions
+
+    def search(self, query: SearchQuery) -> Dict[str, Any]:
+        bits = self.everything
+        terms = tokenize(query.q)
+        title_bits = 0
+        if terms:
+            bits = self._matching("all", terms)
+            title_bits = self._matching("title", terms) if bits else 0
+        for name, value in (("genre", query.genre), ("key", query.key), ("license_type", query.license_type)):
+            value = _normalize(value)
+            if value is not None:
+                bits &= self._facets[name].get(value, 0)
+        if query.bpm_min is not None or query.bpm_max is not None:
+            bits &= self._bpm.select(query.bpm_min, query.bpm_max)
+        if query.price_min is not None or query.price_max is not None:
+            bits &= self._price.select(query.price_min, query.price_max)
+
+        facets = {
+            name: {value: count for value, mask in values.items() if (count := (bits & mask).bit_count())}
+            for name, values in self._facets.items()
+        }
+        # Title matches first, then the rest; bit order is newest first
+        first, rest = bits & title_bits, bits & ~title_bits
+        page = self._positions(first, query.offset, query.limit)
+        if len(page) < query.limit:
+            skipped = max(0, query.offset - first.bit_count())
+            page += self._positions(rest, skipped, query.limit - len(page))
+        return {
+            "total": bits.bit_count(),
+            "results": [self.beats[position] for position in page],
+            "facets": facets,
+        }
+
+
+_index: Optional[Tuple[int, SearchIndex]] = None
+_index_lock = asyncio.Lock()
+
+
+async def _memory_index() -> SearchIndex:
+    global _index
+    snapshot = await catalog_store.get()
+    if _index is not None and _index[0] == snapshot.version:
+        return _index[1]
+    async with _index_lock:
+        if _index is None or _index[0] != snapshot.version:
+            # Tokenizing the catalog is CPU-bound
+            _index = (snapshot.version, await asyncio.to_thread(SearchIndex, snapshot.beats))
+        return _index[1]
+
+
+async def search_beats(query: SearchQuery) -> Dict[str, Any]:
+    """Search active beats; returns ``{"total", "results", "facets"}``."""
+    if get_settings().beat_search_backend == "postgres":
+        params = {f"p_{name}": value for name, value in asdict(query).items()}
+
+        async def load() -> Dict[str, Any]:
+            result = await db.rpc("search_beats", params).execute()
+            return result.data or {"total": 0, "results": [], "facets": {}}
+
+        return await catalog_cache.get_or_load(("search", query), load)
+    return (await _memory_index()).search(query)
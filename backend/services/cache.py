@@ -0,0 +1,201 @@
+"""In-process caches."""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Union
+
+from backend.config import resolve
+
+
+class LRUSet:
+    """Bounded set that forgets the least recently seen keys first.
+
+    Used as a fast path in front of the database for "have we seen this?"
+    checks, e.g. recently processed Stripe event IDs.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._keys: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return True
+            return False
+
+    def add(self, key: Hashable) -> None:
+        with self._lock:
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+@dataclass
+class CacheStats:
+    """Counters for one cache instance."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+    loads: int = 0
+    coalesced: int = 0
+
+
+class TTLCache:
+    """Async read-through cache with per-entry TTL and LRU eviction.
+
+    ``get_or_load`` coalesces concurrent misses for the same key into a
+    single loader call (singleflight). Invalidating a key while its load is
+    in flight discards that load's result, so a write is never shadowed by
+    the stale read that raced it. Loaders returning ``None`` are not cached.
+    A loader's exception is shared with the callers waiting on it; if the
+    loading caller is cancelled, the waiting callers load the key again.
+
+    The cache is per process; invalidations are not broadcast to other
+    workers, which see the change at most ``ttl`` seconds later.
+    ``maxsize`` and ``ttl`` may be deferred settings (``config.setting``),
+    read on first use.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: Union[int, Callable[[], int]] = 1000,
+        ttl: Union[float, Callable[[], float]] = 60.0,
+    ):
+        self.name = name
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def maxsize(self) -> int:
+        if callable(self._maxsize):
+            self._maxsize = resolve(self._maxsize)
+        return self._maxsize
+
+    @property
+    def ttl(self) -> float:
+        if callable(self._ttl):
+            self._ttl = resolve(self._ttl)
+        return self._ttl
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for ``key`` or ``None``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._set(key, value)
+
+    def _set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value, calling ``loader`` once per cold key."""
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.stats.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Only this caller's own cancellation propagates; if the leading
+                # load was cancelled instead, look again and load it ourselves
+                if not inflight.cancelled():
+                    raise
+
+        future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        self.stats.loads += 1
+        try:
+            value = await loader()
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieve it so an un-awaited future does not log "exception was never retrieved"
+            future.exception()
+            raise
+        except BaseException:
+            # The loading caller was cancelled: that is not the followers' error to share
+            future.cancel()
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        future.set_result(value)
+        with self._lock:
+            if value is not None and generation == self._generation:
+                self._set(key, value)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop ``key`` and any load of it that is still in flight."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._inflight.pop(key, None)
+            self._generation += 1
+            self.stats.invalidations += 1
+
+    def clear(self) -> None:
+        """Drop every entry and any load still in flight."""
+        with self._lock:
+            self._entries.clear()
+            self._inflight.clear()
+            self._generation += 1
+            self.stats.invalidations += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats_dict(self) -> Dict[str, Any]:
+        data = asdict(self.stats)
+        lookups = self.stats.hits + self.stats.misses
+        data.update(
+            name=self.name,
+            size=len(self._entries),
+            maxsize=self.maxsize,
+            ttl=self.ttl,
+            hit_ratio=round(self.stats.hits / lookups, 4) if lookups else 0.0,
+        )
+        return data
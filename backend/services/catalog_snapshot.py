@@ -0,0 +1,205 @@
+"""Precomputed snapshot of the public beat catalog.
+
+The storefront catalog is every active beat, newest first. It is loaded once,
+serialized once to JSON, gzip and (when the ``brotli`` package is installed)
+brotli bytes, and indexed by genre, key and BPM so filtered requests never
+touch the database. Writes to ``beats`` mark the snapshot stale through
+``beat_cache.invalidate_beat``; the next request rebuilds it. Snapshots
+also expire after ``CATALOG_SNAPSHOT_MAX_AGE_SECONDS`` so other worker
+processes pick up changes they were not told about.
+"""
+import asyncio
+import bisect
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from backend.config import resolve, setting
+from backend.database import db
+from backend.pagination import apply_keyset, paginate
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Columns safe to publish; audio_url (the purchased file) is deliberately excluded
+CATALOG_FIELDS = (
+    "id", "title", "bpm", "key", "genre", "price_cents", "license_type",
+    "preview_url", "waveform_url", "duration_ms", "producer_name", "created_at",
+)
+CATALOG_PAGE_SIZE = 1000
+MAX_FILTERED_ENCODINGS = 256
+
+# (genre, key, bpm_min, bpm_max); None means "any"
+CatalogFilter = Tuple[Optional[str], Optional[str], Optional[int], Optional[int]]
+
+
+@dataclass
+class EncodedCatalog:
+    """One catalog response body in every supported encoding."""
+
+    etag: str
+    identity: bytes
+    gzip: bytes
+    br: Optional[bytes] = None
+
+    @classmethod
+    def encode(cls, payload: Dict[str, Any], brotli_quality: int) -> "EncodedCatalog":
+        body = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+        return cls(
+            etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+            identity=body,
+            # mtime=0 keeps the bytes identical across rebuilds and workers
+            gzip=gzip.compress(body, compresslevel=6, mtime=0),
+            br=brotli.compress(body, quality=brotli_quality) if brotli else None,
+        )
+
+
+def _normalize(value: Optional[str]) -> Optional[str]:
+    return value.strip().lower() if value and value.strip() else None
+
+
+@dataclass
+class CatalogSnapshot:
+    """Active beats plus their in-memory indexes and encoded full response."""
+
+    version: int
+    beats: List[Dict[str, Any]]
+    built_at: float = field(default_factory=time.monotonic)
+    stale: bool = False
+
+    def __post_init__(self) -> None:
+        self.by_genre: Dict[str, List[int]] = {}
+        self.by_key: Dict[str, List[int]] = {}
+        by_bpm: List[Tuple[int, int]] = []
+        for position, beat in enumerate(self.beats):
+            genre = _normalize(beat.get("genre"))
+            if genre:
+                self.by_genre.setdefault(genre, []).append(position)
+            key = _normalize(beat.get("key"))
+            if key:
+                self.by_key.setdefault(key, []).append(position)
+            if beat.get("bpm") is not None:
+                by_bpm.append((beat["bpm"], position))
+        by_bpm.sort()
+        self._bpm_values = [bpm for bpm, _ in by_bpm]
+        self._bpm_positions = [position for _, position in by_bpm]
+
+        self.full = EncodedCatalog.encode(self._payload(self.beats), brotli_quality=11)
+        self._filtered: "OrderedDict[CatalogFilter, EncodedCatalog]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _payload(beats: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {"success": True, "data": beats}
+
+    def select(self, filters: CatalogFilter) -> List[Dict[str, Any]]:
+        """Beats matching ``filters``, newest first, from the indexes."""
+        genre, key, bpm_min, bpm_max = filters
+        candidates: Optional[set] = None
+
+        def narrow(positions) -> None:
+            nonlocal candidates
+            positions = set(positions)
+            candidates = positions if candidates is None else candidates & positions
+
+        if genre is not None:
+            narrow(self.by_genre.get(genre, ()))
+        if key is not None:
+            narrow(self.by_key.get(key, ()))
+        if bpm_min is not None or bpm_max is not None:
+            lo = bisect.bisect_left(self._bpm_values, bpm_min) if bpm_min is not None else 0
+            hi = bisect.bisect_right(self._bpm_values, bpm_max) if bpm_max is not None else len(self._bpm_values)
+            narrow(self._bpm_positions[lo:hi])
+        if candidates is None:
+            return self.beats
+        return [self.beats[position] for position in sorted(candidates)]
+
+    def encoded(self, filters: CatalogFilter) -> EncodedCatalog:
+        """The encoded response for ``filters``; filtered bodies are memoized per snapshot."""
+        if filters == (None, None, None, None):
+            return self.full
+        with self._lock:
+            cached = self._filtered.get(filters)
+            if cached is not None:
+                self._filtered.move_to_end(filters)
+                return cached
+        encoded = EncodedCatalog.encode(self._payload(self.select(filters)), brotli_quality=5)
+        with self._lock:
+            self._filtered[filters] = encoded
+            while len(self._filtered) > MAX_FILTERED_ENCODINGS:
+                self._filtered.popitem(last=False)
+        return encoded
+
+
+class CatalogStore:
+    """Holds the current snapshot and rebuilds it at most once at a time."""
+
+    def __init__(self, max_age: Union[float, Callable[[], float]] = 60.0):
+        self._max_age = max_age
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._version = 0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def max_age(self) -> float:
+        if callable(self._max_age):
+            self._max_age = resolve(self._max_age)
+        return self._max_age
+
+    def _is_fresh(self, snapshot: Optional[CatalogSnapshot]) -> bool:
+        return (
+            snapshot is not None
+            and not snapshot.stale
+            and time.monotonic() - snapshot.built_at < self.max_age
+        )
+
+    async def _load_active_beats(self) -> List[Dict[str, Any]]:
+        beats: List[Dict[str, Any]] = []
+        cursor = None
+        while True:
+            query = db.table("beats").select(", ".join(CATALOG_FIELDS)).eq("is_active", True)
+            result = await apply_keyset(query, cursor, CATALOG_PAGE_SIZE).execute()
+            rows, cursor = paginate(result.data or [], CATALOG_PAGE_SIZE)
+            beats.extend(rows)
+            if cursor is None:
+                return beats
+
+    async def get(self) -> CatalogSnapshot:
+        """Return a fresh snapshot, rebuilding it if stale or expired."""
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            return snapshot
+        async with self._lock:
+            # Another request may have rebuilt it while we waited
+            if self._is_fresh(self._snapshot):
+                return self._snapshot
+            generation = self._generation
+            beats = await self._load_active_beats()
+            self._version += 1
+            # Serializing and compressing the whole catalog is CPU-bound
+            snapshot = await asyncio.to_thread(CatalogSnapshot, self._version, beats)
+            # Invalidated during the rebuild: serve it once, rebuild on the next request
+            snapshot.stale = generation != self._generation
+            self._snapshot = snapshot
+            logger.info(f"Rebuilt catalog snapshot v{snapshot.version} with {len(beats)} beats")
+            return snapshot
+
+    def mark_stale(self) -> None:
+        """Force the next request to rebuild the snapshot."""
+        self._generation += 1
+        if self._snapshot is not None:
+            self._snapshot.stale = True
+
+
+catalog_store = CatalogStore(max_age=setting("catalog_snapshot_max_age_seconds"))
@@ -0,0 +1,161 @@
+"""Line items of a Stripe checkout session.
+
+A session may sell several beats. Its items are read, in order of
+preference, from:
+
+1. ``session["line_items"]`` - present when the session was retrieved with
+   ``expand[]=line_items`` (and how tests and benchmarks stub the Stripe API)
+2. ``metadata["items"]`` - a JSON array of
+   ``{"beat_id", "license_type", "price_cents"}`` set when the session is
+   created
+3. ``metadata["beat_id"]`` / ``metadata["license_type"]`` - single-beat
+   sessions (Payment Links), priced at the session total
+4. the Stripe API (``list_line_items``), reading ``beat_id`` and
+   ``license_type`` from each price's product (or price) metadata
+
+Per-item prices are rescaled so they always add up to ``amount_total``: a
+session-level discount is spread over the items in proportion to their
+list prices.
+"""
+import asyncio
+import json
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+# Stripe caps a session at 100 line items
+MAX_CHECKOUT_ITEMS = 100
+
+EXCLUSIVE_LICENSE_TYPE = "premium_trackout_exclusive"
+# Storefront list price of each license tier, unless the beat prices its own license_type
+LICENSE_PRICES_CENTS = {
+    "mp3_non_exclusive": 2999,
+    "wav_non_exclusive": 4999,
+    "premium_trackout_non_exclusive": 9999,
+    EXCLUSIVE_LICENSE_TYPE: 29999,
+}
+
+
+class CheckoutItemsError(ValueError):
+    """The session's items can never be fulfilled (missing or malformed metadata)."""
+
+
+@dataclass(frozen=True)
+class CheckoutItem:
+    beat_id: uuid.UUID
+    license_type: str
+    price_cents: int
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"beat_id": str(self.beat_id), "license_type": self.license_type, "price_cents": self.price_cents}
+
+
+def list_price(beat: Dict[str, Any], license_type: str) -> int:
+    """Price of ``license_type`` for ``beat``: its own price_cents for its own license_type, else the tier price."""
+    if beat.get("license_type") == license_type and beat.get("price_cents") is not None:
+        return int(beat["price_cents"])
+    return LICENSE_PRICES_CENTS[license_type]
+
+
+def _item(beat_id: Any, license_type: Any, price_cents: Any) -> CheckoutItem:
+    if not beat_id:
+        raise CheckoutItemsError("Missing required metadata: beat_id")
+    if not license_type:
+        raise CheckoutItemsError("Missing required metadata: license_type")
+    try:
+        parsed_id = uuid.UUID(str(beat_id))
+    except ValueError:
+        raise CheckoutItemsError(f"Invalid beat_id format: {beat_id}")
+    try:
+        price = int(price_cents)
+    except (TypeError, ValueError):
+        raise CheckoutItemsError(f"Invalid price_cents for beat {beat_id}: {price_cents}")
+    if price < 0:
+        raise CheckoutItemsError(f"Invalid price_cents for beat {beat_id}: {price_cents}")
+    return CheckoutItem(parsed_id, str(license_type), price)
+
+
+def _from_line_items(line_items: List[Dict[str, Any]]) -> List[CheckoutItem]:
+    items = []
+    for line in line_items:
+        price = line.get("price") or {}
+        product = price.get("product") if isinstance(price.get("product"), dict) else {}
+        metadata = {**(price.get("metadata") or {}), **(product.get("metadata") or {}), **(line.get("metadata") or {})}
+        quantity = max(int(line.get("quantity") or 1), 1)
+        amount = int(line.get("amount_total") or 0)
+        # One license per unit; the line amount is split across its units
+        for unit in range(quantity):
+            unit_price = amount // quantity + (1 if unit < amount % quantity else 0)
+            items.append(_item(metadata.get("beat_id"), metadata.get("license_type"), unit_price))
+    return items
+
+
+def _from_metadata(metadata: Dict[str, Any], total_cents: int) -> Optional[List[CheckoutItem]]:
+    if metadata.get("items"):
+        try:
+            raw = json.loads(metadata["items"]) if isinstance(metadata["items"], str) else metadata["items"]
+        except ValueError:
+            raise CheckoutItemsError("Invalid metadata items: not valid JSON")
+        if not isinstance(raw, list) or not all(isinstance(entry, dict) for entry in raw):
+            raise CheckoutItemsError("Invalid metadata items: expected a JSON array of objects")
+        if len(raw) == 1 and "price_cents" not in raw[0]:
+            raw = [{**raw[0], "price_cents": total_cents}]
+        return [_item(entry.get("beat_id"), entry.get("license_type"), entry.get("price_cents")) for entry in raw]
+    if metadata.get("beat_id") or metadata.get("license_type"):
+        return [_item(metadata.get("beat_id"), metadata.get("license_type"), total_cents)]
+    return None
+
+
+def _fetch_line_items(session_id: str) -> List[Dict[str, Any]]:
+    """List a session's line items from the Stripe API (blocking)."""
+    from backend.stripe_webhook import get_stripe
+
+    stripe = get_stripe()
+    try:
+        line_items = stripe.checkout.Session.list_line_items(session_id, limit=100, expand=["data.price.product"])
+    except stripe.error.InvalidRequestError as e:
+        # e.g. the session does not exist in this Stripe account; retrying will not help
+        raise CheckoutItemsError(f"Could not list line items for session {session_id}: {e}")
+    # StripeObjects are dicts, nested ones included
+    return list(line_items.auto_paging_iter())
+
+
+def allocate(total_cents: int, weights: List[int]) -> List[int]:
+    """Split ``total_cents`` in proportion to ``weights`` (largest remainder), summing exactly."""
+    weight_total = sum(weights)
+    if weight_total <= 0:
+        weights, weight_total = [1] * len(weights), len(weights)
+    shares = [total_cents * weight // weight_total for weight in weights]
+    remainders = sorted(
+        range(len(weights)), key=lambda i: (total_cents * weights[i] % weight_total, -i), reverse=True
+    )
+    for i in remainders[:total_cents - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+
+async def resolve_checkout_items(session: Dict[str, Any]) -> List[CheckoutItem]:
+    """The items a completed checkout session paid for.
+
+    Raises ``CheckoutItemsError`` when the session can never be fulfilled;
+    Stripe API errors propagate so the event can be replayed.
+    """
+    total_cents = int(session.get("amount_total") or 0)
+    line_items = (session.get("line_items") or {}).get("data")
+    if line_items:
+        items = _from_line_items(line_items)
+    else:
+        items = _from_metadata(session.get("metadata") or {}, total_cents)
+        if items is None:
+            if not session.get("id"):
+                raise CheckoutItemsError("Missing required metadata: beat_id")
+            items = _from_line_items(await asyncio.to_thread(_fetch_line_items, session["id"]))
+    if not items:
+        raise CheckoutItemsError("Checkout session has no line items")
+    if len(items) > MAX_CHECKOUT_ITEMS:
+        raise CheckoutItemsError(f"Checkout session has more than {MAX_CHECKOUT_ITEMS} items")
+
+    prices = [item.price_cents for item in items]
+    if sum(prices) != total_cents:
+        prices = allocate(total_cents, prices)
+    return [CheckoutItem(item.beat_id, item.license_type, price) for item, price in zip(items, prices)]
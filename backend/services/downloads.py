@@ -0,0 +1,284 @@
+"""Signed download links and the download log.
+
+Paid files (license PDFs, purchased audio) are handed out as short-lived
+signed URLs instead of permanent public links. Signing is a Storage API
+call, so each object's signed URL is cached and reused until it has
+``DOWNLOAD_URL_REFRESH_MARGIN_SECONDS`` left; concurrent requests for a cold
+object share one signing call.
+
+Requests are rate limited per client and per license (token buckets,
+``DOWNLOAD_RATE_LIMIT_PER_MINUTE`` with bursts of
+``DOWNLOAD_RATE_LIMIT_BURST``, counted per process).
+
+Every download is appended to an in-memory buffer that a background task
+inserts into ``downloads`` in batches, so a click never waits on that write.
+Rows still buffered when a worker crashes are lost (at most one flush
+interval's worth). A batch that fails for a transient reason (connection
+error, 5xx) is kept and retried on the next flush; one the database rejects
+is written row by row, and rows it still rejects are dropped and counted.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from backend.config import resolve, setting
+from backend.database import db, is_transient_error
+from backend.metrics import Counter, Gauge, registry
+from backend.services.cache import TTLCache
+from backend.services.storage import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+DOWNLOADS = registry.register(Counter(
+    "beatstore_downloads_total", "Signed download links handed out, by kind.",
+    labels=("kind",),
+))
+DOWNLOADS_RATE_LIMITED = registry.register(Counter(
+    "beatstore_downloads_rate_limited_total", "Download requests refused with a 429, by the limit they hit.",
+    labels=("scope",),
+))
+DOWNLOAD_LOG_ROWS = registry.register(Counter(
+    "beatstore_download_log_rows_total", "Download log rows by outcome (written, dropped, rejected).",
+    labels=("outcome",),
+))
+DOWNLOAD_LOG_BUFFERED = registry.register(Gauge(
+    "beatstore_download_log_buffered", "Download log rows waiting to be written.",
+))
+
+
+class UrlSigner:
+    """Signs storage objects, caching each signed URL until shortly before it expires.
+
+    The arguments may be deferred settings; they are read on the first signature.
+    """
+
+    def __init__(
+        self,
+        ttl: Union[int, Callable[[], int]],
+        refresh_margin: Union[int, Callable[[], int]],
+        maxsize: Union[int, Callable[[], int]],
+    ):
+        self._config = (ttl, refresh_margin, maxsize)
+        self._cache: Optional[TTLCache] = None
+        self.ttl = 0
+
+    @property
+    def cache(self) -> TTLCache:
+        if self._cache is None:
+            ttl, refresh_margin, maxsize = (resolve(value) for value in self._config)
+            if not 0 <= refresh_margin < ttl:
+                raise ValueError("The signed URL refresh margin must be shorter than its TTL")
+            self.ttl = ttl
+            self._cache = TTLCache("signed_urls", maxsize=maxsize, ttl=ttl - refresh_margin)
+        return self._cache
+
+    async def sign(self, backend: StorageBackend, path: str) -> Dict[str, str]:
+        """Return ``{"url", "expires_at"}`` for ``path`` in ``backend``, valid for at least the refresh margin."""
+
+        async def load() -> Dict[str, str]:
+            # Taken before the call so the reported expiry is never later than the real one
+            expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+            # The storage client is synchronous
+            url = await asyncio.to_thread(backend.signed_url, path, self.ttl)
+            return {"url": url, "expires_at": expires_at.isoformat()}
+
+        # Keyed by the object's (unsigned) URL: the same path may exist in both buckets
+        return await self.cache.get_or_load(backend.public_url(path), load)
+
+
+class RateLimiter:
+    """Token bucket per key: ``per_minute`` requests a minute on average, in bursts of up to ``burst``.
+
+    Counts per process, so with several workers a client gets up to that
+    many times the limit. At most ``maxsize`` keys are tracked, the least
+    recently seen forgotten first. The arguments may be deferred settings;
+    ``per_minute`` of 0 disables the limit.
+    """
+
+    def __init__(
+        self,
+        per_minute: Union[float, Callable[[], float]],
+        burst: Union[int, Callable[[], int]],
+        maxsize: int = 10000,
+    ):
+        self._config = (per_minute, burst)
+        self.maxsize = maxsize
+        self._rate: Optional[float] = None
+        self._burst = 0.0
+        # key -> (tokens left, when they were counted)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def acquire(self, key: str) -> float:
+        """Take a token for ``key``: 0 if the request may go ahead, else the seconds until it may."""
+        if self._rate is None:
+            per_minute, burst = (resolve(value) for value in self._config)
+            self._rate, self._burst = per_minute / 60.0, float(max(burst, 1))
+        if self._rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens, counted_at = self._buckets.pop(key, (self._burst, now))
+        tokens = min(self._burst, tokens + (now - counted_at) * self._rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self._rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class DownloadRecorder:
+    """Buffers ``downloads`` rows and inserts them in batches from a background task.
+
+    A batch is written every ``flush_interval`` seconds, or as soon as
+    ``batch_size`` rows are waiting. At most ``max_buffer`` rows are held;
+    beyond that the oldest are dropped (and counted) rather than letting a
+    database outage grow the buffer without bound.
+    """
+
+    def __init__(
+        self,
+        batch_size: Union[int, Callable[[], int]],
+        flush_interval: Union[float, Callable[[], float]],
+        max_buffer: Union[int, Callable[[], int]],
+    ):
+        self._config = (batch_size, flush_interval, max_buffer)
+        self._rows: Optional[Deque[Dict[str, Any]]] = None
+        self.batch_size = 0
+        self.flush_interval = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def _configure(self) -> Deque[Dict[str, Any]]:
+        # Read the (possibly deferred) settings once, on first use
+        if self._rows is None:
+            batch_size, flush_interval, max_buffer = (resolve(value) for value in self._config)
+            self.batch_size, self.flush_interval = batch_size, flush_interval
+            self._rows = deque(maxlen=max_buffer)
+        return self._rows
+
+    @property
+    def _buffer(self) -> Deque[Dict[str, Any]]:
+        return self._rows if self._rows is not None else self._configure()
+
+    def record(self, row: Dict[str, Any]) -> None:
+        """Queue one ``downloads`` row; never blocks or raises."""
+        if len(self._buffer) == self._buffer.maxlen:
+            DOWNLOAD_LOG_ROWS.inc(outcome="dropped")
+        # Stamp the click time, not the flush time
+        self._buffer.append({**row, "created_at": datetime.now(timezone.utc).isoformat()})
+        DOWNLOAD_LOG_BUFFERED.set(len(self._buffer))
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Write everything buffered; returns the number of rows written."""
+        written = 0
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                await self._insert(batch)
+            except Exception as e:
+                if is_transient_error(e):
+                    logger.error("Failed to write %d download log rows, will retry: %s", len(batch), e)
+                    self._requeue(batch)
+                    break
+                # One bad row (e.g. its license was deleted since) fails the whole insert; keep the others
+                logger.warning("Download log batch of %d rows rejected, writing them one by one: %s", len(batch), e)
+                inserted, unwritten = await self._insert_each(batch)
+                written += inserted
+                if unwritten:
+                    self._requeue(unwritten)
+                    break
+                continue
+            written += len(batch)
+            DOWNLOAD_LOG_ROWS.inc(len(batch), outcome="written")
+        DOWNLOAD_LOG_BUFFERED.set(len(self._buffer))
+        return written
+
+    async def _insert(self, rows: List[Dict[str, Any]]) -> None:
+        # Imported here: postgrest loads lazily with the database client
+        from postgrest.types import ReturnMethod
+
+        await db.table("downloads").insert(rows, returning=ReturnMethod.minimal).execute()
+
+    async def _insert_each(self, rows: List[Dict[str, Any]]) -> Tuple[int, List[Dict[str, Any]]]:
+        """Insert ``rows`` one at a time, dropping those the database rejects.
+
+        Returns the number written and the rows left unwritten by a transient
+        failure (to be retried).
+        """
+        written = 0
+        for index, row in enumerate(rows):
+            try:
+                await self._insert([row])
+            except Exception as e:
+                if is_transient_error(e):
+                    logger.error("Failed to write download log rows, will retry: %s", e)
+                    return written, rows[index:]
+                DOWNLOAD_LOG_ROWS.inc(outcome="rejected")
+                logger.error(
+                    "Dropping download log row the database rejected: %s", e,
+                    extra={"license_id": row.get("license_id"), "kind": row.get("kind")},
+                )
+                continue
+            written += 1
+            DOWNLOAD_LOG_ROWS.inc(outcome="written")
+        return written, []
+
+    def _requeue(self, rows: List[Dict[str, Any]]) -> None:
+        # Back to the front, in order; if the buffer refilled meanwhile the newest rows give way
+        overflow = len(self._buffer) + len(rows) - self._buffer.maxlen
+        if overflow > 0:
+            DOWNLOAD_LOG_ROWS.inc(overflow, outcome="dropped")
+        self._buffer.extendleft(reversed(rows))
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def start(self) -> None:
+        """Start the background flusher."""
+        if self._task is not None:
+            return
+        self._configure()
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flusher after writing whatever is still buffered."""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+url_signer = UrlSigner(
+    setting("download_url_ttl_seconds"),
+    setting("download_url_refresh_margin_seconds"),
+    setting("download_url_cache_size"),
+)
+download_limiter = RateLimiter(
+    setting("download_rate_limit_per_minute"),
+    setting("download_rate_limit_burst"),
+)
+download_recorder = DownloadRecorder(
+    setting("download_log_batch_size"),
+    setting("download_log_flush_interval_seconds"),
+    setting("download_log_max_buffer"),
+)
@@ -0,0 +1,560 @@
+"""Persistent background job queue with an asyncio worker pool.
+
+Jobs are stored in the ``background_jobs`` table so pending work survives a
+restart. ``SQLiteJobStore`` provides the same semantics without Supabase for
+local development and tests.
+"""
+import asyncio
+import inspect
+import json
+import logging
+import random
+import sqlite3
+import threading
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Set, Union
+
+from backend.config import resolve
+from backend.logs import log_context
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUS_PENDING = "pending"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_COMPLETED = "completed"
+JOB_STATUS_FAILED = "failed"
+
+JobHandler = Callable[[Dict[str, Any]], Any]
+
+
+class JobDeferred(Exception):
+    """Raised by a handler to run its job again in ``delay`` seconds without using up an attempt.
+
+    For work blocked on a dependency that is known to be down (e.g. storage
+    with its circuit breaker open), as opposed to a failure of the job itself.
+    """
+
+    def __init__(self, delay: float, reason: str = ""):
+        super().__init__(reason or f"Deferred for {delay:g}s")
+        self.delay = delay
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_timestamp(value: Any) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+@dataclass
+class Job:
+    """A unit of background work."""
+
+    id: str
+    job_type: str
+    payload: Dict[str, Any]
+    attempts: int = 0
+    max_attempts: int = 5
+    status: str = JOB_STATUS_PENDING
+    run_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "Job":
+        payload = row.get("payload") or {}
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+        return cls(
+            id=str(row["id"]),
+            job_type=row["job_type"],
+            payload=payload,
+            attempts=row.get("attempts") or 0,
+            max_attempts=row.get("max_attempts") or 5,
+            status=row.get("status") or JOB_STATUS_PENDING,
+            run_at=_parse_timestamp(row["run_at"]) if row.get("run_at") else None,
+            last_error=row.get("last_error"),
+        )
+
+
+class JobStore:
+    """Storage interface for the job queue."""
+
+    async def enqueue(self, job_type: str, payload: Dict[str, Any], max_attempts: int) -> Job:
+        raise NotImplementedError
+
+    async def enqueue_many(self, job_type: str, payloads: List[Dict[str, Any]], max_attempts: int) -> List[Job]:
+        """Persist several jobs of one type; stores override this with a single write."""
+        return [await self.enqueue(job_type, payload, max_attempts) for payload in payloads]
+
+    async def claim(self, worker_id: str, limit: int = 1) -> List[Job]:
+        """Lease up to ``limit`` due jobs for ``worker_id``."""
+        raise NotImplementedError
+
+    async def complete(self, job: Job) -> None:
+        raise NotImplementedError
+
+    async def fail(self, job: Job, error: str, retry_at: Optional[datetime]) -> None:
+        """Record a failed attempt; ``retry_at=None`` marks the job dead."""
+        raise NotImplementedError
+
+    async def defer(self, job: Job, reason: str, run_at: datetime) -> None:
+        """Return a claimed job to the pending state until ``run_at``, giving back its attempt."""
+        raise NotImplementedError
+
+    async def release_stale(self, lease_timeout: timedelta) -> int:
+        """Return jobs left running by a crashed worker to the pending state."""
+        raise NotImplementedError
+
+    async def payload_values(self, job_type: str, key: str, values: List[str]) -> Set[str]:
+        """Those of ``values`` that some job of ``job_type`` (in any state) has as ``payload[key]``."""
+        raise NotImplementedError
+
+
+class SupabaseJobStore(JobStore):
+    """Job store backed by the ``background_jobs`` table."""
+
+    table = "background_jobs"
+
+    def __init__(self, client: Any = None):
+        self._client = client
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            from backend.database import db
+
+            self._client = db
+        return self._client
+
+    async def enqueue(self, job_type: str, payload: Dict[str, Any], max_attempts: int) -> Job:
+        row = {
+            "job_type": job_type,
+            "payload": payload,
+            "status": JOB_STATUS_PENDING,
+            "max_attempts": max_attempts,
+            "run_at": _utcnow().isoformat(),
+        }
+        result = await self.client.table(self.table).insert(row).execute()
+        if not result.data:
+            raise RuntimeError(f"Failed to enqueue {job_type} job")
+        return Job.from_row(result.data[0])
+
+    async def enqueue_many(self, job_type: str, payloads: List[Dict[str, Any]], max_attempts: int) -> List[Job]:
+        now = _utcnow().isoformat()
+        rows = [
+            {
+                "job_type": job_type,
+                "payload": payload,
+                "status": JOB_STATUS_PENDING,
+                "max_attempts": max_attempts,
+                "run_at": now,
+            }
+            for payload in payloads
+        ]
+        # One multi-row insert
+        result = await self.client.table(self.table).insert(rows).execute()
+        if len(result.data or []) != len(rows):
+            raise RuntimeError(f"Failed to enqueue {len(rows)} {job_type} jobs")
+        return [Job.from_row(row) for row in result.data]
+
+    async def claim(self, worker_id: str, limit: int = 1) -> List[Job]:
+        now = _utcnow().isoformat()
+        candidates = await (
+            self.client.table(self.table)
+            .select("*")
+            .eq("status", JOB_STATUS_PENDING)
+            .lte("run_at", now)
+            .order("run_at")
+            .limit(limit)
+            .execute()
+        )
+        claimed = []
+        for row in candidates.data or []:
+            # Conditional update: only one worker wins the pending -> running transition
+            update = {
+                "status": JOB_STATUS_RUNNING,
+                "attempts": (row.get("attempts") or 0) + 1,
+                "locked_by": worker_id,
+                "locked_at": now,
+                "updated_at": now,
+            }
+            result = await (
+                self.client.table(self.table)
+                .update(update)
+                .eq("id", row["id"])
+                .eq("status", JOB_STATUS_PENDING)
+                .execute()
+            )
+            if result.data:
+                claimed.append(Job.from_row(result.data[0]))
+        return claimed
+
+    async def complete(self, job: Job) -> None:
+        await (
+            self.client.table(self.table)
+            .update({"status": JOB_STATUS_COMPLETED, "last_error": None, "updated_at": _utcnow().isoformat()})
+            .eq("id", job.id)
+            .execute()
+        )
+
+    async def fail(self, job: Job, error: str, retry_at: Optional[datetime]) -> None:
+        update = {
+            "status": JOB_STATUS_PENDING if retry_at else JOB_STATUS_FAILED,
+            "last_error": error,
+            "locked_by": None,
+            "locked_at": None,
+            "updated_at": _utcnow().isoformat(),
+        }
+        if retry_at:
+            update["run_at"] = retry_at.isoformat()
+        await self.client.table(self.table).update(update).eq("id", job.id).execute()
+
+    async def defer(self, job: Job, reason: str, run_at: datetime) -> None:
+        update = {
+            "status": JOB_STATUS_PENDING,
+            "attempts": max(job.attempts - 1, 0),
+            "last_error": reason,
+            "run_at": run_at.isoformat(),
+            "locked_by": None,
+            "locked_at": None,
+            "updated_at": _utcnow().isoformat(),
+        }
+        await self.client.table(self.table).update(update).eq("id", job.id).execute()
+
+    async def release_stale(self, lease_timeout: timedelta) -> int:
+        cutoff = (_utcnow() - lease_timeout).isoformat()
+        result = await (
+            self.client.table(self.table)
+            .update({"status": JOB_STATUS_PENDING, "locked_by": None, "locked_at": None})
+            .eq("status", JOB_STATUS_RUNNING)
+            .lt("locked_at", cutoff)
+            .execute()
+        )
+        return len(result.data or [])
+
+    async def payload_values(self, job_type: str, key: str, values: List[str]) -> Set[str]:
+        if not values:
+            return set()
+        result = await (
+            self.client.table(self.table)
+            .select("payload")
+            .eq("job_type", job_type)
+            .in_(f"payload->>{key}", values)
+            .execute()
+        )
+        return {str(row["payload"].get(key)) for row in result.data or []}
+
+
+class SQLiteJobStore(JobStore):
+    """Job store backed by SQLite, for local development and tests.
+
+    Defaults to an in-memory database; pass a file path to keep jobs across
+    restarts.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS background_jobs (
+                    id TEXT PRIMARY KEY,
+                    job_type TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 5,
+                    run_at TEXT NOT NULL,
+                    locked_by TEXT,
+                    locked_at TEXT,
+                    last_error TEXT,
+                    created_at TEXT NOT NULL
+                )
+                """
+            )
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def enqueue(self, job_type: str, payload: Dict[str, Any], max_attempts: int) -> Job:
+        job_id = str(uuid.uuid4())
+        now = _utcnow().isoformat()
+        self._execute(
+            "INSERT INTO background_jobs (id, job_type, payload, status, max_attempts, run_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, job_type, json.dumps(payload), JOB_STATUS_PENDING, max_attempts, now, now),
+        )
+        return Job(id=job_id, job_type=job_type, payload=payload, max_attempts=max_attempts)
+
+    async def enqueue_many(self, job_type: str, payloads: List[Dict[str, Any]], max_attempts: int) -> List[Job]:
+        now = _utcnow().isoformat()
+        jobs = [Job(id=str(uuid.uuid4()), job_type=job_type, payload=payload, max_attempts=max_attempts) for payload in payloads]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO background_jobs (id, job_type, payload, status, max_attempts, run_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(job.id, job_type, json.dumps(job.payload), JOB_STATUS_PENDING, max_attempts, now, now) for job in jobs],
+            )
+        return jobs
+
+    async def claim(self, worker_id: str, limit: int = 1) -> List[Job]:
+        now = _utcnow().isoformat()
+        rows = self._execute(
+            "SELECT * FROM background_jobs WHERE status = ? AND run_at <= ? ORDER BY run_at LIMIT ?",
+            (JOB_STATUS_PENDING, now, limit),
+        )
+        claimed = []
+        for row in rows:
+            updated = self._execute(
+                "UPDATE background_jobs SET status = ?, attempts = attempts + 1, locked_by = ?, locked_at = ? "
+                "WHERE id = ? AND status = ? RETURNING *",
+                (JOB_STATUS_RUNNING, worker_id, now, row["id"], JOB_STATUS_PENDING),
+            )
+            if updated:
+                claimed.append(Job.from_row(dict(updated[0])))
+        return claimed
+
+    async def complete(self, job: Job) -> None:
+        self._execute(
+            "UPDATE background_jobs SET status = ?, last_error = NULL WHERE id = ?",
+            (JOB_STATUS_COMPLETED, job.id),
+        )
+
+    async def fail(self, job: Job, error: str, retry_at: Optional[datetime]) -> None:
+        if retry_at:
+            self._execute(
+                "UPDATE background_jobs SET status = ?, last_error = ?, run_at = ?, locked_by = NULL, locked_at = NULL "
+                "WHERE id = ?",
+                (JOB_STATUS_PENDING, error, retry_at.isoformat(), job.id),
+            )
+        else:
+            self._execute(
+                "UPDATE background_jobs SET status = ?, last_error = ?, locked_by = NULL, locked_at = NULL WHERE id = ?",
+                (JOB_STATUS_FAILED, error, job.id),
+            )
+
+    async def defer(self, job: Job, reason: str, run_at: datetime) -> None:
+        self._execute(
+            "UPDATE background_jobs SET status = ?, attempts = MAX(attempts - 1, 0), last_error = ?, run_at = ?, "
+            "locked_by = NULL, locked_at = NULL WHERE id = ?",
+            (JOB_STATUS_PENDING, reason, run_at.isoformat(), job.id),
+        )
+
+    async def release_stale(self, lease_timeout: timedelta) -> int:
+        cutoff = (_utcnow() - lease_timeout).isoformat()
+        rows = self._execute(
+            "UPDATE background_jobs SET status = ?, locked_by = NULL, locked_at = NULL "
+            "WHERE status = ? AND locked_at < ? RETURNING id",
+            (JOB_STATUS_PENDING, JOB_STATUS_RUNNING, cutoff),
+        )
+        return len(rows)
+
+    async def payload_values(self, job_type: str, key: str, values: List[str]) -> Set[str]:
+        if not values:
+            return set()
+        placeholders = ", ".join("?" for _ in values)
+        rows = self._execute(
+            f"SELECT DISTINCT json_extract(payload, ?) AS value FROM background_jobs "
+            f"WHERE job_type = ? AND json_extract(payload, ?) IN ({placeholders})",
+            (f"$.{key}", job_type, f"$.{key}", *values),
+        )
+        return {str(row["value"]) for row in rows}
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Fetch a job by ID (used by local tooling)."""
+        rows = self._execute("SELECT * FROM background_jobs WHERE id = ?", (job_id,))
+        return Job.from_row(dict(rows[0])) if rows else None
+
+
+class JobQueue:
+    """Dispatches stored jobs to registered handlers on a pool of workers.
+
+    Coroutine handlers are awaited; synchronous handlers run in a thread so
+    CPU-bound or blocking work (PDF rendering, storage uploads) never stalls
+    the event loop.
+    Failed jobs are retried with exponential backoff until ``max_attempts``;
+    a handler raising ``JobDeferred`` is re-run after its delay without
+    counting the attempt. ``store`` may be a factory and ``concurrency`` and
+    ``max_attempts`` deferred settings, resolved on first use.
+    """
+
+    def __init__(
+        self,
+        store: Union[JobStore, Callable[[], JobStore]],
+        concurrency: Union[int, Callable[[], int]] = 4,
+        max_attempts: Union[int, Callable[[], int]] = 5,
+        poll_interval: float = 2.0,
+        base_backoff: float = 2.0,
+        max_backoff: float = 300.0,
+        lease_timeout: float = 600.0,
+    ):
+        self._store = store
+        self._concurrency = concurrency
+        self._max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lease_timeout = timedelta(seconds=lease_timeout)
+        self._handlers: Dict[str, JobHandler] = {}
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    @property
+    def store(self) -> JobStore:
+        if callable(self._store):
+            self._store = resolve(self._store)
+        return self._store
+
+    @property
+    def concurrency(self) -> int:
+        if callable(self._concurrency):
+            self._concurrency = resolve(self._concurrency)
+        return self._concurrency
+
+    @property
+    def max_attempts(self) -> int:
+        if callable(self._max_attempts):
+            self._max_attempts = resolve(self._max_attempts)
+        return self._max_attempts
+
+    def register(self, job_type: str, handler: JobHandler) -> None:
+        """Register the handler for a job type."""
+        self._handlers[job_type] = handler
+
+    async def enqueue(self, job_type: str, payload: Dict[str, Any]) -> Job:
+        """Persist a job and wake an idle worker."""
+        if job_type not in self._handlers:
+            raise ValueError(f"No handler registered for job type: {job_type}")
+        job = await self.store.enqueue(job_type, payload, self.max_attempts)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def enqueue_many(self, job_type: str, payloads: List[Dict[str, Any]]) -> List[Job]:
+        """Persist several jobs in one write and wake the idle workers to run them in parallel."""
+        if job_type not in self._handlers:
+            raise ValueError(f"No handler registered for job type: {job_type}")
+        if not payloads:
+            return []
+        jobs = await self.store.enqueue_many(job_type, payloads, self.max_attempts)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return jobs
+
+    def backoff_delay(self, attempts: int) -> float:
+        """Seconds to wait before retrying a job that has failed ``attempts`` times."""
+        delay = min(self.max_backoff, self.base_backoff * (2 ** max(attempts - 1, 0)))
+        return delay * random.uniform(0.8, 1.2)
+
+    async def release_stale(self) -> int:
+        """Re-queue jobs whose worker died mid-run (leased longer than ``lease_timeout``).
+
+        Run by a single leader when several processes share the store.
+        """
+        released = await self.store.release_stale(self.lease_timeout)
+        if released:
+            logger.info("Re-queued %d stale background jobs", released)
+            if self._wakeup is not None:
+                self._wakeup.set()
+        return released
+
+    async def start(self) -> None:
+        """Start the worker pool."""
+        if self._workers:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker(f"worker-{uuid.uuid4().hex[:8]}-{i}"))
+            for i in range(self.concurrency)
+        ]
+
+    async def stop(self) -> None:
+        """Stop the worker pool, letting in-flight jobs finish."""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def run_once(self, worker_id: str = "inline") -> int:
+        """Claim and run due jobs once; returns how many jobs were processed."""
+        jobs = await self.store.claim(worker_id, limit=self.concurrency)
+        for job in jobs:
+            await self._run_job(job)
+        return len(jobs)
+
+    async def _worker(self, worker_id: str) -> None:
+        while not self._stopping:
+            try:
+                jobs = await self.store.claim(worker_id)
+            except Exception as e:
+                logger.error("Job queue claim failed: %s", e, extra={"worker_id": worker_id})
+                jobs = []
+            if jobs:
+                for job in jobs:
+                    await self._run_job(job)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_job(self, job: Job) -> None:
+        with log_context(job_id=job.id, job_type=job.job_type):
+            await self._run_job_in_context(job)
+
+    async def _run_job_in_context(self, job: Job) -> None:
+        handler = self._handlers.get(job.job_type)
+        if handler is None:
+            await self.store.fail(job, f"No handler registered for job type: {job.job_type}", None)
+            return
+        try:
+            if inspect.iscoroutinefunction(handler):
+                await handler(job.payload)
+            else:
+                await asyncio.to_thread(handler, job.payload)
+        except JobDeferred as e:
+            run_at = _utcnow() + timedelta(seconds=max(e.delay, 0.0))
+            logger.info("Job %s (%s) deferred until %s: %s", job.id, job.job_type, run_at, e)
+            try:
+                await self.store.defer(job, str(e), run_at)
+            except Exception as store_error:
+                logger.error("Failed to defer job %s: %s", job.id, store_error)
+            return
+        except Exception as e:
+            retry_at = None
+            if job.attempts < job.max_attempts:
+                retry_at = _utcnow() + timedelta(seconds=self.backoff_delay(job.attempts))
+                logger.warning(
+                    "Job %s (%s) failed on attempt %d, retrying at %s: %s",
+                    job.id, job.job_type, job.attempts, retry_at, e, extra={"attempts": job.attempts},
+                )
+            else:
+                logger.error(
+                    "Job %s (%s) failed permanently after %d attempts: %s",
+                    job.id, job.job_type, job.attempts, e, extra={"attempts": job.attempts},
+                )
+            try:
+                await self.store.fail(job, str(e), retry_at)
+            except Exception as store_error:
+                logger.error("Failed to record failure for job %s: %s", job.id, store_error)
+            return
+        try:
+            await self.store.complete(job)
+        except Exception as e:
+            logger.error("Failed to mark job %s completed: %s", job.id, e)
@@ -1,18 +1,27 @@
-"""License PDF generation service."""
+"""License PDF generation service.
+
+ReportLab is imported on first render rather than at import, so the API
+process starts without loading it. Rendering is deterministic (no creation
+timestamp or random document ID), and PDFs are stored under their SHA-256,
+so re-rendering and re-uploading a license, as a retried job does, writes
+the same object again.
+"""
+import io
 import logging
-import os
-import uuid
+import re
+import threading
+from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from reportlab.platypus import Paragraph, Spacer, SimpleDocTemplate
+from backend.config import get_settings
+from backend.metrics import span
+from backend.services.storage import Buffer, StorageUnavailableError, content_path, private_storage
 
-from backend.config import PRODUCER_NAME, LICENSOR_LEGAL_NAME, SUPABASE_URL
-from backend.database import supabase
+if TYPE_CHECKING:
+    from reportlab.lib.styles import ParagraphStyle
 
 logger = logging.getLogger(__name__)
 
@@ -27,154 +36,237 @@ LICENSE_TEMPLATE_MAP = {
 # Get template directory path
 TEMPLATE_DIR = Path(__file__).parent.parent / "license_templates" / "templates"
 
+# Placeholder text in templates -> render value name
+PLACEHOLDERS = {
+    "[EFFECTIVE DATE – AUTO GENERATED]": "effective_date",
+    "[LICENSOR LEGAL NAME / LLC NAME]": "licensor_legal_name",
+    "[PRODUCER NAME]": "producer_name",
+    "[LICENSEE NAME]": "licensee_name",
+    "[LICENSEE EMAIL]": "licensee_email",
+    "[LICENSE NUMBER / ORDER ID]": "license_number",
+    "[COMPOSITION TITLE]": "composition_title",
+}
+
+_PLACEHOLDER_PATTERN = re.compile("|".join(re.escape(placeholder) for placeholder in PLACEHOLDERS))
+
+# Line types in a compiled template
+LINE_BLANK = "blank"
+LINE_BULLET = "bullet"
+LINE_PARAGRAPH = "paragraph"
+
+# A segment is either literal text or the name of a render value
+Segment = Tuple[bool, str]  # (is_placeholder, text_or_value_name)
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """A license template pre-parsed into typed lines of segments."""
+
+    mtime_ns: int
+    lines: Tuple[Tuple[str, Tuple[Segment, ...]], ...]
+
+    def render(self, values: Dict[str, str]) -> List[Tuple[str, str]]:
+        """Substitute ``values`` and return ``(line_type, text)`` pairs."""
+        return [
+            (line_type, "".join(values[text] if is_placeholder else text for is_placeholder, text in segments))
+            for line_type, segments in self.lines
+        ]
 
-def _load_template(license_type: str) -> Optional[str]:
-    """Load license template by license type."""
+
+def _parse_segments(text: str) -> Tuple[Segment, ...]:
+    segments: List[Segment] = []
+    position = 0
+    for match in _PLACEHOLDER_PATTERN.finditer(text):
+        if match.start() > position:
+            segments.append((False, text[position:match.start()]))
+        segments.append((True, PLACEHOLDERS[match.group(0)]))
+        position = match.end()
+    if position < len(text):
+        segments.append((False, text[position:]))
+    return tuple(segments)
+
+
+def _compile_template(text: str, mtime_ns: int) -> CompiledTemplate:
+    """Parse template text into blank, bullet and paragraph lines."""
+    lines = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            lines.append((LINE_BLANK, ()))
+        elif line.startswith("*"):
+            lines.append((LINE_BULLET, _parse_segments(line[1:].strip())))
+        else:
+            lines.append((LINE_PARAGRAPH, _parse_segments(line)))
+    return CompiledTemplate(mtime_ns=mtime_ns, lines=tuple(lines))
+
+
+_template_cache: Dict[str, CompiledTemplate] = {}
+_template_cache_lock = threading.Lock()
+
+
+def _load_template(license_type: str) -> Optional[CompiledTemplate]:
+    """Load the compiled license template, re-reading it only when the file changes."""
     template_file = LICENSE_TEMPLATE_MAP.get(license_type)
     if not template_file:
-        logger.error(f"Unknown license type: {license_type}")
+        logger.error("Unknown license type: %s", license_type)
         return None
     
     template_path = TEMPLATE_DIR / template_file
-    if not template_path.exists():
-        logger.error(f"Template file not found: {template_path}")
+    try:
+        mtime_ns = template_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        logger.error("Template file not found: %s", template_path)
         return None
     
+    cached = _template_cache.get(license_type)
+    if cached is not None and cached.mtime_ns == mtime_ns:
+        return cached
+    
     try:
         with open(template_path, "r", encoding="utf-8") as f:
-            return f.read()
+            compiled = _compile_template(f.read(), mtime_ns)
     except Exception as e:
-        logger.error(f"Error reading template file {template_path}: {e}")
+        logger.error("Error reading template file %s: %s", template_path, e)
         return None
+    
+    with _template_cache_lock:
+        _template_cache[license_type] = compiled
+    if cached is not None:
+        logger.info("Reloaded license template: %s", template_path)
+    return compiled
 
 
-def _replace_placeholders(
-    template: str,
-    effective_date: str,
-    licensor_legal_name: str,
-    producer_name: str,
-    licensee_name: str,
-    licensee_email: str,
-    license_number: str,
-    composition_title: str,
-) -> str:
-    """Replace placeholders in template with actual values."""
-    replacements = {
-        "[EFFECTIVE DATE – AUTO GENERATED]": effective_date,
-        "[LICENSOR LEGAL NAME / LLC NAME]": licensor_legal_name,
-        "[PRODUCER NAME]": producer_name,
-        "[LICENSEE NAME]": licensee_name,
-        "[LICENSEE EMAIL]": licensee_email,
-        "[LICENSE NUMBER / ORDER ID]": license_number,
-        "[COMPOSITION TITLE]": composition_title,
-    }
-    
-    result = template
-    for placeholder, value in replacements.items():
-        result = result.replace(placeholder, value)
-    
-    return result
+@lru_cache(maxsize=None)
+def _body_style() -> "ParagraphStyle":
+    """Shared body text style, built once and never mutated."""
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+
+    return ParagraphStyle(
+        "LicenseBody",
+        parent=getSampleStyleSheet()["Normal"],
+        fontSize=10,
+        leading=12,
+        spaceAfter=6,
+    )
 
 
-def _create_pdf(content: str, output_path: str) -> bool:
-    """Generate PDF from text content using ReportLab."""
+def _create_pdf(lines: List[Tuple[str, str]]) -> Optional[io.BytesIO]:
+    """Generate PDF from rendered template lines into an in-memory buffer."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, Spacer, SimpleDocTemplate
+
     try:
-        # Create PDF document
+        buffer = io.BytesIO()
         doc = SimpleDocTemplate(
-            output_path,
+            buffer,
             pagesize=letter,
             rightMargin=72,
             leftMargin=72,
             topMargin=72,
             bottomMargin=72,
+            # Same content, same bytes: keeps the content-addressed storage path stable
+            invariant=True,
         )
         
-        # Create styles
-        styles = getSampleStyleSheet()
-        normal_style = styles["Normal"]
-        normal_style.fontSize = 10
-        normal_style.leading = 12
-        normal_style.spaceAfter = 6
+        body_style = _body_style()
         
         # Build story (content)
         story = []
-        
-        # Split content into lines and process
-        lines = content.split("\n")
-        for line in lines:
-            line = line.strip()
-            if not line:
+        for line_type, text in lines:
+            if line_type == LINE_BLANK:
                 story.append(Spacer(1, 0.1 * inch))
+            elif line_type == LINE_BULLET:
+                story.append(Paragraph(f"• {text}", body_style))
             else:
-                # Handle bullet points
-                if line.startswith("*"):
-                    # Remove asterisk and add as paragraph
-                    text = line[1:].strip()
-                    story.append(Paragraph(f"• {text}", normal_style))
-                else:
-                    story.append(Paragraph(line, normal_style))
+                story.append(Paragraph(text, body_style))
         
         # Build PDF
         doc.build(story)
-        return True
+        return buffer
     except Exception as e:
-        logger.error(f"Error creating PDF: {e}")
-        return False
+        logger.error("Error creating PDF: %s", e)
+        return None
+
 
+def license_storage_prefix(order_id: str) -> str:
+    """Storage folder for an order's license PDFs (each named by its content hash)."""
+    return f"licenses/{order_id}"
 
-def _upload_to_storage(pdf_path: str, order_id: str, license_id: str) -> Optional[str]:
-    """Upload PDF to Supabase Storage and return public URL."""
+
+def store_license_pdf(data: Buffer, order_id: str) -> str:
+    """Upload license PDF bytes to the private bucket under their content hash; returns the object path.
+
+    The path is what ``licenses.license_url`` keeps: the bucket has no
+    public URLs, so the PDF is only reachable through a signed download link.
+    """
+    path = content_path(license_storage_prefix(order_id), data, ".pdf")
+    private_storage.upload(path, data, "application/pdf")
+    return path
+
+
+def _upload_to_storage(pdf: io.BytesIO, order_id: str) -> Optional[str]:
+    """Upload an in-memory PDF to the private bucket and return its object path."""
     try:
-        # Read PDF file
-        with open(pdf_path, "rb") as f:
-            pdf_data = f.read()
-        
-        # Create storage path
-        storage_path = f"licenses/{order_id}/{license_id}.pdf"
-        
-        # Upload to Supabase Storage
-        # Python supabase client storage API
-        storage_bucket = supabase.storage.from_("beats")
-        
-        # Upload file - returns (data, error) tuple
-        data, error = storage_bucket.upload(
-            storage_path,
-            pdf_data,
-            file_options={"content-type": "application/pdf"},
-        )
-        
-        if error:
-            logger.error(f"Failed to upload PDF to storage: {error}")
-            return None
-        
-        # Get public URL - returns dict with publicUrl key
-        url_result = storage_bucket.get_public_url(storage_path)
-        
-        # Extract public URL from result
-        # Python client get_public_url returns dict with 'publicUrl' key
-        if isinstance(url_result, dict):
-            public_url = url_result.get("publicUrl") or url_result.get("public_url")
-            if public_url:
-                return public_url
-        elif hasattr(url_result, 'publicUrl'):
-            return url_result.publicUrl
-        elif hasattr(url_result, 'public_url'):
-            return url_result.public_url
-        
-        # If we can't extract URL, construct it manually
-        # Format: {SUPABASE_URL}/storage/v1/object/public/{bucket}/{path}
-        return f"{SUPABASE_URL}/storage/v1/object/public/beats/{storage_path}"
-            
+        # getbuffer() exposes the BytesIO contents without copying
+        with pdf.getbuffer() as view:
+            return store_license_pdf(view, order_id)
+    except StorageUnavailableError:
+        raise
     except Exception as e:
-        logger.error(f"Error uploading PDF to storage: {e}", exc_info=True)
+        logger.error("Error uploading PDF to storage: %s", e, exc_info=True)
         return None
-    finally:
-        # Clean up local file
-        try:
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
-        except Exception as e:
-            logger.warning(f"Error removing temporary PDF file: {e}")
+
+
+def render_license_pdf(
+    license_type: str,
+    order_id: str,
+    customer_name: str,
+    customer_email: str,
+    beat_title: str,
+    producer_name: Optional[str] = None,
+    licensor_legal_name: Optional[str] = None,
+    purchase_date: Optional[datetime] = None,
+) -> Optional[io.BytesIO]:
+    """
+    Render a license agreement PDF into memory without uploading it.
+    
+    Takes the same arguments as ``generate_license_pdf``. Returns the PDF
+    buffer, or None if rendering failed.
+    """
+    # Use defaults if not provided (fallback to env vars, then to placeholder)
+    if producer_name is None:
+        producer_name = get_settings().producer_name or "Producer Name"
+    if licensor_legal_name is None:
+        licensor_legal_name = get_settings().licensor_legal_name or "Licensor Legal Name"
+    if purchase_date is None:
+        purchase_date = datetime.now()
+    
+    # Format effective date
+    effective_date = purchase_date.strftime("%B %d, %Y")
+    
+    # Load template
+    template = _load_template(license_type)
+    if not template:
+        logger.error("Failed to load template for license type: %s", license_type)
+        return None
+    
+    # Substitute placeholder values
+    rendered_lines = template.render({
+        "effective_date": effective_date,
+        "licensor_legal_name": licensor_legal_name,
+        "producer_name": producer_name,
+        "licensee_name": customer_name or "Unknown",
+        "licensee_email": customer_email or "Unknown",
+        "license_number": order_id,
+        "composition_title": beat_title or "Unknown Beat",
+    })
+    
+    # Generate PDF in memory
+    pdf = _create_pdf(rendered_lines)
+    if pdf is None:
+        logger.error("Failed to create PDF")
+    return pdf
 
 
 def generate_license_pdf(
@@ -188,7 +280,7 @@ def generate_license_pdf(
     purchase_date: Optional[datetime] = None,
 ) -> Optional[str]:
     """
-    Generate a license agreement PDF and upload to storage.
+    Generate a license agreement PDF and upload it to the private bucket.
     
     Args:
         license_type: One of the four license types
@@ -201,62 +293,40 @@ def generate_license_pdf(
         purchase_date: Purchase date (defaults to current date)
     
     Returns:
-        Public URL of the generated PDF, or None if generation failed
+        Object path of the PDF in the private bucket, or None if generation failed
+    
+    Raises:
+        StorageUnavailableError: storage is failing fast (circuit breaker open);
+            try again after ``retry_after`` seconds
     """
     try:
-        # Use defaults if not provided (fallback to env vars, then to placeholder)
-        if producer_name is None:
-            producer_name = PRODUCER_NAME or "Producer Name"
-        if licensor_legal_name is None:
-            licensor_legal_name = LICENSOR_LEGAL_NAME or "Licensor Legal Name"
-        if purchase_date is None:
-            purchase_date = datetime.now()
-        
-        # Format effective date
-        effective_date = purchase_date.strftime("%B %d, %Y")
-        
-        # Generate license ID
-        license_id = str(uuid.uuid4())
-        
-        # Load template
-        template = _load_template(license_type)
-        if not template:
-            logger.error(f"Failed to load template for license type: {license_type}")
-            return None
-        
-        # Replace placeholders
-        filled_content = _replace_placeholders(
-            template=template,
-            effective_date=effective_date,
-            licensor_legal_name=licensor_legal_name,
-            producer_name=producer_name,
-            licensee_name=customer_name or "Unknown",
-            licensee_email=customer_email or "Unknown",
-            license_number=order_id,
-            composition_title=beat_title or "Unknown Beat",
-        )
-        
-        # Create temporary PDF file
-        temp_dir = Path("/tmp")
-        temp_dir.mkdir(exist_ok=True)
-        temp_pdf_path = str(temp_dir / f"license_{license_id}.pdf")
-        
-        # Generate PDF
-        if not _create_pdf(filled_content, temp_pdf_path):
-            logger.error("Failed to create PDF")
+        with span("license.render_pdf"):
+            pdf = render_license_pdf(
+                license_type=license_type,
+                order_id=order_id,
+                customer_name=customer_name,
+                customer_email=customer_email,
+                beat_title=beat_title,
+                producer_name=producer_name,
+                licensor_legal_name=licensor_legal_name,
+                purchase_date=purchase_date,
+            )
+        if pdf is None:
             return None
         
-        # Upload to storage
-        public_url = _upload_to_storage(temp_pdf_path, order_id, license_id)
+        # Upload to the private bucket
+        with span("license.storage_upload"):
+            path = _upload_to_storage(pdf, order_id)
         
-        if public_url:
-            logger.info(f"Successfully generated license PDF: {public_url}")
-            return public_url
+        if path:
+            logger.info("Successfully generated license PDF: %s", path)
+            return path
         else:
             logger.error("Failed to upload PDF to storage")
             return None
             
+    except StorageUnavailableError:
+        raise
     except Exception as e:
-        logger.error(f"Error generating license PDF: {e}", exc_info=True)
+        logger.error("Error generating license PDF: %s", e, exc_info=True)
         return None
-
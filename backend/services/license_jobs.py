@@ -0,0 +1,154 @@
+"""Background jobs for license PDF rendering and upload."""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from backend.config import get_settings, setting
+from backend.database import db
+from backend.logs import log_context
+from backend.metrics import collect_timings
+from backend.services.job_queue import JobDeferred, JobQueue, JobStore, SQLiteJobStore, SupabaseJobStore
+from backend.services.license_generator import generate_license_pdf
+from backend.services.storage import StorageUnavailableError
+
+logger = logging.getLogger(__name__)
+
+RENDER_LICENSE_JOB = "render_license"
+
+
+def _create_store() -> JobStore:
+    """Create the job store selected by JOB_QUEUE_BACKEND."""
+    settings = get_settings()
+    if settings.job_queue_backend == "sqlite":
+        return SQLiteJobStore(settings.job_queue_sqlite_path)
+    return SupabaseJobStore()
+
+
+async def render_license_job(payload: Dict[str, Any]) -> None:
+    """Render a license PDF, upload it to the private bucket and store its path on the license row.
+
+    Raises on failure so the queue retries the job with backoff. While
+    storage is failing fast the job is deferred until the breaker's
+    cooldown ends instead, without spending one of its attempts.
+    """
+    purchase_date = payload.get("purchase_date")
+    context = {"order_id": payload["order_id"], "license_id": payload["license_id"], "license_type": payload["license_type"]}
+    # The render and upload spans (timed in the worker thread) land in these timings too
+    with log_context(**context), collect_timings():
+        try:
+            # Rendering and the storage upload are blocking; keep them off the event loop
+            path = await asyncio.to_thread(
+                generate_license_pdf,
+                license_type=payload["license_type"],
+                order_id=payload["order_id"],
+                customer_name=payload.get("customer_name"),
+                customer_email=payload.get("customer_email"),
+                beat_title=payload.get("beat_title"),
+                producer_name=payload.get("producer_name"),
+                licensor_legal_name=payload.get("licensor_legal_name"),
+                purchase_date=datetime.fromisoformat(purchase_date) if purchase_date else None,
+            )
+        except StorageUnavailableError as e:
+            raise JobDeferred(e.retry_after, str(e)) from e
+        if not path:
+            raise RuntimeError(f"License PDF generation failed for license {payload['license_id']}")
+
+        # license_url keeps the object path; the PDF is handed out by /api/downloads/{license_id}
+        result = await db.table("licenses").update({"license_url": path}).eq("id", payload["license_id"]).execute()
+        if not result.data:
+            raise RuntimeError(f"Failed to store license_url for license {payload['license_id']}")
+        logger.info("Stored license PDF for license %s: %s", payload["license_id"], path)
+
+
+# The store is created (and the settings read) on first use
+job_queue = JobQueue(
+    _create_store,
+    concurrency=setting("job_worker_concurrency"),
+    max_attempts=setting("job_max_attempts"),
+)
+job_queue.register(RENDER_LICENSE_JOB, render_license_job)
+
+
+async def enqueue_license_renders(payloads: List[Dict[str, Any]]) -> None:
+    """Queue one render+upload job per license in a single write.
+
+    The worker pool renders them concurrently, at most
+    ``JOB_WORKER_CONCURRENCY`` at a time per process.
+    """
+    await job_queue.enqueue_many(RENDER_LICENSE_JOB, payloads)
+
+
+def render_payload(
+    *,
+    license_id: str,
+    license_type: str,
+    order_id: str,
+    customer_name: Optional[str],
+    customer_email: Optional[str],
+    beat_title: Optional[str],
+    producer_name: Optional[str],
+    licensor_legal_name: Optional[str],
+    purchase_date: str,
+) -> Dict[str, Any]:
+    """Build a render job payload, filling unset producer details from the settings."""
+    # Beat-specific producer info wins; placeholders only show up on misconfigured installs
+    settings = get_settings()
+    return {
+        "license_id": license_id,
+        "license_type": license_type,
+        "order_id": order_id,
+        "customer_name": customer_name,
+        "customer_email": customer_email,
+        "beat_title": beat_title or "Unknown Beat",
+        "producer_name": producer_name or settings.producer_name or "Producer Name",
+        "licensor_legal_name": licensor_legal_name or settings.licensor_legal_name or "Licensor Legal Name",
+        "purchase_date": purchase_date,
+    }
+
+
+async def requeue_missing_licenses(min_age_seconds: float, limit: int = 100) -> int:
+    """Queue render jobs for licenses that never got one.
+
+    The webhook commits the order before queueing its renders, so a failed
+    enqueue would leave ``license_url`` NULL forever. Licenses older than
+    ``min_age_seconds`` without a PDF and without any render job (a dead
+    job is left for an operator) are queued again. Run by the maintenance
+    leader; returns how many jobs were queued.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=min_age_seconds)).isoformat()
+    result = await (
+        db.table("licenses")
+        .select("id, license_type, created_at, order_items (beats (*), orders (*))")
+        .is_("license_url", "null")
+        .lt("created_at", cutoff)
+        .order("created_at")
+        .limit(limit)
+        .execute()
+    )
+    rows = result.data or []
+    queued = await job_queue.store.payload_values(RENDER_LICENSE_JOB, "license_id", [row["id"] for row in rows])
+    payloads = []
+    for row in rows:
+        item = row.get("order_items") or {}
+        order, beat = item.get("orders") or {}, item.get("beats") or {}
+        if row["id"] in queued or order.get("status") != "completed":
+            continue
+        payloads.append(render_payload(
+            license_id=row["id"],
+            license_type=row["license_type"],
+            order_id=order["id"],
+            customer_name=order.get("customer_name"),
+            customer_email=order.get("customer_email"),
+            beat_title=beat.get("title"),
+            producer_name=beat.get("producer_name"),
+            licensor_legal_name=beat.get("licensor_legal_name"),
+            purchase_date=order.get("created_at") or row["created_at"],
+        ))
+    if payloads:
+        await enqueue_license_renders(payloads)
+        logger.warning(
+            "Re-queued license renders for %d license(s) that had none", len(payloads),
+            extra={"license_ids": [payload["license_id"] for payload in payloads]},
+        )
+    return len(payloads)
@@ -0,0 +1,274 @@
+"""Bulk license re-issue: re-render and re-upload PDFs for past purchases.
+
+Used after a template or a producer's ``licensor_legal_name`` changes.
+Licenses are selected by filter and processed one keyset page at a time:
+PDFs render in parallel on a ``ProcessPoolExecutor`` (ReportLab is CPU-bound
+and holds the GIL), uploads run with bounded concurrency, and each page's
+``license_url`` values are written back in one bulk update. A JSON
+checkpoint records the cursor after every page so an interrupted run resumes
+where it stopped. PDFs are written to the private bucket, so a re-issue also
+moves licenses stored before it existed out of the public one (their old
+public objects have to be deleted separately).
+
+CLI:
+    python -m backend.services.license_reissue --license-type wav_non_exclusive \\
+        --from 2026-01-01 --workers 4 --checkpoint reissue.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from backend.database import db
+from backend.pagination import apply_keyset, paginate
+from backend.services.license_generator import render_license_pdf, store_license_pdf
+
+logger = logging.getLogger(__name__)
+
+LICENSE_REISSUE_SELECT = (
+    "id, order_item_id, license_type, beat_id, created_at, "
+    "beats (title, producer_name, licensor_legal_name), "
+    "order_items (order_id, orders (created_at, customer_name, customer_email))"
+)
+
+
+@dataclass
+class ReissueFilter:
+    """Selects which licenses to re-issue; unset fields match everything."""
+
+    beat_id: Optional[str] = None
+    license_type: Optional[str] = None
+    created_from: Optional[str] = None
+    created_to: Optional[str] = None
+
+
+@dataclass
+class ReissueProgress:
+    """Running totals, also the throughput report when the run finishes."""
+
+    total: Optional[int] = None
+    processed: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    workers: int = 1
+    elapsed: float = 0.0
+    finished: bool = False
+    failed_ids: List[str] = field(default_factory=list)
+
+    @property
+    def pdfs_per_second(self) -> float:
+        return self.succeeded / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def pdfs_per_second_per_core(self) -> float:
+        return self.pdfs_per_second / self.workers
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["pdfs_per_second"] = round(self.pdfs_per_second, 2)
+        data["pdfs_per_second_per_core"] = round(self.pdfs_per_second_per_core, 2)
+        return data
+
+
+def _render_task(task: Dict[str, Any]) -> bytes:
+    """Render one license in a worker process and return the PDF bytes."""
+    pdf = render_license_pdf(
+        license_type=task["license_type"],
+        order_id=task["order_id"],
+        customer_name=task["customer_name"],
+        customer_email=task["customer_email"],
+        beat_title=task["beat_title"],
+        producer_name=task["producer_name"],
+        licensor_legal_name=task["licensor_legal_name"],
+        purchase_date=datetime.fromisoformat(task["purchase_date"]) if task["purchase_date"] else None,
+    )
+    if pdf is None:
+        raise RuntimeError(f"Failed to render license {task['license_id']}")
+    return pdf.getvalue()
+
+
+def _task_from_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    beat = row.get("beats") or {}
+    order_item = row.get("order_items") or {}
+    order = order_item.get("orders") or {}
+    purchase_date = order.get("created_at") or row.get("created_at")
+    return {
+        "license_id": row["id"],
+        "license_type": row["license_type"],
+        "order_id": order_item.get("order_id") or row["order_item_id"],
+        "customer_name": order.get("customer_name"),
+        "customer_email": order.get("customer_email"),
+        "beat_title": beat.get("title"),
+        "producer_name": beat.get("producer_name"),
+        "licensor_legal_name": beat.get("licensor_legal_name"),
+        "purchase_date": purchase_date.replace("Z", "+00:00") if purchase_date else None,
+    }
+
+
+def _build_query(filters: ReissueFilter, count: bool = False) -> Any:
+    query = db.table("licenses").select(LICENSE_REISSUE_SELECT, count="exact" if count else None)
+    if filters.beat_id:
+        query = query.eq("beat_id", filters.beat_id)
+    if filters.license_type:
+        query = query.eq("license_type", filters.license_type)
+    if filters.created_from:
+        query = query.gte("created_at", filters.created_from)
+    if filters.created_to:
+        query = query.lt("created_at", filters.created_to)
+    return query
+
+
+def _load_checkpoint(path: Optional[str], filters: ReissueFilter) -> Dict[str, Any]:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("filters") != asdict(filters):
+        raise ValueError(f"Checkpoint {path} was written for different filters")
+    return checkpoint
+
+
+def _save_checkpoint(path: Optional[str], filters: ReissueFilter, cursor: Optional[str], progress: ReissueProgress) -> None:
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"filters": asdict(filters), "cursor": cursor, "progress": progress.to_dict()}, f)
+    os.replace(tmp_path, path)
+
+
+async def reissue_licenses(
+    filters: ReissueFilter,
+    workers: int = os.cpu_count() or 1,
+    upload_concurrency: int = 8,
+    batch_size: int = 100,
+    checkpoint_path: Optional[str] = None,
+    on_progress: Optional[Callable[[ReissueProgress], None]] = None,
+) -> ReissueProgress:
+    """Re-render, re-upload and re-link every license matching ``filters``."""
+    checkpoint = _load_checkpoint(checkpoint_path, filters)
+    cursor = checkpoint.get("cursor")
+    saved = checkpoint.get("progress") or {}
+    progress = ReissueProgress(
+        processed=saved.get("processed", 0),
+        succeeded=saved.get("succeeded", 0),
+        failed=saved.get("failed", 0),
+        failed_ids=saved.get("failed_ids", []),
+        workers=workers,
+    )
+    if checkpoint and cursor is None:
+        progress.finished = True
+        return progress
+
+    loop = asyncio.get_running_loop()
+    upload_slots = asyncio.Semaphore(upload_concurrency)
+    start = time.perf_counter()
+
+    async def process(pool: ProcessPoolExecutor, task: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        try:
+            pdf_bytes = await loop.run_in_executor(pool, _render_task, task)
+            async with upload_slots:
+                path = await asyncio.to_thread(store_license_pdf, pdf_bytes, task["order_id"])
+            return {"license_id": task["license_id"], "license_url": path}
+        except Exception as e:
+            logger.error("Failed to reissue license %s: %s", task["license_id"], e, extra={"license_id": task["license_id"]})
+            return None
+
+    # spawn: never fork a process that owns event-loop, HTTP-pool and worker threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        first_page = True
+        while True:
+            query = apply_keyset(_build_query(filters, count=first_page and progress.total is None), cursor, batch_size)
+            result = await query.execute()
+            if first_page and result.count is not None:
+                progress.total = result.count + progress.processed
+            first_page = False
+            rows, next_cursor = paginate(result.data or [], batch_size)
+            if not rows:
+                cursor = None
+                break
+
+            tasks = [_task_from_row(row) for row in rows]
+            outcomes = await asyncio.gather(*(process(pool, task) for task in tasks))
+
+            # One bulk write per page; update-only, so a license deleted meanwhile is not recreated
+            updates = [
+                {"id": outcome["license_id"], "url": outcome["license_url"]}
+                for outcome in outcomes
+                if outcome
+            ]
+            if updates:
+                await db.rpc("set_license_urls", {"p_rows": updates}).execute()
+
+            progress.processed += len(tasks)
+            progress.succeeded += len(updates)
+            progress.failed += len(tasks) - len(updates)
+            succeeded_ids = {update["id"] for update in updates}
+            progress.failed_ids.extend(task["license_id"] for task in tasks if task["license_id"] not in succeeded_ids)
+            progress.elapsed = time.perf_counter() - start
+
+            cursor = next_cursor
+            if cursor is None:
+                break
+            _save_checkpoint(checkpoint_path, filters, cursor, progress)
+            if on_progress:
+                on_progress(progress)
+
+    progress.elapsed = time.perf_counter() - start
+    progress.finished = True
+    _save_checkpoint(checkpoint_path, filters, None, progress)
+    if on_progress:
+        on_progress(progress)
+    return progress
+
+
+def _print_progress(progress: ReissueProgress) -> None:
+    total = progress.total if progress.total is not None else "?"
+    print(
+        f"[{progress.processed}/{total}] ok={progress.succeeded} failed={progress.failed} "
+        f"{progress.pdfs_per_second:.1f} PDFs/s ({progress.pdfs_per_second_per_core:.1f}/s per core)",
+        flush=True,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--beat-id")
+    parser.add_argument("--license-type")
+    parser.add_argument("--from", dest="created_from", help="ISO date/time, inclusive")
+    parser.add_argument("--to", dest="created_to", help="ISO date/time, exclusive")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--upload-concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--checkpoint", help="checkpoint file; re-run with the same file to resume")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    filters = ReissueFilter(args.beat_id, args.license_type, args.created_from, args.created_to)
+
+    async def run() -> ReissueProgress:
+        try:
+            return await reissue_licenses(
+                filters,
+                workers=args.workers,
+                upload_concurrency=args.upload_concurrency,
+                batch_size=args.batch_size,
+                checkpoint_path=args.checkpoint,
+                on_progress=_print_progress,
+            )
+        finally:
+            await db.aclose()
+
+    progress = asyncio.run(run())
+    print(json.dumps(progress.to_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
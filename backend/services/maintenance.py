@@ -0,0 +1,55 @@
+"""Singleton maintenance duties, run by one elected worker.
+
+With several API workers (see ``backend/gunicorn_conf.py``) every worker
+processes jobs and webhooks, but sweeps that should happen once per cluster
+run only on the holder of the ``maintenance`` lease:
+
+* re-queue background jobs whose worker died mid-run
+* replay Stripe events left unprocessed by a transient failure
+* queue license renders whose enqueue failed after the order was committed
+* mark timed-out exclusive-license holds released
+"""
+import logging
+
+from backend.config import get_settings
+from backend.services.license_jobs import job_queue, requeue_missing_licenses
+from backend.services.reservations import release_expired
+from backend.services.shared_state import LeaderTask, shared_state
+from backend.services.webhook_replay import replay_unprocessed_events
+
+logger = logging.getLogger(__name__)
+
+
+async def run_maintenance() -> None:
+    try:
+        await job_queue.release_stale()
+    except Exception as e:
+        logger.error("Failed to release stale background jobs: %s", e)
+    try:
+        expired = await release_expired()
+        if expired:
+            logger.info("Released %d expired exclusive-license holds", expired)
+    except Exception as e:
+        logger.error("Failed to release expired holds: %s", e)
+    try:
+        await requeue_missing_licenses(get_settings().license_requeue_min_age_seconds)
+    except Exception as e:
+        logger.error("Failed to re-queue missing license renders: %s", e)
+    summary = await replay_unprocessed_events(
+        limit=100,
+        min_age_seconds=get_settings().webhook_replay_min_age_seconds,
+    )
+    if summary["replayed"]:
+        logger.info("Replayed %d stuck webhook events (%d failed)", summary["replayed"], summary["failed"])
+
+
+def create_maintenance_leader() -> LeaderTask:
+    settings = get_settings()
+    return LeaderTask(
+        shared_state,
+        "maintenance",
+        run_maintenance,
+        interval=settings.maintenance_interval_seconds,
+        # Renew well inside the lease so a dead leader is replaced within one TTL
+        renew_interval=settings.leader_lease_seconds / 3,
+    )
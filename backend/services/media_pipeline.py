@@ -0,0 +1,251 @@
+"""Preview clips, waveforms and tempo/key detection for uploaded beats.
+
+Creating or importing a beat queues a ``process_beat_media`` job. The job
+streams the source audio into a temporary file through the storage backend
+(or over HTTP when ``audio_url`` points outside our storage), then a process
+pool decodes it once for the waveform peaks and the duration and cuts a
+short, tagged, low-bitrate preview clip (``backend.services.audio``). Both
+are uploaded and the beat row is updated:
+
+- ``preview_url`` - only when the beat has none or its current one was
+  generated here, so a hand-picked preview is never replaced
+- ``waveform_url`` - little-endian int16 (min, max) pairs, full scale 32767
+- ``duration_ms``
+- ``media_source_url`` - the ``audio_url`` they were made from; a job for an
+  unchanged source does nothing unless it is forced
+- ``detected_bpm`` / ``detected_key`` with ``bpm_confidence`` /
+  ``key_confidence`` (0-1), from the same decoding pass. They are copied to
+  ``bpm`` / ``key`` when those are blank or still hold the previous
+  detection, never over a value entered by hand.
+
+``POST /api/beats/analysis/backfill`` queues detection only (no previews)
+for existing beats.
+"""
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any, BinaryIO, Dict, Iterable, Optional
+
+from backend.config import get_settings
+from backend.database import db
+from backend.metrics import Counter, registry, span
+from backend.services.beat_cache import invalidate_beat
+from backend.services.license_jobs import job_queue
+from backend.services.storage import locate, storage
+
+if TYPE_CHECKING:
+    from backend.services.audio import MediaOptions
+
+logger = logging.getLogger(__name__)
+
+PROCESS_BEAT_MEDIA_JOB = "process_beat_media"
+PREVIEW_PREFIX = "previews"
+WAVEFORM_PREFIX = "waveforms"
+PEAKS_CONTENT_TYPE = "application/octet-stream"
+
+BEAT_MEDIA_JOBS = registry.register(Counter(
+    "beatstore_beat_media_jobs_total", "Beat media jobs by outcome (processed, analyzed, unchanged, missing).",
+    labels=("outcome",),
+))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class MediaSourceError(Exception):
+    """Raised when a beat's source audio cannot be fetched."""
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned, not forked: the API process has threads and an event loop running
+        _pool = ProcessPoolExecutor(
+            max_workers=max(1, get_settings().audio_worker_processes),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_media_pool() -> None:
+    """Stop the worker processes (app shutdown)."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def media_options() -> "MediaOptions":
+    """``MediaOptions`` from the settings; AUDIO_TRANSCODER=auto picks ffmpeg when it is installed."""
+    from backend.services.audio import MediaOptions
+
+    settings = get_settings()
+    ffmpeg_path = shutil.which(settings.ffmpeg_path)
+    transcoder = settings.audio_transcoder
+    if transcoder == "auto":
+        transcoder = "ffmpeg" if ffmpeg_path else "wav"
+    elif transcoder not in ("ffmpeg", "wav"):
+        raise ValueError(f"Unknown AUDIO_TRANSCODER: {transcoder}")
+    if transcoder == "ffmpeg" and not ffmpeg_path:
+        raise RuntimeError(f"AUDIO_TRANSCODER=ffmpeg but {settings.ffmpeg_path} is not installed")
+    return MediaOptions(
+        transcoder=transcoder,
+        ffmpeg_path=ffmpeg_path,
+        preview_seconds=settings.audio_preview_seconds,
+        preview_start_seconds=settings.audio_preview_start_seconds,
+        bitrate_kbps=settings.audio_preview_bitrate_kbps,
+        waveform_points=settings.audio_waveform_points,
+    )
+
+
+def _fetch_url(url: str, dest: BinaryIO, max_bytes: int) -> int:
+    import httpx
+
+    written = 0
+    with httpx.stream("GET", url, follow_redirects=True, timeout=60.0) as response:
+        if response.status_code >= 300:
+            raise MediaSourceError(f"Fetching {url} failed with {response.status_code}")
+        for chunk in response.iter_bytes(1024 * 1024):
+            written += len(chunk)
+            if written > max_bytes:
+                raise MediaSourceError(f"{url} is larger than {max_bytes} bytes")
+            dest.write(chunk)
+    return written
+
+
+def fetch_source(audio_url: str, dest: BinaryIO) -> int:
+    """Stream a beat's ``audio_url`` into ``dest`` (blocking); returns the byte count."""
+    location = locate(audio_url)
+    if location is not None:
+        backend, path = location
+        return backend.download(path, dest)
+    if audio_url.startswith(("http://", "https://")):
+        return _fetch_url(audio_url, dest, get_settings().audio_max_source_bytes)
+    raise MediaSourceError(f"Cannot fetch audio from {audio_url}")
+
+
+def _is_generated(url: Optional[str]) -> bool:
+    return bool(url) and url.startswith(storage.public_url(f"{PREVIEW_PREFIX}/"))
+
+
+def _needs_analysis(beat: Dict[str, Any]) -> bool:
+    return beat.get("bpm") is None or not beat.get("key")
+
+
+def _analysis_update(beat: Dict[str, Any], analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Store the detected values; copy them to bpm/key unless those were set by hand."""
+    update = {
+        "detected_bpm": analysis["bpm"],
+        "bpm_confidence": analysis["bpm_confidence"],
+        "detected_key": analysis["key"],
+        "key_confidence": analysis["key_confidence"],
+    }
+    # A value equal to the previous detection was not entered by hand
+    if analysis["bpm"] is not None and beat.get("bpm") in (None, beat.get("detected_bpm")):
+        update["bpm"] = analysis["bpm"]
+    if analysis["key"] is not None and beat.get("key") in (None, "", beat.get("detected_key")):
+        update["key"] = analysis["key"]
+    return update
+
+
+async def process_beat_media_job(payload: Dict[str, Any]) -> None:
+    """Generate and store a beat's preview clip and waveform, and detect its tempo and key.
+
+    ``analysis_only`` payloads (backfills) skip the preview and waveform.
+    Raises on failure so the queue retries the job with backoff.
+    """
+    from backend.services.audio import analyze_file, render_media
+
+    beat_id = payload["beat_id"]
+    result = await db.table("beats").select(
+        "id, title, producer_name, audio_url, preview_url, waveform_url, media_source_url, "
+        "bpm, key, detected_bpm, detected_key"
+    ).eq("id", beat_id).execute()
+    if not result.data or not result.data[0].get("audio_url"):
+        # Deleted since the job was queued
+        BEAT_MEDIA_JOBS.inc(outcome="missing")
+        return
+    beat = result.data[0]
+    audio_url = beat["audio_url"]
+    force = payload.get("force", False)
+    # A bulk re-import may have cleared preview_url while leaving the audio as it was
+    media_current = beat.get("media_source_url") == audio_url and beat.get("waveform_url") and beat.get("preview_url")
+    render = not payload.get("analysis_only") and (force or not media_current)
+    # New audio invalidates the previous detection too
+    analyze = get_settings().audio_analysis_enabled and (render or force or _needs_analysis(beat))
+    if not render and not analyze:
+        BEAT_MEDIA_JOBS.inc(outcome="unchanged")
+        return
+
+    options = media_options()
+    # Keyed by source so a new upload gets new URLs instead of a stale CDN copy
+    version = hashlib.sha256(audio_url.encode()).hexdigest()[:12]
+    update: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory(prefix="beat-media-") as workdir:
+        source = os.path.join(workdir, "source")
+        with span("media.fetch_source"):
+            with open(source, "wb") as f:
+                size = await asyncio.to_thread(fetch_source, audio_url, f)
+        loop = asyncio.get_running_loop()
+        if not render:
+            with span("media.analyze"):
+                analysis = await loop.run_in_executor(_get_pool(), analyze_file, source, options.ffmpeg_path)
+            update.update(_analysis_update(beat, analysis))
+        else:
+            with span("media.render"):
+                media = await loop.run_in_executor(
+                    _get_pool(), render_media,
+                    source, workdir, beat.get("title") or "", beat.get("producer_name"), options, analyze,
+                )
+            with span("media.upload"):
+                with open(media["preview_path"], "rb") as f:
+                    preview = f.read()
+                with open(media["peaks_path"], "rb") as f:
+                    peaks = f.read()
+                preview_url = await asyncio.to_thread(
+                    storage.upload,
+                    f"{PREVIEW_PREFIX}/{beat_id}/{version}.{media['preview_extension']}",
+                    preview,
+                    media["preview_content_type"],
+                )
+                waveform_url = await asyncio.to_thread(
+                    storage.upload, f"{WAVEFORM_PREFIX}/{beat_id}/{version}.peaks", peaks, PEAKS_CONTENT_TYPE,
+                )
+            update.update(waveform_url=waveform_url, duration_ms=media["duration_ms"], media_source_url=audio_url)
+            if not beat.get("preview_url") or _is_generated(beat["preview_url"]):
+                update["preview_url"] = preview_url
+            if media["analysis"] is not None:
+                update.update(_analysis_update(beat, media["analysis"]))
+
+    # Only if the source has not been replaced meanwhile; its own job will fill it in
+    result = await db.table("beats").update(update).eq("id", beat_id).eq("audio_url", audio_url).execute()
+    invalidate_beat(beat_id)
+    BEAT_MEDIA_JOBS.inc(outcome="processed" if render else "analyzed")
+    logger.info(
+        "Processed media for beat %s (%d source bytes)%s",
+        beat_id, size, "" if result.data else " (source changed meanwhile, not stored)",
+        extra={"media": {name: value for name, value in update.items() if not name.endswith("_url")}},
+    )
+
+
+job_queue.register(PROCESS_BEAT_MEDIA_JOB, process_beat_media_job)
+
+
+async def enqueue_beat_media(beat_ids: Iterable[str], force: bool = False, analysis_only: bool = False) -> None:
+    """Queue media processing for the given beats in a single write (no-op when disabled).
+
+    ``analysis_only`` queues tempo/key detection without regenerating previews
+    and waveforms; ``force`` redoes work even if the source is unchanged.
+    """
+    if not get_settings().audio_pipeline_enabled:
+        return
+    payloads = [
+        {"beat_id": beat_id, "force": force, "analysis_only": analysis_only}
+        for beat_id in dict.fromkeys(str(beat_id) for beat_id in beat_ids)
+    ]
+    if payloads:
+        await job_queue.enqueue_many(PROCESS_BEAT_MEDIA_JOB, payloads)
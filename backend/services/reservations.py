@@ -0,0 +1,210 @@
+"""Holds on exclusive licenses while a buyer checks out.
+
+An exclusive license can be sold once. Starting a checkout for one takes a
+hold on the beat (``reserve_exclusive``) through the
+``reserve_exclusive_beats`` Postgres function, which locks the beats rows so
+that of any number of concurrent requests exactly one gets the hold. The
+hold lasts as long as the Stripe session (plus
+``RESERVATION_GRACE_SECONDS``) and ends in one of three ways:
+
+- fulfillment converts it (``fulfill_checkout_items``), which also refuses
+  a second exclusive sale of the same beat, holds or not
+- the session expires or the buyer abandons it (``release``)
+- it times out; an expired hold stops counting at once and the maintenance
+  sweep (``release_expired``) marks it released
+
+``get_availability`` answers "can this beat still be bought exclusively"
+for the storefront from a short-TTL cache that every change to a hold
+clears in all workers.
+"""
+import asyncio
+import logging
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from backend.config import setting
+from backend.database import db
+from backend.metrics import Counter, registry
+from backend.services.cache import TTLCache
+from backend.services.shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+AVAILABILITY_CHANNEL = "beat_availability"
+# Key of the cached list of every live hold
+ALL_HOLDS = "__held__"
+
+RESERVATIONS = registry.register(Counter(
+    "beatstore_beat_reservations_total",
+    "Exclusive-license holds by outcome (reserved, conflict, released, expired, converted, sold_out, refunded, refund_failed).",
+    labels=("outcome",),
+))
+
+availability_cache = TTLCache(
+    "availability", maxsize=setting("availability_cache_size"), ttl=setting("availability_cache_ttl_seconds")
+)
+
+
+class BeatsUnavailableError(Exception):
+    """Raised when a hold cannot be taken on every requested beat."""
+
+    def __init__(self, beat_ids: List[str]):
+        self.beat_ids = beat_ids
+        super().__init__(f"Exclusive license not available for beat(s): {', '.join(beat_ids)}")
+
+
+@dataclass(frozen=True)
+class Hold:
+    token: str
+    beat_ids: Tuple[str, ...]
+    expires_at: str
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _invalidate_local() -> None:
+    availability_cache.clear()
+
+
+def invalidate_availability() -> None:
+    """Forget cached availability in this worker and (via shared state) all others."""
+    _invalidate_local()
+    shared_state.publish_nowait(AVAILABILITY_CHANNEL, "")
+
+
+shared_state.subscribe(AVAILABILITY_CHANNEL, lambda message: _invalidate_local())
+
+
+async def reserve_exclusive(beat_ids: Iterable[str], ttl_seconds: int, token: Optional[str] = None) -> Hold:
+    """Hold the exclusive license of every beat for ``ttl_seconds``, or none of them.
+
+    Passing the ``token`` of an existing hold extends it. Raises
+    ``BeatsUnavailableError`` listing the beats that are inactive, sold or
+    held by someone else.
+    """
+    beat_ids = tuple(dict.fromkeys(str(beat_id) for beat_id in beat_ids))
+    token = token or str(uuid.uuid4())
+    result = await db.rpc("reserve_exclusive_beats", {
+        "p_beat_ids": list(beat_ids),
+        "p_hold_token": token,
+        "p_ttl_seconds": int(ttl_seconds),
+    }).execute()
+    outcome = result.data or {}
+    if not outcome.get("reserved"):
+        RESERVATIONS.inc(outcome="conflict")
+        raise BeatsUnavailableError([str(beat_id) for beat_id in outcome.get("unavailable") or beat_ids])
+    RESERVATIONS.inc(outcome="reserved")
+    invalidate_availability()
+    return Hold(token=token, beat_ids=beat_ids, expires_at=outcome["expires_at"])
+
+
+async def attach_checkout(token: str, checkout_id: str) -> None:
+    """Record the Stripe checkout session a hold was taken for."""
+    await db.table("beat_reservations").update({
+        "stripe_checkout_id": checkout_id,
+        "updated_at": _now(),
+    }).eq("hold_token", token).eq("status", "held").execute()
+
+
+async def release(checkout_id: Optional[str] = None, token: Optional[str] = None) -> int:
+    """End the live holds of a checkout session and/or hold token; returns how many were released."""
+    filters = [f"stripe_checkout_id.eq.{checkout_id}" if checkout_id else None, f"hold_token.eq.{token}" if token else None]
+    filters = [f for f in filters if f]
+    if not filters:
+        return 0
+    result = await db.table("beat_reservations").update({
+        "status": "released",
+        "updated_at": _now(),
+    }).eq("status", "held").or_(",".join(filters)).execute()
+    released = len(result.data or [])
+    if released:
+        RESERVATIONS.inc(released, outcome="released")
+        invalidate_availability()
+    return released
+
+
+async def release_expired() -> int:
+    """Mark every timed-out hold released (maintenance sweep); returns how many there were."""
+    result = await db.table("beat_reservations").update({
+        "status": "released",
+        "updated_at": _now(),
+    }).eq("status", "held").lte("expires_at", _now()).execute()
+    expired = len(result.data or [])
+    if expired:
+        RESERVATIONS.inc(expired, outcome="expired")
+        invalidate_availability()
+    return expired
+
+
+def expire_checkout_session(checkout_id: str) -> None:
+    """Close a Stripe checkout session so it can no longer be paid (blocking)."""
+    from backend.stripe_webhook import get_stripe
+
+    get_stripe().checkout.Session.expire(checkout_id)
+
+
+def refund_checkout_payment(payment_intent_id: str, checkout_id: str) -> str:
+    """Refund the whole payment of a checkout that could not be fulfilled (blocking); returns the refund ID.
+
+    Keyed by the checkout, so a replayed event cannot refund it twice.
+    """
+    from backend.stripe_webhook import get_stripe
+
+    refund = get_stripe().Refund.create(
+        payment_intent=payment_intent_id,
+        metadata={"checkout_id": checkout_id, "reason": "exclusive_license_sold_out"},
+        idempotency_key=f"sold-out-refund-{checkout_id}",
+    )
+    return refund["id"]
+
+
+def _is_live(reservation: Dict[str, Any], now: datetime) -> bool:
+    return reservation["status"] == "held" and datetime.fromisoformat(reservation["expires_at"]) > now
+
+
+async def _load_availability(beat_ids: Tuple[str, ...]) -> Dict[str, Dict[str, Any]]:
+    beats, reservations = await asyncio.gather(
+        db.table("beats").select("id, is_active").in_("id", list(beat_ids)).execute(),
+        db.table("beat_reservations").select("beat_id, status, expires_at").in_("beat_id", list(beat_ids)).execute(),
+    )
+    active = {row["id"]: row.get("is_active") for row in beats.data or []}
+    by_beat = {row["beat_id"]: row for row in reservations.data or []}
+    now = datetime.now(timezone.utc)
+    availability = {}
+    for beat_id in beat_ids:
+        reservation = by_beat.get(beat_id)
+        if reservation is not None and reservation["status"] == "converted":
+            availability[beat_id] = {"status": "sold", "held_until": None}
+        elif not active.get(beat_id):
+            availability[beat_id] = {"status": "unavailable", "held_until": None}
+        elif reservation is not None and _is_live(reservation, now):
+            availability[beat_id] = {"status": "held", "held_until": reservation["expires_at"]}
+        else:
+            availability[beat_id] = {"status": "available", "held_until": None}
+    return availability
+
+
+async def _load_holds() -> Dict[str, Dict[str, Any]]:
+    result = await db.table("beat_reservations").select("beat_id, expires_at").eq(
+        "status", "held"
+    ).gt("expires_at", _now()).execute()
+    return {row["beat_id"]: {"status": "held", "held_until": row["expires_at"]} for row in result.data or []}
+
+
+async def get_availability(beat_ids: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Exclusive availability per beat: ``{beat_id: {"status", "held_until"}}``.
+
+    ``status`` is ``available``, ``held`` (until ``held_until``), ``sold`` or
+    ``unavailable`` (inactive or missing). Without ``beat_ids``, returns just
+    the beats currently on hold. Cached for ``AVAILABILITY_CACHE_TTL_SECONDS``.
+    """
+    if beat_ids is None:
+        return await availability_cache.get_or_load(ALL_HOLDS, _load_holds)
+    key = tuple(sorted(dict.fromkeys(str(beat_id) for beat_id in beat_ids)))
+    if not key:
+        return {}
+    return await availability_cache.get_or_load(key, lambda: _load_availability(key))
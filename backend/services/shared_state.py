@@ -0,0 +1,459 @@
+"""Cross-worker coordination: broadcast messages and leader leases.
+
+In-process state (caches, snapshots) lives in every worker. The shared-state
+backend lets one worker tell the others about a change and lets exactly one
+worker run singleton duties. Select it with ``SHARED_STATE_BACKEND``:
+
+* ``memory``   - one process; messages stay local and this worker always leads
+* ``sqlite``   - several processes on one host sharing a SQLite file
+                 (local multi-worker runs and the benchmark harness)
+* ``postgres`` - several processes or hosts: LISTEN/NOTIFY for messages and
+                 session advisory locks for leadership. Needs ``asyncpg`` and
+                 a direct (session-mode) ``DATABASE_URL``; transaction-mode
+                 poolers such as PgBouncer drop both LISTEN and session locks.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from backend.config import get_settings
+from backend.metrics import Counter, Gauge, registry
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[str], None]
+
+SHARED_STATE_MESSAGES = registry.register(Counter(
+    "beatstore_shared_state_messages_total", "Shared-state messages by channel and direction.",
+    labels=("channel", "direction"),
+))
+LEADER = registry.register(Gauge(
+    "beatstore_leader", "1 if this worker currently holds the named leader lease.",
+    labels=("role",),
+))
+
+
+class SharedState:
+    """Interface for shared-state backends."""
+
+    def __init__(self) -> None:
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self) -> None:
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        """Call ``handler(message)`` for messages other workers publish on ``channel``."""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def publish(self, channel: str, message: str) -> None:
+        """Deliver ``message`` to every other worker subscribed to ``channel``."""
+        raise NotImplementedError
+
+    def publish_nowait(self, channel: str, message: str) -> None:
+        """Publish without waiting; safe to call from sync code and other threads."""
+        if self._loop is None or self._loop.is_closed():
+            # Not started (imports, scripts): nothing else to notify
+            return
+
+        async def send() -> None:
+            try:
+                await self.publish(channel, message)
+            except Exception as e:
+                logger.error("Failed to publish on %s: %s", channel, e)
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            task = asyncio.ensure_future(send())
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+        else:
+            asyncio.run_coroutine_threadsafe(send(), self._loop)
+
+    async def acquire_leadership(self, name: str) -> bool:
+        """Take or renew the ``name`` lease; True while this worker holds it."""
+        raise NotImplementedError
+
+    async def release_leadership(self, name: str) -> None:
+        raise NotImplementedError
+
+    def _envelope(self, message: str) -> str:
+        return json.dumps({"origin": self.worker_id, "message": message})
+
+    def _dispatch(self, channel: str, payload: str) -> None:
+        try:
+            envelope = json.loads(payload)
+        except ValueError:
+            logger.error("Dropping malformed shared-state message on %s", channel)
+            return
+        if envelope.get("origin") == self.worker_id:
+            return
+        SHARED_STATE_MESSAGES.inc(channel=channel, direction="received")
+        for handler in self._handlers.get(channel, []):
+            try:
+                handler(envelope.get("message", ""))
+            except Exception as e:
+                logger.error("Shared-state handler for %s failed: %s", channel, e, exc_info=True)
+
+
+class InMemorySharedState(SharedState):
+    """Single-process backend: no other workers to notify, always the leader."""
+
+    async def publish(self, channel: str, message: str) -> None:
+        SHARED_STATE_MESSAGES.inc(channel=channel, direction="sent")
+
+    async def acquire_leadership(self, name: str) -> bool:
+        return True
+
+    async def release_leadership(self, name: str) -> None:
+        return None
+
+
+class SQLiteSharedState(SharedState):
+    """Processes on one host coordinating through a shared SQLite file.
+
+    Messages are rows polled every ``poll_interval`` seconds; leadership is a
+    lease row renewed by its owner and taken over once it expires.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.2, lease_ttl: float = 15.0, retention: float = 300.0):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.lease_ttl = lease_ttl
+        self.retention = retention
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._poller: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_leases ("
+            "name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        return conn
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def start(self) -> None:
+        await super().start()
+        self._conn = await asyncio.to_thread(self._connect)
+        rows = await asyncio.to_thread(self._query, "SELECT COALESCE(MAX(id), 0) FROM shared_messages")
+        # Only messages published after we joined matter
+        self._last_id = rows[0][0]
+        self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self) -> None:
+        await super().stop()
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _poll(self) -> None:
+        last_prune = 0.0
+        while True:
+            try:
+                rows = await asyncio.to_thread(
+                    self._query,
+                    "SELECT id, channel, payload FROM shared_messages WHERE id > ? ORDER BY id",
+                    (self._last_id,),
+                )
+                for row_id, channel, payload in rows:
+                    self._last_id = row_id
+                    self._dispatch(channel, payload)
+                if time.time() - last_prune > self.retention:
+                    last_prune = time.time()
+                    await asyncio.to_thread(
+                        self._query, "DELETE FROM shared_messages WHERE created_at < ?", (time.time() - self.retention,)
+                    )
+            except Exception as e:
+                logger.error("Shared-state poll failed: %s", e)
+            await asyncio.sleep(self.poll_interval)
+
+    async def publish(self, channel: str, message: str) -> None:
+        await asyncio.to_thread(
+            self._query,
+            "INSERT INTO shared_messages (channel, payload, created_at) VALUES (?, ?, ?)",
+            (channel, self._envelope(message), time.time()),
+        )
+        SHARED_STATE_MESSAGES.inc(channel=channel, direction="sent")
+
+    async def acquire_leadership(self, name: str) -> bool:
+        now = time.time()
+        rows = await asyncio.to_thread(
+            self._query,
+            "INSERT INTO shared_leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE shared_leases.owner = excluded.owner OR shared_leases.expires_at < ? "
+            "RETURNING owner",
+            (name, self.worker_id, now + self.lease_ttl, now),
+        )
+        return bool(rows) and rows[0][0] == self.worker_id
+
+    async def release_leadership(self, name: str) -> None:
+        await asyncio.to_thread(
+            self._query, "DELETE FROM shared_leases WHERE name = ? AND owner = ?", (name, self.worker_id)
+        )
+
+
+def _advisory_key(name: str) -> int:
+    # Stable signed 64-bit key for pg_advisory_lock
+    return int.from_bytes(hashlib.sha1(f"beatstore:{name}".encode()).digest()[:8], "big", signed=True)
+
+
+class PostgresSharedState(SharedState):
+    """LISTEN/NOTIFY for messages, session advisory locks for leadership.
+
+    One dedicated connection holds the listeners and the locks, so if the
+    worker dies Postgres releases its leadership with the session.
+    """
+
+    CHANNEL_PREFIX = "beatstore_"
+
+    def __init__(self, dsn: Optional[str]):
+        super().__init__()
+        self.dsn = dsn
+        self._conn: Any = None
+        self._conn_lock = asyncio.Lock()
+        self._held: Set[str] = set()
+
+    async def _connect(self) -> None:
+        # Optional dependency, only needed for this backend
+        import asyncpg
+
+        if not self.dsn:
+            raise ValueError("Required environment variable DATABASE_URL is not set")
+        self._conn = await asyncpg.connect(self.dsn)
+        self._held.clear()
+        for channel in self._handlers:
+            await self._conn.add_listener(self.CHANNEL_PREFIX + channel, self._on_notify)
+
+    def _on_notify(self, connection: Any, pid: int, channel: str, payload: str) -> None:
+        self._dispatch(channel[len(self.CHANNEL_PREFIX):], payload)
+
+    async def _ensure_connection(self) -> Any:
+        if self._conn is None or self._conn.is_closed():
+            if self._held:
+                logger.warning("Lost shared-state connection; leadership of %s released", sorted(self._held))
+            await self._connect()
+        return self._conn
+
+    async def start(self) -> None:
+        await super().start()
+        async with self._conn_lock:
+            await self._ensure_connection()
+
+    async def stop(self) -> None:
+        await super().stop()
+        async with self._conn_lock:
+            if self._conn is not None and not self._conn.is_closed():
+                await self._conn.close()
+            self._conn = None
+            self._held.clear()
+
+    async def publish(self, channel: str, message: str) -> None:
+        async with self._conn_lock:
+            conn = await self._ensure_connection()
+            await conn.execute("SELECT pg_notify($1, $2)", self.CHANNEL_PREFIX + channel, self._envelope(message))
+        SHARED_STATE_MESSAGES.inc(channel=channel, direction="sent")
+
+    async def acquire_leadership(self, name: str) -> bool:
+        async with self._conn_lock:
+            conn = await self._ensure_connection()
+            if name in self._held:
+                # The lock lives as long as the session; a cheap query proves the session does
+                await conn.fetchval("SELECT 1")
+                return True
+            if await conn.fetchval("SELECT pg_try_advisory_lock($1)", _advisory_key(name)):
+                self._held.add(name)
+                return True
+            return False
+
+    async def release_leadership(self, name: str) -> None:
+        async with self._conn_lock:
+            if name in self._held and self._conn is not None and not self._conn.is_closed():
+                await self._conn.execute("SELECT pg_advisory_unlock($1)", _advisory_key(name))
+            self._held.discard(name)
+
+
+class LeaderTask:
+    """Runs ``task`` every ``interval`` seconds on whichever worker holds the ``name`` lease.
+
+    Every worker runs the loop; the lease is renewed every ``renew_interval``
+    seconds (well inside the lease TTL) so a dead leader is replaced quickly.
+    ``task`` runs in its own asyncio task so renewal carries on while it runs,
+    and it is cancelled if the lease is lost meanwhile, so a run that outlasts
+    the TTL never overlaps with the next leader's.
+    """
+
+    def __init__(
+        self,
+        state: SharedState,
+        name: str,
+        task: Callable[[], Awaitable[None]],
+        interval: float,
+        renew_interval: float = 5.0,
+    ):
+        self.state = state
+        self.name = name
+        self.task = task
+        self.interval = interval
+        self.renew_interval = min(renew_interval, interval)
+        self.is_leader = False
+        self._runner: Optional[asyncio.Task] = None
+        self._current: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        await self._cancel_current()
+        if self.is_leader:
+            try:
+                await self.state.release_leadership(self.name)
+            except Exception as e:
+                logger.error("Failed to release %s leadership: %s", self.name, e)
+            self._set_leader(False)
+
+    def _set_leader(self, is_leader: bool) -> None:
+        if is_leader != self.is_leader:
+            logger.info(
+                "Worker %s %s %s leadership", self.state.worker_id, "acquired" if is_leader else "lost", self.name,
+                extra={"worker_id": self.state.worker_id},
+            )
+        self.is_leader = is_leader
+        LEADER.set(float(is_leader), role=self.name)
+
+    async def _cancel_current(self) -> None:
+        if self._current is not None:
+            self._current.cancel()
+            await asyncio.gather(self._current, return_exceptions=True)
+            self._current = None
+
+    async def _run_task(self) -> None:
+        try:
+            await self.task()
+        except Exception as e:
+            logger.error("%s leader task failed: %s", self.name, e, exc_info=True)
+
+    async def _run(self) -> None:
+        last_run = 0.0
+        while True:
+            try:
+                self._set_leader(await self.state.acquire_leadership(self.name))
+            except Exception as e:
+                logger.error("%s leader election failed: %s", self.name, e)
+                self._set_leader(False)
+            if not self.is_leader:
+                # Another worker may hold the lease now: stop before it starts its own run
+                await self._cancel_current()
+            elif (self._current is None or self._current.done()) and time.monotonic() - last_run >= self.interval:
+                last_run = time.monotonic()
+                self._current = asyncio.create_task(self._run_task())
+            await asyncio.sleep(self.renew_interval)
+
+
+def create_shared_state(backend: Optional[str] = None) -> SharedState:
+    """Create the shared-state backend selected by SHARED_STATE_BACKEND."""
+    settings = get_settings()
+    backend = backend or settings.shared_state_backend
+    if backend == "memory":
+        return InMemorySharedState()
+    if backend == "sqlite":
+        return SQLiteSharedState(settings.shared_state_sqlite_path, lease_ttl=settings.leader_lease_seconds)
+    if backend == "postgres":
+        return PostgresSharedState(settings.database_url)
+    raise ValueError(f"Unknown SHARED_STATE_BACKEND: {backend}")
+
+
+class LazySharedState(SharedState):
+    """Creates the configured backend on first use (not at import).
+
+    Subscriptions made before then, e.g. by modules at import time, are
+    handed to the backend when it is created.
+    """
+
+    def __init__(self) -> None:
+        self._backend: Optional[SharedState] = None
+        self._subscriptions: List[Tuple[str, MessageHandler]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self) -> SharedState:
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    backend = create_shared_state()
+                    for channel, handler in self._subscriptions:
+                        backend.subscribe(channel, handler)
+                    self._backend = backend
+        return self._backend
+
+    @property
+    def worker_id(self) -> str:
+        return self.backend.worker_id
+
+    async def start(self) -> None:
+        await self.backend.start()
+
+    async def stop(self) -> None:
+        await self.backend.stop()
+
+    def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        with self._lock:
+            if self._backend is None:
+                self._subscriptions.append((channel, handler))
+                return
+        self._backend.subscribe(channel, handler)
+
+    async def publish(self, channel: str, message: str) -> None:
+        await self.backend.publish(channel, message)
+
+    def publish_nowait(self, channel: str, message: str) -> None:
+        self.backend.publish_nowait(channel, message)
+
+    async def acquire_leadership(self, name: str) -> bool:
+        return await self.backend.acquire_leadership(name)
+
+    async def release_leadership(self, name: str) -> None:
+        await self.backend.release_leadership(name)
+
+
+# Shared by caches (invalidation) and leader tasks; connects in the app lifespan
+shared_state: SharedState = LazySharedState()
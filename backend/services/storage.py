@@ -0,0 +1,509 @@
+"""Pluggable object storage for generated files.
+
+Uploads take a ``bytes``/``memoryview`` buffer and hand it to the backend
+without writing a temporary file or copying it; ``download`` streams an
+object into a file without holding it in memory. Downloads of paid files go
+through ``signed_url``, which returns a link that stops working after
+``expires_in`` seconds. Select the backend with ``STORAGE_BACKEND``:
+``supabase`` (default), ``local`` or ``memory``.
+
+Files buyers pay for live in the private bucket ``STORAGE_PRIVATE_BUCKET``
+(``private_storage``), which has no public URLs: rows keep the object's
+path and the files are only handed out as signed links by
+``/api/downloads``. License PDFs are stored there; beat audio is read from
+either bucket. ``locate`` resolves a stored
+reference (a private path, or a URL of either bucket) to its storage.
+
+Every backend is wrapped in ``ResilientStorage``: transient failures
+(timeouts, dropped connections, 5xx, 429) are retried with exponential
+backoff, and after ``STORAGE_BREAKER_THRESHOLD`` consecutive failures a
+circuit breaker fails calls immediately with ``StorageUnavailableError``
+for ``STORAGE_BREAKER_COOLDOWN_SECONDS``, so callers can defer the work
+instead of queueing up behind a storage outage. ``upload_content`` stores
+an object under the SHA-256 of its bytes, so uploading the same file again
+(e.g. from a retried job) overwrites the same object instead of adding one.
+"""
+import hashlib
+import logging
+import random
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, Optional, Tuple, TypeVar, Union
+
+from backend.config import get_settings
+from backend.metrics import SYNC_SUPABASE_HOOKS, Counter, Gauge, registry
+
+logger = logging.getLogger(__name__)
+
+Buffer = Union[bytes, bytearray, memoryview]
+T = TypeVar("T")
+
+STORAGE_CALLS = registry.register(Counter(
+    "beatstore_storage_calls_total",
+    "Storage calls by operation and outcome (ok, retried, failed, rejected by the open breaker).",
+    labels=("operation", "outcome"),
+))
+STORAGE_BREAKER_OPEN = registry.register(Gauge(
+    "beatstore_storage_breaker_open", "1 while the storage circuit breaker is failing calls fast.",
+))
+
+# Responses that may succeed if the request is sent again
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class StorageError(Exception):
+    """Raised when an object cannot be stored; ``retryable`` if trying again may succeed."""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class StorageUnavailableError(StorageError):
+    """Raised without calling storage while the circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Storage is unavailable, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def content_path(prefix: str, data: Buffer, suffix: str = "") -> str:
+    """``{prefix}/{sha256 of data}{suffix}``: the same bytes always map to the same object."""
+    return f"{prefix}/{hashlib.sha256(data).hexdigest()}{suffix}"
+
+
+class StorageBackend:
+    """Interface for object storage backends."""
+
+    def upload(self, path: str, data: Buffer, content_type: str) -> str:
+        """Store ``data`` at ``path`` (overwriting) and return its public URL."""
+        raise NotImplementedError
+
+    def upload_content(self, prefix: str, data: Buffer, content_type: str, suffix: str = "") -> str:
+        """Store ``data`` under ``prefix``, named by its content hash; returns its public URL."""
+        return self.upload(content_path(prefix, data, suffix), data, content_type)
+
+    def download(self, path: str, dest: BinaryIO) -> int:
+        """Write the object at ``path`` to ``dest``; returns the number of bytes written."""
+        raise NotImplementedError
+
+    def public_url(self, path: str) -> str:
+        raise NotImplementedError
+
+    def signed_url(self, path: str, expires_in: int) -> str:
+        """Return a URL for ``path`` that is valid for ``expires_in`` seconds."""
+        raise NotImplementedError
+
+    def object_path(self, url: str) -> Optional[str]:
+        """Inverse of ``public_url``: the object path, or ``None`` for URLs outside this storage."""
+        prefix = self.public_url("")
+        if not url.startswith(prefix):
+            return None
+        return url[len(prefix):].split("?", 1)[0] or None
+
+
+class SupabaseStorage(StorageBackend):
+    """Supabase Storage over a pooled HTTP client.
+
+    Buffers larger than ``chunked_threshold`` are streamed with chunked
+    transfer encoding in ``chunk_size`` slices of the original buffer.
+    One instance (and so one connection pool of ``max_connections``) serves
+    every storage caller in the process.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        bucket: str = "beats",
+        chunk_size: int = 1024 * 1024,
+        chunked_threshold: int = 5 * 1024 * 1024,
+        timeout: float = 30.0,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+    ):
+        self.url = url.rstrip("/")
+        self.bucket = bucket
+        self.chunk_size = chunk_size
+        self.chunked_threshold = chunked_threshold
+        import httpx
+
+        self._transport_errors = httpx.TransportError
+        self._client = httpx.Client(
+            base_url=f"{self.url}/storage/v1",
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+            event_hooks=SYNC_SUPABASE_HOOKS,
+        )
+
+    def _chunks(self, view: memoryview) -> Iterator[memoryview]:
+        for offset in range(0, view.nbytes, self.chunk_size):
+            yield view[offset:offset + self.chunk_size]
+
+    @staticmethod
+    def _error(action: str, response) -> StorageError:
+        return StorageError(
+            f"{action} failed with {response.status_code}: {response.text}",
+            retryable=response.status_code in RETRYABLE_STATUSES,
+        )
+
+    def upload(self, path: str, data: Buffer, content_type: str) -> str:
+        view = memoryview(data).cast("B")
+        headers = {"Content-Type": content_type, "x-upsert": "true"}
+        if view.nbytes > self.chunked_threshold:
+            content = self._chunks(view)
+        else:
+            # A single memoryview chunk with an explicit length avoids both a copy and chunked encoding
+            content = iter([view])
+            headers["Content-Length"] = str(view.nbytes)
+        try:
+            response = self._client.post(f"/object/{self.bucket}/{path}", content=content, headers=headers)
+        except self._transport_errors as e:
+            raise StorageError(f"Upload of {path} failed: {e!r}", retryable=True) from e
+        if response.status_code >= 300:
+            raise self._error(f"Upload of {path}", response)
+        return self.public_url(path)
+
+    def download(self, path: str, dest: BinaryIO) -> int:
+        written = 0
+        try:
+            with self._client.stream("GET", f"/object/{self.bucket}/{path}") as response:
+                if response.status_code >= 300:
+                    response.read()
+                    raise self._error(f"Download of {path}", response)
+                for chunk in response.iter_bytes(self.chunk_size):
+                    dest.write(chunk)
+                    written += len(chunk)
+        except self._transport_errors as e:
+            raise StorageError(f"Download of {path} failed: {e!r}", retryable=True) from e
+        return written
+
+    def public_url(self, path: str) -> str:
+        # Format: {SUPABASE_URL}/storage/v1/object/public/{bucket}/{path}
+        return f"{self.url}/storage/v1/object/public/{self.bucket}/{path}"
+
+    def signed_url(self, path: str, expires_in: int) -> str:
+        try:
+            response = self._client.post(f"/object/sign/{self.bucket}/{path}", json={"expiresIn": expires_in})
+        except self._transport_errors as e:
+            raise StorageError(f"Signing {path} failed: {e!r}", retryable=True) from e
+        if response.status_code >= 300:
+            raise self._error(f"Signing {path}", response)
+        # signedURL is relative to the storage API: /object/sign/{bucket}/{path}?token=...
+        return f"{self.url}/storage/v1{response.json()['signedURL']}"
+
+
+class LocalFileStorage(StorageBackend):
+    """Stores objects under a local directory (development and offline runs)."""
+
+    def __init__(self, root: str, base_url: Optional[str] = None):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip("/") if base_url else None
+
+    def upload(self, path: str, data: Buffer, content_type: str) -> str:
+        target = self.root / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(data)
+        return self.public_url(path)
+
+    def download(self, path: str, dest: BinaryIO) -> int:
+        try:
+            with open(self.root / path, "rb") as f:
+                before = dest.tell()
+                shutil.copyfileobj(f, dest)
+                return dest.tell() - before
+        except FileNotFoundError:
+            raise StorageError(f"Object {path} not found")
+
+    def public_url(self, path: str) -> str:
+        if self.base_url:
+            return f"{self.base_url}/{path}"
+        return (self.root / path).resolve().as_uri()
+
+    def object_path(self, url: str) -> Optional[str]:
+        prefix = f"{self.base_url}/" if self.base_url else self.root.resolve().as_uri() + "/"
+        if not url.startswith(prefix):
+            return None
+        return url[len(prefix):] or None
+
+    def signed_url(self, path: str, expires_in: int) -> str:
+        # Local files are served by whatever fronts the directory; expiry is not enforced here
+        return self.public_url(path)
+
+
+class InMemoryStorage(StorageBackend):
+    """Keeps objects in a dict; for tests and benchmarks."""
+
+    def __init__(self, bucket: str = "beats"):
+        self.bucket = bucket
+        self.objects: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def upload(self, path: str, data: Buffer, content_type: str) -> str:
+        with self._lock:
+            self.objects[path] = bytes(data)
+        return self.public_url(path)
+
+    def download(self, path: str, dest: BinaryIO) -> int:
+        data = self.objects.get(path)
+        if data is None:
+            raise StorageError(f"Object {path} not found")
+        dest.write(data)
+        return len(data)
+
+    def public_url(self, path: str) -> str:
+        return f"memory://{self.bucket}/{path}"
+
+    def signed_url(self, path: str, expires_in: int) -> str:
+        if path not in self.objects:
+            raise StorageError(f"Object {path} not found")
+        return f"{self.public_url(path)}?expires={int(time.time()) + expires_in}"
+
+
+class CircuitBreaker:
+    """Stops calls to a failing service for ``cooldown`` seconds after ``threshold`` consecutive failures.
+
+    Once the cooldown has passed a single trial call is let through: if it
+    succeeds the breaker closes, if it fails the breaker stays open for
+    another cooldown. Thread-safe; storage calls run in worker threads.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def before_call(self) -> None:
+        """Raise ``StorageUnavailableError`` unless a call may go through now."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0:
+                raise StorageUnavailableError(remaining)
+            if self._trial:
+                # Another caller's trial call is deciding; check back after it
+                raise StorageUnavailableError(min(self.cooldown, 1.0))
+            self._trial = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._trial = False
+            if self.opened_at is not None:
+                self.opened_at = None
+                STORAGE_BREAKER_OPEN.set(0)
+                logger.info("Storage circuit breaker closed")
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                self._trial = False
+                STORAGE_BREAKER_OPEN.set(1)
+                logger.warning(
+                    "Storage circuit breaker open for %gs after %d consecutive failures", self.cooldown, self.failures
+                )
+
+
+class ResilientStorage(StorageBackend):
+    """Retries transient failures of ``backend`` and fails fast while its breaker is open.
+
+    A call that fails with a retryable ``StorageError`` is tried up to
+    ``max_attempts`` times, sleeping ``base_delay * 2**n`` seconds (capped
+    at ``max_delay``, with jitter) in between; storage calls already run
+    off the event loop. Every failed attempt counts towards the breaker; a
+    non-retryable error (e.g. a missing object) means storage answered and
+    counts as a success. Downloads are only retried into seekable files,
+    which are rewound first.
+    """
+
+    def __init__(
+        self,
+        backend: StorageBackend,
+        max_attempts: int = 4,
+        base_delay: float = 0.2,
+        max_delay: float = 5.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.backend = backend
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+
+    def retry_delay(self, attempt: int) -> float:
+        """Seconds to wait after failed attempt number ``attempt``."""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _call(
+        self,
+        operation: str,
+        fn: Callable[[], T],
+        max_attempts: Optional[int] = None,
+        rewind: Optional[Callable[[], None]] = None,
+    ) -> T:
+        max_attempts = max_attempts or self.max_attempts
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.breaker.before_call()
+            except StorageUnavailableError:
+                STORAGE_CALLS.inc(operation=operation, outcome="rejected")
+                raise
+            try:
+                result = fn()
+            except StorageError as e:
+                if not e.retryable:
+                    self.breaker.record_success()
+                    STORAGE_CALLS.inc(operation=operation, outcome="failed")
+                    raise
+                self.breaker.record_failure()
+                if attempt >= max_attempts:
+                    STORAGE_CALLS.inc(operation=operation, outcome="failed")
+                    raise
+                STORAGE_CALLS.inc(operation=operation, outcome="retried")
+                delay = self.retry_delay(attempt)
+                logger.warning("Storage %s failed on attempt %d, retrying in %.2fs: %s", operation, attempt, delay, e)
+                time.sleep(delay)
+                if rewind is not None:
+                    rewind()
+                continue
+            except Exception:
+                # Not an answer from storage (e.g. a bad argument); release a trial call all the same
+                self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            STORAGE_CALLS.inc(operation=operation, outcome="ok")
+            return result
+
+    def upload(self, path: str, data: Buffer, content_type: str) -> str:
+        return self._call("upload", lambda: self.backend.upload(path, data, content_type))
+
+    def download(self, path: str, dest: BinaryIO) -> int:
+        if not dest.seekable():
+            return self._call("download", lambda: self.backend.download(path, dest), max_attempts=1)
+        start = dest.tell()
+
+        def rewind() -> None:
+            dest.seek(start)
+            dest.truncate()
+
+        return self._call("download", lambda: self.backend.download(path, dest), rewind=rewind)
+
+    def public_url(self, path: str) -> str:
+        return self.backend.public_url(path)
+
+    def signed_url(self, path: str, expires_in: int) -> str:
+        return self._call("sign", lambda: self.backend.signed_url(path, expires_in))
+
+    def object_path(self, url: str) -> Optional[str]:
+        return self.backend.object_path(url)
+
+
+def _create_backend(backend: str, private: bool) -> StorageBackend:
+    settings = get_settings()
+    bucket = settings.storage_private_bucket if private else settings.storage_bucket
+    if backend == "local":
+        if private:
+            # Never under the (possibly served) public directory
+            return LocalFileStorage(settings.local_private_storage_dir)
+        return LocalFileStorage(settings.local_storage_dir, settings.local_storage_base_url)
+    if backend == "memory":
+        return InMemoryStorage(bucket)
+    if backend != "supabase":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    url, key = settings.require("supabase_url", "supabase_service_role_key")
+    return SupabaseStorage(
+        url,
+        key,
+        bucket=bucket,
+        chunk_size=settings.storage_chunk_size,
+        chunked_threshold=settings.storage_chunked_threshold,
+        timeout=max(settings.supabase_timeout_seconds, 30.0),
+        max_connections=settings.storage_pool_max_connections,
+        max_keepalive=settings.storage_pool_max_keepalive,
+    )
+
+
+def create_storage(backend: Optional[str] = None, private: bool = False) -> StorageBackend:
+    """Create the storage backend selected by STORAGE_BACKEND, with retries and a circuit breaker.
+
+    ``private`` selects the private bucket instead of the public one.
+    """
+    settings = get_settings()
+    return ResilientStorage(
+        _create_backend(backend or settings.storage_backend, private),
+        max_attempts=settings.storage_max_attempts,
+        base_delay=settings.storage_retry_base_seconds,
+        max_delay=settings.storage_retry_max_seconds,
+        breaker=CircuitBreaker(settings.storage_breaker_threshold, settings.storage_breaker_cooldown_seconds),
+    )
+
+
+class LazyStorage(StorageBackend):
+    """Creates the configured backend on first use."""
+
+    def __init__(self, private: bool = False) -> None:
+        self.private = private
+        self._backend: Optional[StorageBackend] = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self) -> StorageBackend:
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = create_storage(private=self.private)
+        return self._backend
+
+    def upload(self, path: str, data: Buffer, content_type: str) -> str:
+        return self.backend.upload(path, data, content_type)
+
+    def download(self, path: str, dest: BinaryIO) -> int:
+        return self.backend.download(path, dest)
+
+    def public_url(self, path: str) -> str:
+        return self.backend.public_url(path)
+
+    def signed_url(self, path: str, expires_in: int) -> str:
+        return self.backend.signed_url(path, expires_in)
+
+    def object_path(self, url: str) -> Optional[str]:
+        return self.backend.object_path(url)
+
+
+# Shared storage backend for public files (previews, waveforms)
+storage: StorageBackend = LazyStorage()
+# Paid files (license PDFs), only reachable through signed URLs
+private_storage: StorageBackend = LazyStorage(private=True)
+
+
+def locate(reference: str) -> Optional[Tuple[StorageBackend, str]]:
+    """The storage holding a stored file reference and the object's path in it.
+
+    A reference is an object path in the private bucket (license PDFs) or a
+    URL of either bucket (beat audio, licenses stored before the private
+    bucket existed). ``None`` for URLs outside our storage.
+    """
+    if "://" not in reference:
+        return private_storage, reference
+    for backend in (private_storage, storage):
+        path = backend.object_path(reference)
+        if path is not None:
+            return backend, path
+    return None
@@ -0,0 +1,117 @@
+"""Replay Stripe events that were recorded but never processed.
+
+Events stay unprocessed in webhook_events when fulfillment hit a transient
+failure (database or network error). Replaying is safe: fulfill_checkout
+skips events that were already fulfilled. Each failure pushes the event's
+``next_attempt_at`` back (exponential backoff) and events that keep failing,
+or fail in a way retrying cannot fix, are given up on, so they do not
+crowd out newer events.
+
+CLI:
+    python -m backend.services.webhook_replay --limit 500 --concurrency 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from backend.database import db, is_transient_error
+from backend.logs import log_context
+from backend.stripe_webhook import _mark_event, handle_stripe_event
+
+logger = logging.getLogger(__name__)
+
+
+async def replay_unprocessed_events(
+    limit: Optional[int] = None,
+    concurrency: int = 4,
+    batch_size: int = 100,
+    min_age_seconds: float = 0,
+) -> Dict[str, int]:
+    """Re-run fulfillment for unprocessed Stripe events that are due for a retry, oldest first.
+
+    ``min_age_seconds`` skips recent events that a worker may still be
+    processing (replaying them is safe, just wasted work).
+    """
+    summary = {"replayed": 0, "succeeded": 0, "failed": 0}
+    slots = asyncio.Semaphore(concurrency)
+    cursor = None
+
+    async def replay(row: Dict) -> bool:
+        event = row["payload"]
+        if isinstance(event, str):
+            event = json.loads(event)
+        async with slots, log_context(stripe_event_id=event["id"]):
+            try:
+                await handle_stripe_event(event)
+                return True
+            except Exception as e:
+                logger.error("Replay of event %s failed: %s", event["id"], e)
+                try:
+                    await _mark_event(event["id"], processed=False, error=str(e), retryable=is_transient_error(e))
+                except Exception as mark_error:
+                    logger.error("Failed to record replay error for event %s: %s", event["id"], mark_error)
+                return False
+
+    # Events that fail during this run are rescheduled past it
+    now = datetime.now(timezone.utc).isoformat()
+    while limit is None or summary["replayed"] < limit:
+        page_size = batch_size if limit is None else min(batch_size, limit - summary["replayed"])
+        query = (
+            db.table("webhook_events")
+            .select("id, stripe_event_id, payload, created_at")
+            .eq("source", "stripe")
+            .eq("processed", False)
+            .lte("next_attempt_at", now)
+        )
+        if min_age_seconds:
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=min_age_seconds)
+            query = query.lt("created_at", cutoff.isoformat())
+        if cursor:
+            # Keyset seek past the previous page so events that fail again are not retried in a loop
+            query = query.or_(
+                f'created_at.gt."{cursor[0]}",and(created_at.eq."{cursor[0]}",id.gt."{cursor[1]}")'
+            )
+        result = await query.order("created_at").order("id").limit(page_size).execute()
+        rows = [row for row in result.data or [] if row.get("stripe_event_id")]
+        if not result.data:
+            break
+        cursor = (result.data[-1]["created_at"], result.data[-1]["id"])
+
+        outcomes = await asyncio.gather(*(replay(row) for row in rows))
+        summary["replayed"] += len(outcomes)
+        summary["succeeded"] += sum(outcomes)
+        summary["failed"] += len(outcomes) - sum(outcomes)
+        logger.info("Replayed %d events (%d failed)", summary["replayed"], summary["failed"])
+        if len(result.data) < page_size:
+            break
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=None, help="maximum events to replay")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    async def run() -> Dict[str, int]:
+        from backend.services.license_jobs import job_queue
+
+        # Workers render the licenses queued by replayed events
+        await job_queue.start()
+        try:
+            return await replay_unprocessed_events(args.limit, args.concurrency, args.batch_size)
+        finally:
+            await job_queue.stop()
+            await db.aclose()
+
+    print(json.dumps(asyncio.run(run()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,35 @@
-"""Stripe webhook handler for checkout.session.completed events."""
+"""Stripe webhook handler for checkout.session.completed and checkout.session.expired events."""
+import asyncio
+import json
 import logging
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
 
-import stripe
 from fastapi import APIRouter, Request, Header
 from fastapi.responses import Response
 
-from backend.config import STRIPE_SECRET_KEY, STRIPE_WEBHOOK_SECRET, PRODUCER_NAME, LICENSOR_LEGAL_NAME
-from backend.database import supabase
-from backend.services.license_generator import generate_license_pdf
-
-# Initialize Stripe
-stripe.api_key = STRIPE_SECRET_KEY
+from backend.config import get_settings
+from backend.database import db, is_transient_error
+from backend.logs import bind_log_context, log_context
+from backend.metrics import Counter, collect_timings, registry, span
+from backend.services.beat_cache import invalidate_beats
+from backend.services.cache import LRUSet
+from backend.services.checkout_items import (
+    EXCLUSIVE_LICENSE_TYPE,
+    CheckoutItem,
+    CheckoutItemsError,
+    resolve_checkout_items,
+)
+from backend.services.license_jobs import enqueue_license_renders, render_payload
+from backend.services.reservations import (
+    RESERVATIONS,
+    expire_checkout_session,
+    invalidate_availability,
+    refund_checkout_payment,
+    release,
+)
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -20,177 +37,375 @@ logger = logging.getLogger(__name__)
 # Create router
 router = APIRouter(prefix="/webhooks", tags=["webhooks"])
 
+WEBHOOK_FAILURES = registry.register(Counter(
+    "beatstore_webhook_event_failures_total",
+    "Failed Stripe event processing attempts by outcome (retry: queued for the replay sweep, dead: given up).",
+    labels=("outcome",),
+))
 
-@router.post("/stripe")
-async def stripe_webhook(
-    request: Request,
-    stripe_signature: str = Header(..., alias="stripe-signature"),
-) -> Response:
+@lru_cache(maxsize=None)
+def _processed_events() -> LRUSet:
+    """Recently processed Stripe event IDs: replays are answered without a database round trip.
+
+    Created on first use so importing this module does not load the settings.
     """
-    Handle Stripe webhook events.
+    return LRUSet(get_settings().webhook_dedup_cache_size)
+
+
+@lru_cache(maxsize=None)
+def get_stripe() -> Any:
+    """Import and initialize the Stripe SDK on first use.
+
+    Importing ``stripe`` takes most of a second, so it is kept off the import
+    path; the app lifespan warms it in a background thread after startup.
+    """
+    import stripe
+
+    stripe.api_key = get_settings().stripe_secret_key
+    return stripe
+
+
+async def _fulfill_checkout(
+    checkout_id: str,
+    total_cents: int,
+    items: List[CheckoutItem],
+    user_id: Optional[uuid.UUID] = None,
+    customer_name: Optional[str] = None,
+    customer_email: Optional[str] = None,
+    event_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Fulfill a checkout with the fulfill_checkout_items Postgres function.
+    
+    One RPC round trip reads the beats, inserts the order and then every
+    order_item and license in one multi-row insert each, and deactivates
+    exclusively licensed beats in a single transaction, so a crash can
+    never leave a partial order behind. When ``event_id`` is given, the
+    webhook_events row is locked and marked processed in the same
+    transaction, so each Stripe event is fulfilled exactly once.
     
-    Only processes checkout.session.completed events.
-    Creates order, order_item, and license records.
-    Deactivates beat if license_type is 'exclusive'.
+    Exclusive licenses are sold once: if one of the beats was already sold
+    exclusively nothing is written and {"sold_out": [beat ids]} is returned.
+    Otherwise each exclusive beat's hold is converted to the new order.
+    
+    Returns:
+        Dict with order_id, items (order_item_id, license_id, beat_id,
+        license_type, price_cents, beat_title, producer_name and
+        licensor_legal_name per item, in input order) and preempted (checkout
+        ids whose holds on the same beats this sale overrode), or
+        {"duplicate": true} if the event was already fulfilled
     """
-    payload = await request.body()
+    result = await db.rpc("fulfill_checkout_items", {
+        "p_stripe_checkout_id": checkout_id,
+        "p_total_cents": total_cents,
+        "p_items": [item.to_dict() for item in items],
+        "p_user_id": str(user_id) if user_id else None,
+        "p_customer_name": customer_name,
+        "p_customer_email": customer_email,
+        "p_stripe_event_id": event_id,
+    }).execute()
+    if not result.data:
+        raise RuntimeError(f"fulfill_checkout_items returned no data for checkout {checkout_id}")
+    return result.data
+
+
+async def _record_event(event: Dict[str, Any]) -> bool:
+    """
+    Persist a verified Stripe event in webhook_events.
     
+    Returns:
+        False if the event ID was already recorded (a redelivery)
+    """
+    result = await db.table("webhook_events").upsert(
+        {
+            "source": "stripe",
+            "event_type": event["type"],
+            "payload": event,
+            "stripe_event_id": event["id"],
+            "processed": False,
+        },
+        on_conflict="stripe_event_id",
+        ignore_duplicates=True,
+    ).execute()
+    return bool(result.data)
+
+
+async def _is_event_processed(event_id: str) -> bool:
+    result = await db.table("webhook_events").select("processed").eq("stripe_event_id", event_id).execute()
+    return bool(result.data and result.data[0].get("processed"))
+
+
+def _retry_delay(attempts: int) -> float:
+    """Seconds before the replay sweep retries an event that has failed ``attempts`` times."""
+    settings = get_settings()
+    return min(settings.webhook_retry_max_seconds, settings.webhook_retry_base_seconds * (2 ** max(attempts - 1, 0)))
+
+
+async def _mark_event(
+    event_id: str, processed: bool = True, error: Optional[str] = None, retryable: bool = True
+) -> None:
+    """Record the outcome of processing an event on its webhook_events row.
+
+    A failure (``processed=False``) counts an attempt and schedules the next
+    one for the replay sweep with exponential backoff. After
+    ``WEBHOOK_RETRY_MAX_ATTEMPTS``, or at once if the error is not
+    ``retryable``, the event is given up on: marked processed with its
+    error, so it no longer holds up the sweep.
+    """
+    update: Dict[str, Any] = {"processed": processed, "error": error}
+    if not processed:
+        result = await db.table("webhook_events").select("attempts").eq("stripe_event_id", event_id).execute()
+        # Read-then-write: two concurrent failures may count as one, which only delays giving up
+        attempts = (result.data[0].get("attempts") or 0) + 1 if result.data else 1
+        update["attempts"] = attempts
+        if not retryable or attempts >= get_settings().webhook_retry_max_attempts:
+            WEBHOOK_FAILURES.inc(outcome="dead")
+            reason = "not retryable" if not retryable else f"gave up after {attempts} attempts"
+            update.update(processed=True, error=f"{error} ({reason})")
+            logger.error("Stripe event %s failed permanently (%s): %s", event_id, reason, error, extra={"attempts": attempts})
+        else:
+            WEBHOOK_FAILURES.inc(outcome="retry")
+            retry_at = datetime.now(timezone.utc) + timedelta(seconds=_retry_delay(attempts))
+            update["next_attempt_at"] = retry_at.isoformat()
+    update["processed_at"] = datetime.now().isoformat() if update["processed"] else None
+    await db.table("webhook_events").update(update).eq("stripe_event_id", event_id).execute()
+
+
+async def _refund_sold_out(event_id: str, session: Dict[str, Any], beat_ids: List[str]) -> None:
+    """Refund a checkout whose exclusive license was sold to someone else.
+
+    The outcome is kept on the event's webhook_events row. A transient
+    Stripe failure leaves the event unprocessed so the replay sweep
+    retries the refund; a refund Stripe rejects is left for an operator.
+    """
+    checkout_id = session.get("id")
+    sold = f"Exclusive license already sold for beat(s) {', '.join(beat_ids)}"
+    payment_intent = session.get("payment_intent")
+    if not payment_intent:
+        RESERVATIONS.inc(outcome="refund_failed")
+        error = f"{sold}; checkout {checkout_id} has no payment to refund, refund it manually"
+        logger.error("%s", error)
+        await _mark_event(event_id, error=error)
+        return
+    stripe = get_stripe()
     try:
-        # Verify webhook signature
-        event = stripe.Webhook.construct_event(
-            payload, stripe_signature, STRIPE_WEBHOOK_SECRET
+        refund_id = await asyncio.to_thread(refund_checkout_payment, payment_intent, checkout_id)
+    except stripe.error.InvalidRequestError as e:
+        RESERVATIONS.inc(outcome="refund_failed")
+        error = f"{sold}; refunding checkout {checkout_id} failed, refund it manually: {e}"
+        logger.error("%s", error)
+        await _mark_event(event_id, error=error)
+        return
+    except Exception as e:
+        RESERVATIONS.inc(outcome="refund_failed")
+        error = f"{sold}; refunding checkout {checkout_id} failed, will retry: {e}"
+        logger.error("%s", error)
+        await _mark_event(event_id, processed=False, error=error)
+        return
+    RESERVATIONS.inc(outcome="refunded")
+    error = f"{sold}; refunded checkout {checkout_id} ({refund_id})"
+    logger.warning("%s", error, extra={"refund_id": refund_id})
+    await _mark_event(event_id, error=error)
+
+
+async def handle_stripe_event(event: Dict[str, Any]) -> None:
+    """
+    Fulfill a verified, recorded Stripe event.
+    
+    Events that can never succeed (unhandled type, bad metadata) are marked
+    processed with an error. Transient failures raise and leave the event
+    unprocessed so it can be replayed. Records logged meanwhile carry the
+    event id and, once known, the checkout, beat and order ids.
+    """
+    with log_context(stripe_event_id=event["id"], event_type=event["type"]):
+        await _handle_event(event)
+
+
+async def _handle_event(event: Dict[str, Any]) -> None:
+    event_id = event["id"]
+    
+    # An abandoned checkout gives up its exclusive-license holds
+    if event["type"] == "checkout.session.expired":
+        session = event["data"]["object"]
+        bind_log_context(checkout_id=session.get("id"))
+        released = await release(
+            checkout_id=session.get("id"), token=(session.get("metadata") or {}).get("hold_token")
         )
-    except ValueError as e:
-        logger.error(f"Invalid payload: {e}")
-        return Response(status_code=400)
-    except stripe.error.SignatureVerificationError as e:
-        logger.error(f"Invalid signature: {e}")
-        return Response(status_code=400)
-    
-    # Only handle checkout.session.completed events
+        if released:
+            logger.info("Released %d hold(s) of expired checkout %s", released, session.get("id"))
+        await _mark_event(event_id)
+        return
+    
+    # Otherwise only handle checkout.session.completed events
     if event["type"] != "checkout.session.completed":
-        logger.info(f"Ignoring event type: {event['type']}")
-        return Response(status_code=200)
+        logger.info("Ignoring event type: %s", event["type"])
+        await _mark_event(event_id)
+        return
+    
+    session = event["data"]["object"]
+    metadata = session.get("metadata") or {}
+    bind_log_context(checkout_id=session.get("id"))
     
+    # One session may sell several beats; fail fast if they cannot be determined
     try:
-        session = event["data"]["object"]
-        metadata = session.get("metadata", {})
-        
-        # Fail fast if required metadata is missing
-        beat_id_str = metadata.get("beat_id")
-        license_type = metadata.get("license_type")
-        
-        if not beat_id_str:
-            logger.error("Missing required metadata: beat_id")
-            return Response(status_code=200)  # Return 200 to prevent Stripe retries
-        
-        if not license_type:
-            logger.error("Missing required metadata: license_type")
-            return Response(status_code=200)
-        
-        # Parse beat_id
+        items = await resolve_checkout_items(session)
+    except CheckoutItemsError as e:
+        logger.error("%s", e)
+        await _mark_event(event_id, error=str(e))
+        return
+    beat_ids = list(dict.fromkeys(str(item.beat_id) for item in items))
+    if len(beat_ids) == 1:
+        bind_log_context(beat_id=beat_ids[0])
+    else:
+        bind_log_context(beat_ids=beat_ids)
+    
+    # Extract user_id from metadata if present (nullable)
+    user_id = None
+    if "user_id" in metadata:
         try:
-            beat_id = uuid.UUID(beat_id_str)
+            user_id = uuid.UUID(metadata["user_id"])
         except ValueError:
-            logger.error(f"Invalid beat_id format: {beat_id_str}")
-            return Response(status_code=200)
-        
-        # Extract user_id from metadata if present (nullable)
-        user_id = None
-        if "user_id" in metadata:
-            try:
-                user_id = uuid.UUID(metadata["user_id"])
-            except ValueError:
-                logger.warning(f"Invalid user_id format: {metadata['user_id']}, proceeding without user_id")
-        
-        # Extract other required fields
-        checkout_id = session.get("id")
-        total_cents = session.get("amount_total", 0)
-        price_cents = total_cents  # For single-item checkout
-        
-        # Extract customer information from Stripe session
-        customer_details = session.get("customer_details", {})
-        customer_name = customer_details.get("name") or customer_details.get("email") or session.get("customer_email") or "Unknown Customer"
-        customer_email = customer_details.get("email") or session.get("customer_email") or "unknown@example.com"
-        
-        # Fetch beat information including producer fields
-        beat_title = "Unknown Beat"
-        beat_producer_name = None
-        beat_licensor_legal_name = None
+            logger.warning("Invalid user_id format: %s, proceeding without user_id", metadata["user_id"])
+    
+    # Extract other required fields
+    checkout_id = session.get("id")
+    total_cents = session.get("amount_total", 0)
+    
+    # Extract customer information from Stripe session
+    customer_details = session.get("customer_details") or {}
+    customer_name = customer_details.get("name") or customer_details.get("email") or session.get("customer_email") or "Unknown Customer"
+    customer_email = customer_details.get("email") or session.get("customer_email") or "unknown@example.com"
+    
+    # Create the order, every order_item and license (and deactivate exclusive beats) atomically
+    # The beat lookups and every insert run inside this one RPC
+    with span("webhook.fulfill_checkout"):
+        fulfillment = await _fulfill_checkout(
+            checkout_id=checkout_id,
+            total_cents=total_cents,
+            items=items,
+            user_id=user_id,
+            customer_name=customer_name,
+            customer_email=customer_email,
+            event_id=event_id,
+        )
+    if fulfillment.get("duplicate"):
+        logger.info("Event %s was already fulfilled, skipping", event_id)
+        return
+    if fulfillment.get("sold_out"):
+        # Paid for an exclusive license someone else already bought; nothing was written
+        RESERVATIONS.inc(outcome="sold_out")
+        await _refund_sold_out(event_id, session, fulfillment["sold_out"])
+        return
+    bind_log_context(order_id=fulfillment["order_id"])
+    
+    purchase_date = datetime.now().isoformat()
+    renders = [
+        render_payload(
+            license_id=item["license_id"],
+            license_type=item["license_type"],
+            order_id=fulfillment["order_id"],
+            customer_name=customer_name,
+            customer_email=customer_email,
+            beat_title=item.get("beat_title"),
+            producer_name=item.get("producer_name"),
+            licensor_legal_name=item.get("licensor_legal_name"),
+            purchase_date=purchase_date,
+        )
+        for item in fulfillment["items"]
+    ]
+    
+    # Render and upload the license PDFs off the request path, all queued in one write
+    try:
+        with span("webhook.enqueue_license_render"):
+            await enqueue_license_renders(renders)
+    except Exception as e:
+        # The order is committed; the maintenance sweep queues these renders later
+        logger.error("Failed to enqueue license renders for order %s: %s", fulfillment["order_id"], e, exc_info=True)
+    
+    exclusive_beat_ids = list(dict.fromkeys(str(item.beat_id) for item in items if item.license_type == EXCLUSIVE_LICENSE_TYPE))
+    if exclusive_beat_ids:
+        invalidate_beats(exclusive_beat_ids)
+        invalidate_availability()
+        RESERVATIONS.inc(len(exclusive_beat_ids), outcome="converted")
+        logger.info("Deactivated beats %s due to exclusive licenses", ", ".join(exclusive_beat_ids))
+    
+    # Checkouts still holding those beats can no longer be fulfilled; close them before they are paid
+    for preempted_id in fulfillment.get("preempted") or []:
         try:
-            beat_result = supabase.table("beats").select("title, producer_name, licensor_legal_name").eq("id", str(beat_id)).single().execute()
-            if beat_result.data:
-                beat_title = beat_result.data.get("title", "Unknown Beat")
-                beat_producer_name = beat_result.data.get("producer_name")
-                beat_licensor_legal_name = beat_result.data.get("licensor_legal_name")
+            await asyncio.to_thread(expire_checkout_session, preempted_id)
+            logger.info("Expired checkout %s: its exclusive beat was sold by checkout %s", preempted_id, checkout_id)
         except Exception as e:
-            logger.warning(f"Failed to fetch beat information for beat_id {beat_id}: {e}")
-        
-        # Database operations
-        # 1. Insert order
-        order_data = {
-            "user_id": str(user_id) if user_id else None,
-            "stripe_checkout_id": checkout_id,
-            "total_cents": total_cents,
-            "status": "completed",
-        }
-        
-        order_result = supabase.table("orders").insert(order_data).execute()
-        if not order_result.data:
-            logger.error("Failed to insert order")
-            return Response(status_code=200)
-        
-        order_id = order_result.data[0]["id"]
-        
-        # Generate license PDF (with error handling - don't crash webhook)
-        # Use beat-specific producer info if available, otherwise fallback to env vars
-        # If neither is available, use placeholder values (shouldn't happen in production)
-        producer_name = beat_producer_name or PRODUCER_NAME or "Producer Name"
-        licensor_legal_name = beat_licensor_legal_name or LICENSOR_LEGAL_NAME or "Licensor Legal Name"
-        
-        license_url = None
+            logger.error("Failed to expire preempted checkout %s: %s", preempted_id, e)
+    
+    logger.info(
+        "Successfully processed checkout %s with %d item(s)", checkout_id, len(items),
+        extra={"item_count": len(items), "total_cents": total_cents},
+    )
+
+
+@router.post("/stripe")
+async def stripe_webhook(
+    request: Request,
+    stripe_signature: str = Header(..., alias="stripe-signature"),
+) -> Response:
+    """
+    Handle Stripe webhook events.
+    
+    Every verified event is recorded in webhook_events, keyed by its Stripe
+    event ID, so redeliveries are acknowledged without creating duplicate
+    orders. checkout.session.completed events are fulfilled: the order
+    and an order_item and license per line item are created, the license
+    PDF renders are queued, and exclusively licensed beats are deactivated.
+    checkout.session.expired events release the session's exclusive-license
+    holds.
+    """
+    payload = await request.body()
+    stripe = get_stripe()
+    
+    # Span durations of this delivery are attached to the records it logs
+    with collect_timings():
         try:
-            license_url = generate_license_pdf(
-                license_type=license_type,
-                order_id=order_id,
-                customer_name=customer_name,
-                customer_email=customer_email,
-                beat_title=beat_title,
-                producer_name=producer_name,
-                licensor_legal_name=licensor_legal_name,
-                purchase_date=datetime.now(),
-            )
-        except Exception as e:
-            logger.error(f"Error generating license PDF: {e}", exc_info=True)
-        
-        # Use placeholder URL if generation failed
-        if not license_url:
-            license_url = f"https://example.com/licenses/{uuid.uuid4()}"
-            logger.warning("License PDF generation failed, using placeholder URL")
-        
-        # 2. Insert order_item
-        order_item_data = {
-            "order_id": order_id,
-            "beat_id": str(beat_id),
-            "license_type": license_type,
-            "price_cents": price_cents,
-        }
-        
-        order_item_result = supabase.table("order_items").insert(order_item_data).execute()
-        if not order_item_result.data:
-            logger.error("Failed to insert order_item")
-            return Response(status_code=200)
-        
-        order_item_id = order_item_result.data[0]["id"]
+            # Verify webhook signature
+            with span("webhook.verify_signature"):
+                stripe.WebhookSignature.verify_header(
+                    payload.decode("utf-8"), stripe_signature, get_settings().stripe_webhook_secret
+                )
+                event = json.loads(payload)
+        except ValueError as e:
+            logger.error("Invalid payload: %s", e)
+            return Response(status_code=400)
+        except stripe.error.SignatureVerificationError as e:
+            logger.error("Invalid signature: %s", e)
+            return Response(status_code=400)
         
-        # 3. Insert license
-        license_data = {
-            "order_item_id": order_item_id,
-            "user_id": str(user_id) if user_id else None,
-            "beat_id": str(beat_id),
-            "license_type": license_type,
-            "license_url": license_url,
-        }
+        event_id = event.get("id")
+        if not event_id or "type" not in event:
+            logger.error("Invalid payload: missing event id or type")
+            return Response(status_code=400)
         
-        license_result = supabase.table("licenses").insert(license_data).execute()
-        if not license_result.data:
-            logger.error("Failed to insert license")
+        # Fast path: a redelivery of an event this process already handled
+        if event_id in _processed_events():
             return Response(status_code=200)
         
-        # 4. If license_type is 'premium_trackout_exclusive', deactivate the beat
-        if license_type == "premium_trackout_exclusive":
+        with log_context(stripe_event_id=event_id, event_type=event["type"]):
             try:
-                supabase.table("beats").update({"is_active": False}).eq("id", str(beat_id)).execute()
-                logger.info(f"Deactivated beat {beat_id} due to exclusive license")
+                with span("webhook.record_event"):
+                    is_new = await _record_event(event)
+                if not is_new and await _is_event_processed(event_id):
+                    logger.info("Duplicate event %s already processed", event_id)
+                    _processed_events().add(event_id)
+                    return Response(status_code=200)
+                
+                await handle_stripe_event(event)
+                _processed_events().add(event_id)
+                return Response(status_code=200)
+                
             except Exception as e:
-                logger.error(f"Failed to deactivate beat {beat_id}: {e}")
-                # Continue - license was created successfully
-        
-        logger.info(f"Successfully processed checkout for beat {beat_id}, license_type {license_type}")
-        return Response(status_code=200)
-        
-    except Exception as e:
-        # Log error but return 200 to prevent Stripe retries
-        logger.error(f"Error processing webhook: {e}", exc_info=True)
-        return Response(status_code=200)
-
+                # Log error but return 200 to prevent Stripe retries; the event stays
+                # unprocessed in webhook_events for the replay tool
+                logger.error("Error processing webhook: %s", e, exc_info=True)
+                try:
+                    await _mark_event(event_id, processed=False, error=str(e), retryable=is_transient_error(e))
+                except Exception as mark_error:
+                    logger.error("Failed to record webhook error for event %s: %s", event_id, mark_error)
+                return Response(status_code=200)
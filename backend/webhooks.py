@@ -1,6 +1,7 @@
 """Webhook events API endpoints."""
-from fastapi import APIRouter, HTTPException
-from backend.database import supabase
+from fastapi import APIRouter, HTTPException, Query
+from backend.database import db
+from backend.services.webhook_replay import replay_unprocessed_events
 
 router = APIRouter(prefix="/api/webhooks", tags=["webhooks"])
 
@@ -9,15 +10,21 @@ router = APIRouter(prefix="/api/webhooks", tags=["webhooks"])
 async def list_webhook_events():
     """Get all webhook events - Admin only."""
     try:
-        result = supabase.table("webhook_events").select("*").order("created_at", desc=True).limit(100).execute()
+        result = await db.table("webhook_events").select("*").order("created_at", desc=True).limit(100).execute()
         
         return {"success": True, "data": result.data or []}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching webhook events: {str(e)}")
 
 
-
-
-
-
-
+@router.post("/replay")
+async def replay_webhook_events(
+    limit: int = Query(100, ge=1, le=1000),
+    concurrency: int = Query(4, ge=1, le=32),
+):
+    """Reprocess unprocessed Stripe events - Admin only."""
+    try:
+        summary = await replay_unprocessed_events(limit=limit, concurrency=concurrency)
+        return {"success": True, "data": summary}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error replaying webhook events: {str(e)}")
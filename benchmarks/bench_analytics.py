@@ -0,0 +1,191 @@
+"""Sales analytics benchmark: ad-hoc aggregation vs incrementally maintained rollups.
+
+Seeds an SQLite database with the orders / order_items shape and the rollup
+tables and trigger of the sales rollups migration (translated to SQLite), up
+to ``--orders`` orders spread over ``--days`` days. At a few checkpoints it
+times the dashboard queries both ways:
+
+* ad-hoc - GROUP BY over the full order_items/orders join (what the dashboard
+  effectively did client-side from the unbounded order listing)
+* rollup - the same answers read from the sales_beat_totals, sales_daily_rollup
+  and sales_daily_totals tables
+
+and checks both return identical results. Rollup latency should stay flat as
+history grows; ad-hoc latency grows linearly. Also reports insert throughput
+with the rollup triggers enabled, i.e. the write-side cost.
+
+Exits non-zero on a result mismatch or if the median rollup query at the
+largest checkpoint exceeds ``--budget-ms``.
+
+Usage:
+    python -m benchmarks.bench_analytics --orders 1000000 --budget-ms 20
+"""
+import argparse
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+LICENSE_PRICES = {"mp3_non_exclusive": 2999, "wav_non_exclusive": 4999, "premium_trackout_exclusive": 29999}
+
+SCHEMA = """
+CREATE TABLE beats (id TEXT PRIMARY KEY, title TEXT NOT NULL);
+CREATE TABLE orders (id INTEGER PRIMARY KEY, created_at TEXT NOT NULL, status TEXT NOT NULL);
+CREATE TABLE order_items (
+    id INTEGER PRIMARY KEY, order_id INTEGER NOT NULL, beat_id TEXT NOT NULL,
+    license_type TEXT NOT NULL, price_cents INTEGER NOT NULL
+);
+CREATE INDEX idx_order_items_order_id ON order_items(order_id);
+
+CREATE TABLE sales_daily_rollup (
+    day TEXT NOT NULL, beat_id TEXT NOT NULL, license_type TEXT NOT NULL,
+    items_count INTEGER NOT NULL DEFAULT 0, revenue_cents INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, beat_id, license_type)
+);
+CREATE TABLE sales_daily_totals (
+    day TEXT PRIMARY KEY, items_count INTEGER NOT NULL DEFAULT 0, revenue_cents INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE sales_beat_totals (
+    beat_id TEXT NOT NULL, license_type TEXT NOT NULL,
+    items_count INTEGER NOT NULL DEFAULT 0, revenue_cents INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (beat_id, license_type)
+);
+CREATE INDEX idx_sales_beat_totals_revenue ON sales_beat_totals(revenue_cents DESC);
+
+CREATE TRIGGER trg_sales_rollup_order_item AFTER INSERT ON order_items
+WHEN (SELECT status FROM orders WHERE id = NEW.order_id) = 'completed'
+BEGIN
+    INSERT INTO sales_daily_rollup (day, beat_id, license_type, items_count, revenue_cents)
+    VALUES ((SELECT substr(created_at, 1, 10) FROM orders WHERE id = NEW.order_id),
+            NEW.beat_id, NEW.license_type, 1, NEW.price_cents)
+    ON CONFLICT (day, beat_id, license_type) DO UPDATE
+    SET items_count = items_count + excluded.items_count, revenue_cents = revenue_cents + excluded.revenue_cents;
+    INSERT INTO sales_daily_totals (day, items_count, revenue_cents)
+    VALUES ((SELECT substr(created_at, 1, 10) FROM orders WHERE id = NEW.order_id), 1, NEW.price_cents)
+    ON CONFLICT (day) DO UPDATE
+    SET items_count = items_count + excluded.items_count, revenue_cents = revenue_cents + excluded.revenue_cents;
+    INSERT INTO sales_beat_totals (beat_id, license_type, items_count, revenue_cents)
+    VALUES (NEW.beat_id, NEW.license_type, 1, NEW.price_cents)
+    ON CONFLICT (beat_id, license_type) DO UPDATE
+    SET items_count = items_count + excluded.items_count, revenue_cents = revenue_cents + excluded.revenue_cents;
+END;
+"""
+
+# name -> (ad-hoc query, rollup query); {since} is the start of the 30-day window
+QUERIES = {
+    "top beats (all time)": (
+        """SELECT oi.beat_id, b.title, COUNT(*), SUM(oi.price_cents) AS revenue
+           FROM order_items oi JOIN orders o ON o.id = oi.order_id JOIN beats b ON b.id = oi.beat_id
+           WHERE o.status = 'completed' GROUP BY oi.beat_id ORDER BY revenue DESC, oi.beat_id LIMIT 10""",
+        """SELECT t.beat_id, b.title, SUM(t.items_count), SUM(t.revenue_cents) AS revenue
+           FROM sales_beat_totals t JOIN beats b ON b.id = t.beat_id
+           GROUP BY t.beat_id ORDER BY revenue DESC, t.beat_id LIMIT 10""",
+    ),
+    "top beats (last 30 days)": (
+        """SELECT oi.beat_id, b.title, COUNT(*), SUM(oi.price_cents) AS revenue
+           FROM order_items oi JOIN orders o ON o.id = oi.order_id JOIN beats b ON b.id = oi.beat_id
+           WHERE o.status = 'completed' AND o.created_at >= '{since}'
+           GROUP BY oi.beat_id ORDER BY revenue DESC, oi.beat_id LIMIT 10""",
+        """SELECT r.beat_id, b.title, SUM(r.items_count), SUM(r.revenue_cents) AS revenue
+           FROM sales_daily_rollup r JOIN beats b ON b.id = r.beat_id
+           WHERE r.day >= '{since}' GROUP BY r.beat_id ORDER BY revenue DESC, r.beat_id LIMIT 10""",
+    ),
+    "revenue by license type": (
+        """SELECT oi.license_type, COUNT(*), SUM(oi.price_cents) FROM order_items oi
+           JOIN orders o ON o.id = oi.order_id WHERE o.status = 'completed'
+           GROUP BY oi.license_type ORDER BY oi.license_type""",
+        """SELECT license_type, SUM(items_count), SUM(revenue_cents) FROM sales_beat_totals
+           GROUP BY license_type ORDER BY license_type""",
+    ),
+    "monthly time series": (
+        """SELECT substr(o.created_at, 1, 7), COUNT(*), SUM(oi.price_cents) FROM order_items oi
+           JOIN orders o ON o.id = oi.order_id WHERE o.status = 'completed' GROUP BY 1 ORDER BY 1""",
+        """SELECT substr(day, 1, 7), SUM(items_count), SUM(revenue_cents) FROM sales_daily_totals
+           GROUP BY 1 ORDER BY 1""",
+    ),
+}
+
+
+def seed(conn: sqlite3.Connection, start: int, stop: int, beats: List[str], first_day: date, days: int, rng: random.Random) -> float:
+    """Insert orders ``start..stop`` (one item each) and return the elapsed seconds."""
+    license_types = list(LICENSE_PRICES)
+    began = time.perf_counter()
+    for batch_start in range(start, stop, 10000):
+        batch = range(batch_start, min(batch_start + 10000, stop))
+        orders, items = [], []
+        for order_id in batch:
+            day = first_day + timedelta(days=rng.randrange(days))
+            status = "completed" if rng.random() > 0.02 else "failed"
+            orders.append((order_id, f"{day.isoformat()}T{rng.randrange(24):02d}:00:00", status))
+            license_type = rng.choices(license_types, weights=(70, 25, 5))[0]
+            # Skewed popularity so "top beats" is meaningful
+            beat = beats[min(int(rng.paretovariate(1.2)) - 1, len(beats) - 1)]
+            items.append((order_id, order_id, beat, license_type, LICENSE_PRICES[license_type]))
+        with conn:
+            conn.executemany("INSERT INTO orders VALUES (?, ?, ?)", orders)
+            conn.executemany("INSERT INTO order_items VALUES (?, ?, ?, ?, ?)", items)
+    return time.perf_counter() - began
+
+
+def time_query(conn: sqlite3.Connection, sql: str, runs: int) -> Tuple[float, List[tuple]]:
+    timings = []
+    rows: List[tuple] = []
+    for _ in range(runs):
+        began = time.perf_counter()
+        rows = conn.execute(sql).fetchall()
+        timings.append((time.perf_counter() - began) * 1000)
+    return statistics.median(timings), rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--beats", type=int, default=500)
+    parser.add_argument("--days", type=int, default=3 * 365, help="history length the orders are spread over")
+    parser.add_argument("--checkpoints", type=int, default=3, help="measure at orders/100, orders/10, ... orders")
+    parser.add_argument("--runs", type=int, default=5, help="timed runs per query (median reported)")
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if a rollup query median exceeds this at full size")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(SCHEMA)
+    beats = [f"beat-{i:05d}" for i in range(args.beats)]
+    conn.executemany("INSERT INTO beats VALUES (?, ?)", [(beat, f"Beat {beat}") for beat in beats])
+    first_day = date(2024, 1, 1)
+    since = (first_day + timedelta(days=args.days - 30)).isoformat()
+
+    sizes = sorted({max(1, args.orders // 10 ** power) for power in range(args.checkpoints)})
+    seeded = 0
+    failures = 0
+    final: Dict[str, float] = {}
+    print(f"{'orders':>10}  {'query':<26} {'ad-hoc ms':>10} {'rollup ms':>10} {'speedup':>8}")
+    for size in sizes:
+        elapsed = seed(conn, seeded, size, beats, first_day, args.days, rng)
+        print(f"seeded {size - seeded} orders with rollup triggers at {(size - seeded) / elapsed:,.0f} orders/s")
+        seeded = size
+        for name, (adhoc_sql, rollup_sql) in QUERIES.items():
+            adhoc_ms, adhoc_rows = time_query(conn, adhoc_sql.format(since=since), args.runs)
+            rollup_ms, rollup_rows = time_query(conn, rollup_sql.format(since=since), args.runs)
+            mismatch = adhoc_rows != rollup_rows
+            failures += mismatch
+            final[name] = rollup_ms
+            print(f"{size:>10,}  {name:<26} {adhoc_ms:>10.2f} {rollup_ms:>10.2f} {adhoc_ms / max(rollup_ms, 1e-6):>7.0f}x"
+                  + ("  MISMATCH" if mismatch else ""))
+
+    rollup_rows = conn.execute("SELECT COUNT(*) FROM sales_daily_rollup").fetchone()[0]
+    print(f"sales_daily_rollup: {rollup_rows:,} rows for {seeded:,} orders")
+    if failures:
+        print(f"FAIL: {failures} rollup result(s) differ from the ad-hoc aggregation", file=sys.stderr)
+    over = {name: ms for name, ms in final.items() if args.budget_ms is not None and ms > args.budget_ms}
+    for name, ms in over.items():
+        print(f"FAIL: {name} took {ms:.2f} ms, over the {args.budget_ms:.2f} ms budget", file=sys.stderr)
+    return 1 if failures or over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""Tempo/key analysis throughput and accuracy benchmark.
+
+Synthesizes ``--tracks`` beats with a known tempo and key (kick on every
+beat, hi-hat on the off-beats, a four-chord diatonic progression with
+bass), writes them as 16-bit stereo 44.1 kHz WAV files and analyzes them
+with ``backend.services.audio.analyze_file`` across a spawned process pool,
+as the media pipeline does. Reports seconds of audio analyzed per CPU-second
+(summed over the workers), the wall-clock speed-up over real time, worker
+peak memory and detection accuracy:
+
+- BPM exact: within 1 BPM
+- BPM octave: within 1 BPM of the tempo, half of it or double it
+- key exact, and key up to the relative major/minor
+
+Exits non-zero if the analysis rate is below ``--min-rate`` or the exact
+BPM or key accuracy is below ``--min-accuracy``.
+
+Usage:
+    python -m benchmarks.bench_audio_analysis --tracks 24 --seconds 120 --workers 2 --min-rate 200
+"""
+import argparse
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from backend.services.audio import analyze_file
+from backend.services.audio_analysis import NOTES
+
+SAMPLE_RATE = 44100
+MAJOR_SCALE = (0, 2, 4, 5, 7, 9, 11)
+MINOR_SCALE = (0, 2, 3, 5, 7, 8, 10)
+# Scale degrees of the chord on each bar: I-V-vi-IV and i-VI-iv-v
+MAJOR_PROGRESSION = (0, 4, 5, 3)
+MINOR_PROGRESSION = (0, 5, 3, 4)
+
+
+def synthesize(bpm: int, tonic: int, minor: bool, seconds: float, rng: np.random.Generator) -> np.ndarray:
+    """A mono float32 beat at ``bpm`` in the given key."""
+    total = int(seconds * SAMPLE_RATE)
+    out = np.zeros(total, dtype=np.float32)
+    beat = 60.0 / bpm
+    scale = MINOR_SCALE if minor else MAJOR_SCALE
+    progression = MINOR_PROGRESSION if minor else MAJOR_PROGRESSION
+    bar = 4 * beat
+    for index in range(int(seconds / bar) + 1):
+        start = int(index * bar * SAMPLE_RATE)
+        if start >= total:
+            break
+        end = min(total, int((index + 1) * bar * SAMPLE_RATE))
+        t = np.arange(end - start) / SAMPLE_RATE
+        degree = progression[index % 4]
+        for step in (0, 2, 4):
+            semitone = tonic + scale[(degree + step) % 7] + (12 if degree + step >= 7 else 0)
+            frequency = 130.81 * 2 ** (semitone / 12)
+            for harmonic, amplitude in ((1, 1.0), (2, 0.4), (3, 0.2)):
+                out[start:end] += 0.08 * amplitude * np.sin(2 * np.pi * frequency * harmonic * t)
+        bass = 65.41 * 2 ** (((tonic + scale[degree]) % 12) / 12)
+        out[start:end] += 0.15 * np.sin(2 * np.pi * bass * t)
+
+    t = np.arange(int(0.15 * SAMPLE_RATE)) / SAMPLE_RATE
+    kick = (np.sin(2 * np.pi * (50 + 100 * np.exp(-t * 30)) * t) * np.exp(-t * 20)).astype(np.float32)
+    hat_length = int(0.03 * SAMPLE_RATE)
+    hat = (rng.standard_normal(hat_length) * np.exp(-np.arange(hat_length) / SAMPLE_RATE * 150) * 0.2).astype(np.float32)
+    for index in range(int(seconds / beat) + 1):
+        for offset, sound in ((0.0, kick), (0.5, hat)):
+            start = int((index + offset) * beat * SAMPLE_RATE)
+            if start < total:
+                out[start:start + len(sound)] += sound[:total - start]
+    return out / np.abs(out).max() * 0.9
+
+
+def write_wav(path: Path, samples: np.ndarray) -> None:
+    stereo = np.repeat((samples * 32767).astype("<i2")[:, None], 2, axis=1)
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(stereo.tobytes())
+
+
+def make_tracks(directory: Path, count: int, seconds: float, seed: int) -> List[Tuple[Path, int, str]]:
+    rng = np.random.default_rng(seed)
+    tracks = []
+    for index in range(count):
+        bpm, tonic, minor = int(rng.integers(70, 181)), int(rng.integers(12)), bool(rng.integers(2))
+        path = directory / f"track{index}.wav"
+        write_wav(path, synthesize(bpm, tonic, minor, seconds, rng))
+        tracks.append((path, bpm, f"{NOTES[tonic]} {'Minor' if minor else 'Major'}"))
+    return tracks
+
+
+def relative_key(key: str) -> str:
+    note, mode = key.split()
+    index = NOTES.index(note)
+    if mode == "Major":
+        return f"{NOTES[(index + 9) % 12]} Minor"
+    return f"{NOTES[(index + 3) % 12]} Major"
+
+
+def peak_rss_kib() -> int:
+    """This process's peak resident memory.
+
+    ``ru_maxrss`` survives ``exec``, so in a spawned worker it reports the
+    parent's peak at fork time; Linux's VmHWM is reset by ``exec``.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def timed_analysis(path: str) -> Dict[str, Any]:
+    """Runs in a worker: the analysis plus the CPU time it took there."""
+    began = time.process_time()
+    result = analyze_file(path)
+    return {**result, "cpu": time.process_time() - began, "max_rss_kib": peak_rss_kib()}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=24)
+    parser.add_argument("--seconds", type=float, default=120.0, help="length of each track")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--min-rate", type=float, default=None, help="fail below this many audio seconds per CPU-second")
+    parser.add_argument("--min-accuracy", type=float, default=None, help="fail if exact BPM or key accuracy is below this (0-1)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-audio-") as directory:
+        began = time.perf_counter()
+        tracks = make_tracks(Path(directory), args.tracks, args.seconds, args.seed)
+        print(f"synthesized {len(tracks)} x {args.seconds:.0f} s tracks in {time.perf_counter() - began:.1f} s")
+
+        pool = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"))
+        with pool:
+            # Start the workers (imports) before timing
+            list(pool.map(int, range(args.workers)))
+            began = time.perf_counter()
+            results = list(pool.map(timed_analysis, [str(path) for path, _, _ in tracks]))
+            wall = time.perf_counter() - began
+
+    audio_seconds = sum(result["seconds"] for result in results)
+    cpu_seconds = sum(result["cpu"] for result in results)
+    bpm_exact = bpm_octave = key_exact = key_relative = 0
+    for (_, bpm, key), result in zip(tracks, results):
+        detected = result["bpm"]
+        if detected is not None:
+            bpm_exact += abs(detected - bpm) <= 1
+            bpm_octave += min(abs(detected - bpm), abs(detected - 2 * bpm), abs(2 * detected - bpm)) <= 1
+        key_exact += result["key"] == key
+        key_relative += result["key"] in (key, relative_key(key))
+    count = len(tracks)
+    rate = audio_seconds / cpu_seconds if cpu_seconds else float("inf")
+
+    print(f"audio analyzed:        {audio_seconds:,.0f} s in {wall:.2f} s wall, {cpu_seconds:.2f} CPU-s")
+    print(f"audio s per CPU-s:     {rate:,.0f}")
+    print(f"wall speed-up:         {audio_seconds / wall:,.0f}x real time with {args.workers} worker(s)")
+    print(f"worker peak RSS:       {max(result['max_rss_kib'] for result in results) / 1024:.0f} MiB")
+    print(f"BPM exact / octave:    {bpm_exact / count:.0%} / {bpm_octave / count:.0%}")
+    print(f"key exact / relative:  {key_exact / count:.0%} / {key_relative / count:.0%}")
+    print(f"mean confidence:       bpm {np.mean([r['bpm_confidence'] or 0 for r in results]):.2f}, "
+          f"key {np.mean([r['key_confidence'] or 0 for r in results]):.2f}")
+
+    failed = False
+    if args.min_rate is not None and rate < args.min_rate:
+        print(f"FAIL: {rate:,.0f} audio s per CPU-s is below {args.min_rate:,.0f}", file=sys.stderr)
+        failed = True
+    if args.min_accuracy is not None and min(bpm_exact, key_exact) / count < args.min_accuracy:
+        print(f"FAIL: accuracy is below {args.min_accuracy:.0%}", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Requests/second vs. concurrency for the sync and async Supabase clients.
+
+Starts a local fake Supabase with a fixed per-request latency and issues the
+same `beats` lookup the routers do, from N concurrent coroutines:
+
+* ``sync``  - the global synchronous ``supabase`` client called directly from
+  ``async def`` handlers (the old behaviour; each call blocks the event loop)
+* ``async`` - ``AsyncDatabase`` with its pooled keep-alive connection
+
+Usage:
+    python -m benchmarks.bench_db_concurrency --latency-ms 20 --requests 400
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, List
+
+from benchmarks.fake_supabase import FakeSupabase, FakeSupabaseServer
+
+SERVICE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark"
+
+
+async def _run(concurrency: int, total: int, call: Callable[[], Awaitable[None]]) -> float:
+    remaining = total
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await call()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return total / (time.perf_counter() - start)
+
+
+async def bench(url: str, concurrency_levels: List[int], total: int, pool_size: int) -> None:
+    from supabase import create_client
+
+    from backend.database import AsyncDatabase
+
+    sync_client = create_client(url, SERVICE_KEY)
+    async_db = AsyncDatabase(url, SERVICE_KEY, max_connections=pool_size, max_keepalive_connections=pool_size)
+
+    async def sync_call() -> None:
+        sync_client.table("beats").select("*").eq("is_active", True).limit(20).execute()
+
+    async def async_call() -> None:
+        await async_db.table("beats").select("*").eq("is_active", True).limit(20).execute()
+
+    print(f"{'concurrency':>11} {'sync rps':>10} {'async rps':>10} {'speedup':>8}")
+    for concurrency in concurrency_levels:
+        sync_rps = await _run(concurrency, total, sync_call)
+        async_rps = await _run(concurrency, total, async_call)
+        print(f"{concurrency:>11} {sync_rps:>10.1f} {async_rps:>10.1f} {async_rps / sync_rps:>7.1f}x")
+    await async_db.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="simulated Supabase round-trip latency")
+    parser.add_argument("--requests", type=int, default=400, help="requests per concurrency level")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="comma-separated concurrency levels")
+    parser.add_argument("--pool-size", type=int, default=64, help="async connection pool size")
+    args = parser.parse_args()
+
+    state = FakeSupabase(latency_ms=args.latency_ms)
+    for i in range(50):
+        state.insert("beats", {"title": f"Beat {i}", "price_cents": 2999, "is_active": True})
+
+    with FakeSupabaseServer(state) as server:
+        os.environ.setdefault("SUPABASE_URL", server.url)
+        os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", SERVICE_KEY)
+        os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_benchmark")
+        os.environ.setdefault("STRIPE_WEBHOOK_SECRET", "whsec_benchmark")
+        levels = [int(level) for level in args.concurrency.split(",")]
+        asyncio.run(bench(server.url, levels, args.requests, args.pool_size))
+
+
+if __name__ == "__main__":
+    main()
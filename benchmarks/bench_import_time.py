@@ -0,0 +1,96 @@
+"""Import-time benchmark and cold-start regression guard for the API process.
+
+Runs ``python -X importtime -c "import backend.main"`` in a fresh interpreter
+several times, with Stripe and Supabase credentials removed from the
+environment to check that the app imports without them. Reports the median
+cumulative import time of ``backend.main`` and the slowest top-level
+packages. Exits non-zero when the median exceeds ``--budget-ms`` or when a
+module that should load lazily (Stripe, Supabase, ReportLab, httpx) is
+imported eagerly.
+
+Usage:
+    python -m benchmarks.bench_import_time --runs 5 --budget-ms 600
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+TARGET = "backend.main"
+DEFERRED_MODULES = ("stripe", "supabase", "reportlab", "httpx", "postgrest")
+CREDENTIAL_VARS = ("STRIPE_SECRET_KEY", "STRIPE_WEBHOOK_SECRET", "SUPABASE_URL", "SUPABASE_SERVICE_ROLE_KEY")
+
+
+def _parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """Parse ``-X importtime`` output into (module, self_us, cumulative_us)."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        entries.append((name.strip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def measure_once() -> List[Tuple[str, int, int]]:
+    env = {name: value for name, value in os.environ.items() if name not in CREDENTIAL_VARS}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {TARGET}"],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        tail = "\n".join(result.stderr.splitlines()[-15:])
+        raise RuntimeError(f"import {TARGET} failed without credentials:\n{tail}")
+    return _parse_importtime(result.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to measure (after one warm-up)")
+    parser.add_argument("--budget-ms", type=float, default=600.0, help="fail if the median import time exceeds this")
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level packages to list")
+    args = parser.parse_args()
+
+    measure_once()  # warm the bytecode and OS file caches
+    totals: List[float] = []
+    by_package: Dict[str, List[int]] = defaultdict(list)
+    imported = set()
+    for _ in range(args.runs):
+        entries = measure_once()
+        imported.update(name for name, _, _ in entries)
+        target = next(cumulative for name, _, cumulative in entries if name == TARGET)
+        totals.append(target / 1000)
+        run_packages: Dict[str, int] = defaultdict(int)
+        for name, self_us, _ in entries:
+            run_packages[name.split(".")[0]] += self_us
+        for package, self_us in run_packages.items():
+            by_package[package].append(self_us)
+
+    median = statistics.median(totals)
+    print(f"import {TARGET}: median {median:.1f} ms over {args.runs} runs (min {min(totals):.1f}, max {max(totals):.1f})")
+    print("slowest top-level packages (median self time):")
+    ranked = sorted(((statistics.median(values) / 1000, package) for package, values in by_package.items()), reverse=True)
+    for ms, package in ranked[:args.top]:
+        print(f"  {ms:8.1f} ms  {package}")
+
+    failed = False
+    eager = sorted(module for module in DEFERRED_MODULES if module in imported)
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}", file=sys.stderr)
+        failed = True
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f"FAIL: {median:.1f} ms is over the {args.budget_ms:.1f} ms budget", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
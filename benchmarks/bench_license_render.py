@@ -0,0 +1,62 @@
+"""License render micro-benchmark and throughput regression guard.
+
+Renders N license PDFs in memory through the compiled-template path
+(template lookup, placeholder substitution, ReportLab layout) without
+uploading them, and reports licenses rendered per second. Exits non-zero
+when ``--min-rate`` is given and throughput falls below it.
+
+Usage:
+    python -m benchmarks.bench_license_render -n 200 --min-rate 40
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_benchmark")
+os.environ.setdefault("STRIPE_WEBHOOK_SECRET", "whsec_benchmark")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark")
+
+from backend.services.license_generator import LICENSE_TEMPLATE_MAP, _create_pdf, _load_template  # noqa: E402
+
+
+def render_once(license_type: str, index: int) -> None:
+    template = _load_template(license_type)
+    lines = template.render({
+        "effective_date": "January 01, 2026",
+        "licensor_legal_name": "5D Labs LLC",
+        "producer_name": "5D",
+        "licensee_name": f"Customer {index}",
+        "licensee_email": f"customer{index}@example.com",
+        "license_number": f"order-{index}",
+        "composition_title": "Benchmark Beat",
+    })
+    if _create_pdf(lines) is None:
+        raise RuntimeError("PDF render failed")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--count", type=int, default=200, help="licenses to render")
+    parser.add_argument("--min-rate", type=float, default=None, help="fail if licenses/sec drops below this")
+    args = parser.parse_args()
+
+    license_types = list(LICENSE_TEMPLATE_MAP)
+    render_once(license_types[0], -1)  # warm template and style caches
+
+    start = time.perf_counter()
+    for i in range(args.count):
+        render_once(license_types[i % len(license_types)], i)
+    elapsed = time.perf_counter() - start
+
+    rate = args.count / elapsed
+    print(f"rendered {args.count} licenses in {elapsed:.2f}s: {rate:.1f} licenses/sec ({1000 / rate:.2f} ms each)")
+    if args.min_rate is not None and rate < args.min_rate:
+        print(f"FAIL: {rate:.1f} licenses/sec is below the {args.min_rate:.1f} budget", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""Logging overhead on the request path.
+
+1. Per record: the time a log call costs the calling thread, for
+
+   * ``sync-text`` - a ``StreamHandler`` with the plain formatter and an
+     f-string message (formatting and the write happen in the caller)
+   * ``queue-json`` - ``backend.logs``: the queue handler with a bound
+     ``log_context``, ``%s`` arguments and ``extra=`` fields, JSON written
+     by the listener thread
+
+   Both write to a sink that takes ``--sink-delay-us`` per write, standing
+   in for a slow stderr pipe or log shipper.
+
+2. Per request: ``--events`` Stripe webhooks delivered to the app (ASGI,
+   fake Supabase) with ``configure_logging()`` on. The time log calls
+   spent on the request path (``beatstore_log_emit_seconds_total``) and
+   the records written or sampled out are read from ``/metrics`` and
+   divided by the deliveries.
+
+Exits non-zero if the per-request logging overhead exceeds
+``--budget-us`` microseconds.
+
+Usage:
+    python -m benchmarks.bench_logging --records 20000 --events 300 --budget-us 150
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import re
+import sys
+import time
+from typing import Dict
+
+from benchmarks.bench_webhook import SERVICE_KEY, WEBHOOK_SECRET, asgi_client, sign
+from benchmarks.fake_supabase import FakeSupabase, FakeSupabaseServer
+
+METRIC = re.compile(r'^(beatstore_log_\w+?)(?:\{outcome="(\w+)"\})? (\S+)$', re.MULTILINE)
+
+
+class SlowSink(io.TextIOBase):
+    """A text stream that takes ``delay`` seconds per write and discards the data."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.writes = 0
+
+    def write(self, text: str) -> int:
+        if self.delay:
+            time.sleep(self.delay)
+        self.writes += 1
+        return len(text)
+
+
+def per_record(records: int, delay: float) -> Dict[str, Dict[str, float]]:
+    import queue
+    from logging.handlers import QueueListener
+
+    from backend.logs import AsyncQueueHandler, JsonFormatter, log_context
+
+    results = {}
+    order_id, beat_id, event_id = "0b7c6f5e-order", "5d1e2f3a-beat", "evt_1NbenchX"
+
+    sink = SlowSink(delay)
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    log = logging.getLogger("bench.sync")
+    log.handlers, log.propagate = [handler], False
+    log.setLevel(logging.INFO)
+    began = time.perf_counter()
+    for index in range(records):
+        log.info(f"Successfully processed checkout cs_{index} for order {order_id} beat {beat_id} event {event_id}")
+    elapsed = time.perf_counter() - began
+    results["sync-text"] = {"caller_us": elapsed / records * 1e6, "drained_s": elapsed}
+
+    sink = SlowSink(delay)
+    output = logging.StreamHandler(sink)
+    output.setFormatter(JsonFormatter())
+    queued = AsyncQueueHandler(queue.Queue(maxsize=records + 1))
+    listener = QueueListener(queued.queue, output)
+    log = logging.getLogger("bench.queue")
+    log.handlers, log.propagate = [queued], False
+    log.setLevel(logging.INFO)
+    listener.start()
+    began = time.perf_counter()
+    with log_context(order_id=order_id, beat_id=beat_id, stripe_event_id=event_id):
+        for index in range(records):
+            log.info("Successfully processed checkout %s", f"cs_{index}", extra={"item_count": 1})
+    caller = time.perf_counter() - began
+    listener.stop()
+    results["queue-json"] = {"caller_us": caller / records * 1e6, "drained_s": time.perf_counter() - began}
+    return results
+
+
+def scrape(text: str) -> Dict[str, float]:
+    values = {}
+    for name, outcome, value in METRIC.findall(text):
+        values[f"{name}:{outcome}" if outcome else name] = float(value)
+    return values
+
+
+async def per_request(events: int, env: Dict[str, str], state: FakeSupabase) -> Dict[str, float]:
+    beat = state.insert("beats", {
+        "title": "Bench", "price_cents": 2999, "license_type": "mp3_non_exclusive",
+        "audio_url": "https://example.com/beat.wav", "is_active": True,
+    })
+    async with asgi_client(env) as client:
+        before = scrape((await client.get("/metrics")).text)
+        began = time.perf_counter()
+        for index in range(events):
+            event = {
+                "id": f"evt_log_{index}", "object": "event", "type": "checkout.session.completed",
+                "data": {"object": {
+                    "id": f"cs_log_{index}", "object": "checkout.session", "amount_total": 2999,
+                    "metadata": {"beat_id": beat["id"], "license_type": "mp3_non_exclusive"},
+                    "customer_details": {"name": "Bench", "email": "bench@example.com"},
+                }},
+            }
+            payload = json.dumps(event).encode()
+            response = await client.post("/webhooks/stripe", content=payload, headers={"stripe-signature": sign(payload)})
+            if response.status_code != 200:
+                raise RuntimeError(f"Webhook returned {response.status_code}")
+        elapsed = time.perf_counter() - began
+        after = scrape((await client.get("/metrics")).text)
+    delta = {key: after.get(key, 0.0) - before.get(key, 0.0) for key in after}
+    return {
+        "request_ms": elapsed / events * 1000,
+        "emit_us": delta.get("beatstore_log_emit_seconds_total", 0.0) / events * 1e6,
+        "queued": delta.get("beatstore_log_records_total:queued", 0.0) / events,
+        "sampled_out": delta.get("beatstore_log_records_total:sampled_out", 0.0) / events,
+        "dropped": delta.get("beatstore_log_records_total:dropped", 0.0),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20000, help="records per handler in the per-record test")
+    parser.add_argument("--sink-delay-us", type=float, default=20.0, help="time the log sink takes per write")
+    parser.add_argument("--events", type=int, default=300, help="webhook deliveries in the per-request test")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated Supabase round-trip latency")
+    parser.add_argument("--budget-us", type=float, default=None, help="fail if logging costs a request more than this")
+    args = parser.parse_args()
+
+    print(f"{'handler':<12} {'caller us/record':>17} {'drained in':>11}")
+    for name, result in per_record(args.records, args.sink_delay_us / 1e6).items():
+        print(f"{name:<12} {result['caller_us']:>17.2f} {result['drained_s']:>10.2f}s")
+
+    state = FakeSupabase(latency_ms=args.latency_ms)
+    with FakeSupabaseServer(state) as server:
+        env = {
+            "SUPABASE_URL": server.url,
+            "SUPABASE_SERVICE_ROLE_KEY": SERVICE_KEY,
+            "STRIPE_SECRET_KEY": "sk_test_benchmark",
+            "STRIPE_WEBHOOK_SECRET": WEBHOOK_SECRET,
+            "STORAGE_BACKEND": "memory",
+            "JOB_QUEUE_BACKEND": "sqlite",
+            # Measure the logging path, not the license renders it queues
+            "JOB_WORKER_CONCURRENCY": "1",
+        }
+        # The app's log lines are not the output of this benchmark
+        stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+        try:
+            result = asyncio.run(per_request(args.events, env, state))
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+
+    print(f"\nper webhook request ({args.events} deliveries, {result['request_ms']:.2f} ms each):")
+    print(f"  records written:    {result['queued']:.2f}")
+    print(f"  records sampled out: {result['sampled_out']:.2f}")
+    print(f"  records dropped:    {result['dropped']:.0f} in total")
+    print(f"  logging overhead:   {result['emit_us']:.1f} us ({result['emit_us'] / 10 / result['request_ms']:.2f}% of the request)")
+    if args.budget_us is not None and result["emit_us"] > args.budget_us:
+        print(f"FAIL: {result['emit_us']:.1f} us of logging per request exceeds {args.budget_us:.0f} us", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""Multi-worker consistency and throughput harness.
+
+Starts a fake Supabase and N API worker processes (one uvicorn process per
+port, the same app gunicorn would run) coordinating through the SQLite
+shared-state backend, then checks:
+
+* leader election - exactly one worker holds the maintenance lease, and a
+  new one takes over after the leader is killed
+* cache consistency - a beat toggled through one worker is seen by every
+  other worker long before its cache TTL, via broadcast invalidation
+* webhook idempotency - the same Stripe event delivered to every worker at
+  once creates exactly one order
+* throughput scaling - cached beat lookups/sec against 1..N workers
+
+Exits non-zero if a check fails (or scaling falls below ``--min-scaling``).
+
+Usage:
+    python -m benchmarks.bench_multiworker --workers 4 --duration 5
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import httpx
+
+from benchmarks.fake_supabase import FakeSupabase, FakeSupabaseServer
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SERVICE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark"
+WEBHOOK_SECRET = "whsec_benchmark"
+LEASE_SECONDS = 2.0
+LEADER_METRIC = re.compile(r'^beatstore_leader\{role="maintenance"\} (\S+)$', re.MULTILINE)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Worker:
+    def __init__(self, port: int, env: Dict[str, str]):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=REPO_ROOT,
+            env=env,
+        )
+
+    def wait_ready(self, timeout: float = 30.0) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"worker on port {self.port} exited with {self.process.returncode}")
+            try:
+                if httpx.get(f"{self.url}/", timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f"worker on port {self.port} did not start")
+
+    def is_leader(self) -> bool:
+        match = LEADER_METRIC.search(httpx.get(f"{self.url}/metrics", timeout=5).text)
+        return bool(match) and float(match.group(1)) == 1.0
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self) -> None:
+        # SIGKILL: no graceful lease release, the lease has to expire
+        self.process.send_signal(signal.SIGKILL)
+        self.process.wait()
+
+    def stop(self) -> None:
+        if self.alive():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def _sign(payload: bytes) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(WEBHOOK_SECRET.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def _leaders(workers: List[Worker]) -> List[Worker]:
+    return [worker for worker in workers if worker.alive() and worker.is_leader()]
+
+
+def check_leader_election(workers: List[Worker]) -> Tuple[bool, str]:
+    time.sleep(LEASE_SECONDS)
+    leaders = _leaders(workers)
+    if len(leaders) != 1:
+        return False, f"expected 1 maintenance leader, found {len(leaders)}"
+
+    leader = leaders[0]
+    leader.kill()
+    killed_at = time.monotonic()
+    deadline = killed_at + LEASE_SECONDS * 5
+    while time.monotonic() < deadline:
+        leaders = _leaders(workers)
+        if len(leaders) == 1:
+            return True, f"1 leader; failover after SIGKILL took {time.monotonic() - killed_at:.2f}s"
+        if len(leaders) > 1:
+            return False, f"{len(leaders)} leaders after failover"
+        time.sleep(0.1)
+    return False, "no new leader after the old one was killed"
+
+
+def check_cache_consistency(state: FakeSupabase, workers: List[Worker], timeout: float = 5.0) -> Tuple[bool, str]:
+    beat = state.insert("beats", {
+        "title": "Consistency", "price_cents": 2999, "is_active": True,
+        "license_type": "mp3_non_exclusive", "audio_url": "x", "genre": "trap",
+    })
+    for worker in workers:
+        # Warm every worker's beat cache and catalog snapshot
+        httpx.get(f"{worker.url}/api/beats/{beat['id']}", timeout=5).raise_for_status()
+        httpx.get(f"{worker.url}/api/catalog/", timeout=5).raise_for_status()
+
+    writer, readers = workers[0], workers[1:]
+    httpx.patch(f"{writer.url}/api/beats/{beat['id']}/toggle-active", params={"is_active": "false"}, timeout=5).raise_for_status()
+    changed_at = time.monotonic()
+
+    lags: List[float] = []
+    for worker in readers:
+        while True:
+            beat_seen = httpx.get(f"{worker.url}/api/beats/{beat['id']}", timeout=5).json()["data"]["is_active"]
+            catalog = httpx.get(f"{worker.url}/api/catalog/", timeout=5).json()["data"]
+            if not beat_seen and all(row["id"] != beat["id"] for row in catalog):
+                lags.append(time.monotonic() - changed_at)
+                break
+            if time.monotonic() - changed_at > timeout:
+                return False, f"worker on port {worker.port} still serves the stale beat after {timeout:.0f}s"
+            time.sleep(0.02)
+    return True, f"all {len(readers)} other workers consistent within {max(lags, default=0) * 1000:.0f} ms"
+
+
+async def _post_everywhere(workers: List[Worker], payload: bytes) -> List[int]:
+    async with httpx.AsyncClient(timeout=10) as client:
+        responses = await asyncio.gather(*(
+            client.post(
+                f"{worker.url}/webhooks/stripe",
+                content=payload,
+                headers={"stripe-signature": _sign(payload), "content-type": "application/json"},
+            )
+            for worker in workers
+        ))
+    return [response.status_code for response in responses]
+
+
+def check_webhook_idempotency(state: FakeSupabase, workers: List[Worker]) -> Tuple[bool, str]:
+    beat = state.insert("beats", {"title": "Webhook", "price_cents": 2999, "is_active": True, "license_type": "mp3_non_exclusive", "audio_url": "x"})
+    event = {
+        "id": "evt_multiworker", "object": "event", "type": "checkout.session.completed",
+        "data": {"object": {
+            "id": "cs_multiworker", "object": "checkout.session", "amount_total": 2999,
+            "metadata": {"beat_id": beat["id"], "license_type": "mp3_non_exclusive"},
+            "customer_details": {"name": "Load Test", "email": "load@example.com"},
+        }},
+    }
+    statuses = asyncio.run(_post_everywhere(workers, json.dumps(event).encode()))
+    orders = [row for row in state.table("orders") if row.get("stripe_checkout_id") == "cs_multiworker"]
+    ok = all(status == 200 for status in statuses) and len(orders) == 1
+    return ok, f"{len(workers)} concurrent deliveries -> {len(orders)} order(s), statuses {sorted(set(statuses))}"
+
+
+def _load_client(task: Tuple[List[str], str, int, float]) -> int:
+    urls, path, concurrency, duration = task
+
+    async def run() -> int:
+        done = 0
+        deadline = time.monotonic() + duration
+        async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency * len(urls))) as client:
+            async def loop(index: int) -> None:
+                nonlocal done
+                url = urls[index % len(urls)] + path
+                while time.monotonic() < deadline:
+                    response = await client.get(url)
+                    if response.status_code == 200:
+                        done += 1
+
+            await asyncio.gather(*(loop(i) for i in range(concurrency)))
+        return done
+
+    return asyncio.run(run())
+
+
+def measure_throughput(workers: List[Worker], path: str, clients: int, concurrency: int, duration: float) -> List[Tuple[int, float]]:
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(clients) as pool:
+        for count in range(1, len(workers) + 1):
+            urls = [worker.url for worker in workers[:count]]
+            for url in urls:
+                httpx.get(url + path, timeout=5)  # warm the cache
+            total = sum(pool.map(_load_client, [(urls, path, concurrency, duration)] * clients))
+            results.append((count, total / duration))
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of load per worker count")
+    parser.add_argument("--clients", type=int, default=max(2, os.cpu_count() or 1), help="load generator processes")
+    parser.add_argument("--concurrency", type=int, default=16, help="in-flight requests per load generator")
+    parser.add_argument("--min-scaling", type=float, default=None, help="fail if N-worker rps / 1-worker rps is below this")
+    args = parser.parse_args()
+    if args.workers < 2:
+        parser.error("--workers must be at least 2")
+
+    state = FakeSupabase()
+    beat = state.insert("beats", {"title": "Load", "price_cents": 2999, "is_active": True, "license_type": "mp3_non_exclusive", "audio_url": "x"})
+    failures = 0
+    with FakeSupabaseServer(state) as server, tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            SUPABASE_URL=server.url,
+            SUPABASE_SERVICE_ROLE_KEY=SERVICE_KEY,
+            STRIPE_SECRET_KEY="sk_test_benchmark",
+            STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+            STORAGE_BACKEND="memory",
+            JOB_QUEUE_BACKEND="supabase",
+            SHARED_STATE_BACKEND="sqlite",
+            SHARED_STATE_SQLITE_PATH=os.path.join(tmp, "shared_state.db"),
+            LEADER_LEASE_SECONDS=str(LEASE_SECONDS),
+            # Long TTLs: only broadcast invalidation can make workers converge in time
+            BEAT_CACHE_TTL_SECONDS="600",
+            CATALOG_CACHE_TTL_SECONDS="600",
+            CATALOG_SNAPSHOT_MAX_AGE_SECONDS="600",
+        )
+        workers = [Worker(_free_port(), env) for _ in range(args.workers)]
+        try:
+            for worker in workers:
+                worker.wait_ready()
+            print(f"{args.workers} workers up on ports {', '.join(str(worker.port) for worker in workers)} ({os.cpu_count()} CPUs)")
+
+            for name, check in (
+                ("cache consistency", lambda: check_cache_consistency(state, workers)),
+                ("webhook idempotency", lambda: check_webhook_idempotency(state, workers)),
+            ):
+                ok, detail = check()
+                failures += not ok
+                print(f"{'PASS' if ok else 'FAIL'} {name}: {detail}")
+
+            results = measure_throughput(workers, f"/api/beats/{beat['id']}", args.clients, args.concurrency, args.duration)
+            base = results[0][1]
+            print("throughput (cached GET /api/beats/{id}):")
+            for count, rps in results:
+                print(f"  {count} worker(s): {rps:8.0f} req/s  ({rps / base:.2f}x)")
+            scaling = results[-1][1] / base
+            if args.min_scaling is not None and scaling < args.min_scaling:
+                failures += 1
+                print(f"FAIL scaling: {scaling:.2f}x is below {args.min_scaling:.2f}x")
+
+            # Last: it kills a worker
+            ok, detail = check_leader_election(workers)
+            failures += not ok
+            print(f"{'PASS' if ok else 'FAIL'} leader election: {detail}")
+        finally:
+            for worker in workers:
+                worker.stop()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
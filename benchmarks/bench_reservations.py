@@ -0,0 +1,206 @@
+"""Exclusive-license contention stress test.
+
+Each round seeds a fresh beat and races ``--contenders`` buyers for its
+exclusive license, all released at the same instant:
+
+1. ``reserve``   - concurrent ``reserve_exclusive`` calls (the hold taken
+                   when a checkout session starts); exactly one may win
+2. ``re-reserve`` - the winner releases its hold and everyone races again;
+                   exactly one may win
+3. ``fulfill``   - concurrent ``checkout.session.completed`` webhooks for
+                   the exclusive license, as unreserved Payment Link
+                   checkouts would send; exactly one order may be written
+                   and every other event must be refused as sold out
+
+By default this runs the backend against the fake Supabase server, whose
+RPC mirrors serialize on one lock. ``--database-url`` instead races phase 1
+and 2 through ``reserve_exclusive_beats`` on a real Postgres (migrations
+applied; needs ``asyncpg``), one connection per contender, which exercises
+the row locks themselves. Its test beats are deleted afterwards.
+
+Reports the hold latency percentiles. Exits non-zero if any phase of any
+round had other than exactly one winner.
+
+Usage:
+    python -m benchmarks.bench_reservations --rounds 20 --contenders 32 --latency-ms 5
+    python -m benchmarks.bench_reservations --database-url postgresql://postgres@localhost/beatstore_test
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from benchmarks.bench_webhook import SERVICE_KEY, WEBHOOK_SECRET, asgi_client, sign
+from benchmarks.fake_supabase import FakeSupabase, FakeSupabaseServer
+
+EXCLUSIVE = "premium_trackout_exclusive"
+HOLD_TTL_SECONDS = 600
+
+
+async def race(contenders: int, attempt: Callable[[int], Awaitable[bool]]) -> Tuple[int, List[float]]:
+    """Start every attempt at once; returns the number that won and their latencies (ms)."""
+    start = asyncio.Event()
+    latencies: List[float] = []
+
+    async def contender(index: int) -> bool:
+        await start.wait()
+        began = time.perf_counter()
+        try:
+            return await attempt(index)
+        finally:
+            latencies.append((time.perf_counter() - began) * 1000)
+
+    tasks = [asyncio.create_task(contender(index)) for index in range(contenders)]
+    await asyncio.sleep(0)
+    start.set()
+    results = await asyncio.gather(*tasks)
+    return sum(results), latencies
+
+
+def completed_event(beat_id: str, index: int) -> Dict:
+    checkout_id = f"cs_bench_{uuid.uuid4().hex[:12]}"
+    return {
+        "id": f"evt_{checkout_id}", "object": "event", "type": "checkout.session.completed",
+        "data": {"object": {
+            "id": checkout_id, "object": "checkout.session", "amount_total": 29999,
+            "metadata": {"beat_id": beat_id, "license_type": EXCLUSIVE},
+            "customer_details": {"name": f"Buyer {index}", "email": f"buyer{index}@example.com"},
+        }},
+    }
+
+
+async def run_fake(args: argparse.Namespace, state: FakeSupabase, env: Dict[str, str]) -> Tuple[List[str], List[float]]:
+    failures: List[str] = []
+    latencies: List[float] = []
+    async with asgi_client(env) as client:
+        from backend.services.reservations import BeatsUnavailableError, release, reserve_exclusive
+
+        for round_index in range(args.rounds):
+            beat = state.insert("beats", {
+                "title": f"Exclusive {round_index}", "price_cents": 29999, "license_type": EXCLUSIVE,
+                "audio_url": "https://example.com/beat.wav", "is_active": True,
+            })
+            holds: Dict[int, str] = {}
+
+            async def reserve(index: int) -> bool:
+                try:
+                    hold = await reserve_exclusive([beat["id"]], HOLD_TTL_SECONDS)
+                except BeatsUnavailableError:
+                    return False
+                holds[index] = hold.token
+                return True
+
+            for phase in ("reserve", "re-reserve"):
+                if phase == "re-reserve":
+                    await release(token=holds.pop(next(iter(holds))))
+                winners, phase_latencies = await race(args.contenders, reserve)
+                latencies.extend(phase_latencies)
+                if winners != 1:
+                    failures.append(f"round {round_index} {phase}: {winners} winners")
+            await release(token=holds[next(iter(holds))])
+
+            async def fulfill(index: int) -> bool:
+                payload = json.dumps(completed_event(beat["id"], index)).encode()
+                response = await client.post("/webhooks/stripe", content=payload, headers={"stripe-signature": sign(payload)})
+                return response.status_code == 200
+
+            delivered, _ = await race(args.contenders, fulfill)
+            sold = [row for row in state.table("licenses") if row["beat_id"] == beat["id"] and row["license_type"] == EXCLUSIVE]
+            refused = [
+                row for row in state.table("webhook_events")
+                if row.get("processed") and "already sold" in (row.get("error") or "") and beat["id"] in row["error"]
+            ]
+            if delivered != args.contenders or len(sold) != 1 or len(refused) != args.contenders - 1:
+                failures.append(
+                    f"round {round_index} fulfill: {len(sold)} exclusive licenses, {len(refused)} refused, "
+                    f"{delivered}/{args.contenders} delivered"
+                )
+    return failures, latencies
+
+
+async def run_postgres(args: argparse.Namespace) -> Tuple[List[str], List[float]]:
+    import asyncpg
+
+    failures: List[str] = []
+    latencies: List[float] = []
+    pool = await asyncpg.create_pool(args.database_url, min_size=args.contenders, max_size=args.contenders)
+    beat_ids: List[uuid.UUID] = []
+    try:
+        for round_index in range(args.rounds):
+            beat_id = await pool.fetchval(
+                "INSERT INTO beats (title, price_cents, license_type, audio_url, is_active) "
+                "VALUES ($1, 29999, $2, 'https://example.com/beat.wav', TRUE) RETURNING id",
+                f"bench-reservations {round_index}", EXCLUSIVE,
+            )
+            beat_ids.append(beat_id)
+            holds: Dict[int, uuid.UUID] = {}
+
+            async def reserve(index: int) -> bool:
+                token = uuid.uuid4()
+                outcome = json.loads(await pool.fetchval(
+                    "SELECT reserve_exclusive_beats($1::uuid[], $2::uuid, $3)", [beat_id], token, HOLD_TTL_SECONDS,
+                ))
+                if outcome["reserved"]:
+                    holds[index] = token
+                return outcome["reserved"]
+
+            for phase in ("reserve", "re-reserve"):
+                if phase == "re-reserve":
+                    await pool.execute(
+                        "UPDATE beat_reservations SET status = 'released' WHERE hold_token = $1",
+                        holds.pop(next(iter(holds))),
+                    )
+                winners, phase_latencies = await race(args.contenders, reserve)
+                latencies.extend(phase_latencies)
+                if winners != 1:
+                    failures.append(f"round {round_index} {phase}: {winners} winners")
+    finally:
+        await pool.execute("DELETE FROM beats WHERE id = ANY($1::uuid[])", beat_ids)
+        await pool.close()
+    return failures, latencies
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--contenders", type=int, default=32, help="concurrent buyers per race")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="simulated Supabase round-trip latency")
+    parser.add_argument("--database-url", help="race reserve_exclusive_beats on this Postgres instead of the fake")
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    if args.database_url:
+        failures, latencies = asyncio.run(run_postgres(args))
+    else:
+        state = FakeSupabase(latency_ms=args.latency_ms)
+        with FakeSupabaseServer(state) as server:
+            env = {
+                "SUPABASE_URL": server.url,
+                "SUPABASE_SERVICE_ROLE_KEY": SERVICE_KEY,
+                "STRIPE_SECRET_KEY": "sk_test_benchmark",
+                "STRIPE_WEBHOOK_SECRET": WEBHOOK_SECRET,
+                "STORAGE_BACKEND": "memory",
+                "JOB_QUEUE_BACKEND": "sqlite",
+            }
+            os.environ.update(env)
+            failures, latencies = asyncio.run(run_fake(args, state, env))
+    elapsed = time.perf_counter() - began
+
+    latencies.sort()
+    print(f"rounds:             {args.rounds} x {args.contenders} contenders in {elapsed:.1f} s")
+    print(f"hold attempts:      {len(latencies)}")
+    print(f"hold latency p50:   {statistics.median(latencies):.1f} ms")
+    print(f"hold latency p99:   {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]:.1f} ms")
+    print(f"contested phases:   {args.rounds * (2 if args.database_url else 3)}, {len(failures)} failed")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""Beat search latency benchmark for the in-process search index.
+
+Builds ``SearchIndex`` over ``--beats`` synthetic active beats (the shape of
+the catalog snapshot), then runs a mix of storefront queries - single words,
+search-as-you-type prefixes, multi-word, filter-only, text plus filters and
+deep pages - and reports p50 / p99 per kind, including serializing the
+response body. Exits non-zero if the overall p99 exceeds ``--p99-ms``.
+
+Usage:
+    python -m benchmarks.bench_search --beats 100000 --p99-ms 20
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+from backend.services.beat_search import SearchIndex, SearchQuery
+
+WORDS = (
+    "dark night drive summer lost dream money street cold fire ghost gold wave "
+    "midnight love rain city smoke heart vibe motion legacy paradise empire storm"
+).split()
+GENRES = ["Trap", "Drill", "RnB", "Pop", "Lo-Fi", "Afrobeats", "Boom Bap", "Reggaeton", "House", "Hyperpop"]
+KEYS = [f"{note} {mode}" for note in "C C# D D# E F F# G G# A A# B".split() for mode in ("Major", "Minor")]
+PRODUCERS = [f"Producer{i}" for i in range(300)]
+LICENSES = [("mp3_non_exclusive", 2999), ("wav_non_exclusive", 4999), ("premium_trackout_exclusive", 29999)]
+
+
+def make_beats(count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    beats = []
+    for i in range(count):
+        license_type, price = rng.choice(LICENSES)
+        beats.append({
+            "id": f"00000000-0000-0000-0000-{i:012d}",
+            # A shared vocabulary plus a unique word, like real titles
+            "title": " ".join(rng.sample(WORDS, rng.randint(1, 3))) + f" {rng.choice(WORDS)}{i}",
+            "bpm": rng.randint(60, 200),
+            "key": rng.choice(KEYS),
+            "genre": rng.choice(GENRES),
+            "price_cents": price + rng.choice((0, 0, 0, 500, 1000)),
+            "license_type": license_type,
+            "preview_url": f"https://cdn.example.com/previews/{i}.mp3",
+            "producer_name": rng.choice(PRODUCERS),
+            "created_at": f"2026-01-01T00:00:{i % 60:02d}+00:00",
+        })
+    return beats
+
+
+def query_mix(rng: random.Random, beats: List[Dict[str, Any]]) -> Dict[str, Callable[[], SearchQuery]]:
+    return {
+        "word": lambda: SearchQuery(q=rng.choice(WORDS)),
+        "prefix": lambda: SearchQuery(q=rng.choice(WORDS)[:rng.randint(2, 4)]),
+        "two words": lambda: SearchQuery(q=" ".join(rng.sample(WORDS, 2))),
+        "unique title": lambda: SearchQuery(q=rng.choice(beats)["title"].split()[-1]),
+        "filters only": lambda: SearchQuery(genre=rng.choice(GENRES), bpm_min=120, bpm_max=150),
+        "text + filters": lambda: SearchQuery(
+            q=rng.choice(WORDS), key=rng.choice(KEYS), license_type=LICENSES[0][0], price_max=4000,
+        ),
+        "producer": lambda: SearchQuery(q=rng.choice(PRODUCERS)),
+        "deep page": lambda: SearchQuery(offset=rng.randint(1000, 10000)),
+        "everything": lambda: SearchQuery(),
+    }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--beats", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200, help="queries per kind")
+    parser.add_argument("--p99-ms", type=float, default=None, help="fail if the overall p99 exceeds this")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    beats = make_beats(args.beats, rng)
+    began = time.perf_counter()
+    index = SearchIndex(beats)
+    print(f"indexed {args.beats:,} beats in {time.perf_counter() - began:.2f} s")
+
+    overall: List[float] = []
+    print(f"{'query':<16} {'p50 ms':>8} {'p99 ms':>8} {'avg hits':>10}")
+    for name, make in query_mix(rng, beats).items():
+        timings, hits = [], []
+        for _ in range(args.queries):
+            query = make()
+            began = time.perf_counter()
+            found = index.search(query)
+            json.dumps({"success": True, "data": found["results"], "total": found["total"], "facets": found["facets"]})
+            timings.append((time.perf_counter() - began) * 1000)
+            hits.append(found["total"])
+        overall.extend(timings)
+        print(f"{name:<16} {statistics.median(timings):>8.2f} {percentile(timings, 99):>8.2f} {statistics.mean(hits):>10,.0f}")
+
+    p99 = percentile(overall, 99)
+    print(f"{'overall':<16} {statistics.median(overall):>8.2f} {p99:>8.2f}")
+    if args.p99_ms is not None and p99 > args.p99_ms:
+        print(f"FAIL: p99 {p99:.2f} ms is over the {args.p99_ms:.2f} ms budget", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""License uploads against a faulty storage service.
+
+Runs the app (ASGI, fake Supabase) with ``STORAGE_BACKEND=supabase``
+pointed at the fake, whose Storage API answers ``--error-rate`` of requests
+with a 503 and drops ``--reset-rate`` of them without a response:
+
+1. ``--licenses`` checkout webhooks are delivered, half of them during a
+   ``--outage-seconds`` storage outage, and the render jobs run until every
+   license has its PDF (or ``--timeout``)
+2. every render job is enqueued a second time, as a job retried after its
+   upload succeeded would be, and run again
+
+Reports the storage calls retried and rejected by the circuit breaker and
+the faults injected. Exits non-zero if a license ends without a PDF, a
+``license_url`` points at a missing object, a job died, or the retried jobs
+added objects instead of overwriting their own.
+
+Usage:
+    python -m benchmarks.bench_storage --licenses 40 --error-rate 0.2 --reset-rate 0.05 --outage-seconds 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+from benchmarks.bench_webhook import SERVICE_KEY, WEBHOOK_SECRET, asgi_client, sign
+from benchmarks.fake_supabase import FakeSupabase, FakeSupabaseServer, StorageFaults
+
+LICENSE_PREFIX = "purchases/licenses/"
+
+
+def completed_event(beat_id: str, index: int) -> bytes:
+    return json.dumps({
+        "id": f"evt_storage_{index}", "object": "event", "type": "checkout.session.completed",
+        "data": {"object": {
+            "id": f"cs_storage_{index}", "object": "checkout.session", "amount_total": 2999,
+            "metadata": {"beat_id": beat_id, "license_type": "mp3_non_exclusive"},
+            # A different buyer per license, so every PDF has different content
+            "customer_details": {"name": f"Buyer {index}", "email": f"buyer{index}@example.com"},
+        }},
+    }).encode()
+
+
+async def wait_for_jobs(store, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        # The SQLite store is local tooling; read its table directly
+        if not store._execute("SELECT 1 FROM background_jobs WHERE status IN ('pending', 'running') LIMIT 1"):
+            return True
+        await asyncio.sleep(0.2)
+    return False
+
+
+async def run(args: argparse.Namespace, state: FakeSupabase, env: Dict[str, str]) -> List[str]:
+    failures: List[str] = []
+    beat = state.insert("beats", {
+        "title": "Bench", "price_cents": 2999, "license_type": "mp3_non_exclusive",
+        "audio_url": "https://example.com/beat.wav", "is_active": True,
+    })
+    async with asgi_client(env) as client:
+        from backend.services.license_jobs import RENDER_LICENSE_JOB, job_queue
+
+        began = time.perf_counter()
+        for index in range(args.licenses):
+            if index == args.licenses // 2 and args.outage_seconds:
+                state.storage_faults.outage(args.outage_seconds)
+            payload = completed_event(beat["id"], index)
+            response = await client.post("/webhooks/stripe", content=payload, headers={"stripe-signature": sign(payload)})
+            if response.status_code != 200:
+                failures.append(f"webhook {index} returned {response.status_code}")
+        if not await wait_for_jobs(job_queue.store, args.timeout):
+            failures.append(f"render jobs still pending after {args.timeout:.0f} s")
+        print(f"first pass:         {time.perf_counter() - began:.1f} s")
+
+        objects_before = {key for key in state.objects if key.startswith(LICENSE_PREFIX)}
+        rows = job_queue.store._execute("SELECT payload FROM background_jobs WHERE job_type = ?", (RENDER_LICENSE_JOB,))
+        await job_queue.enqueue_many(RENDER_LICENSE_JOB, [json.loads(row["payload"]) for row in rows])
+        if not await wait_for_jobs(job_queue.store, args.timeout):
+            failures.append(f"retried render jobs still pending after {args.timeout:.0f} s")
+        objects_after = {key for key in state.objects if key.startswith(LICENSE_PREFIX)}
+
+        dead = job_queue.store._execute("SELECT id, last_error FROM background_jobs WHERE status = 'failed'")
+        for row in dead:
+            failures.append(f"job {row['id']} died: {row['last_error']}")
+
+        from backend.services.storage import STORAGE_CALLS
+
+        calls = {
+            outcome: STORAGE_CALLS.value(operation="upload", outcome=outcome)
+            for outcome in ("ok", "retried", "failed", "rejected")
+        }
+
+    licenses = state.table("licenses")
+    missing = [row["id"] for row in licenses if not row.get("license_url")]
+    dangling = [
+        row["id"] for row in licenses
+        # license_url holds the object's path in the private bucket
+        if row.get("license_url") and f"purchases/{row['license_url']}" not in state.objects
+    ]
+    if len(licenses) != args.licenses:
+        failures.append(f"{len(licenses)} licenses written for {args.licenses} checkouts")
+    if missing:
+        failures.append(f"{len(missing)} licenses without a PDF")
+    if dangling:
+        failures.append(f"{len(dangling)} license_url values point at missing objects")
+    if objects_after != objects_before:
+        failures.append(f"retried jobs added {len(objects_after - objects_before)} objects")
+    if len(objects_after) != len(licenses):
+        failures.append(f"{len(objects_after)} license objects stored for {len(licenses)} licenses")
+
+    faults = state.storage_faults.injected
+    print(f"licenses:           {len(licenses)}, {len(licenses) - len(missing)} with a PDF")
+    print(f"license objects:    {len(objects_after)} ({state.storage_writes} writes)")
+    print(f"faults injected:    {faults['error']} errors, {faults['reset']} resets, {faults['outage']} during the outage")
+    print(f"uploads:            {calls['ok']:.0f} ok, {calls['retried']:.0f} retried, "
+          f"{calls['failed']:.0f} failed, {calls['rejected']:.0f} rejected by the breaker")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--licenses", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.2, help="share of storage requests answered 503")
+    parser.add_argument("--reset-rate", type=float, default=0.05, help="share of storage requests dropped")
+    parser.add_argument("--outage-seconds", type=float, default=3.0, help="full storage outage halfway through")
+    parser.add_argument("--cooldown", type=float, default=1.0, help="circuit breaker cooldown (seconds)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for the render jobs")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    state = FakeSupabase()
+    state.storage_faults = StorageFaults(error_rate=args.error_rate, reset_rate=args.reset_rate, seed=args.seed)
+    with FakeSupabaseServer(state) as server:
+        env = {
+            "SUPABASE_URL": server.url,
+            "SUPABASE_SERVICE_ROLE_KEY": SERVICE_KEY,
+            "STRIPE_SECRET_KEY": "sk_test_benchmark",
+            "STRIPE_WEBHOOK_SECRET": WEBHOOK_SECRET,
+            "STORAGE_BACKEND": "supabase",
+            "STORAGE_RETRY_BASE_SECONDS": "0.05",
+            "STORAGE_BREAKER_COOLDOWN_SECONDS": str(args.cooldown),
+            "JOB_QUEUE_BACKEND": "sqlite",
+        }
+        # The app's retry warnings are not the output of this benchmark
+        stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+        try:
+            failures = asyncio.run(run(args, state, env))
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
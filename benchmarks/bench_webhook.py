@@ -0,0 +1,327 @@
+"""Stripe webhook load test and replay harness.
+
+Generates ``checkout.session.completed`` events for seeded beats, signs each
+delivery with a local ``STRIPE_WEBHOOK_SECRET`` (exactly as Stripe does) and
+fires them at ``POST /webhooks/stripe`` with ``--concurrency`` requests in
+flight. Everything runs against the fake Supabase REST / storage server, so
+runs are offline and reproducible for a given ``--seed``.
+
+``--max-items`` makes multi-beat carts (given as ``metadata["items"]`` or
+as expanded ``line_items``, standing in for the Stripe API).
+``--duplicates`` re-sends that fraction of events, shuffled in among the
+originals the way Stripe retries arrive. ``--record`` saves the generated
+events as NDJSON; ``--replay`` sends a saved (or captured) NDJSON file
+instead, seeding any beat it references.
+
+Reports throughput, p50 / p95 / p99 webhook latency, the per-phase
+breakdown (``span`` timings scraped from ``/metrics`` before and after the
+run) and how long the background jobs took to render and upload every
+license PDF (``generate_license_pdf``). Exits non-zero if a delivery
+failed, an event was fulfilled twice or never, a license was not rendered
+within ``--render-timeout``, or p99 exceeds ``--p99-ms``.
+
+Usage:
+    python -m benchmarks.bench_webhook --events 500 --concurrency 16 --duplicates 0.1
+    python -m benchmarks.bench_webhook --transport http --latency-ms 10 --record events.ndjson
+    python -m benchmarks.bench_webhook --max-items 5 --job-concurrency 8
+    python -m benchmarks.bench_webhook --replay events.ndjson --p99-ms 250
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import httpx
+
+from benchmarks.fake_supabase import FakeSupabase, FakeSupabaseServer
+
+SERVICE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark"
+WEBHOOK_SECRET = "whsec_benchmark"
+# Non-exclusive only: an exclusive sale deactivates its beat
+LICENSES = [("mp3_non_exclusive", 2999), ("wav_non_exclusive", 4999), ("premium_trackout_non_exclusive", 9999)]
+PHASE_METRIC = re.compile(r'^beatstore_phase_duration_seconds_(sum|count)\{phase="([^"]+)",outcome="([^"]+)"\} (\S+)$', re.MULTILINE)
+SUPABASE_METRIC = re.compile(r'^beatstore_supabase_calls_total\{api="([^"]+)",table="([^"]+)",method="([^"]+)",status="[^"]*"\} (\S+)$', re.MULTILINE)
+
+
+def sign(payload: bytes, secret: str = WEBHOOK_SECRET) -> str:
+    """A ``Stripe-Signature`` header for ``payload``, timestamped now."""
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def seed_beats(state: FakeSupabase, count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    return [
+        state.insert("beats", {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "title": f"Drop Day {i}",
+            "price_cents": 2999,
+            "license_type": "mp3_non_exclusive",
+            "audio_url": f"https://cdn.example.com/audio/{i}.wav",
+            "is_active": True,
+            "producer_name": f"Producer {i % 7}",
+            "licensor_legal_name": f"Producer {i % 7} LLC",
+        })
+        for i in range(count)
+    ]
+
+
+def make_events(count: int, beats: List[Dict[str, Any]], rng: random.Random, max_items: int = 1) -> List[Dict[str, Any]]:
+    """Checkout events of 1..``max_items`` beats; carts alternate between metadata items and expanded line_items."""
+    events = []
+    for i in range(count):
+        cart = [(beat, *rng.choice(LICENSES)) for beat in rng.sample(beats, rng.randint(1, max_items))]
+        suffix = f"{rng.getrandbits(64):016x}"
+        session: Dict[str, Any] = {
+            "id": f"cs_test_{suffix}",
+            "object": "checkout.session",
+            "amount_total": sum(amount for _, _, amount in cart),
+            "currency": "usd",
+            "customer_details": {"name": f"Customer {i}", "email": f"customer{i}@example.com"},
+        }
+        if len(cart) == 1:
+            beat, license_type, _ = cart[0]
+            session["metadata"] = {"beat_id": beat["id"], "license_type": license_type}
+        elif i % 2:
+            session["metadata"] = {"items": json.dumps([
+                {"beat_id": beat["id"], "license_type": license_type, "price_cents": amount}
+                for beat, license_type, amount in cart
+            ])}
+        else:
+            # What the Stripe API returns for an expanded session, so no API call is made
+            session["metadata"] = {}
+            session["line_items"] = {"object": "list", "data": [
+                {"object": "item", "amount_total": amount, "quantity": 1,
+                 "price": {"product": {"metadata": {"beat_id": beat["id"], "license_type": license_type}}}}
+                for beat, license_type, amount in cart
+            ]}
+        events.append({
+            "id": f"evt_bench_{suffix}",
+            "object": "event",
+            "type": "checkout.session.completed",
+            "created": 1_790_000_000 + i,
+            "data": {"object": session},
+        })
+    return events
+
+
+def event_beat_ids(event: Dict[str, Any]) -> List[str]:
+    """Every beat an event buys, whichever way its items are given."""
+    session = (event.get("data") or {}).get("object") or {}
+    metadata = session.get("metadata") or {}
+    if (session.get("line_items") or {}).get("data"):
+        return [line["price"]["product"]["metadata"]["beat_id"] for line in session["line_items"]["data"]]
+    if metadata.get("items"):
+        return [item["beat_id"] for item in json.loads(metadata["items"])]
+    return [metadata["beat_id"]] if metadata.get("beat_id") else []
+
+
+def load_events(path: str, state: FakeSupabase) -> List[Dict[str, Any]]:
+    """Read NDJSON events, seeding a beat for every ``beat_id`` they reference."""
+    with open(path, "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    known = {beat["id"] for beat in state.table("beats")}
+    for event in events:
+        for beat_id in event_beat_ids(event):
+            if beat_id not in known:
+                known.add(beat_id)
+                state.insert("beats", {
+                    "id": beat_id, "title": f"Replayed {beat_id[:8]}", "price_cents": 2999,
+                    "license_type": "mp3_non_exclusive", "audio_url": "x", "is_active": True,
+                })
+    return events
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def scrape(text: str) -> Tuple[Dict[Tuple[str, str], List[float]], Dict[str, float]]:
+    """Phase ``(phase, outcome) -> [sum, count]`` and Supabase calls per ``api table method``."""
+    phases: Dict[Tuple[str, str], List[float]] = {}
+    for kind, phase, outcome, value in PHASE_METRIC.findall(text):
+        phases.setdefault((phase, outcome), [0.0, 0.0])[0 if kind == "sum" else 1] = float(value)
+    calls: Dict[str, float] = {}
+    for api, table, method, value in SUPABASE_METRIC.findall(text):
+        key = f"{api} {table} {method}"
+        calls[key] = calls.get(key, 0.0) + float(value)
+    return phases, calls
+
+
+@asynccontextmanager
+async def asgi_client(env: Dict[str, str]) -> AsyncIterator[httpx.AsyncClient]:
+    """The app in this process; its background job workers share the event loop."""
+    os.environ.update(env)
+    from backend.main import app
+
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            yield client
+
+
+@asynccontextmanager
+async def http_client(env: Dict[str, str]) -> AsyncIterator[httpx.AsyncClient]:
+    """One uvicorn worker process, as deployed."""
+    from benchmarks.bench_multiworker import Worker, _free_port
+
+    worker = Worker(_free_port(), dict(os.environ, **env))
+    try:
+        await asyncio.to_thread(worker.wait_ready)
+        async with httpx.AsyncClient(base_url=worker.url, timeout=60) as client:
+            yield client
+    finally:
+        worker.stop()
+
+
+async def deliver(
+    client: httpx.AsyncClient, payloads: List[bytes], concurrency: int
+) -> Tuple[List[float], Dict[int, int], float]:
+    """POST every payload; returns latencies (ms), status counts and elapsed seconds."""
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    queue = iter(payloads)
+
+    async def worker() -> None:
+        for payload in queue:
+            began = time.perf_counter()
+            try:
+                response = await client.post(
+                    "/webhooks/stripe",
+                    content=payload,
+                    headers={"stripe-signature": sign(payload), "content-type": "application/json"},
+                )
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            latencies.append((time.perf_counter() - began) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    began = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - began
+
+
+async def wait_for_licenses(state: FakeSupabase, expected: int, timeout: float) -> Tuple[int, float]:
+    """Wait until ``expected`` licenses have a PDF URL; returns (rendered, seconds waited)."""
+    began = time.perf_counter()
+    while True:
+        rendered = sum(1 for row in state.table("licenses") if row.get("license_url"))
+        if rendered >= expected or time.perf_counter() - began > timeout:
+            return rendered, time.perf_counter() - began
+        await asyncio.sleep(0.05)
+
+
+async def run(args: argparse.Namespace, state: FakeSupabase, env: Dict[str, str], events: List[Dict[str, Any]]) -> int:
+    rng = random.Random(args.seed)
+    payloads = [json.dumps(event).encode() for event in events]
+    deliveries = payloads + [rng.choice(payloads) for _ in range(int(len(payloads) * args.duplicates))]
+    expected_licenses = sum(len(event_beat_ids(event)) for event in events)
+    rng.shuffle(deliveries)
+
+    connect = asgi_client if args.transport == "asgi" else http_client
+    async with connect(env) as client:
+        phases_before, calls_before = scrape((await client.get("/metrics")).text)
+        latencies, statuses, elapsed = await deliver(client, deliveries, args.concurrency)
+        rendered, render_wait = await wait_for_licenses(state, expected_licenses, args.render_timeout)
+        phases_after, calls_after = scrape((await client.get("/metrics")).text)
+
+    print(f"{len(deliveries)} deliveries ({len(events)} events for {expected_licenses} items, {len(deliveries) - len(events)} duplicates), "
+          f"concurrency {args.concurrency}, transport {args.transport}, Supabase latency {args.latency_ms:g} ms")
+    print(f"throughput: {len(deliveries) / elapsed:.1f} webhooks/s over {elapsed:.2f} s")
+    print(f"latency ms: p50 {statistics.median(latencies):.1f}  p95 {percentile(latencies, 95):.1f}  "
+          f"p99 {percentile(latencies, 99):.1f}  max {max(latencies):.1f}")
+    print(f"statuses: {', '.join(f'{status}={count}' for status, count in sorted(statuses.items()))}")
+
+    print(f"\n{'phase':<34} {'outcome':<8} {'count':>7} {'mean ms':>9} {'total s':>9}")
+    for key in sorted(phases_after):
+        total, count = (after - before for after, before in zip(phases_after[key], phases_before.get(key, [0.0, 0.0])))
+        if count:
+            print(f"{key[0]:<34} {key[1]:<8} {count:>7.0f} {total / count * 1000:>9.2f} {total:>9.2f}")
+    print(f"\n{'supabase calls':<34} {'total':>7} {'per event':>10}")
+    for key in sorted(calls_after):
+        count = calls_after[key] - calls_before.get(key, 0.0)
+        if count:
+            print(f"{key:<34} {count:>7.0f} {count / len(events):>10.2f}")
+
+    render_seconds = elapsed + render_wait
+    print(f"\nlicense PDFs: {rendered}/{expected_licenses} rendered and uploaded, "
+          f"{rendered / render_seconds:.1f} licenses/s end to end ({render_seconds:.2f} s)")
+
+    failures = []
+    errors = sum(count for status, count in statuses.items() if status != 200)
+    if errors:
+        failures.append(f"{errors} deliveries did not return 200")
+    orders = len(state.table("orders"))
+    if orders != len(events):
+        failures.append(f"{orders} orders for {len(events)} events (duplicates must be fulfilled once)")
+    unprocessed = sum(1 for row in state.table("webhook_events") if not row.get("processed"))
+    if unprocessed:
+        failures.append(f"{unprocessed} webhook events left unprocessed")
+    licenses = len(state.table("licenses"))
+    if licenses != expected_licenses:
+        failures.append(f"{licenses} licenses for {expected_licenses} purchased items")
+    if rendered < expected_licenses:
+        failures.append(f"only {rendered} of {expected_licenses} license PDFs rendered within {args.render_timeout:g} s")
+    p99 = percentile(latencies, 99)
+    if args.p99_ms is not None and p99 > args.p99_ms:
+        failures.append(f"p99 {p99:.1f} ms is over the {args.p99_ms:g} ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=500, help="distinct checkout events to generate")
+    parser.add_argument("--beats", type=int, default=50, help="beats to seed and buy from")
+    parser.add_argument("--max-items", type=int, default=1, help="beats per checkout: 1..N, for multi-item carts")
+    parser.add_argument("--concurrency", type=int, default=16, help="webhook requests in flight")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="fraction of events delivered a second time")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="simulated Supabase round-trip latency")
+    parser.add_argument("--transport", choices=("asgi", "http"), default="asgi",
+                        help="asgi: app in this process; http: one uvicorn worker process")
+    parser.add_argument("--job-concurrency", type=int, default=4, help="license render workers (JOB_WORKER_CONCURRENCY)")
+    parser.add_argument("--render-timeout", type=float, default=120.0, help="seconds to wait for license PDFs")
+    parser.add_argument("--record", help="write the generated events to this NDJSON file")
+    parser.add_argument("--replay", help="send the events in this NDJSON file instead of generating them")
+    parser.add_argument("--p99-ms", type=float, default=None, help="fail if webhook p99 latency exceeds this")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    state = FakeSupabase(latency_ms=args.latency_ms)
+    if args.replay:
+        events = load_events(args.replay, state)
+    else:
+        events = make_events(args.events, seed_beats(state, args.beats, rng), rng, args.max_items)
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(event) + "\n" for event in events)
+
+    with FakeSupabaseServer(state) as server:
+        env = {
+            "SUPABASE_URL": server.url,
+            "SUPABASE_SERVICE_ROLE_KEY": SERVICE_KEY,
+            "STRIPE_SECRET_KEY": "sk_test_benchmark",
+            "STRIPE_WEBHOOK_SECRET": WEBHOOK_SECRET,
+            # The real upload path, into the fake storage API
+            "STORAGE_BACKEND": "supabase",
+            "JOB_QUEUE_BACKEND": "supabase",
+            "JOB_WORKER_CONCURRENCY": str(args.job_concurrency),
+        }
+        return asyncio.run(run(args, state, env, events))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
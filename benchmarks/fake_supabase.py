@@ -0,0 +1,763 @@
+"""In-memory stand-in for the Supabase REST (PostgREST) and Storage APIs.
+
+Implements the subset of the HTTP API the backend uses so benchmarks can run
+offline against a server with a configurable per-request latency.
+``FakeSupabase.storage_faults`` injects Storage API failures (error
+responses, dropped connections, slow responses, full outages) to exercise
+the storage client's retries and circuit breaker.
+
+Run standalone:
+    python -m benchmarks.fake_supabase --port 54321 --latency-ms 20
+    python -m benchmarks.fake_supabase --storage-error-rate 0.2 --storage-reset-rate 0.05
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+EXCLUSIVE_LICENSE_TYPE = "premium_trackout_exclusive"
+
+
+def _coerce(value: str) -> Any:
+    if value == "null":
+        return None
+    if value == "true":
+        return True
+    if value == "false":
+        return False
+    return value
+
+
+def _column(row: Dict[str, Any], key: str) -> Any:
+    """A row's column, or a JSON field of one (``payload->>license_id``)."""
+    if "->>" not in key:
+        return row.get(key)
+    column, field = key.split("->>", 1)
+    value = row.get(column)
+    if isinstance(value, str):
+        value = json.loads(value)
+    return (value or {}).get(field)
+
+
+def _compare(row_value: Any, op: str, raw: str) -> bool:
+    if op == "is":
+        return row_value is _coerce(raw)
+    if op == "in":
+        options = [v.strip().strip('"') for v in raw.strip("()").split(",") if v.strip()]
+        return str(row_value) in options
+    target = _coerce(raw)
+    if isinstance(row_value, bool) or isinstance(target, bool):
+        left, right = row_value, target
+    elif isinstance(row_value, (int, float)) and not isinstance(target, (int, float)):
+        try:
+            left, right = row_value, float(target)
+        except (TypeError, ValueError):
+            left, right = str(row_value), str(target)
+    else:
+        left, right = (str(row_value) if row_value is not None else None), (str(target) if target is not None else None)
+    if op == "eq":
+        return left == right
+    if op == "neq":
+        return left != right
+    if left is None or right is None:
+        return False
+    if op == "gt":
+        return left > right
+    if op == "gte":
+        return left >= right
+    if op == "lt":
+        return left < right
+    if op == "lte":
+        return left <= right
+    if op in ("like", "ilike"):
+        pattern = re.escape(str(right)).replace("\\*", ".*").replace("%", ".*")
+        flags = re.IGNORECASE if op == "ilike" else 0
+        return re.fullmatch(pattern, str(left), flags) is not None
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+def _split_top_level(expr: str) -> List[str]:
+    parts, depth, current = [], 0, ""
+    for char in expr:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _match_logic(row: Dict[str, Any], kind: str, expr: str) -> bool:
+    """Evaluate an ``or=(...)``/``and=(...)`` expression against a row."""
+    results = []
+    for term in _split_top_level(expr.strip()[1:-1]):
+        if term.startswith(("or(", "and(")):
+            nested = term.split("(", 1)[0]
+            results.append(_match_logic(row, nested, term[len(nested):]))
+        else:
+            column, op, raw = term.split(".", 2)
+            if raw.startswith('"') and raw.endswith('"'):
+                raw = raw[1:-1].replace('\\"', '"')
+            results.append(_compare(row.get(column), op, raw))
+    return any(results) if kind == "or" else all(results)
+
+
+def _fulfill_checkout_items(state: "FakeSupabase", params: Dict[str, Any]) -> Dict[str, Any]:
+    """Mirror of the fulfill_checkout_items Postgres function."""
+    event = None
+    if params.get("p_stripe_event_id"):
+        event = next((row for row in state.table("webhook_events") if row.get("stripe_event_id") == params["p_stripe_event_id"]), None)
+        if event is not None and event.get("processed"):
+            return {"duplicate": True}
+    items = params.get("p_items") or []
+    if not items:
+        raise ValueError("p_items must be a non-empty array")
+    beats = {row["id"]: row for row in state.table("beats")}
+    for item in items:
+        if item["beat_id"] not in beats:
+            raise LookupError(f"Beat {item['beat_id']} not found")
+    exclusive = list(dict.fromkeys(item["beat_id"] for item in items if item["license_type"] == EXCLUSIVE_LICENSE_TYPE))
+    sold_out = sorted({row["beat_id"] for row in state.table("licenses") if row.get("license_type") == EXCLUSIVE_LICENSE_TYPE} & set(exclusive))
+    if sold_out:
+        return {"sold_out": sold_out}
+    order = state.insert("orders", {
+        "user_id": params.get("p_user_id"),
+        "stripe_checkout_id": params["p_stripe_checkout_id"],
+        "total_cents": params["p_total_cents"],
+        "status": "completed",
+        "customer_name": params.get("p_customer_name"),
+        "customer_email": params.get("p_customer_email"),
+    })
+    fulfilled = []
+    for item in items:
+        beat = beats[item["beat_id"]]
+        order_item = state.insert("order_items", {
+            "order_id": order["id"],
+            "beat_id": beat["id"],
+            "license_type": item["license_type"],
+            "price_cents": item["price_cents"],
+        })
+        license_row = state.insert("licenses", {
+            "order_item_id": order_item["id"],
+            "user_id": params.get("p_user_id"),
+            "beat_id": beat["id"],
+            "license_type": item["license_type"],
+            "license_url": None,
+        })
+        _apply_sales_rollup(state, order["created_at"][:10], beat["id"], item["license_type"], 1, item["price_cents"])
+        if item["license_type"] == "premium_trackout_exclusive":
+            beat["is_active"] = False
+        fulfilled.append({
+            "order_item_id": order_item["id"],
+            "license_id": license_row["id"],
+            "beat_id": beat["id"],
+            "license_type": item["license_type"],
+            "price_cents": item["price_cents"],
+            "beat_title": beat.get("title"),
+            "producer_name": beat.get("producer_name"),
+            "licensor_legal_name": beat.get("licensor_legal_name"),
+        })
+    now = datetime.now(timezone.utc).isoformat()
+    reservations = {row["beat_id"]: row for row in state.table("beat_reservations")}
+    preempted = []
+    for beat_id in exclusive:
+        reservation = reservations.get(beat_id)
+        if reservation is None:
+            state.insert("beat_reservations", {
+                "beat_id": beat_id, "hold_token": str(uuid.uuid4()), "stripe_checkout_id": params["p_stripe_checkout_id"],
+                "status": "converted", "expires_at": now, "order_id": order["id"], "updated_at": now,
+            })
+            continue
+        if (reservation["status"] == "held" and reservation["expires_at"] > now
+                and reservation.get("stripe_checkout_id") not in (None, params["p_stripe_checkout_id"])):
+            preempted.append(reservation["stripe_checkout_id"])
+        reservation.update(stripe_checkout_id=params["p_stripe_checkout_id"], status="converted", order_id=order["id"], updated_at=now)
+    if event is not None:
+        event.update({"processed": True, "processed_at": now, "error": None})
+    return {"order_id": order["id"], "items": fulfilled, "preempted": preempted}
+
+
+def _reserve_exclusive_beats(state: "FakeSupabase", params: Dict[str, Any]) -> Dict[str, Any]:
+    """Mirror of the reserve_exclusive_beats Postgres function (the server lock stands in for the row locks)."""
+    beat_ids = list(dict.fromkeys(params.get("p_beat_ids") or []))
+    if not beat_ids:
+        raise ValueError("p_beat_ids must be a non-empty array")
+    if not params.get("p_ttl_seconds") or params["p_ttl_seconds"] <= 0:
+        raise ValueError("p_ttl_seconds must be positive")
+    now = datetime.now(timezone.utc)
+    beats = {row["id"]: row for row in state.table("beats")}
+    reservations = {row["beat_id"]: row for row in state.table("beat_reservations")}
+    sold = {row["beat_id"] for row in state.table("licenses") if row.get("license_type") == EXCLUSIVE_LICENSE_TYPE}
+    token = params["p_hold_token"]
+    unavailable = []
+    for beat_id in beat_ids:
+        beat, reservation = beats.get(beat_id), reservations.get(beat_id)
+        if (beat is None or not beat.get("is_active") or beat_id in sold
+                or (reservation is not None and reservation["status"] == "converted")
+                or (reservation is not None and reservation["status"] == "held"
+                    and reservation["expires_at"] > now.isoformat() and reservation["hold_token"] != token)):
+            unavailable.append(beat_id)
+    if unavailable:
+        return {"reserved": False, "unavailable": sorted(unavailable)}
+    expires_at = (now + timedelta(seconds=params["p_ttl_seconds"])).isoformat()
+    for beat_id in beat_ids:
+        reservation = reservations.get(beat_id)
+        values = {"hold_token": token, "status": "held", "expires_at": expires_at, "order_id": None, "updated_at": now.isoformat()}
+        if reservation is None:
+            state.insert("beat_reservations", {"beat_id": beat_id, "stripe_checkout_id": None, **values})
+        else:
+            if reservation["hold_token"] != token or reservation["status"] != "held":
+                values["stripe_checkout_id"] = None
+            reservation.update(values)
+    return {"reserved": True, "unavailable": [], "expires_at": expires_at}
+
+
+def _fulfill_checkout(state: "FakeSupabase", params: Dict[str, Any]) -> Dict[str, Any]:
+    """Mirror of the single-item fulfill_checkout Postgres function."""
+    result = _fulfill_checkout_items(state, {
+        **params,
+        "p_items": [{"beat_id": params["p_beat_id"], "license_type": params["p_license_type"], "price_cents": params["p_price_cents"]}],
+    })
+    if result.get("duplicate") or result.get("sold_out"):
+        return result
+    item = result["items"][0]
+    return {
+        "order_id": result["order_id"],
+        "order_item_id": item["order_item_id"],
+        "license_id": item["license_id"],
+        "beat_title": item["beat_title"],
+        "producer_name": item["producer_name"],
+        "licensor_legal_name": item["licensor_legal_name"],
+    }
+
+
+def _apply_sales_rollup(state: "FakeSupabase", day: str, beat_id: str, license_type: str, items: int, revenue_cents: int) -> None:
+    """Mirror of the apply_sales_rollup_delta Postgres function (run by the order_items trigger)."""
+    for table, key in (("sales_daily_rollup", {"day": day, "beat_id": beat_id, "license_type": license_type}),
+                       ("sales_daily_totals", {"day": day}),
+                       ("sales_beat_totals", {"beat_id": beat_id, "license_type": license_type})):
+        row = next((r for r in state.table(table) if all(r[k] == v for k, v in key.items())), None)
+        if row is None:
+            row = {**key, "items_count": 0, "revenue_cents": 0}
+            state.table(table).append(row)
+        row["items_count"] += items
+        row["revenue_cents"] += revenue_cents
+
+
+def _rollup_rows(state: "FakeSupabase", params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    date_from, date_to = params.get("p_from"), params.get("p_to")
+    if date_from is None and date_to is None:
+        return state.table("sales_beat_totals")
+    return [
+        row for row in state.table("sales_daily_rollup")
+        if (date_from is None or row["day"] >= date_from) and (date_to is None or row["day"] < date_to)
+    ]
+
+
+def _sum_by(rows: List[Dict[str, Any]], key: Callable[[Dict[str, Any]], Any], name: str) -> List[Dict[str, Any]]:
+    totals: Dict[Any, Dict[str, Any]] = {}
+    for row in rows:
+        total = totals.setdefault(key(row), {name: key(row), "items_count": 0, "revenue_cents": 0})
+        total["items_count"] += row["items_count"]
+        total["revenue_cents"] += row["revenue_cents"]
+    return list(totals.values())
+
+
+def _sales_top_beats(state: "FakeSupabase", params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    titles = {beat["id"]: beat.get("title") for beat in state.table("beats")}
+    rows = _sum_by(_rollup_rows(state, params), lambda row: row["beat_id"], "beat_id")
+    rows.sort(key=lambda row: (-row["revenue_cents"], row["beat_id"]))
+    return [{**row, "title": titles.get(row["beat_id"])} for row in rows[:params.get("p_limit", 10)]]
+
+
+def _sales_by_license_type(state: "FakeSupabase", params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    rows = _sum_by(_rollup_rows(state, params), lambda row: row["license_type"], "license_type")
+    return sorted(rows, key=lambda row: -row["revenue_cents"])
+
+
+def _sales_timeseries(state: "FakeSupabase", params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    granularity = params["p_granularity"]
+
+    def period(row: Dict[str, Any]) -> str:
+        day = datetime.fromisoformat(row["day"]).date()
+        if granularity == "week":
+            day = day.fromordinal(day.toordinal() - day.weekday())
+        elif granularity == "month":
+            day = day.replace(day=1)
+        return day.isoformat()
+
+    date_from, date_to = params.get("p_from"), params.get("p_to")
+    rows = [
+        row for row in state.table("sales_daily_totals")
+        if (date_from is None or row["day"] >= date_from) and (date_to is None or row["day"] < date_to)
+    ]
+    return sorted(_sum_by(rows, period, "period"), key=lambda row: row["period"])
+
+
+def _refresh_sales_rollups(state: "FakeSupabase", params: Dict[str, Any]) -> Dict[str, Any]:
+    date_from = params.get("p_from")
+    daily = state.table("sales_daily_rollup")
+    daily[:] = [row for row in daily if date_from is not None and row["day"] < date_from]
+    day_totals = state.table("sales_daily_totals")
+    day_totals[:] = [row for row in day_totals if date_from is not None and row["day"] < date_from]
+    orders = {order["id"]: order for order in state.table("orders")}
+    for item in state.table("order_items"):
+        order = orders.get(item["order_id"])
+        if order and order.get("status") == "completed" and (date_from is None or order["created_at"][:10] >= date_from):
+            _apply_sales_rollup(state, order["created_at"][:10], item["beat_id"], item["license_type"], 1, item["price_cents"])
+    # Totals are re-derived from the daily table
+    totals = _sum_by(daily, lambda row: (row["beat_id"], row["license_type"]), "key")
+    state.table("sales_beat_totals")[:] = [
+        {"beat_id": row["key"][0], "license_type": row["key"][1], "items_count": row["items_count"], "revenue_cents": row["revenue_cents"]}
+        for row in totals
+    ]
+    return {"days_refreshed": len({row["day"] for row in daily if date_from is None or row["day"] >= date_from})}
+
+
+BEAT_COLUMNS = (
+    "title", "bpm", "key", "genre", "price_cents", "license_type", "audio_url", "preview_url",
+    "is_active", "producer_name", "licensor_legal_name",
+)
+BEAT_REQUIRED = ("title", "price_cents", "license_type", "audio_url")
+
+
+def _bulk_upsert_beats(state: "FakeSupabase", params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Mirror of the bulk_upsert_beats Postgres function (all rows or none)."""
+    beats = params["p_beats"]
+    for beat in beats:
+        missing = [column for column in BEAT_REQUIRED if beat.get(column) is None]
+        if missing:
+            raise ValueError(f'null value in column "{missing[0]}" of relation "beats" violates not-null constraint')
+    existing = {row["id"]: row for row in state.table("beats")}
+    results = []
+    for ordinal, beat in enumerate(beats, start=1):
+        row = existing.get(beat.get("id"))
+        if row is not None:
+            # Updates only touch the columns given
+            values = {column: beat[column] for column in BEAT_COLUMNS if column in beat}
+            row.update(values, updated_at=datetime.now(timezone.utc).isoformat())
+        else:
+            values = {column: beat.get(column) for column in BEAT_COLUMNS}
+            if values["is_active"] is None:
+                values["is_active"] = True
+            row = state.insert("beats", {**({"id": beat["id"]} if beat.get("id") else {}), **values})
+        results.append({"ordinal": ordinal, "id": row["id"], "created": beat.get("id") not in existing})
+    return results
+
+
+def _set_license_urls(state: "FakeSupabase", params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Mirror of the set_license_urls Postgres function (updates existing licenses only)."""
+    urls = {row["id"]: row["url"] for row in params["p_rows"]}
+    updated = []
+    for row in state.table("licenses"):
+        if row["id"] in urls:
+            row["license_url"] = urls[row["id"]]
+            updated.append({"id": row["id"]})
+    return updated
+
+
+DEFAULT_RPCS: Dict[str, Callable[["FakeSupabase", Dict[str, Any]], Any]] = {
+    "bulk_upsert_beats": _bulk_upsert_beats,
+    "fulfill_checkout": _fulfill_checkout,
+    "fulfill_checkout_items": _fulfill_checkout_items,
+    "sales_top_beats": _sales_top_beats,
+    "sales_by_license_type": _sales_by_license_type,
+    "sales_timeseries": _sales_timeseries,
+    "refresh_sales_rollups": _refresh_sales_rollups,
+    "reserve_exclusive_beats": _reserve_exclusive_beats,
+    "set_license_urls": _set_license_urls,
+}
+
+
+class StorageFaults:
+    """Failures injected into Storage API requests.
+
+    Each request is, at random, answered with ``error_status``
+    (``error_rate``), dropped without a response (``reset_rate``) or
+    delayed by ``slow_ms`` (``slow_rate``). During an ``outage()`` every
+    request gets ``error_status``. ``seed`` makes the sequence repeatable.
+    """
+
+    def __init__(
+        self,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        reset_rate: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_ms: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.reset_rate = reset_rate
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.down_until = 0.0
+        self.injected: Dict[str, int] = {"error": 0, "reset": 0, "slow": 0, "outage": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def outage(self, seconds: float) -> None:
+        """Fail every storage request for the next ``seconds``."""
+        self.down_until = time.monotonic() + seconds
+
+    def draw(self) -> Optional[str]:
+        """The fault for the next request: "outage", "error", "reset", "slow" or None."""
+        with self._lock:
+            if time.monotonic() < self.down_until:
+                fault = "outage"
+            else:
+                roll = self._random.random()
+                if roll < self.error_rate:
+                    fault = "error"
+                elif roll < self.error_rate + self.reset_rate:
+                    fault = "reset"
+                elif roll < self.error_rate + self.reset_rate + self.slow_rate:
+                    fault = "slow"
+                else:
+                    return None
+            self.injected[fault] += 1
+            return fault
+
+
+# Column defaults the migrations declare, filled in on insert
+COLUMN_DEFAULTS: Dict[str, Callable[[], Dict[str, Any]]] = {
+    "webhook_events": lambda: {"attempts": 0, "next_attempt_at": datetime.now(timezone.utc).isoformat()},
+}
+
+
+class FakeSupabase:
+    """Shared state for the fake server: tables, RPC functions and storage objects."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000.0
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.unique: Dict[str, Tuple[str, ...]] = {}
+        self.rpcs: Dict[str, Callable[["FakeSupabase", Dict[str, Any]], Any]] = dict(DEFAULT_RPCS)
+        self.objects: Dict[str, bytes] = {}
+        # Signed URL token -> (object key, expiry as a Unix timestamp)
+        self.signed: Dict[str, Tuple[str, float]] = {}
+        self.storage_faults = StorageFaults()
+        # Successful object writes, including overwrites of an existing key
+        self.storage_writes = 0
+        self.lock = threading.RLock()
+        self.request_count = 0
+
+    def table(self, name: str) -> List[Dict[str, Any]]:
+        return self.tables.setdefault(name, [])
+
+    def insert(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Insert a row directly, filling the same defaults Postgres would."""
+        with self.lock:
+            row = dict(row)
+            row.setdefault("id", str(uuid.uuid4()))
+            row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+            for column, value in COLUMN_DEFAULTS.get(table, dict)().items():
+                row.setdefault(column, value)
+            self.table(table).append(row)
+            return row
+
+    def select(self, table: str, params: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        rows = list(self.table(table))
+        for key, value in params:
+            if key in RESERVED_PARAMS:
+                continue
+            if key in ("or", "and"):
+                rows = [row for row in rows if _match_logic(row, key, value)]
+                continue
+            negate = value.startswith("not.")
+            op, raw = (value[4:] if negate else value).split(".", 1)
+            rows = [row for row in rows if _compare(_column(row, key), op, raw) != negate]
+        query = dict(params)
+        for clause in reversed(query.get("order", "").split(",")):
+            if not clause:
+                continue
+            parts = clause.split(".")
+            desc = "desc" in parts[1:]
+            rows.sort(key=lambda row: (row.get(parts[0]) is None, row.get(parts[0]) or ""), reverse=desc)
+        offset = int(query.get("offset", 0))
+        if "limit" in query:
+            rows = rows[offset:offset + int(query["limit"])]
+        elif offset:
+            rows = rows[offset:]
+        return rows
+
+
+def _singular(table: str) -> str:
+    return table[:-1] if table.endswith("s") else table
+
+
+def _project_row(state: "FakeSupabase", table: str, row: Dict[str, Any], select: str) -> Dict[str, Any]:
+    """Apply a select list, resolving embeds (``beats(title)``) by ``<name>_id`` foreign keys."""
+    projected: Dict[str, Any] = {}
+    for item in (part.strip() for part in _split_top_level(select)):
+        if not item:
+            continue
+        if "(" not in item:
+            if item == "*":
+                projected.update(row)
+            else:
+                alias, _, column = item.rpartition(":")
+                projected[alias or column] = row.get(column)
+            continue
+        head, inner = item.split("(", 1)
+        alias, _, name = head.strip().rpartition(":")
+        name = name.split("!", 1)[0].strip()
+        inner = inner.rsplit(")", 1)[0]
+        foreign_key = f"{_singular(name)}_id"
+        if foreign_key in row:
+            # Many-to-one: the row points at one parent
+            parent = next((r for r in state.table(name) if r.get("id") == row[foreign_key]), None)
+            value: Any = _project_row(state, name, parent, inner) if parent else None
+        else:
+            # One-to-many: children point back at this row
+            back_key = f"{_singular(table)}_id"
+            value = [_project_row(state, name, r, inner) for r in state.table(name) if r.get(back_key) == row.get("id")]
+        projected[alias or name] = value
+    return projected
+
+
+def _project(state: "FakeSupabase", table: str, rows: List[Dict[str, Any]], select: Optional[str]) -> List[Dict[str, Any]]:
+    if not select or select.strip() == "*":
+        return [dict(row) for row in rows]
+    return [_project_row(state, table, row, select) for row in rows]
+
+
+def make_handler(state: FakeSupabase):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):  # noqa: A002 - silence request logging
+            pass
+
+        def _send(self, status: int, body: Any = None, content_type: str = "application/json", headers: Optional[Dict[str, str]] = None):
+            if isinstance(body, (bytes, bytearray)):
+                payload = bytes(body)
+            elif body is None:
+                payload = b""
+            else:
+                payload = json.dumps(body, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _body(self) -> bytes:
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        break
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                return b"".join(chunks)
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def _dispatch(self, method: str):
+            body = self._body()
+            if state.latency:
+                time.sleep(state.latency)
+            with state.lock:
+                state.request_count += 1
+            parts = urlsplit(self.path)
+            params = parse_qsl(parts.query, keep_blank_values=True)
+            path = unquote(parts.path)
+            try:
+                if path.startswith("/rest/v1/rpc/"):
+                    return self._rpc(path[len("/rest/v1/rpc/"):], body)
+                if path.startswith("/rest/v1/"):
+                    return self._rest(method, path[len("/rest/v1/"):], params, body)
+                if path.startswith("/storage/v1/"):
+                    return self._storage(method, path[len("/storage/v1/"):], params, body)
+            except Exception as e:  # surface as a PostgREST-style error
+                return self._send(400, {"message": str(e), "code": "FAKE", "details": None, "hint": None})
+            self._send(404, {"message": f"Not found: {path}"})
+
+        def _rest(self, method: str, table: str, params: List[Tuple[str, str]], body: bytes):
+            query = dict(params)
+            prefer = self.headers.get("Prefer", "")
+            single = "vnd.pgrst.object" in self.headers.get("Accept", "")
+            with state.lock:
+                if method == "GET":
+                    rows = _project(state, table, state.select(table, params), query.get("select"))
+                elif method == "POST":
+                    payload = json.loads(body or b"[]")
+                    rows = []
+                    conflict = tuple(query.get("on_conflict", "").split(",")) if query.get("on_conflict") else state.unique.get(table)
+                    for row in payload if isinstance(payload, list) else [payload]:
+                        existing = None
+                        if conflict:
+                            existing = next(
+                                (r for r in state.table(table) if all(r.get(c) == row.get(c) for c in conflict)),
+                                None,
+                            )
+                        if existing is not None:
+                            if "ignore-duplicates" in prefer:
+                                continue
+                            if "merge-duplicates" in prefer:
+                                existing.update(row)
+                                rows.append(dict(existing))
+                                continue
+                            return self._send(409, {"message": "duplicate key value violates unique constraint", "code": "23505", "details": None, "hint": None})
+                        rows.append(dict(state.insert(table, row)))
+                elif method == "PATCH":
+                    values = json.loads(body or b"{}")
+                    rows = []
+                    for row in state.select(table, params):
+                        row.update(values)
+                        rows.append(dict(row))
+                elif method == "DELETE":
+                    doomed = state.select(table, params)
+                    ids = {id(row) for row in doomed}
+                    state.tables[table] = [row for row in state.table(table) if id(row) not in ids]
+                    rows = [dict(row) for row in doomed]
+                else:
+                    return self._send(405, {"message": "Method not allowed"})
+            total = len(rows)
+            if method == "GET" and "count=exact" in prefer:
+                with state.lock:
+                    total = len(state.select(table, [p for p in params if p[0] not in ("limit", "offset")]))
+            headers = {"Content-Range": f"0-{max(len(rows) - 1, 0)}/{total}"}
+            if single:
+                if len(rows) != 1:
+                    return self._send(406, {"message": "JSON object requested, multiple (or no) rows returned", "code": "PGRST116", "details": f"Results contain {len(rows)} rows", "hint": None})
+                return self._send(200, rows[0], headers=headers)
+            if method != "GET" and "return=representation" not in prefer:
+                return self._send(204 if method != "POST" else 201, headers=headers)
+            self._send(201 if method == "POST" else 200, rows, headers=headers)
+
+        def _rpc(self, name: str, body: bytes):
+            fn = state.rpcs.get(name)
+            if fn is None:
+                return self._send(404, {"message": f"Could not find the function public.{name}", "code": "PGRST202", "details": None, "hint": None})
+            try:
+                with state.lock:
+                    result = fn(state, json.loads(body or b"{}"))
+            except (LookupError, ValueError) as e:
+                # What PostgREST returns for an exception raised inside the function
+                return self._send(400, {"message": str(e), "code": "P0001", "details": None, "hint": None})
+            self._send(200, result)
+
+        def _storage(self, method: str, path: str, params: List[Tuple[str, str]], body: bytes):
+            fault = state.storage_faults.draw()
+            if fault == "reset":
+                # Close the connection without answering; the client sees a transport error
+                self.close_connection = True
+                return
+            if fault == "slow":
+                time.sleep(state.storage_faults.slow_ms / 1000.0)
+            elif fault is not None:
+                status = state.storage_faults.error_status
+                return self._send(status, {"statusCode": str(status), "error": "Injected", "message": f"Injected {fault}"})
+            if path.startswith("object/sign/"):
+                key = path[len("object/sign/"):]
+                if method == "POST":
+                    if key not in state.objects:
+                        return self._send(400, {"statusCode": "404", "error": "not_found", "message": "Object not found"})
+                    token = uuid.uuid4().hex
+                    state.signed[token] = (key, time.time() + int(json.loads(body or b"{}").get("expiresIn", 60)))
+                    return self._send(200, {"signedURL": f"/object/sign/{key}?token={token}"})
+                signed_key, expires_at = state.signed.get(dict(params).get("token", ""), ("", 0.0))
+                if signed_key != key or expires_at < time.time():
+                    return self._send(400, {"statusCode": "400", "error": "InvalidJWT", "message": "Invalid or expired token"})
+                return self._send(200, state.objects[key], content_type="application/octet-stream")
+            if path.startswith("object/public/"):
+                key = path[len("object/public/"):]
+                if key not in state.objects:
+                    return self._send(404, {"message": "Object not found"})
+                return self._send(200, state.objects[key], content_type="application/octet-stream")
+            if path.startswith("object/"):
+                key = path[len("object/"):]
+                if method in ("POST", "PUT"):
+                    if method == "POST" and key in state.objects and self.headers.get("x-upsert") != "true":
+                        return self._send(400, {"statusCode": "409", "error": "Duplicate", "message": "The resource already exists"})
+                    with state.lock:
+                        state.objects[key] = body
+                        state.storage_writes += 1
+                    return self._send(200, {"Key": key})
+                if method == "GET":
+                    if key not in state.objects:
+                        return self._send(404, {"message": "Object not found"})
+                    return self._send(200, state.objects[key], content_type="application/octet-stream")
+            self._send(404, {"message": f"Unsupported storage path: {path}"})
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def do_PATCH(self):
+            self._dispatch("PATCH")
+
+        def do_PUT(self):
+            self._dispatch("PUT")
+
+        def do_DELETE(self):
+            self._dispatch("DELETE")
+
+    return Handler
+
+
+class FakeSupabaseServer:
+    """Runs a ``FakeSupabase`` on a background thread."""
+
+    def __init__(self, state: Optional[FakeSupabase] = None, host: str = "127.0.0.1", port: int = 0):
+        self.state = state or FakeSupabase()
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.state))
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeSupabaseServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--storage-error-rate", type=float, default=0.0, help="share of storage requests answered 503")
+    parser.add_argument("--storage-reset-rate", type=float, default=0.0, help="share of storage requests dropped")
+    args = parser.parse_args()
+    state = FakeSupabase(args.latency_ms)
+    state.storage_faults = StorageFaults(error_rate=args.storage_error_rate, reset_rate=args.storage_reset_rate)
+    server = FakeSupabaseServer(state, args.host, args.port)
+    print(f"Fake Supabase listening on {server.url}")
+    server.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
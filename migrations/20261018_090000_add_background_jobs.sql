@@ -0,0 +1,30 @@
+-- Migration: Add Background Job Queue
+-- Moves license PDF rendering/upload off the Stripe webhook request path
+-- All changes are additive and non-breaking
+
+-- 1. Persistent job queue table (survives API restarts)
+CREATE TABLE IF NOT EXISTS background_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    job_type TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    locked_by TEXT,
+    locked_at TIMESTAMPTZ,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Only accessed via service role
+ALTER TABLE background_jobs ENABLE ROW LEVEL SECURITY;
+
+-- Workers poll for due pending jobs; stale-lease recovery scans running jobs
+CREATE INDEX IF NOT EXISTS idx_background_jobs_status_run_at ON background_jobs(status, run_at);
+CREATE INDEX IF NOT EXISTS idx_background_jobs_locked_at ON background_jobs(locked_at) WHERE status = 'running';
+
+-- 2. License rows are created before the PDF exists; the job fills license_url in
+ALTER TABLE licenses
+ALTER COLUMN license_url DROP NOT NULL;
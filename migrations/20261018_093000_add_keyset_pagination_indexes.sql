@@ -0,0 +1,9 @@
+-- Migration: Add Keyset Pagination Indexes
+-- Supports cursor pagination on (created_at, id) for GET /api/beats, /api/orders and /api/licenses
+-- All changes are additive and non-breaking
+
+-- Composite indexes matching ORDER BY created_at DESC, id DESC and the
+-- (created_at, id) < (cursor) seek predicate
+CREATE INDEX IF NOT EXISTS idx_beats_created_at_id ON beats(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_created_at_id ON orders(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_licenses_created_at_id ON licenses(created_at DESC, id DESC);
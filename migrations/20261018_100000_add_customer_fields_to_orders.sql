@@ -0,0 +1,12 @@
+-- Migration: Add Customer Fields to Orders Table
+-- Stores the Stripe customer name/email so license PDFs can be re-issued later
+-- All changes are additive and non-breaking
+
+ALTER TABLE orders
+ADD COLUMN IF NOT EXISTS customer_name TEXT;
+
+ALTER TABLE orders
+ADD COLUMN IF NOT EXISTS customer_email TEXT;
+
+-- Re-issue selects licenses by beat/type and date range
+CREATE INDEX IF NOT EXISTS idx_licenses_license_type_created_at ON licenses(license_type, created_at);
@@ -0,0 +1,112 @@
+-- Migration: Idempotent Stripe Webhook Processing
+-- Persists every verified Stripe event keyed by its event ID and makes fulfillment exactly-once
+-- All changes are additive and non-breaking
+
+-- 1. Stripe event ID (unique) and processing outcome on webhook_events
+ALTER TABLE webhook_events
+ADD COLUMN IF NOT EXISTS stripe_event_id TEXT;
+
+ALTER TABLE webhook_events
+ADD COLUMN IF NOT EXISTS processed_at TIMESTAMPTZ;
+
+ALTER TABLE webhook_events
+ADD COLUMN IF NOT EXISTS error TEXT;
+
+-- Failed processing attempts and when the replay sweep may try again (exponential backoff);
+-- events that keep failing are given up on (processed = TRUE, error kept)
+ALTER TABLE webhook_events
+ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE webhook_events
+ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+-- Unique index doubles as the ON CONFLICT target for INSERT ... ON CONFLICT DO NOTHING
+CREATE UNIQUE INDEX IF NOT EXISTS idx_webhook_events_stripe_event_id ON webhook_events(stripe_event_id);
+
+-- Replay tool scans unprocessed events that are due, oldest first
+CREATE INDEX IF NOT EXISTS idx_webhook_events_unprocessed ON webhook_events(next_attempt_at, created_at) WHERE processed = FALSE;
+
+-- 2. fulfill_checkout marks the event processed in the same transaction
+DROP FUNCTION IF EXISTS fulfill_checkout(TEXT, INTEGER, UUID, TEXT, INTEGER, UUID, TEXT, TEXT);
+
+CREATE OR REPLACE FUNCTION fulfill_checkout(
+    p_stripe_checkout_id TEXT,
+    p_total_cents INTEGER,
+    p_beat_id UUID,
+    p_license_type TEXT,
+    p_price_cents INTEGER,
+    p_user_id UUID DEFAULT NULL,
+    p_customer_name TEXT DEFAULT NULL,
+    p_customer_email TEXT DEFAULT NULL,
+    p_stripe_event_id TEXT DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_beat beats%ROWTYPE;
+    v_order_id UUID;
+    v_order_item_id UUID;
+    v_license_id UUID;
+    v_event_processed BOOLEAN;
+BEGIN
+    -- Lock the event row: concurrent redeliveries wait here, then see processed = TRUE
+    IF p_stripe_event_id IS NOT NULL THEN
+        SELECT processed INTO v_event_processed
+        FROM webhook_events
+        WHERE stripe_event_id = p_stripe_event_id
+        FOR UPDATE;
+
+        IF v_event_processed THEN
+            RETURN jsonb_build_object('duplicate', TRUE);
+        END IF;
+    END IF;
+
+    -- Lock the beat row for exclusive licenses so concurrent fulfillments serialize
+    IF p_license_type = 'premium_trackout_exclusive' THEN
+        SELECT * INTO v_beat FROM beats WHERE id = p_beat_id FOR UPDATE;
+    ELSE
+        SELECT * INTO v_beat FROM beats WHERE id = p_beat_id;
+    END IF;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Beat % not found', p_beat_id USING ERRCODE = 'P0002';
+    END IF;
+
+    INSERT INTO orders (user_id, stripe_checkout_id, total_cents, status, customer_name, customer_email)
+    VALUES (p_user_id, p_stripe_checkout_id, p_total_cents, 'completed', p_customer_name, p_customer_email)
+    RETURNING id INTO v_order_id;
+
+    INSERT INTO order_items (order_id, beat_id, license_type, price_cents)
+    VALUES (v_order_id, p_beat_id, p_license_type, p_price_cents)
+    RETURNING id INTO v_order_item_id;
+
+    -- license_url is filled in by the render_license background job
+    INSERT INTO licenses (order_item_id, user_id, beat_id, license_type, license_url)
+    VALUES (v_order_item_id, p_user_id, p_beat_id, p_license_type, NULL)
+    RETURNING id INTO v_license_id;
+
+    IF p_license_type = 'premium_trackout_exclusive' THEN
+        UPDATE beats SET is_active = FALSE, updated_at = NOW() WHERE id = p_beat_id;
+    END IF;
+
+    IF p_stripe_event_id IS NOT NULL THEN
+        UPDATE webhook_events
+        SET processed = TRUE, processed_at = NOW(), error = NULL
+        WHERE stripe_event_id = p_stripe_event_id;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'order_id', v_order_id,
+        'order_item_id', v_order_item_id,
+        'license_id', v_license_id,
+        'beat_title', v_beat.title,
+        'producer_name', v_beat.producer_name,
+        'licensor_legal_name', v_beat.licensor_legal_name
+    );
+END;
+$$;
+
+-- Only the backend (service role) may fulfill orders
+REVOKE EXECUTE ON FUNCTION fulfill_checkout(TEXT, INTEGER, UUID, TEXT, INTEGER, UUID, TEXT, TEXT, TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION fulfill_checkout(TEXT, INTEGER, UUID, TEXT, INTEGER, UUID, TEXT, TEXT, TEXT) TO service_role;
@@ -0,0 +1,219 @@
+-- Migration: Add Sales Analytics Rollups
+-- Incrementally maintained revenue rollups behind /api/analytics, so the admin dashboard
+-- no longer aggregates the full order history client-side
+-- All changes are additive and non-breaking
+
+-- Revenue per day, beat and license type (completed orders only). One row per
+-- (day, beat, license type) that had a sale, so reads scale with the date
+-- window and catalog size, not with the number of orders.
+CREATE TABLE IF NOT EXISTS sales_daily_rollup (
+    day DATE NOT NULL,
+    beat_id UUID NOT NULL REFERENCES beats(id),
+    license_type TEXT NOT NULL,
+    items_count INTEGER NOT NULL DEFAULT 0,
+    revenue_cents BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, beat_id, license_type)
+);
+
+-- Revenue per day across the catalog, for time series (one row per day with a sale)
+CREATE TABLE IF NOT EXISTS sales_daily_totals (
+    day DATE PRIMARY KEY,
+    items_count INTEGER NOT NULL DEFAULT 0,
+    revenue_cents BIGINT NOT NULL DEFAULT 0
+);
+
+-- All-time totals per beat and license type, for unbounded top-beats queries
+CREATE TABLE IF NOT EXISTS sales_beat_totals (
+    beat_id UUID NOT NULL REFERENCES beats(id),
+    license_type TEXT NOT NULL,
+    items_count INTEGER NOT NULL DEFAULT 0,
+    revenue_cents BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (beat_id, license_type)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sales_beat_totals_revenue ON sales_beat_totals(revenue_cents DESC);
+
+-- Add (or with negative arguments, remove) one order item's contribution
+CREATE OR REPLACE FUNCTION apply_sales_rollup_delta(
+    p_day DATE,
+    p_beat_id UUID,
+    p_license_type TEXT,
+    p_items INTEGER,
+    p_revenue_cents BIGINT
+)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO sales_daily_rollup (day, beat_id, license_type, items_count, revenue_cents)
+    VALUES (p_day, p_beat_id, p_license_type, p_items, p_revenue_cents)
+    ON CONFLICT (day, beat_id, license_type) DO UPDATE
+    SET items_count = sales_daily_rollup.items_count + EXCLUDED.items_count,
+        revenue_cents = sales_daily_rollup.revenue_cents + EXCLUDED.revenue_cents;
+
+    INSERT INTO sales_daily_totals (day, items_count, revenue_cents)
+    VALUES (p_day, p_items, p_revenue_cents)
+    ON CONFLICT (day) DO UPDATE
+    SET items_count = sales_daily_totals.items_count + EXCLUDED.items_count,
+        revenue_cents = sales_daily_totals.revenue_cents + EXCLUDED.revenue_cents;
+
+    INSERT INTO sales_beat_totals (beat_id, license_type, items_count, revenue_cents)
+    VALUES (p_beat_id, p_license_type, p_items, p_revenue_cents)
+    ON CONFLICT (beat_id, license_type) DO UPDATE
+    SET items_count = sales_beat_totals.items_count + EXCLUDED.items_count,
+        revenue_cents = sales_beat_totals.revenue_cents + EXCLUDED.revenue_cents;
+$$;
+
+-- New order items (fulfill_checkout inserts them in the same transaction as the order)
+CREATE OR REPLACE FUNCTION sales_rollup_on_order_item()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_order orders%ROWTYPE;
+BEGIN
+    SELECT * INTO v_order FROM orders WHERE id = NEW.order_id;
+    IF v_order.status = 'completed' THEN
+        PERFORM apply_sales_rollup_delta(
+            v_order.created_at::date, NEW.beat_id, NEW.license_type, 1, NEW.price_cents
+        );
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_sales_rollup_order_item ON order_items;
+CREATE TRIGGER trg_sales_rollup_order_item
+    AFTER INSERT ON order_items
+    FOR EACH ROW EXECUTE FUNCTION sales_rollup_on_order_item();
+
+-- Orders entering or leaving 'completed' (e.g. a future refund flow) move their items in or out
+CREATE OR REPLACE FUNCTION sales_rollup_on_order_status()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_sign INTEGER;
+BEGIN
+    IF NEW.status = 'completed' THEN
+        v_sign := 1;
+    ELSE
+        v_sign := -1;
+    END IF;
+    PERFORM apply_sales_rollup_delta(NEW.created_at::date, oi.beat_id, oi.license_type, v_sign, v_sign * oi.price_cents)
+    FROM order_items oi
+    WHERE oi.order_id = NEW.id;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_sales_rollup_order_status ON orders;
+CREATE TRIGGER trg_sales_rollup_order_status
+    AFTER UPDATE OF status ON orders
+    FOR EACH ROW
+    WHEN ((OLD.status = 'completed') IS DISTINCT FROM (NEW.status = 'completed'))
+    EXECUTE FUNCTION sales_rollup_on_order_status();
+
+-- Rebuild the rollups from order_items (from p_from onwards, or everything).
+-- Used for the initial backfill and to repair drift after manual data fixes.
+CREATE OR REPLACE FUNCTION refresh_sales_rollups(p_from DATE DEFAULT NULL)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_days INTEGER;
+BEGIN
+    DELETE FROM sales_daily_rollup WHERE p_from IS NULL OR day >= p_from;
+
+    INSERT INTO sales_daily_rollup (day, beat_id, license_type, items_count, revenue_cents)
+    SELECT o.created_at::date, oi.beat_id, oi.license_type, COUNT(*), SUM(oi.price_cents)
+    FROM order_items oi
+    JOIN orders o ON o.id = oi.order_id
+    WHERE o.status = 'completed'
+      AND (p_from IS NULL OR o.created_at >= p_from)
+    GROUP BY 1, 2, 3;
+
+    -- Totals are re-derived from the (much smaller) daily table
+    DELETE FROM sales_daily_totals WHERE p_from IS NULL OR day >= p_from;
+    INSERT INTO sales_daily_totals (day, items_count, revenue_cents)
+    SELECT day, SUM(items_count), SUM(revenue_cents)
+    FROM sales_daily_rollup
+    WHERE p_from IS NULL OR day >= p_from
+    GROUP BY day;
+
+    DELETE FROM sales_beat_totals;
+    INSERT INTO sales_beat_totals (beat_id, license_type, items_count, revenue_cents)
+    SELECT beat_id, license_type, SUM(items_count), SUM(revenue_cents)
+    FROM sales_daily_rollup
+    GROUP BY beat_id, license_type;
+
+    SELECT COUNT(*) INTO v_days FROM sales_daily_totals WHERE p_from IS NULL OR day >= p_from;
+    RETURN jsonb_build_object('days_refreshed', v_days);
+END;
+$$;
+
+-- Read functions for the API (date window is [p_from, p_to), NULL = unbounded)
+CREATE OR REPLACE FUNCTION sales_top_beats(p_from DATE DEFAULT NULL, p_to DATE DEFAULT NULL, p_limit INTEGER DEFAULT 10)
+RETURNS TABLE (beat_id UUID, title TEXT, items_count BIGINT, revenue_cents BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH per_beat AS (
+        SELECT t.beat_id, SUM(t.items_count)::BIGINT AS items_count, SUM(t.revenue_cents)::BIGINT AS revenue_cents
+        FROM sales_beat_totals t
+        WHERE p_from IS NULL AND p_to IS NULL
+        GROUP BY t.beat_id
+        UNION ALL
+        SELECT r.beat_id, SUM(r.items_count)::BIGINT, SUM(r.revenue_cents)::BIGINT
+        FROM sales_daily_rollup r
+        WHERE (p_from IS NOT NULL OR p_to IS NOT NULL)
+          AND (p_from IS NULL OR r.day >= p_from)
+          AND (p_to IS NULL OR r.day < p_to)
+        GROUP BY r.beat_id
+    )
+    SELECT p.beat_id, b.title, p.items_count, p.revenue_cents
+    FROM per_beat p
+    JOIN beats b ON b.id = p.beat_id
+    ORDER BY p.revenue_cents DESC, p.beat_id
+    LIMIT p_limit;
+$$;
+
+CREATE OR REPLACE FUNCTION sales_by_license_type(p_from DATE DEFAULT NULL, p_to DATE DEFAULT NULL)
+RETURNS TABLE (license_type TEXT, items_count BIGINT, revenue_cents BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT t.license_type, SUM(t.items_count)::BIGINT, SUM(t.revenue_cents)::BIGINT
+    FROM sales_beat_totals t
+    WHERE p_from IS NULL AND p_to IS NULL
+    GROUP BY t.license_type
+    UNION ALL
+    SELECT r.license_type, SUM(r.items_count)::BIGINT, SUM(r.revenue_cents)::BIGINT
+    FROM sales_daily_rollup r
+    WHERE (p_from IS NOT NULL OR p_to IS NOT NULL)
+      AND (p_from IS NULL OR r.day >= p_from)
+      AND (p_to IS NULL OR r.day < p_to)
+    GROUP BY r.license_type
+    ORDER BY 3 DESC;
+$$;
+
+CREATE OR REPLACE FUNCTION sales_timeseries(p_granularity TEXT, p_from DATE DEFAULT NULL, p_to DATE DEFAULT NULL)
+RETURNS TABLE (period DATE, items_count BIGINT, revenue_cents BIGINT)
+LANGUAGE plpgsql
+STABLE
+AS $$
+BEGIN
+    IF p_granularity NOT IN ('day', 'week', 'month') THEN
+        RAISE EXCEPTION 'granularity must be day, week or month, got %', p_granularity;
+    END IF;
+    RETURN QUERY
+    SELECT date_trunc(p_granularity, r.day)::date, SUM(r.items_count)::BIGINT, SUM(r.revenue_cents)::BIGINT
+    FROM sales_daily_totals r
+    WHERE (p_from IS NULL OR r.day >= p_from)
+      AND (p_to IS NULL OR r.day < p_to)
+    GROUP BY 1
+    ORDER BY 1;
+END;
+$$;
+
+-- Backfill from existing orders
+SELECT refresh_sales_rollups();
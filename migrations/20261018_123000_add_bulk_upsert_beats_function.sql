@@ -0,0 +1,73 @@
+-- Migration: Add bulk_upsert_beats Function
+-- Inserts or updates many beats in one multi-row statement (one transaction) for POST /api/beats/bulk
+-- All changes are additive and non-breaking
+
+-- p_beats is a JSON array of beat objects. Objects with an "id" of an existing beat update
+-- only the columns they contain (a key left out keeps the stored value, so re-importing a row
+-- never clears previews, detected bpm/key or a sold exclusive's is_active); objects with an
+-- unknown "id" create the beat with that id and objects without one are inserted. Returns one
+-- row per input element, in input order, with the beat id and whether it was created.
+-- Any error (e.g. a NOT NULL violation) rolls back the whole call.
+CREATE OR REPLACE FUNCTION bulk_upsert_beats(p_beats JSONB)
+RETURNS TABLE (ordinal BIGINT, id UUID, created BOOLEAN)
+LANGUAGE sql
+AS $$
+    WITH input AS (
+        SELECT
+            elem.ordinality AS ordinal,
+            COALESCE((elem.value->>'id')::uuid, gen_random_uuid()) AS id,
+            elem.value AS beat
+        FROM jsonb_array_elements(p_beats) WITH ORDINALITY AS elem(value, ordinality)
+    ),
+    updated AS (
+        UPDATE beats SET
+            title = CASE WHEN input.beat ? 'title' THEN input.beat->>'title' ELSE beats.title END,
+            bpm = CASE WHEN input.beat ? 'bpm' THEN (input.beat->>'bpm')::integer ELSE beats.bpm END,
+            key = CASE WHEN input.beat ? 'key' THEN input.beat->>'key' ELSE beats.key END,
+            genre = CASE WHEN input.beat ? 'genre' THEN input.beat->>'genre' ELSE beats.genre END,
+            price_cents = CASE WHEN input.beat ? 'price_cents' THEN (input.beat->>'price_cents')::integer ELSE beats.price_cents END,
+            license_type = CASE WHEN input.beat ? 'license_type' THEN input.beat->>'license_type' ELSE beats.license_type END,
+            audio_url = CASE WHEN input.beat ? 'audio_url' THEN input.beat->>'audio_url' ELSE beats.audio_url END,
+            preview_url = CASE WHEN input.beat ? 'preview_url' THEN input.beat->>'preview_url' ELSE beats.preview_url END,
+            is_active = CASE WHEN input.beat ? 'is_active' THEN (input.beat->>'is_active')::boolean ELSE beats.is_active END,
+            producer_name = CASE WHEN input.beat ? 'producer_name' THEN input.beat->>'producer_name' ELSE beats.producer_name END,
+            licensor_legal_name = CASE WHEN input.beat ? 'licensor_legal_name' THEN input.beat->>'licensor_legal_name' ELSE beats.licensor_legal_name END,
+            updated_at = NOW()
+        FROM input
+        WHERE beats.id = input.id
+        RETURNING beats.id
+    ),
+    inserted AS (
+        INSERT INTO beats (
+            id, title, bpm, key, genre, price_cents, license_type, audio_url, preview_url,
+            is_active, producer_name, licensor_legal_name
+        )
+        SELECT
+            input.id,
+            beat->>'title',
+            (beat->>'bpm')::integer,
+            beat->>'key',
+            beat->>'genre',
+            (beat->>'price_cents')::integer,
+            beat->>'license_type',
+            beat->>'audio_url',
+            beat->>'preview_url',
+            COALESCE((beat->>'is_active')::boolean, TRUE),
+            beat->>'producer_name',
+            beat->>'licensor_legal_name'
+        FROM input
+        -- Both CTEs see the beats as they were before the call, so each row goes to exactly one
+        WHERE NOT EXISTS (SELECT 1 FROM beats WHERE beats.id = input.id)
+        ORDER BY input.ordinal
+        RETURNING beats.id
+    ),
+    written AS (
+        SELECT updated.id, FALSE AS created FROM updated
+        UNION ALL
+        SELECT inserted.id, TRUE AS created FROM inserted
+    )
+    SELECT input.ordinal, written.id, written.created
+    FROM input
+    JOIN written ON written.id = input.id
+    ORDER BY input.ordinal;
+$$;
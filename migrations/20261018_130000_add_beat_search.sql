@@ -0,0 +1,111 @@
+-- Migration: Add Beat Search
+-- Full-text search vector, GIN / btree indexes and the search_beats function behind
+-- GET /api/beats/search (used when BEAT_SEARCH_BACKEND=postgres)
+-- All changes are additive and non-breaking
+
+-- Title (weight A), producer (B) and genre (C), 'simple' config: beat titles are
+-- names and slang, so no stemming or stop words
+ALTER TABLE beats ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', COALESCE(title, '')), 'A') ||
+        setweight(to_tsvector('simple', COALESCE(producer_name, '')), 'B') ||
+        setweight(to_tsvector('simple', COALESCE(genre, '')), 'C')
+    ) STORED;
+
+-- Search only ever looks at active beats, so the indexes are partial. Genre, key and license
+-- type are compared trimmed and lowercased (as the in-memory backend does), so those indexes are
+-- on the same expressions search_beats filters on
+CREATE INDEX IF NOT EXISTS idx_beats_search_vector ON beats USING GIN (search_vector) WHERE is_active;
+CREATE INDEX IF NOT EXISTS idx_beats_active_bpm ON beats(bpm) WHERE is_active;
+CREATE INDEX IF NOT EXISTS idx_beats_active_price ON beats(price_cents) WHERE is_active;
+CREATE INDEX IF NOT EXISTS idx_beats_active_key ON beats(lower(trim(key))) WHERE is_active;
+CREATE INDEX IF NOT EXISTS idx_beats_active_genre ON beats(lower(trim(genre))) WHERE is_active;
+CREATE INDEX IF NOT EXISTS idx_beats_active_license_type ON beats(lower(trim(license_type))) WHERE is_active;
+
+-- Returns {"total": n, "results": [...], "facets": {"genre": {...}, "key": {...}, "license_type": {...}}}.
+-- Every term must match; the last one also matches as a prefix when it has 2+ characters.
+-- Beats whose title matches every term come first, then newest first.
+CREATE OR REPLACE FUNCTION search_beats(
+    p_q TEXT DEFAULT NULL,
+    p_genre TEXT DEFAULT NULL,
+    p_key TEXT DEFAULT NULL,
+    p_license_type TEXT DEFAULT NULL,
+    p_bpm_min INTEGER DEFAULT NULL,
+    p_bpm_max INTEGER DEFAULT NULL,
+    p_price_min INTEGER DEFAULT NULL,
+    p_price_max INTEGER DEFAULT NULL,
+    p_limit INTEGER DEFAULT 20,
+    p_offset INTEGER DEFAULT 0
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+    v_terms TEXT[];
+    v_query TSQUERY;
+    v_title_query TSQUERY;
+    v_result JSONB;
+BEGIN
+    -- Normalized like the stored values; a blank filter is no filter
+    p_genre := NULLIF(lower(trim(p_genre)), '');
+    p_key := NULLIF(lower(trim(p_key)), '');
+    p_license_type := NULLIF(lower(trim(p_license_type)), '');
+
+    SELECT array_agg(term) INTO v_terms
+    FROM regexp_split_to_table(lower(COALESCE(p_q, '')), '\W+') AS term
+    WHERE term <> '';
+
+    IF v_terms IS NOT NULL THEN
+        -- Quote each term so user input cannot inject tsquery operators
+        SELECT
+            to_tsquery('simple', string_agg(quote_literal(term) || CASE WHEN prefix THEN ':*' ELSE '' END, ' & ')),
+            to_tsquery('simple', string_agg(quote_literal(term) || CASE WHEN prefix THEN ':*A' ELSE ':A' END, ' & '))
+        INTO v_query, v_title_query
+        FROM (
+            SELECT term, ordinality = array_length(v_terms, 1) AND length(term) >= 2 AS prefix
+            FROM unnest(v_terms) WITH ORDINALITY AS t(term, ordinality)
+        ) AS terms;
+    END IF;
+
+    WITH matched AS (
+        SELECT b.*, (v_title_query IS NOT NULL AND b.search_vector @@ v_title_query) AS title_match
+        FROM beats b
+        WHERE b.is_active
+          AND (v_query IS NULL OR b.search_vector @@ v_query)
+          AND (p_genre IS NULL OR lower(trim(b.genre)) = p_genre)
+          AND (p_key IS NULL OR lower(trim(b.key)) = p_key)
+          AND (p_license_type IS NULL OR lower(trim(b.license_type)) = p_license_type)
+          AND (p_bpm_min IS NULL OR b.bpm >= p_bpm_min)
+          AND (p_bpm_max IS NULL OR b.bpm <= p_bpm_max)
+          AND (p_price_min IS NULL OR b.price_cents >= p_price_min)
+          AND (p_price_max IS NULL OR b.price_cents <= p_price_max)
+    ),
+    page AS (
+        SELECT id, title, bpm, key, genre, price_cents, license_type, preview_url, producer_name, created_at, title_match
+        FROM matched
+        ORDER BY title_match DESC, created_at DESC, id DESC
+        LIMIT p_limit OFFSET p_offset
+    )
+    SELECT jsonb_build_object(
+        'total', (SELECT COUNT(*) FROM matched),
+        'results', COALESCE((
+            SELECT jsonb_agg(to_jsonb(page) - 'title_match' ORDER BY page.title_match DESC, page.created_at DESC, page.id DESC)
+            FROM page
+        ), '[]'::jsonb),
+        'facets', jsonb_build_object(
+            'genre', COALESCE((SELECT jsonb_object_agg(value, count) FROM (
+                SELECT lower(trim(genre)) AS value, COUNT(*) AS count FROM matched
+                WHERE trim(COALESCE(genre, '')) <> '' GROUP BY 1) AS f), '{}'::jsonb),
+            'key', COALESCE((SELECT jsonb_object_agg(value, count) FROM (
+                SELECT lower(trim(key)) AS value, COUNT(*) AS count FROM matched
+                WHERE trim(COALESCE(key, '')) <> '' GROUP BY 1) AS f), '{}'::jsonb),
+            'license_type', COALESCE((SELECT jsonb_object_agg(value, count) FROM (
+                SELECT lower(trim(license_type)) AS value, COUNT(*) AS count FROM matched
+                WHERE trim(COALESCE(license_type, '')) <> '' GROUP BY 1) AS f), '{}'::jsonb)
+        )
+    ) INTO v_result;
+
+    RETURN v_result;
+END;
+$$;
@@ -0,0 +1,18 @@
+-- Migration: Add Download Log Fields
+-- Lets GET /api/downloads/{license_id} record each download in the downloads table
+-- All changes are additive and non-breaking
+
+-- 1. Guest checkouts have no user, like orders.user_id and licenses.user_id
+ALTER TABLE downloads
+ALTER COLUMN user_id DROP NOT NULL;
+
+-- 2. Which license was used and what was downloaded ('license' PDF or 'audio')
+ALTER TABLE downloads
+ADD COLUMN IF NOT EXISTS license_id UUID REFERENCES licenses(id);
+
+ALTER TABLE downloads
+ADD COLUMN IF NOT EXISTS kind TEXT;
+
+-- 3. Download history per license and per order, newest first
+CREATE INDEX IF NOT EXISTS idx_downloads_license_id_created_at ON downloads(license_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_downloads_order_id ON downloads(order_id);
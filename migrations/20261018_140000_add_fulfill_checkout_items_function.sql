@@ -0,0 +1,123 @@
+-- Migration: Add fulfill_checkout_items Function
+-- Fulfills a multi-item Stripe checkout (one order, N order_items and licenses) in one transaction
+-- All changes are additive and non-breaking
+
+-- p_items is a JSON array of {"beat_id", "license_type", "price_cents"}. Inserts the
+-- order, then every order_item and license in one multi-row statement each, and
+-- deactivates exclusively licensed beats. Event handling matches fulfill_checkout:
+-- the webhook_events row is locked and marked processed in the same transaction.
+-- Returns {"order_id", "items": [{"order_item_id", "license_id", "beat_id", "license_type",
+-- "price_cents", "beat_title", "producer_name", "licensor_legal_name"}, ...]} in input
+-- order, or {"duplicate": true}.
+CREATE OR REPLACE FUNCTION fulfill_checkout_items(
+    p_stripe_checkout_id TEXT,
+    p_total_cents INTEGER,
+    p_items JSONB,
+    p_user_id UUID DEFAULT NULL,
+    p_customer_name TEXT DEFAULT NULL,
+    p_customer_email TEXT DEFAULT NULL,
+    p_stripe_event_id TEXT DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_order_id UUID;
+    v_event_processed BOOLEAN;
+    v_missing UUID;
+    v_items JSONB;
+BEGIN
+    -- Lock the event row: concurrent redeliveries wait here, then see processed = TRUE
+    IF p_stripe_event_id IS NOT NULL THEN
+        SELECT processed INTO v_event_processed
+        FROM webhook_events
+        WHERE stripe_event_id = p_stripe_event_id
+        FOR UPDATE;
+
+        IF v_event_processed THEN
+            RETURN jsonb_build_object('duplicate', TRUE);
+        END IF;
+    END IF;
+
+    IF jsonb_typeof(p_items) IS DISTINCT FROM 'array' OR jsonb_array_length(p_items) = 0 THEN
+        RAISE EXCEPTION 'p_items must be a non-empty array' USING ERRCODE = '22023';
+    END IF;
+
+    SELECT (item->>'beat_id')::uuid INTO v_missing
+    FROM jsonb_array_elements(p_items) AS item
+    WHERE NOT EXISTS (SELECT 1 FROM beats WHERE beats.id = (item->>'beat_id')::uuid)
+    LIMIT 1;
+
+    IF v_missing IS NOT NULL THEN
+        RAISE EXCEPTION 'Beat % not found', v_missing USING ERRCODE = 'P0002';
+    END IF;
+
+    -- Lock beats sold exclusively so concurrent fulfillments serialize; id order avoids deadlocks
+    PERFORM 1 FROM beats
+    WHERE id IN (
+        SELECT (item->>'beat_id')::uuid FROM jsonb_array_elements(p_items) AS item
+        WHERE item->>'license_type' = 'premium_trackout_exclusive'
+    )
+    ORDER BY id
+    FOR UPDATE;
+
+    INSERT INTO orders (user_id, stripe_checkout_id, total_cents, status, customer_name, customer_email)
+    VALUES (p_user_id, p_stripe_checkout_id, p_total_cents, 'completed', p_customer_name, p_customer_email)
+    RETURNING id INTO v_order_id;
+
+    -- Ids are generated up front so each license can reference its order_item in the same
+    -- statement (foreign keys are checked at its end; data-modifying CTEs always run to
+    -- completion). license_url is filled in by the render_license background job
+    WITH input AS MATERIALIZED (
+        SELECT
+            elem.ordinality AS ordinal,
+            gen_random_uuid() AS order_item_id,
+            gen_random_uuid() AS license_id,
+            (elem.value->>'beat_id')::uuid AS beat_id,
+            elem.value->>'license_type' AS license_type,
+            (elem.value->>'price_cents')::integer AS price_cents
+        FROM jsonb_array_elements(p_items) WITH ORDINALITY AS elem(value, ordinality)
+    ),
+    new_items AS (
+        INSERT INTO order_items (id, order_id, beat_id, license_type, price_cents)
+        SELECT order_item_id, v_order_id, beat_id, license_type, price_cents FROM input ORDER BY ordinal
+        RETURNING id
+    ),
+    new_licenses AS (
+        INSERT INTO licenses (id, order_item_id, user_id, beat_id, license_type, license_url)
+        SELECT license_id, order_item_id, p_user_id, beat_id, license_type, NULL FROM input ORDER BY ordinal
+        RETURNING id
+    )
+    SELECT jsonb_agg(jsonb_build_object(
+        'order_item_id', input.order_item_id,
+        'license_id', input.license_id,
+        'beat_id', input.beat_id,
+        'license_type', input.license_type,
+        'price_cents', input.price_cents,
+        'beat_title', b.title,
+        'producer_name', b.producer_name,
+        'licensor_legal_name', b.licensor_legal_name
+    ) ORDER BY input.ordinal)
+    INTO v_items
+    FROM input
+    JOIN beats b ON b.id = input.beat_id;
+
+    UPDATE beats SET is_active = FALSE, updated_at = NOW()
+    WHERE id IN (
+        SELECT (item->>'beat_id')::uuid FROM jsonb_array_elements(p_items) AS item
+        WHERE item->>'license_type' = 'premium_trackout_exclusive'
+    );
+
+    IF p_stripe_event_id IS NOT NULL THEN
+        UPDATE webhook_events
+        SET processed = TRUE, processed_at = NOW(), error = NULL
+        WHERE stripe_event_id = p_stripe_event_id;
+    END IF;
+
+    RETURN jsonb_build_object('order_id', v_order_id, 'items', COALESCE(v_items, '[]'::jsonb));
+END;
+$$;
+
+-- Only the backend (service role) may fulfill orders
+REVOKE EXECUTE ON FUNCTION fulfill_checkout_items(TEXT, INTEGER, JSONB, UUID, TEXT, TEXT, TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION fulfill_checkout_items(TEXT, INTEGER, JSONB, UUID, TEXT, TEXT, TEXT) TO service_role;
@@ -0,0 +1,14 @@
+-- Migration: Add Beat Media Fields
+-- Stores the waveform and duration generated from each beat's audio alongside its preview clip
+-- All changes are additive and non-breaking
+
+-- 1. Waveform peaks file (int16 min/max pairs) and track length
+ALTER TABLE beats
+ADD COLUMN IF NOT EXISTS waveform_url TEXT;
+
+ALTER TABLE beats
+ADD COLUMN IF NOT EXISTS duration_ms INTEGER;
+
+-- 2. The audio_url the preview and waveform were generated from; a new upload regenerates them
+ALTER TABLE beats
+ADD COLUMN IF NOT EXISTS media_source_url TEXT;
@@ -0,0 +1,20 @@
+-- Migration: Add Beat Analysis Fields
+-- Stores the tempo and key detected from each beat's audio, with confidence scores
+-- All changes are additive and non-breaking
+
+-- 1. Last detection; bpm/key are filled from it unless they were entered by hand
+ALTER TABLE beats
+ADD COLUMN IF NOT EXISTS detected_bpm INTEGER;
+
+ALTER TABLE beats
+ADD COLUMN IF NOT EXISTS detected_key TEXT;
+
+-- 2. Confidence of each detection, from 0 (a guess) to 1
+ALTER TABLE beats
+ADD COLUMN IF NOT EXISTS bpm_confidence REAL CHECK (bpm_confidence BETWEEN 0 AND 1);
+
+ALTER TABLE beats
+ADD COLUMN IF NOT EXISTS key_confidence REAL CHECK (key_confidence BETWEEN 0 AND 1);
+
+-- 3. The analysis backfill pages through beats missing either value
+CREATE INDEX IF NOT EXISTS idx_beats_missing_bpm_or_key ON beats(id) WHERE bpm IS NULL OR key IS NULL;
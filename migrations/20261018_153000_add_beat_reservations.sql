@@ -0,0 +1,254 @@
+-- Migration: Add Beat Reservations
+-- Short-lived holds on beats sold exclusively, so only one buyer can check out an exclusive license
+-- All changes are additive and non-breaking
+
+-- 1. One row per beat: the current (or last) hold on its exclusive license.
+-- A hold is live while status = 'held' and expires_at is in the future; an expired
+-- hold needs no cleanup to stop counting (the maintenance sweep marks it released).
+-- 'converted' means the exclusive license was sold (order_id).
+CREATE TABLE IF NOT EXISTS beat_reservations (
+    beat_id UUID PRIMARY KEY REFERENCES beats(id) ON DELETE CASCADE,
+    hold_token UUID NOT NULL,
+    stripe_checkout_id TEXT,
+    status TEXT NOT NULL DEFAULT 'held' CHECK (status IN ('held', 'converted', 'released')),
+    expires_at TIMESTAMPTZ NOT NULL,
+    order_id UUID REFERENCES orders(id) ON DELETE SET NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Only accessed via service role
+ALTER TABLE beat_reservations ENABLE ROW LEVEL SECURITY;
+
+-- Holds are attached to and released by their checkout session or token
+CREATE INDEX IF NOT EXISTS idx_beat_reservations_checkout ON beat_reservations(stripe_checkout_id)
+WHERE stripe_checkout_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_beat_reservations_token ON beat_reservations(hold_token);
+-- Storefront availability and the expiry sweep read the live holds
+CREATE INDEX IF NOT EXISTS idx_beat_reservations_held ON beat_reservations(expires_at) WHERE status = 'held';
+
+-- 2. Exclusive sales are looked up per beat when reserving and fulfilling
+CREATE INDEX IF NOT EXISTS idx_licenses_exclusive_beat ON licenses(beat_id)
+WHERE license_type = 'premium_trackout_exclusive';
+
+-- 3. Reserve the exclusive license of every beat in p_beat_ids, or none of them.
+-- The beats rows are locked first (in id order, so overlapping requests cannot
+-- deadlock): a second request for the same beat waits for the first to commit and
+-- then sees its hold. The upsert alone would not do - under READ COMMITTED two
+-- inserts of a new row both succeed, the second as an update of the first.
+-- A beat is unavailable if it is missing or inactive, already sold exclusively, or
+-- held by a live hold with another token; reserving again with the same token
+-- extends the hold.
+-- Returns {"reserved": true, "unavailable": [], "expires_at"} or
+-- {"reserved": false, "unavailable": [beat ids]}.
+CREATE OR REPLACE FUNCTION reserve_exclusive_beats(
+    p_beat_ids UUID[],
+    p_hold_token UUID,
+    p_ttl_seconds INTEGER
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_unavailable UUID[];
+    v_expires_at TIMESTAMPTZ := NOW() + make_interval(secs => p_ttl_seconds);
+BEGIN
+    IF p_beat_ids IS NULL OR cardinality(p_beat_ids) = 0 THEN
+        RAISE EXCEPTION 'p_beat_ids must be a non-empty array' USING ERRCODE = '22023';
+    END IF;
+    IF p_ttl_seconds IS NULL OR p_ttl_seconds <= 0 THEN
+        RAISE EXCEPTION 'p_ttl_seconds must be positive' USING ERRCODE = '22023';
+    END IF;
+
+    PERFORM 1 FROM beats
+    WHERE id = ANY(p_beat_ids)
+    ORDER BY id
+    FOR UPDATE;
+
+    SELECT array_agg(requested.id ORDER BY requested.id) INTO v_unavailable
+    FROM (SELECT DISTINCT unnest(p_beat_ids) AS id) AS requested
+    LEFT JOIN beats b ON b.id = requested.id
+    LEFT JOIN beat_reservations r ON r.beat_id = requested.id
+    WHERE b.id IS NULL
+       OR NOT b.is_active
+       OR r.status = 'converted'
+       OR (r.status = 'held' AND r.expires_at > NOW() AND r.hold_token <> p_hold_token)
+       OR EXISTS (
+           SELECT 1 FROM licenses l
+           WHERE l.beat_id = requested.id AND l.license_type = 'premium_trackout_exclusive'
+       );
+
+    IF v_unavailable IS NOT NULL THEN
+        RETURN jsonb_build_object('reserved', FALSE, 'unavailable', to_jsonb(v_unavailable));
+    END IF;
+
+    INSERT INTO beat_reservations (beat_id, hold_token, status, expires_at)
+    SELECT DISTINCT unnest(p_beat_ids), p_hold_token, 'held', v_expires_at
+    ON CONFLICT (beat_id) DO UPDATE SET
+        -- An extension keeps its checkout session; a new hold starts without one
+        stripe_checkout_id = CASE
+            WHEN beat_reservations.hold_token = EXCLUDED.hold_token
+                 AND beat_reservations.status = 'held' THEN beat_reservations.stripe_checkout_id
+        END,
+        hold_token = EXCLUDED.hold_token,
+        status = 'held',
+        expires_at = EXCLUDED.expires_at,
+        order_id = NULL,
+        updated_at = NOW();
+
+    RETURN jsonb_build_object('reserved', TRUE, 'unavailable', '[]'::jsonb, 'expires_at', v_expires_at);
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION reserve_exclusive_beats(UUID[], UUID, INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION reserve_exclusive_beats(UUID[], UUID, INTEGER) TO service_role;
+
+-- 4. fulfill_checkout_items, now also refusing a second exclusive sale and converting holds.
+-- Under the beats row locks it already takes, an exclusive item whose beat was already
+-- sold exclusively makes the whole checkout fail without writing anything: it returns
+-- {"sold_out": [beat ids]} and the caller refunds. Otherwise each exclusive beat's
+-- reservation becomes 'converted' with the new order, and the response lists the live
+-- holds of other checkouts it displaced ("preempted": [checkout ids]) so their
+-- sessions can be expired. Everything else is unchanged.
+CREATE OR REPLACE FUNCTION fulfill_checkout_items(
+    p_stripe_checkout_id TEXT,
+    p_total_cents INTEGER,
+    p_items JSONB,
+    p_user_id UUID DEFAULT NULL,
+    p_customer_name TEXT DEFAULT NULL,
+    p_customer_email TEXT DEFAULT NULL,
+    p_stripe_event_id TEXT DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_order_id UUID;
+    v_event_processed BOOLEAN;
+    v_missing UUID;
+    v_items JSONB;
+    v_exclusive UUID[];
+    v_sold_out UUID[];
+    v_preempted TEXT[];
+BEGIN
+    -- Lock the event row: concurrent redeliveries wait here, then see processed = TRUE
+    IF p_stripe_event_id IS NOT NULL THEN
+        SELECT processed INTO v_event_processed
+        FROM webhook_events
+        WHERE stripe_event_id = p_stripe_event_id
+        FOR UPDATE;
+
+        IF v_event_processed THEN
+            RETURN jsonb_build_object('duplicate', TRUE);
+        END IF;
+    END IF;
+
+    IF jsonb_typeof(p_items) IS DISTINCT FROM 'array' OR jsonb_array_length(p_items) = 0 THEN
+        RAISE EXCEPTION 'p_items must be a non-empty array' USING ERRCODE = '22023';
+    END IF;
+
+    SELECT (item->>'beat_id')::uuid INTO v_missing
+    FROM jsonb_array_elements(p_items) AS item
+    WHERE NOT EXISTS (SELECT 1 FROM beats WHERE beats.id = (item->>'beat_id')::uuid)
+    LIMIT 1;
+
+    IF v_missing IS NOT NULL THEN
+        RAISE EXCEPTION 'Beat % not found', v_missing USING ERRCODE = 'P0002';
+    END IF;
+
+    SELECT array_agg(DISTINCT (item->>'beat_id')::uuid) INTO v_exclusive
+    FROM jsonb_array_elements(p_items) AS item
+    WHERE item->>'license_type' = 'premium_trackout_exclusive';
+
+    -- Lock beats sold exclusively so concurrent fulfillments (and reservations) serialize;
+    -- id order avoids deadlocks
+    PERFORM 1 FROM beats
+    WHERE id = ANY(v_exclusive)
+    ORDER BY id
+    FOR UPDATE;
+
+    SELECT array_agg(DISTINCT l.beat_id) INTO v_sold_out
+    FROM licenses l
+    WHERE l.beat_id = ANY(v_exclusive) AND l.license_type = 'premium_trackout_exclusive';
+
+    IF v_sold_out IS NOT NULL THEN
+        RETURN jsonb_build_object('sold_out', to_jsonb(v_sold_out));
+    END IF;
+
+    INSERT INTO orders (user_id, stripe_checkout_id, total_cents, status, customer_name, customer_email)
+    VALUES (p_user_id, p_stripe_checkout_id, p_total_cents, 'completed', p_customer_name, p_customer_email)
+    RETURNING id INTO v_order_id;
+
+    -- Ids are generated up front so each license can reference its order_item in the same
+    -- statement (foreign keys are checked at its end; data-modifying CTEs always run to
+    -- completion). license_url is filled in by the render_license background job
+    WITH input AS MATERIALIZED (
+        SELECT
+            elem.ordinality AS ordinal,
+            gen_random_uuid() AS order_item_id,
+            gen_random_uuid() AS license_id,
+            (elem.value->>'beat_id')::uuid AS beat_id,
+            elem.value->>'license_type' AS license_type,
+            (elem.value->>'price_cents')::integer AS price_cents
+        FROM jsonb_array_elements(p_items) WITH ORDINALITY AS elem(value, ordinality)
+    ),
+    new_items AS (
+        INSERT INTO order_items (id, order_id, beat_id, license_type, price_cents)
+        SELECT order_item_id, v_order_id, beat_id, license_type, price_cents FROM input ORDER BY ordinal
+        RETURNING id
+    ),
+    new_licenses AS (
+        INSERT INTO licenses (id, order_item_id, user_id, beat_id, license_type, license_url)
+        SELECT license_id, order_item_id, p_user_id, beat_id, license_type, NULL FROM input ORDER BY ordinal
+        RETURNING id
+    )
+    SELECT jsonb_agg(jsonb_build_object(
+        'order_item_id', input.order_item_id,
+        'license_id', input.license_id,
+        'beat_id', input.beat_id,
+        'license_type', input.license_type,
+        'price_cents', input.price_cents,
+        'beat_title', b.title,
+        'producer_name', b.producer_name,
+        'licensor_legal_name', b.licensor_legal_name
+    ) ORDER BY input.ordinal)
+    INTO v_items
+    FROM input
+    JOIN beats b ON b.id = input.beat_id;
+
+    IF v_exclusive IS NOT NULL THEN
+        UPDATE beats SET is_active = FALSE, updated_at = NOW()
+        WHERE id = ANY(v_exclusive);
+
+        SELECT array_agg(stripe_checkout_id) INTO v_preempted
+        FROM beat_reservations
+        WHERE beat_id = ANY(v_exclusive)
+          AND status = 'held'
+          AND expires_at > NOW()
+          AND stripe_checkout_id IS NOT NULL
+          AND stripe_checkout_id <> p_stripe_checkout_id;
+
+        -- Sessions started without a hold (Payment Links) convert a new row
+        INSERT INTO beat_reservations (beat_id, hold_token, stripe_checkout_id, status, expires_at, order_id)
+        SELECT beat_id, gen_random_uuid(), p_stripe_checkout_id, 'converted', NOW(), v_order_id
+        FROM unnest(v_exclusive) AS beat_id
+        ON CONFLICT (beat_id) DO UPDATE SET
+            stripe_checkout_id = EXCLUDED.stripe_checkout_id,
+            status = 'converted',
+            order_id = EXCLUDED.order_id,
+            updated_at = NOW();
+    END IF;
+
+    IF p_stripe_event_id IS NOT NULL THEN
+        UPDATE webhook_events
+        SET processed = TRUE, processed_at = NOW(), error = NULL
+        WHERE stripe_event_id = p_stripe_event_id;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'order_id', v_order_id,
+        'items', COALESCE(v_items, '[]'::jsonb),
+        'preempted', COALESCE(to_jsonb(v_preempted), '[]'::jsonb)
+    );
+END;
+$$;
@@ -0,0 +1,10 @@
+-- Migration: Add License Render Sweep Indexes
+-- Lets the maintenance sweep find licenses whose render job was never queued
+-- All changes are additive and non-breaking
+
+-- 1. Licenses still waiting for their PDF, oldest first
+CREATE INDEX IF NOT EXISTS idx_licenses_missing_url_created_at ON licenses(created_at) WHERE license_url IS NULL;
+
+-- 2. Render jobs by the license they render
+CREATE INDEX IF NOT EXISTS idx_background_jobs_render_license_id ON background_jobs((payload->>'license_id'))
+    WHERE job_type = 'render_license';
@@ -0,0 +1,15 @@
+-- Migration: Add Private Purchases Bucket
+-- License PDFs move to a private storage bucket, reachable only through signed download links
+-- All changes are additive and non-breaking
+
+-- 1. The bucket; public = FALSE means no /object/public/ URLs work for it and, with no
+-- storage.objects policy for it, only the service role (the API) can read or write it.
+-- Set STORAGE_PRIVATE_BUCKET if it is given another name.
+INSERT INTO storage.buckets (id, name, public)
+VALUES ('purchases', 'purchases', FALSE)
+ON CONFLICT (id) DO NOTHING;
+
+-- 2. New rows keep the PDF's object path in the private bucket, not a URL. Rows written before
+-- this migration still hold a public URL until their license is re-issued (POST /api/licenses/reissue)
+COMMENT ON COLUMN licenses.license_url IS
+    'Object path of the license PDF in the private bucket (older rows: public URL in the beats bucket); downloaded through /api/downloads/{license_id}';
@@ -0,0 +1,17 @@
+-- Migration: Add set_license_urls Function
+-- Writes back many re-issued license PDFs in one statement for the bulk license re-issue
+-- All changes are additive and non-breaking
+
+-- p_rows is a JSON array of {"id": <license id>, "url": <object path>} objects. Only existing
+-- licenses are updated: a license deleted while a re-issue runs stays deleted. Returns the ids
+-- that were updated.
+CREATE OR REPLACE FUNCTION set_license_urls(p_rows JSONB)
+RETURNS TABLE (id UUID)
+LANGUAGE sql
+AS $$
+    UPDATE licenses
+    SET license_url = v.url
+    FROM jsonb_to_recordset(p_rows) AS v(id UUID, url TEXT)
+    WHERE licenses.id = v.id
+    RETURNING licenses.id;
+$$;
@@ -3,7 +3,7 @@ import { motion } from 'framer-motion'
 import AdminLayout from '../../components/AdminLayout'
 import AdminProtected from '../../components/AdminProtected'
 import DataTable from '../../components/admin/DataTable'
-import { fetchAllLicenses } from '../../utils/adminSupabase'
+import { fetchAllLicenses, licenseDownloadUrl } from '../../utils/adminSupabase'
 
 const Licenses = () => {
   const [licenses, setLicenses] = useState([])
@@ -54,13 +54,13 @@ const Licenses = () => {
       render: (value) => value ? value.substring(0, 8) + '...' : 'Guest'
     },
     { 
-      key: 'license_url', 
-      label: 'License URL',
-      render: (value) => (
-        <a href={value} target="_blank" rel="noopener noreferrer" className="link">
+      key: 'pdf_ready', 
+      label: 'License PDF',
+      render: (value, row) => value ? (
+        <a href={licenseDownloadUrl(row.id)} target="_blank" rel="noopener noreferrer" className="link">
           View License
         </a>
-      )
+      ) : 'Pending'
     },
     { 
       key: 'created_at', 
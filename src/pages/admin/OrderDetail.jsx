@@ -4,7 +4,7 @@ import { motion } from 'framer-motion'
 import { ArrowLeft } from 'lucide-react'
 import AdminLayout from '../../components/AdminLayout'
 import AdminProtected from '../../components/AdminProtected'
-import { fetchOrderById } from '../../utils/adminSupabase'
+import { fetchOrderById, licenseDownloadUrl } from '../../utils/adminSupabase'
 
 const OrderDetail = () => {
   const { id } = useParams()
@@ -123,7 +123,9 @@ const OrderDetail = () => {
                       {item.licenses.map((license) => (
                         <div key={license.id} className="license-item">
                           <p>Type: {license.license_type}</p>
-                          <p>URL: <a href={license.license_url} target="_blank" rel="noopener noreferrer">{license.license_url}</a></p>
+                          <p>PDF: {license.pdf_ready ? (
+                            <a href={licenseDownloadUrl(license.id)} target="_blank" rel="noopener noreferrer">Download</a>
+                          ) : 'Pending'}</p>
                         </div>
                       ))}
                     </div>
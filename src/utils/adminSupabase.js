@@ -28,21 +28,39 @@ if (typeof window !== 'undefined') {
 }
 // #endregion
 
+// Largest page the list endpoints return (MAX_PAGE_SIZE in backend/pagination.py)
+const PAGE_SIZE = 500
+
 /**
- * Fetch all beats (including inactive) - Admin only
- * Uses backend API instead of direct Supabase access
+ * Fetch every row of a paginated list endpoint, following `next_cursor`
  */
-export async function fetchAllBeats() {
-  try {
-    const response = await fetch(`${API_URL}/api/beats/`)
+async function fetchAllPages(path, errorMessage) {
+  const rows = []
+  let cursor = null
+  do {
+    const params = new URLSearchParams({ limit: PAGE_SIZE })
+    if (cursor) params.set('cursor', cursor)
+    const response = await fetch(`${API_URL}${path}?${params}`)
 
     if (!response.ok) {
       const error = await response.json()
-      throw new Error(error.detail || 'Failed to fetch beats')
+      throw new Error(error.detail || errorMessage)
     }
 
     const result = await response.json()
-    return result.data || []
+    rows.push(...(result.data || []))
+    cursor = result.next_cursor
+  } while (cursor)
+  return rows
+}
+
+/**
+ * Fetch all beats (including inactive) - Admin only
+ * Uses backend API instead of direct Supabase access
+ */
+export async function fetchAllBeats() {
+  try {
+    return await fetchAllPages('/api/beats/', 'Failed to fetch beats')
   } catch (error) {
     console.error('Error fetching all beats:', error)
     throw error
@@ -55,15 +73,7 @@ export async function fetchAllBeats() {
  */
 export async function fetchAllOrders() {
   try {
-    const response = await fetch(`${API_URL}/api/orders/`)
-
-    if (!response.ok) {
-      const error = await response.json()
-      throw new Error(error.detail || 'Failed to fetch orders')
-    }
-
-    const result = await response.json()
-    return result.data || []
+    return await fetchAllPages('/api/orders/', 'Failed to fetch orders')
   } catch (error) {
     console.error('Error fetching orders:', error)
     throw error
@@ -97,21 +107,21 @@ export async function fetchOrderById(orderId) {
  */
 export async function fetchAllLicenses() {
   try {
-    const response = await fetch(`${API_URL}/api/licenses/`)
-
-    if (!response.ok) {
-      const error = await response.json()
-      throw new Error(error.detail || 'Failed to fetch licenses')
-    }
-
-    const result = await response.json()
-    return result.data || []
+    return await fetchAllPages('/api/licenses/', 'Failed to fetch licenses')
   } catch (error) {
     console.error('Error fetching licenses:', error)
     throw error
   }
 }
 
+/**
+ * Link to a license PDF - the files are in a private bucket and only
+ * reachable through the downloads endpoint, which redirects to a signed URL
+ */
+export function licenseDownloadUrl(licenseId) {
+  return `${API_URL}/api/downloads/${licenseId}?redirect=true`
+}
+
 /**
  * Fetch all webhook events - Admin only
  * Uses backend API instead of direct Supabase access
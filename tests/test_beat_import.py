@@ -0,0 +1,153 @@
+"""Bulk beat import: parsing, row validation and all-or-nothing uploads."""
+import asyncio
+import json
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from backend import beats
+from backend.beats import BeatImport
+from backend.services import beat_import
+from backend.services.beat_import import read_rows, write_rows
+
+BEAT_ID = str(uuid.uuid4())
+HEADER = "id,title,price_cents,license_type,audio_url,preview_url,bpm"
+
+
+class Upload:
+    """A request body delivered in small chunks, as a slow client would send it."""
+
+    def __init__(self, body: str, content_type: str = "text/csv", chunk_size: int = 7):
+        self.data = body.encode()
+        self.headers = {"content-type": content_type}
+        self.chunk_size = chunk_size
+
+    async def stream(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            yield self.data[start:start + self.chunk_size]
+
+    async def body(self):
+        return self.data
+
+
+def _read(body: str, fmt: str = "csv", max_rows: int = 100):
+    return asyncio.run(read_rows(Upload(body), fmt, BeatImport, max_rows))
+
+
+def test_quoted_fields_may_span_lines_and_contain_commas():
+    body = (
+        "title,price_cents,license_type,audio_url,producer_name\n"
+        '"Night, Drive",2999,mp3_non_exclusive,https://example.com/a.wav,"Line one\n'
+        'line ""two"""\n'
+        "Second,1999,mp3_non_exclusive,https://example.com/b.wav,\n"
+    )
+    valid, results = _read(body)
+    assert [result.status for result in results] == ["pending", "pending"]
+    first, second = valid[0][1], valid[1][1]
+    assert first["title"] == "Night, Drive"
+    assert first["producer_name"] == 'Line one\nline "two"'
+    assert "producer_name" not in second
+
+
+def test_rows_with_the_wrong_column_count_are_invalid():
+    body = (
+        "title,price_cents,license_type,audio_url\n"
+        "Short,2999,mp3_non_exclusive\n"
+        "Long,2999,mp3_non_exclusive,https://example.com/a.wav,extra\n"
+        "Good,2999,mp3_non_exclusive,https://example.com/a.wav\n"
+    )
+    valid, results = _read(body)
+    assert [result.status for result in results] == ["invalid", "invalid", "pending"]
+    assert results[0].errors == ["expected 4 columns, got 3"]
+    assert results[1].errors == ["expected 4 columns, got 5"]
+    assert [row for row, _ in valid] == [3]
+
+
+def test_unterminated_quote_is_reported():
+    body = 'title,price_cents,license_type,audio_url\n"Open,2999,mp3_non_exclusive,https://example.com/a.wav\n'
+    valid, results = _read(body)
+    assert valid == []
+    assert results[-1].errors == ["unterminated quoted field"]
+
+
+def test_duplicate_ids_are_rejected():
+    row = {"id": BEAT_ID, "title": "A", "price_cents": 100, "license_type": "mp3_non_exclusive", "audio_url": "a.wav"}
+    body = "\n".join(json.dumps(item) for item in [row, {**row, "title": "B"}])
+    valid, results = _read(body, fmt="ndjson")
+    assert results[0].status == "pending"
+    assert results[1].status == "invalid"
+    assert results[1].errors == ["id: duplicate of row 1"]
+    assert len(valid) == 1
+
+
+def test_validation_errors_name_the_field():
+    valid, results = _read(json.dumps([{"title": "A", "price_cents": "lots"}]), fmt="json")
+    assert valid == []
+    assert any(error.startswith("price_cents:") for error in results[0].errors)
+    assert any(error.startswith("audio_url:") for error in results[0].errors)
+
+
+def test_rows_carry_only_the_fields_given():
+    body = f"{HEADER}\n{BEAT_ID},Updated,2999,mp3_non_exclusive,https://example.com/a.wav,,\n"
+    valid, _ = _read(body)
+    data = valid[0][1]
+    # Left-out fields are not defaulted, so updating this beat keeps its preview, bpm and is_active
+    assert data == {
+        "id": BEAT_ID, "title": "Updated", "price_cents": 2999,
+        "license_type": "mp3_non_exclusive", "audio_url": "https://example.com/a.wav",
+    }
+
+
+def test_too_many_rows():
+    body = "title,price_cents,license_type,audio_url\n" + "A,1,mp3_non_exclusive,a.wav\n" * 3
+    with pytest.raises(HTTPException) as error:
+        _read(body, max_rows=2)
+    assert error.value.status_code == 413
+
+
+def test_atomic_upload_with_an_invalid_row_writes_nothing(monkeypatch):
+    async def write_rows(*args, **kwargs):
+        raise AssertionError("nothing may be written")
+
+    monkeypatch.setattr(beats, "write_rows", write_rows)
+    body = (
+        "title,price_cents,license_type,audio_url\n"
+        "Good,2999,mp3_non_exclusive,https://example.com/a.wav\n"
+        "Bad,free,mp3_non_exclusive,https://example.com/b.wav\n"
+    )
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(beats.bulk_upsert_beats(Upload(body), format="csv", atomic=True))
+    assert error.value.status_code == 422
+    statuses = [result["status"] for result in error.value.detail["results"]]
+    assert statuses == ["not_written", "invalid"]
+
+
+def test_failing_chunk_is_retried_row_by_row(monkeypatch):
+    calls = []
+
+    async def upsert(rows):
+        calls.append(len(rows))
+        if len(rows) > 1 or rows[0]["title"] == "Bad":
+            raise RuntimeError("violates check constraint")
+        return [{"ordinal": 1, "id": str(uuid.uuid4()), "created": True}]
+
+    monkeypatch.setattr(beat_import, "_upsert", upsert)
+    valid, results = _read(
+        "title,price_cents,license_type,audio_url\n"
+        "Good,1,mp3_non_exclusive,a.wav\nBad,1,mp3_non_exclusive,b.wav\n"
+    )
+    asyncio.run(write_rows(valid, results, chunk_size=10, atomic=False))
+    assert [result.status for result in results] == ["created", "failed"]
+    assert calls == [2, 1, 1]
+
+
+def test_atomic_write_failure_raises(monkeypatch):
+    async def upsert(rows):
+        raise RuntimeError("violates not-null constraint")
+
+    monkeypatch.setattr(beat_import, "_upsert", upsert)
+    valid, results = _read("title,price_cents,license_type,audio_url\nA,1,mp3_non_exclusive,a.wav\n")
+    with pytest.raises(RuntimeError):
+        asyncio.run(write_rows(valid, results, chunk_size=10, atomic=True))
+    assert results[0].status == "pending"
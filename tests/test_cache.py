@@ -0,0 +1,142 @@
+"""TTLCache: coalesced loads, invalidation and cancellation."""
+import asyncio
+
+import pytest
+
+from backend.services.cache import TTLCache
+
+
+def test_concurrent_misses_call_the_loader_once():
+    cache = TTLCache("test")
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"id": 1}
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_load("beat", loader) for _ in range(10)))
+
+    results = asyncio.run(main())
+    assert calls == 1
+    assert results == [{"id": 1}] * 10
+    assert cache.stats.coalesced == 9
+    assert cache.get("beat") == {"id": 1}
+
+
+def test_loader_error_is_shared_and_not_cached():
+    cache = TTLCache("test")
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("database down")
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_load("beat", loader) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.stats.loads == 1
+    assert cache.get("beat") is None
+
+
+def test_invalidate_during_load_discards_the_result():
+    cache = TTLCache("test")
+
+    async def main():
+        started = asyncio.Event()
+
+        async def loader():
+            started.set()
+            await asyncio.sleep(0.01)
+            return "stale"
+
+        task = asyncio.create_task(cache.get_or_load("beat", loader))
+        await started.wait()
+        cache.invalidate("beat")
+        return await task
+
+    assert asyncio.run(main()) == "stale"
+    assert cache.get("beat") is None
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    cache = TTLCache("test")
+    calls = 0
+
+    async def main():
+        started = asyncio.Event()
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            started.set()
+            await asyncio.sleep(0.05)
+            return f"load {calls}"
+
+        leader = asyncio.create_task(cache.get_or_load("beat", loader))
+        await started.wait()
+        waiters = [asyncio.create_task(cache.get_or_load("beat", loader)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*waiters)
+
+    # One waiter takes over the load; the others coalesce onto it
+    assert asyncio.run(main()) == ["load 2"] * 3
+    assert calls == 2
+    assert cache.get("beat") == "load 2"
+
+
+def test_cancelled_waiter_leaves_the_load_running():
+    cache = TTLCache("test")
+
+    async def main():
+        started = asyncio.Event()
+
+        async def loader():
+            started.set()
+            await asyncio.sleep(0.02)
+            return "value"
+
+        leader = asyncio.create_task(cache.get_or_load("beat", loader))
+        await started.wait()
+        waiter = asyncio.create_task(cache.get_or_load("beat", loader))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await leader
+
+    assert asyncio.run(main()) == "value"
+    assert cache.get("beat") == "value"
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    cache = TTLCache("test", ttl=10)
+    now = 1000.0
+    monkeypatch.setattr("backend.services.cache.time.monotonic", lambda: now)
+    cache.set("beat", "value")
+    assert cache.get("beat") == "value"
+    now += 11
+    assert cache.get("beat") is None
+    assert cache.stats.expirations == 1
+
+
+def test_deferred_settings_are_read_on_first_use():
+    reads = []
+
+    def maxsize():
+        reads.append("maxsize")
+        return 2
+
+    cache = TTLCache("test", maxsize=maxsize, ttl=60)
+    assert reads == []
+    for key in "abc":
+        cache.set(key, key)
+    assert reads == ["maxsize"]
+    assert len(cache) == 2
+    assert cache.get("a") is None
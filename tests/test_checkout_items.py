@@ -0,0 +1,147 @@
+"""Checkout session items: where they are read from and how the total is split."""
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from backend.services import checkout_items
+from backend.services.checkout_items import CheckoutItemsError, allocate, resolve_checkout_items
+
+BEAT_A = str(uuid.uuid4())
+BEAT_B = str(uuid.uuid4())
+BEAT_C = str(uuid.uuid4())
+
+
+def _line(beat_id, license_type, amount, quantity=1):
+    return {
+        "amount_total": amount,
+        "quantity": quantity,
+        "price": {"product": {"metadata": {"beat_id": beat_id, "license_type": license_type}}},
+    }
+
+
+def _resolve(session):
+    return asyncio.run(resolve_checkout_items(session))
+
+
+def _summary(items):
+    return [(str(item.beat_id), item.license_type, item.price_cents) for item in items]
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    """Line items the Stripe API returns, keyed by session id; records which sessions were listed."""
+    sessions = {}
+    calls = []
+
+    def fetch_line_items(session_id):
+        calls.append(session_id)
+        return sessions[session_id]
+
+    monkeypatch.setattr(checkout_items, "_fetch_line_items", fetch_line_items)
+    return sessions, calls
+
+
+@pytest.mark.parametrize("total, weights", [
+    (0, [2999, 4999]),
+    (1, [1, 1, 1]),
+    (2700, [2999, 4999]),
+    (9999, [2999, 2999, 2999]),
+    (10000, [1, 2, 3, 4, 5, 6, 7]),
+    (12345, [29999, 0, 4999]),
+    (500, [0, 0, 0]),
+])
+def test_allocated_cents_add_up_to_the_total(total, weights):
+    shares = allocate(total, weights)
+    assert sum(shares) == total
+    assert len(shares) == len(weights)
+    # All-zero weights split evenly
+    weights = weights if sum(weights) else [1] * len(weights)
+    for share, weight in zip(shares, weights):
+        # Largest remainder: every share is its exact proportion rounded down or up
+        assert abs(share - total * weight / sum(weights)) < 1
+
+
+def test_rounding_is_stable():
+    # Equal remainders: the extra cents go to the earliest items
+    assert allocate(100, [1, 1, 1]) == [34, 33, 33]
+    assert allocate(2, [1, 1, 1]) == [1, 1, 0]
+    assert allocate(2700, [2999, 4999]) == allocate(2700, [2999, 4999])
+    # The largest remainder gets the cent, not the earliest item
+    assert allocate(10, [1, 2]) == [3, 7]
+    assert allocate(10, [2, 1]) == [7, 3]
+    # No weight at all: split evenly
+    assert allocate(500, [0, 0, 0]) == [167, 167, 166]
+
+
+def test_expanded_line_items_come_first(fetched):
+    session = {
+        "id": "cs_1",
+        "amount_total": 7998,
+        "line_items": {"data": [_line(BEAT_A, "mp3_non_exclusive", 2999), _line(BEAT_B, "wav_non_exclusive", 4999)]},
+        "metadata": {"beat_id": BEAT_C, "license_type": "mp3_non_exclusive"},
+    }
+    assert _summary(_resolve(session)) == [
+        (BEAT_A, "mp3_non_exclusive", 2999),
+        (BEAT_B, "wav_non_exclusive", 4999),
+    ]
+    assert fetched[1] == []
+
+
+def test_line_item_quantity_is_one_license_per_unit():
+    session = {"amount_total": 5999, "line_items": {"data": [_line(BEAT_A, "mp3_non_exclusive", 5999, quantity=2)]}}
+    assert [item.price_cents for item in _resolve(session)] == [3000, 2999]
+
+
+def test_metadata_items_before_single_beat_metadata(fetched):
+    items = [
+        {"beat_id": BEAT_A, "license_type": "mp3_non_exclusive", "price_cents": 2999},
+        {"beat_id": BEAT_B, "license_type": "wav_non_exclusive", "price_cents": 4999},
+    ]
+    session = {
+        "id": "cs_1",
+        # A session-level discount, spread over the items by list price
+        "amount_total": 7000,
+        "metadata": {"items": json.dumps(items), "beat_id": BEAT_C, "license_type": "mp3_non_exclusive"},
+    }
+    resolved = _resolve(session)
+    assert [str(item.beat_id) for item in resolved] == [BEAT_A, BEAT_B]
+    assert [item.price_cents for item in resolved] == allocate(7000, [2999, 4999])
+    assert sum(item.price_cents for item in resolved) == 7000
+    assert fetched[1] == []
+
+
+def test_single_metadata_item_without_a_price_costs_the_total():
+    session = {"amount_total": 2499, "metadata": {"items": [{"beat_id": BEAT_A, "license_type": "mp3_non_exclusive"}]}}
+    assert _summary(_resolve(session)) == [(BEAT_A, "mp3_non_exclusive", 2499)]
+
+
+def test_single_beat_metadata_is_priced_at_the_total(fetched):
+    session = {"id": "cs_1", "amount_total": 2499, "metadata": {"beat_id": BEAT_A, "license_type": "mp3_non_exclusive"}}
+    assert _summary(_resolve(session)) == [(BEAT_A, "mp3_non_exclusive", 2499)]
+    assert fetched[1] == []
+
+
+def test_falls_back_to_listing_line_items(fetched):
+    sessions, calls = fetched
+    sessions["cs_1"] = [_line(BEAT_A, "mp3_non_exclusive", 2999), _line(BEAT_B, "wav_non_exclusive", 4999)]
+    session = {"id": "cs_1", "amount_total": 7998, "metadata": {}}
+    assert _summary(_resolve(session)) == [
+        (BEAT_A, "mp3_non_exclusive", 2999),
+        (BEAT_B, "wav_non_exclusive", 4999),
+    ]
+    assert calls == ["cs_1"]
+
+
+def test_session_without_items_or_id_cannot_be_fulfilled(fetched):
+    with pytest.raises(CheckoutItemsError):
+        _resolve({"amount_total": 2999, "metadata": {}})
+    assert fetched[1] == []
+
+
+def test_malformed_metadata_items_are_rejected():
+    with pytest.raises(CheckoutItemsError):
+        _resolve({"amount_total": 2999, "metadata": {"items": "not json"}})
+    with pytest.raises(CheckoutItemsError):
+        _resolve({"amount_total": 2999, "metadata": {"items": json.dumps([{"beat_id": "nope", "license_type": "x"}])}})
@@ -0,0 +1,98 @@
+"""Download rate limiting and the download log."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from backend.services import downloads
+from backend.services.downloads import DownloadRecorder, RateLimiter
+
+APIError = pytest.importorskip("postgrest.exceptions").APIError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("backend.services.downloads.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_burst_then_refill(clock):
+    limiter = RateLimiter(per_minute=60, burst=3)
+    assert [limiter.acquire("client:a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("client:a") == pytest.approx(1.0)
+    # Other keys have their own bucket
+    assert limiter.acquire("client:b") == 0.0
+
+    clock[0] += 1.0
+    assert limiter.acquire("client:a") == 0.0
+    assert limiter.acquire("client:a") > 0
+
+
+def test_zero_rate_disables_the_limit():
+    limiter = RateLimiter(per_minute=0, burst=1)
+    assert all(limiter.acquire("client:a") == 0.0 for _ in range(100))
+
+
+def test_forgets_the_least_recently_seen_keys(clock):
+    limiter = RateLimiter(per_minute=60, burst=1, maxsize=2)
+    limiter.acquire("a")
+    limiter.acquire("b")
+    limiter.acquire("c")
+    # "a" was dropped and starts with a full bucket again
+    assert limiter.acquire("a") == 0.0
+    assert limiter.acquire("c") > 0
+
+
+class DownloadsTable:
+    """Inserts into ``downloads``; rows whose license_id is in ``rejected`` fail the insert."""
+
+    def __init__(self):
+        self.rows = []
+        self.rejected = set()
+        self.unavailable = False
+        self._pending = None
+
+    def insert(self, rows, returning=None):
+        self._pending = rows
+        return self
+
+    async def execute(self):
+        if self.unavailable:
+            raise APIError({"code": 503, "message": "JSON could not be generated"})
+        if any(row["license_id"] in self.rejected for row in self._pending):
+            raise APIError({"code": "23503", "message": "violates foreign key constraint"})
+        self.rows.extend(self._pending)
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = DownloadsTable()
+    monkeypatch.setattr(downloads, "db", SimpleNamespace(table=lambda name: table))
+    return table
+
+
+def _recorder(licenses, batch_size=10, max_buffer=100):
+    recorder = DownloadRecorder(batch_size, 1.0, max_buffer)
+    for license_id in licenses:
+        recorder.record({"license_id": license_id, "kind": "license"})
+    return recorder
+
+
+def test_rejected_row_is_dropped_and_the_rest_written(table):
+    table.rejected = {"deleted"}
+    recorder = _recorder(["a", "deleted", "b", "c"], batch_size=2)
+    assert asyncio.run(recorder.flush()) == 3
+    assert [row["license_id"] for row in table.rows] == ["a", "b", "c"]
+    assert len(recorder._buffer) == 0
+
+
+def test_transient_failure_keeps_the_batch_in_order(table):
+    table.unavailable = True
+    recorder = _recorder(["a", "b", "c"], batch_size=2)
+    assert asyncio.run(recorder.flush()) == 0
+    assert [row["license_id"] for row in recorder._buffer] == ["a", "b", "c"]
+
+    table.unavailable = False
+    assert asyncio.run(recorder.flush()) == 3
+    assert [row["license_id"] for row in table.rows] == ["a", "b", "c"]
@@ -0,0 +1,150 @@
+"""Background job queue: retries, backoff, deferral and stale-lease recovery."""
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from backend.services.job_queue import (
+    JOB_STATUS_COMPLETED,
+    JOB_STATUS_FAILED,
+    JOB_STATUS_PENDING,
+    JOB_STATUS_RUNNING,
+    JobDeferred,
+    JobQueue,
+    SQLiteJobStore,
+)
+
+JOB_TYPE = "test_job"
+
+
+def _queue(handler, max_attempts: int = 3) -> JobQueue:
+    queue = JobQueue(SQLiteJobStore(), concurrency=1, max_attempts=max_attempts)
+    queue.register(JOB_TYPE, handler)
+    return queue
+
+
+def _make_due(queue: JobQueue, job_id: str) -> None:
+    # Skip the backoff or deferral instead of sleeping through it
+    queue.store._execute("UPDATE background_jobs SET run_at = '2000-01-01T00:00:00+00:00' WHERE id = ?", (job_id,))
+
+
+def _run_until_settled(queue: JobQueue, job_id: str, rounds: int = 10):
+    for _ in range(rounds):
+        asyncio.run(queue.run_once())
+        job = queue.store.get(job_id)
+        if job.status != JOB_STATUS_PENDING:
+            return job
+        _make_due(queue, job_id)
+    return queue.store.get(job_id)
+
+
+def test_failed_job_is_retried_until_it_succeeds():
+    calls = []
+
+    def handler(payload):
+        calls.append(payload)
+        if len(calls) < 3:
+            raise RuntimeError(f"failure {len(calls)}")
+
+    queue = _queue(handler)
+    job = asyncio.run(queue.enqueue(JOB_TYPE, {"n": 1}))
+    job = _run_until_settled(queue, job.id)
+    assert job.status == JOB_STATUS_COMPLETED
+    assert job.attempts == 3
+    assert job.last_error is None
+    assert calls == [{"n": 1}] * 3
+
+
+def test_failed_job_waits_for_its_backoff():
+    async def handler(payload):
+        raise RuntimeError("storage down")
+
+    queue = _queue(handler)
+    job = asyncio.run(queue.enqueue(JOB_TYPE, {}))
+    assert asyncio.run(queue.run_once()) == 1
+    job = queue.store.get(job.id)
+    assert job.status == JOB_STATUS_PENDING
+    assert job.last_error == "storage down"
+    # Not due again until the backoff has passed
+    assert asyncio.run(queue.run_once()) == 0
+
+
+def test_job_fails_permanently_after_max_attempts():
+    calls = []
+
+    def handler(payload):
+        calls.append(payload)
+        raise ValueError("bad payload")
+
+    queue = _queue(handler, max_attempts=2)
+    job = asyncio.run(queue.enqueue(JOB_TYPE, {}))
+    job = _run_until_settled(queue, job.id)
+    assert job.status == JOB_STATUS_FAILED
+    assert job.attempts == 2
+    assert job.last_error == "bad payload"
+    assert len(calls) == 2
+
+
+def test_backoff_doubles_with_jitter_up_to_the_cap():
+    queue = JobQueue(SQLiteJobStore(), base_backoff=2.0, max_backoff=300.0)
+    for attempts, expected in [(1, 2.0), (2, 4.0), (3, 8.0), (8, 256.0), (9, 300.0), (20, 300.0)]:
+        for _ in range(20):
+            assert expected * 0.8 <= queue.backoff_delay(attempts) <= expected * 1.2
+
+
+def test_deferred_job_is_rescheduled_without_using_an_attempt():
+    calls = []
+
+    def handler(payload):
+        calls.append(payload)
+        if len(calls) <= 5:
+            raise JobDeferred(60, "storage circuit open")
+
+    # More deferrals than attempts: only failures count towards max_attempts
+    queue = _queue(handler, max_attempts=2)
+    job = asyncio.run(queue.enqueue(JOB_TYPE, {}))
+    asyncio.run(queue.run_once())
+    deferred = queue.store.get(job.id)
+    assert deferred.status == JOB_STATUS_PENDING
+    assert deferred.attempts == 0
+    assert deferred.last_error == "storage circuit open"
+    assert asyncio.run(queue.run_once()) == 0
+
+    job = _run_until_settled(queue, job.id)
+    assert job.status == JOB_STATUS_COMPLETED
+    assert len(calls) == 6
+
+
+def test_release_stale_requeues_only_expired_leases():
+    queue = _queue(lambda payload: None)
+    stale, fresh = asyncio.run(queue.enqueue_many(JOB_TYPE, [{"n": 1}, {"n": 2}]))
+    claimed = asyncio.run(queue.store.claim("dead-worker", limit=2))
+    assert {job.id for job in claimed} == {stale.id, fresh.id}
+    queue.store._execute(
+        "UPDATE background_jobs SET locked_at = '2000-01-01T00:00:00+00:00' WHERE id = ?", (stale.id,)
+    )
+
+    assert asyncio.run(queue.store.release_stale(timedelta(minutes=10))) == 1
+    assert queue.store.get(stale.id).status == JOB_STATUS_PENDING
+    assert queue.store.get(fresh.id).status == JOB_STATUS_RUNNING
+
+    # The released job runs again; its attempt count keeps the lost run
+    assert asyncio.run(queue.run_once()) == 1
+    job = queue.store.get(stale.id)
+    assert job.status == JOB_STATUS_COMPLETED
+    assert job.attempts == 2
+
+
+def test_payload_values_finds_the_jobs_already_enqueued():
+    queue = _queue(lambda payload: None)
+    asyncio.run(queue.enqueue_many(JOB_TYPE, [{"license_id": "a"}, {"license_id": "b"}]))
+    found = asyncio.run(queue.store.payload_values(JOB_TYPE, "license_id", ["a", "c"]))
+    assert found == {"a"}
+    assert asyncio.run(queue.store.payload_values("other_job", "license_id", ["a"])) == set()
+    assert asyncio.run(queue.store.payload_values(JOB_TYPE, "license_id", [])) == set()
+
+
+def test_enqueue_rejects_unknown_job_types():
+    queue = _queue(lambda payload: None)
+    with pytest.raises(ValueError):
+        asyncio.run(queue.enqueue("unknown", {}))
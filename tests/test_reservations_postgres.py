@@ -0,0 +1,112 @@
+"""Exclusive-license races against a real Postgres.
+
+The row locks in ``reserve_exclusive_beats`` and ``fulfill_checkout_items``
+are what keep an exclusive license from being sold twice; these tests race
+them with one connection per buyer. They need a database with the
+migrations applied and ``asyncpg``, and are skipped otherwise:
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost/beatstore_test python -m pytest tests/test_reservations_postgres.py
+
+The beats, orders and licenses they create are deleted afterwards.
+"""
+import asyncio
+import json
+import os
+import uuid
+from typing import Any, Awaitable, Callable, List
+
+import pytest
+
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+EXCLUSIVE = "premium_trackout_exclusive"
+CONTENDERS = 16
+ROUNDS = 5
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+async def _race(contenders: int, attempt: Callable[[int], Awaitable[Any]]) -> List[Any]:
+    """Run ``attempt`` for every contender at the same instant."""
+    start = asyncio.Event()
+
+    async def contender(index: int) -> Any:
+        await start.wait()
+        return await attempt(index)
+
+    tasks = [asyncio.create_task(contender(index)) for index in range(contenders)]
+    await asyncio.sleep(0)
+    start.set()
+    return await asyncio.gather(*tasks)
+
+
+def _run_with_pool(test: Callable[[Any, List[uuid.UUID], str], Awaitable[None]]) -> None:
+    asyncpg = pytest.importorskip("asyncpg")
+    prefix = f"cs_test_{uuid.uuid4().hex[:8]}"
+
+    async def main() -> None:
+        pool = await asyncpg.create_pool(DATABASE_URL, min_size=CONTENDERS, max_size=CONTENDERS)
+        beat_ids: List[uuid.UUID] = []
+        try:
+            await test(pool, beat_ids, prefix)
+        finally:
+            await pool.execute("DELETE FROM licenses WHERE beat_id = ANY($1::uuid[])", beat_ids)
+            await pool.execute("DELETE FROM order_items WHERE beat_id = ANY($1::uuid[])", beat_ids)
+            await pool.execute("DELETE FROM beats WHERE id = ANY($1::uuid[])", beat_ids)
+            await pool.execute("DELETE FROM orders WHERE stripe_checkout_id LIKE $1", f"{prefix}%")
+            await pool.close()
+
+    asyncio.run(main())
+
+
+async def _insert_beat(pool: Any, beat_ids: List[uuid.UUID]) -> uuid.UUID:
+    beat_id = await pool.fetchval(
+        "INSERT INTO beats (title, price_cents, license_type, audio_url, is_active) "
+        "VALUES ('test exclusive', 29999, $1, 'https://example.com/beat.wav', TRUE) RETURNING id",
+        EXCLUSIVE,
+    )
+    beat_ids.append(beat_id)
+    return beat_id
+
+
+def test_one_hold_per_exclusive_beat():
+    async def test(pool: Any, beat_ids: List[uuid.UUID], prefix: str) -> None:
+        for _ in range(ROUNDS):
+            beat_id = await _insert_beat(pool, beat_ids)
+
+            async def reserve(index: int) -> bool:
+                outcome = await pool.fetchval(
+                    "SELECT reserve_exclusive_beats($1::uuid[], $2::uuid, 60)", [beat_id], uuid.uuid4(),
+                )
+                return json.loads(outcome)["reserved"]
+
+            assert sum(await _race(CONTENDERS, reserve)) == 1
+
+    _run_with_pool(test)
+
+
+def test_one_sale_per_exclusive_beat():
+    async def test(pool: Any, beat_ids: List[uuid.UUID], prefix: str) -> None:
+        for round_index in range(ROUNDS):
+            beat_id = await _insert_beat(pool, beat_ids)
+            items = json.dumps([{"beat_id": str(beat_id), "license_type": EXCLUSIVE, "price_cents": 29999}])
+
+            async def fulfill(index: int) -> dict:
+                outcome = await pool.fetchval(
+                    "SELECT fulfill_checkout_items($1, 29999, $2::jsonb)", f"{prefix}_{round_index}_{index}", items,
+                )
+                return json.loads(outcome)
+
+            outcomes = await _race(CONTENDERS, fulfill)
+            sold = [outcome for outcome in outcomes if "order_id" in outcome]
+            refused = [outcome for outcome in outcomes if outcome.get("sold_out") == [str(beat_id)]]
+            assert len(sold) == 1
+            assert len(refused) == CONTENDERS - 1
+            licenses = await pool.fetchval(
+                "SELECT count(*) FROM licenses WHERE beat_id = $1 AND license_type = $2", beat_id, EXCLUSIVE,
+            )
+            assert licenses == 1
+            assert await pool.fetchval("SELECT is_active FROM beats WHERE id = $1", beat_id) is False
+            status = await pool.fetchval("SELECT status FROM beat_reservations WHERE beat_id = $1", beat_id)
+            assert status == "converted"
+
+    _run_with_pool(test)
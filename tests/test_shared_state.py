@@ -0,0 +1,166 @@
+"""Cross-worker coordination: leader failover and cache invalidation.
+
+Two ``SQLiteSharedState`` instances on one file stand in for two worker
+processes.
+"""
+import asyncio
+import time
+
+from backend.services import beat_cache
+from backend.services.shared_state import LeaderTask, SQLiteSharedState
+
+POLL = 0.02
+
+
+def _workers(tmp_path, lease_ttl: float = 15.0):
+    path = str(tmp_path / "shared_state.db")
+    return (
+        SQLiteSharedState(path, poll_interval=POLL, lease_ttl=lease_ttl),
+        SQLiteSharedState(path, poll_interval=POLL, lease_ttl=lease_ttl),
+    )
+
+
+async def _eventually(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        await asyncio.sleep(POLL)
+    return condition()
+
+
+def test_one_leader_until_its_lease_is_released(tmp_path):
+    async def main():
+        first, second = _workers(tmp_path)
+        await first.start()
+        await second.start()
+        try:
+            assert await first.acquire_leadership("maintenance")
+            assert not await second.acquire_leadership("maintenance")
+            # Renewing keeps the lease
+            assert await first.acquire_leadership("maintenance")
+            await first.release_leadership("maintenance")
+            assert await second.acquire_leadership("maintenance")
+            assert not await first.acquire_leadership("maintenance")
+        finally:
+            await first.stop()
+            await second.stop()
+
+    asyncio.run(main())
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    async def main():
+        first, second = _workers(tmp_path, lease_ttl=0.2)
+        await first.start()
+        await second.start()
+        try:
+            assert await first.acquire_leadership("maintenance")
+            assert not await second.acquire_leadership("maintenance")
+            # The leader dies without releasing its lease
+            await asyncio.sleep(0.3)
+            assert await second.acquire_leadership("maintenance")
+            assert not await first.acquire_leadership("maintenance")
+        finally:
+            await first.stop()
+            await second.stop()
+
+    asyncio.run(main())
+
+
+def test_leader_task_fails_over_when_the_leader_stops(tmp_path):
+    async def main():
+        first, second = _workers(tmp_path)
+        runs = {"first": 0, "second": 0}
+
+        def counter(name):
+            async def task():
+                runs[name] += 1
+            return task
+
+        await first.start()
+        await second.start()
+        leader = LeaderTask(first, "maintenance", counter("first"), interval=0.05, renew_interval=0.05)
+        follower = LeaderTask(second, "maintenance", counter("second"), interval=0.05, renew_interval=0.05)
+        try:
+            await leader.start()
+            assert await _eventually(lambda: leader.is_leader and runs["first"] > 0)
+            await follower.start()
+            await asyncio.sleep(0.2)
+            assert not follower.is_leader
+            assert runs["second"] == 0
+
+            await leader.stop()
+            assert await _eventually(lambda: follower.is_leader and runs["second"] > 0)
+        finally:
+            await leader.stop()
+            await follower.stop()
+            await first.stop()
+            await second.stop()
+
+    asyncio.run(main())
+
+
+def test_lease_is_renewed_while_a_long_task_runs(tmp_path):
+    async def main():
+        first, second = _workers(tmp_path, lease_ttl=0.2)
+        running = {"now": 0, "most": 0, "finished": 0}
+
+        async def sweep():
+            running["now"] += 1
+            running["most"] = max(running["most"], running["now"])
+            try:
+                # Several lease TTLs long
+                await asyncio.sleep(0.6)
+                running["finished"] += 1
+            finally:
+                running["now"] -= 1
+
+        await first.start()
+        await second.start()
+        leader = LeaderTask(first, "maintenance", sweep, interval=5.0, renew_interval=0.05)
+        follower = LeaderTask(second, "maintenance", sweep, interval=5.0, renew_interval=0.05)
+        try:
+            await leader.start()
+            assert await _eventually(lambda: running["now"] == 1)
+            await follower.start()
+            assert await _eventually(lambda: running["finished"] == 1)
+            assert leader.is_leader
+            assert not follower.is_leader
+            assert running["most"] == 1
+        finally:
+            await leader.stop()
+            await follower.stop()
+            await first.stop()
+            await second.stop()
+
+    asyncio.run(main())
+
+
+def test_beat_invalidation_reaches_the_other_workers(tmp_path):
+    async def main():
+        writer, reader = _workers(tmp_path)
+        reader.subscribe(beat_cache.INVALIDATION_CHANNEL, beat_cache._on_remote_invalidation)
+        received = []
+        writer.subscribe(beat_cache.INVALIDATION_CHANNEL, received.append)
+        await writer.start()
+        await reader.start()
+        try:
+            beat_cache.beat_cache.set("beat-1", {"id": "beat-1"})
+            beat_cache.beat_cache.set("beat-2", {"id": "beat-2"})
+            beat_cache.catalog_cache.set("page-1", [{"id": "beat-1"}])
+
+            await writer.publish(beat_cache.INVALIDATION_CHANNEL, "beat-1")
+            assert await _eventually(lambda: beat_cache.beat_cache.get("beat-1") is None)
+            assert beat_cache.beat_cache.get("beat-2") == {"id": "beat-2"}
+            assert beat_cache.catalog_cache.get("page-1") is None
+            # A worker does not receive its own messages
+            await asyncio.sleep(POLL * 5)
+            assert received == []
+        finally:
+            await writer.stop()
+            await reader.stop()
+            beat_cache.beat_cache.clear()
+            beat_cache.catalog_cache.clear()
+
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""Refunds for checkouts paid after their exclusive license was sold."""
+import asyncio
+
+import pytest
+
+stripe = pytest.importorskip("stripe")
+
+from backend import stripe_webhook  # noqa: E402
+
+SESSION = {"id": "cs_late", "payment_intent": "pi_late"}
+BEAT_IDS = ["beat-1"]
+
+
+@pytest.fixture
+def marked(monkeypatch):
+    calls = []
+
+    async def mark_event(event_id, processed=True, error=None):
+        calls.append({"event_id": event_id, "processed": processed, "error": error})
+
+    monkeypatch.setattr(stripe_webhook, "_mark_event", mark_event)
+    monkeypatch.setattr(stripe_webhook, "get_stripe", lambda: stripe)
+    return calls
+
+
+def _refund_with(monkeypatch, refund):
+    refunds = []
+
+    def refund_checkout_payment(payment_intent_id, checkout_id):
+        refunds.append((payment_intent_id, checkout_id))
+        return refund()
+
+    monkeypatch.setattr(stripe_webhook, "refund_checkout_payment", refund_checkout_payment)
+    return refunds
+
+
+def test_refunds_the_payment_and_marks_the_event_processed(monkeypatch, marked):
+    refunds = _refund_with(monkeypatch, lambda: "re_123")
+    asyncio.run(stripe_webhook._refund_sold_out("evt_1", SESSION, BEAT_IDS))
+    assert refunds == [("pi_late", "cs_late")]
+    assert marked[0]["processed"] is True
+    assert "refunded checkout cs_late (re_123)" in marked[0]["error"]
+    assert "already sold for beat(s) beat-1" in marked[0]["error"]
+
+
+def test_transient_refund_failure_leaves_the_event_for_replay(monkeypatch, marked):
+    def refund():
+        raise stripe.error.APIConnectionError("connection reset")
+
+    _refund_with(monkeypatch, refund)
+    asyncio.run(stripe_webhook._refund_sold_out("evt_1", SESSION, BEAT_IDS))
+    assert marked[0]["processed"] is False
+    assert "will retry" in marked[0]["error"]
+
+
+def test_rejected_refund_is_left_for_an_operator(monkeypatch, marked):
+    def refund():
+        raise stripe.error.InvalidRequestError("Charge has already been refunded.", param=None)
+
+    _refund_with(monkeypatch, refund)
+    asyncio.run(stripe_webhook._refund_sold_out("evt_1", SESSION, BEAT_IDS))
+    assert marked[0]["processed"] is True
+    assert "refund it manually" in marked[0]["error"]
+
+
+def test_checkout_without_a_payment_is_not_refunded(monkeypatch, marked):
+    refunds = _refund_with(monkeypatch, lambda: "re_123")
+    asyncio.run(stripe_webhook._refund_sold_out("evt_1", {"id": "cs_free"}, BEAT_IDS))
+    assert refunds == []
+    assert marked[0]["processed"] is True
+    assert "no payment to refund" in marked[0]["error"]
@@ -0,0 +1,178 @@
+"""Resilient storage: retries, the circuit breaker and content-addressed uploads."""
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional
+
+import pytest
+
+from backend.services import license_generator, license_jobs
+from backend.services.job_queue import JobDeferred
+from backend.services.storage import (
+    CircuitBreaker,
+    InMemoryStorage,
+    ResilientStorage,
+    StorageError,
+    StorageUnavailableError,
+    content_path,
+)
+
+
+class FlakyStorage(InMemoryStorage):
+    """Fails the next ``failures`` uploads with ``error``, then stores normally."""
+
+    def __init__(self, failures: int = 0, error: Optional[StorageError] = None):
+        super().__init__()
+        self.failures = failures
+        self.error = error or StorageError("503 Service Unavailable", retryable=True)
+        self.calls = 0
+
+    def upload(self, path, data, content_type):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        return super().upload(path, data, content_type)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("backend.services.storage.time.monotonic", clock)
+    return clock
+
+
+def _resilient(backend, threshold=3, cooldown=30.0, max_attempts=4):
+    return ResilientStorage(
+        backend, max_attempts=max_attempts, base_delay=0.0, breaker=CircuitBreaker(threshold, cooldown),
+    )
+
+
+def test_transient_failures_are_retried():
+    backend = FlakyStorage(failures=2)
+    storage = _resilient(backend)
+    assert storage.upload("a.pdf", b"data", "application/pdf") == "memory://beats/a.pdf"
+    assert backend.calls == 3
+    assert backend.objects == {"a.pdf": b"data"}
+    assert storage.breaker.failures == 0
+
+
+def test_gives_up_after_max_attempts():
+    backend = FlakyStorage(failures=10)
+    storage = _resilient(backend, threshold=10, max_attempts=3)
+    with pytest.raises(StorageError):
+        storage.upload("a.pdf", b"data", "application/pdf")
+    assert backend.calls == 3
+
+
+def test_permanent_errors_are_not_retried_and_do_not_trip_the_breaker():
+    backend = FlakyStorage(failures=5, error=StorageError("400 Bad Request"))
+    storage = _resilient(backend, threshold=1)
+    with pytest.raises(StorageError):
+        storage.upload("a.pdf", b"data", "application/pdf")
+    assert backend.calls == 1
+    assert not storage.breaker.is_open
+
+
+def test_breaker_opens_after_consecutive_failures_and_fails_fast(clock):
+    backend = FlakyStorage(failures=100)
+    storage = _resilient(backend, threshold=3, max_attempts=3)
+    with pytest.raises(StorageError):
+        storage.upload("a.pdf", b"data", "application/pdf")
+    assert storage.breaker.is_open
+
+    clock.now += 10
+    with pytest.raises(StorageUnavailableError) as rejected:
+        storage.upload("a.pdf", b"data", "application/pdf")
+    assert rejected.value.retry_after == pytest.approx(20.0)
+    # Rejected without calling storage
+    assert backend.calls == 3
+
+
+def test_half_open_trial_success_closes_the_breaker(clock):
+    breaker = CircuitBreaker(threshold=2, cooldown=30.0)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.is_open
+
+    clock.now += 31
+    breaker.before_call()
+    # Only one trial call at a time
+    with pytest.raises(StorageUnavailableError):
+        breaker.before_call()
+    breaker.record_success()
+    assert not breaker.is_open
+    breaker.before_call()
+
+
+def test_half_open_trial_failure_reopens_the_breaker(clock):
+    backend = FlakyStorage(failures=100)
+    storage = _resilient(backend, threshold=2, cooldown=30.0, max_attempts=2)
+    with pytest.raises(StorageError):
+        storage.upload("a.pdf", b"data", "application/pdf")
+    assert storage.breaker.is_open
+
+    clock.now += 31
+    # The trial call fails: open for another full cooldown, without retrying
+    with pytest.raises(StorageError):
+        storage.upload("a.pdf", b"data", "application/pdf")
+    assert backend.calls == 3
+    clock.now += 29
+    with pytest.raises(StorageUnavailableError):
+        storage.upload("a.pdf", b"data", "application/pdf")
+
+    clock.now += 2
+    backend.failures = 0
+    storage.upload("a.pdf", b"data", "application/pdf")
+    assert not storage.breaker.is_open
+
+
+def test_render_job_is_deferred_while_the_breaker_is_open(monkeypatch):
+    def generate_license_pdf(**kwargs):
+        raise StorageUnavailableError(12.5)
+
+    monkeypatch.setattr(license_jobs, "generate_license_pdf", generate_license_pdf)
+    payload = {"order_id": "order-1", "license_id": "license-1", "license_type": "mp3_non_exclusive"}
+    with pytest.raises(JobDeferred) as deferred:
+        asyncio.run(license_jobs.render_license_job(payload))
+    assert deferred.value.delay == 12.5
+
+
+def test_content_path_depends_only_on_the_bytes():
+    assert content_path("licenses/o1", b"pdf", ".pdf") == content_path("licenses/o1", bytearray(b"pdf"), ".pdf")
+    assert content_path("licenses/o1", b"pdf", ".pdf") != content_path("licenses/o1", b"pdf2", ".pdf")
+    assert content_path("licenses/o1", b"pdf", ".pdf").endswith(".pdf")
+
+
+def test_rendering_a_license_twice_stores_one_object(monkeypatch):
+    pytest.importorskip("reportlab")
+    bucket = InMemoryStorage("purchases")
+    monkeypatch.setattr(license_generator, "private_storage", bucket)
+    arguments = dict(
+        license_type="mp3_non_exclusive",
+        order_id="order-1",
+        customer_name="Buyer",
+        customer_email="buyer@example.com",
+        beat_title="Beat",
+        producer_name="Producer",
+        licensor_legal_name="Producer LLC",
+        purchase_date=datetime(2026, 10, 18, tzinfo=timezone.utc),
+    )
+
+    first = license_generator.generate_license_pdf(**arguments)
+    # A retried job renders the same license again
+    second = license_generator.generate_license_pdf(**arguments)
+    assert first == second
+    assert list(bucket.objects) == [first]
+    assert first.startswith("licenses/order-1/")
+
+    other = license_generator.generate_license_pdf(**{**arguments, "customer_name": "Another Buyer"})
+    assert other != first
+    assert len(bucket.objects) == 2
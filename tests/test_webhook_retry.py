@@ -0,0 +1,98 @@
+"""Retry scheduling and giving up on Stripe events that keep failing."""
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("postgrest")
+
+from postgrest.exceptions import APIError  # noqa: E402
+
+from backend import stripe_webhook  # noqa: E402
+from backend.config import get_settings  # noqa: E402
+from backend.database import is_transient_error  # noqa: E402
+
+
+class EventsTable:
+    """Just enough of a PostgREST query on webhook_events for ``_mark_event``."""
+
+    def __init__(self, row):
+        self.row = row
+        self._update = None
+
+    def select(self, columns):
+        self._update = None
+        return self
+
+    def update(self, values):
+        self._update = values
+        return self
+
+    def eq(self, column, value):
+        assert (column, value) == ("stripe_event_id", self.row["stripe_event_id"])
+        return self
+
+    async def execute(self):
+        if self._update is not None:
+            self.row.update(self._update)
+        return SimpleNamespace(data=[dict(self.row)])
+
+
+@pytest.fixture
+def event(monkeypatch):
+    row = {"stripe_event_id": "evt_1", "processed": False, "attempts": 0, "error": None}
+    table = EventsTable(row)
+    monkeypatch.setattr(stripe_webhook, "db", SimpleNamespace(table=lambda name: table))
+    return row
+
+
+def test_transient_errors():
+    assert is_transient_error(ConnectionError("reset by peer"))
+    assert is_transient_error(APIError({"code": 503, "message": "JSON could not be generated"}))
+    assert is_transient_error(APIError({"code": "40001", "message": "could not serialize access"}))
+    assert is_transient_error(APIError({"code": "57014", "message": "canceling statement due to statement timeout"}))
+    assert is_transient_error(APIError({"code": "PGRST001", "message": "Database client error"}))
+
+
+def test_permanent_errors():
+    assert not is_transient_error(APIError({"code": "P0002", "message": "Beat 1 not found"}))
+    assert not is_transient_error(APIError({"code": "23503", "message": "violates foreign key constraint"}))
+    assert not is_transient_error(APIError({"code": "22P02", "message": "invalid input syntax for type uuid"}))
+    assert not is_transient_error(APIError({"code": "PGRST204", "message": "Could not find the column"}))
+    assert not is_transient_error(APIError({"code": 400, "message": "JSON could not be generated"}))
+
+
+def test_failure_counts_an_attempt_and_backs_off(event):
+    before = datetime.now(timezone.utc)
+    asyncio.run(stripe_webhook._mark_event("evt_1", processed=False, error="timeout"))
+    assert event["attempts"] == 1
+    assert event["processed"] is False
+    first_retry = datetime.fromisoformat(event["next_attempt_at"])
+    assert (first_retry - before).total_seconds() >= get_settings().webhook_retry_base_seconds * 0.99
+
+    asyncio.run(stripe_webhook._mark_event("evt_1", processed=False, error="timeout"))
+    assert event["attempts"] == 2
+    assert datetime.fromisoformat(event["next_attempt_at"]) > first_retry
+
+
+def test_event_is_given_up_after_max_attempts(event):
+    event["attempts"] = get_settings().webhook_retry_max_attempts - 1
+    asyncio.run(stripe_webhook._mark_event("evt_1", processed=False, error="timeout"))
+    assert event["processed"] is True
+    assert event["processed_at"] is not None
+    assert "gave up after" in event["error"]
+
+
+def test_non_retryable_failure_is_given_up_at_once(event):
+    asyncio.run(stripe_webhook._mark_event("evt_1", processed=False, error="Beat 1 not found", retryable=False))
+    assert event["attempts"] == 1
+    assert event["processed"] is True
+    assert event["error"] == "Beat 1 not found (not retryable)"
+
+
+def test_backoff_is_capped():
+    settings = get_settings()
+    assert stripe_webhook._retry_delay(1) == settings.webhook_retry_base_seconds
+    assert stripe_webhook._retry_delay(2) == settings.webhook_retry_base_seconds * 2
+    assert stripe_webhook._retry_delay(50) == settings.webhook_retry_max_seconds